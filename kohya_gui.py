@@ -3,15 +3,15 @@ import sys
 import argparse
 import subprocess
 import contextlib
+
+# Started before gradio and the GUI modules are imported so that --profile-startup can time them
+from kohya_gui.class_startup_profiler import StartupProfiler
+
+startup_profiler = StartupProfiler.from_argv()
+
 import gradio as gr
 
 from kohya_gui.class_gui_config import KohyaSSGUIConfig
-from kohya_gui.dreambooth_gui import dreambooth_tab
-from kohya_gui.finetune_gui import finetune_tab
-from kohya_gui.textual_inversion_gui import ti_tab
-from kohya_gui.utilities import utilities_tab
-from kohya_gui.lora_gui import lora_tab
-from kohya_gui.class_lora_tab import LoRATools
 from kohya_gui.custom_logging import setup_logging
 from kohya_gui.localization_ext import add_javascript
 
@@ -30,34 +30,45 @@ def initialize_ui_interface(config, headless, use_shell, release_info, readme_co
     # Load custom CSS if available
     css = read_file_content("./assets/style.css")
 
+    # Tab modules are imported here rather than at module level, so `--help` and argument errors
+    # return without loading the whole GUI
+    with startup_profiler.section("import tab modules"):
+        from kohya_gui.dreambooth_gui import dreambooth_tab
+        from kohya_gui.finetune_gui import finetune_tab
+        from kohya_gui.textual_inversion_gui import ti_tab
+        from kohya_gui.utilities import utilities_tab
+        from kohya_gui.lora_gui import lora_tab
+        from kohya_gui.class_lora_tab import LoRATools
+
     # Create the main Gradio Blocks interface
     ui_interface = gr.Blocks(css=css, title=f"Kohya_ss GUI {release_info}", theme=gr.themes.Default())
     with ui_interface:
         # Create tabs for different functionalities
-        with gr.Tab("Dreambooth"):
+        with gr.Tab("Dreambooth"), startup_profiler.section("dreambooth_tab"):
             (
                 train_data_dir_input,
                 reg_data_dir_input,
                 output_dir_input,
                 logging_dir_input,
             ) = dreambooth_tab(headless=headless, config=config, use_shell_flag=use_shell)
-        with gr.Tab("LoRA"):
+        with gr.Tab("LoRA"), startup_profiler.section("lora_tab"):
             lora_tab(headless=headless, config=config, use_shell_flag=use_shell)
-        with gr.Tab("Textual Inversion"):
+        with gr.Tab("Textual Inversion"), startup_profiler.section("ti_tab"):
             ti_tab(headless=headless, config=config, use_shell_flag=use_shell)
-        with gr.Tab("Finetuning"):
+        with gr.Tab("Finetuning"), startup_profiler.section("finetune_tab"):
             finetune_tab(headless=headless, config=config, use_shell_flag=use_shell)
         with gr.Tab("Utilities"):
             # Utilities tab requires inputs from the Dreambooth tab
-            utilities_tab(
-                train_data_dir_input=train_data_dir_input,
-                reg_data_dir_input=reg_data_dir_input,
-                output_dir_input=output_dir_input,
-                logging_dir_input=logging_dir_input,
-                headless=headless,
-                config=config,
-            )
-            with gr.Tab("LoRA"):
+            with startup_profiler.section("utilities_tab"):
+                utilities_tab(
+                    train_data_dir_input=train_data_dir_input,
+                    reg_data_dir_input=reg_data_dir_input,
+                    output_dir_input=output_dir_input,
+                    logging_dir_input=logging_dir_input,
+                    headless=headless,
+                    config=config,
+                )
+            with gr.Tab("LoRA"), startup_profiler.section("LoRATools"):
                 _ = LoRATools(headless=headless)
         with gr.Tab("About"):
             # About tab to display release information and README content
@@ -81,7 +92,8 @@ def UI(**kwargs):
     readme_content = read_file_content("./README.md")
 
     # Load configuration from the specified file
-    config = KohyaSSGUIConfig(config_file_path=kwargs.get("config"))
+    with startup_profiler.section("KohyaSSGUIConfig"):
+        config = KohyaSSGUIConfig(config_file_path=kwargs.get("config"))
     if config.is_config_loaded():
         log.info(f"Loaded default GUI values from '{kwargs.get('config')}'...")
 
@@ -91,7 +103,20 @@ def UI(**kwargs):
         log.info("Using shell=True when running external commands...")
 
     # Initialize the Gradio UI interface
-    ui_interface = initialize_ui_interface(config, kwargs.get("headless", False), use_shell, release_info, readme_content)
+    with startup_profiler.section("initialize_ui_interface"):
+        ui_interface = initialize_ui_interface(config, kwargs.get("headless", False), use_shell, release_info, readme_content)
+
+    if kwargs.get("profile_startup"):
+        # Report where the startup time went and exit without starting the server
+        startup_profiler.stop()
+        report = startup_profiler.write_report(kwargs.get("profile_startup_report"))
+        log.info(f"Startup profile written to {kwargs.get('profile_startup_report')}\n{StartupProfiler.summary(report)}")
+        return
+
+    # The job queue is opened (and the jobs left from the previous session started) only when the server really runs
+    from kohya_gui.lora_gui import start_job_queue
+
+    start_job_queue()
 
     # Construct launch parameters using dictionary comprehension
     launch_params = {
@@ -130,6 +155,8 @@ def initialize_arg_parser():
     parser.add_argument("--requirements", type=str, default=None, help="requirements file to use for validation")
     parser.add_argument("--root_path", type=str, default=None, help="`root_path` for Gradio to enable reverse proxy support. e.g. /kohya_ss")
     parser.add_argument("--noverify", action="store_true", help="Disable requirements verification")
+    parser.add_argument("--profile-startup", action="store_true", help="Build the UI, write a startup time report (imports, config load, each tab) and exit without launching; implies --noverify")
+    parser.add_argument("--profile-startup-report", type=str, default="./startup_profile.json", help="Where --profile-startup writes its JSON report")
     return parser
 
 if __name__ == "__main__":
@@ -140,8 +167,8 @@ if __name__ == "__main__":
     # Set up logging based on the debug flag
     log = setup_logging(debug=args.debug)
 
-    # Verify requirements unless `noverify` flag is set
-    if args.noverify:
+    # Verify requirements unless `noverify` flag is set (the startup profile measures the GUI only)
+    if args.noverify or args.profile_startup:
         log.warning("Skipping requirements verification.")
     else:
         # Run the validation command to verify requirements
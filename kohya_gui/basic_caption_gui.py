@@ -8,6 +8,7 @@ from .common_gui import (
     list_dirs,
     setup_environment,
 )
+from .class_caption_manifest import caption_incrementally, caption_model_id
 import os
 import sys
 
@@ -28,6 +29,7 @@ def caption_images(
     postfix: str,
     find_text: str,
     replace_text: str,
+    incremental: bool = True,
 ):
     """
     Captions images in a given directory with a given caption text.
@@ -41,6 +43,7 @@ def caption_images(
         postfix (str): Text to be added after the caption text.
         find_text (str): Text to be replaced in the caption files.
         replace_text (str): Text to replace the found text in the caption files.
+        incremental (bool): Only write captions for images that are new or changed since the last run.
 
     Returns:
         None
@@ -78,20 +81,42 @@ def caption_images(
             run_cmd.append("--caption_file_ext")
             run_cmd.append(caption_ext)
 
-        run_cmd.append(rf"{images_dir}")
-
-        # Reconstruct the safe command string for display
-        command_to_run = " ".join(run_cmd)
-        log.info(f"Executing command: {command_to_run}")
-
         # Set the environment variable for the Python path
         env = setup_environment()
 
-        # Run the command in the sd-scripts folder context
-        subprocess.run(run_cmd, env=env, shell=False)
+        def run_captioner(folder):
+            folder_cmd = run_cmd + [rf"{folder}"]
+
+            # Reconstruct the safe command string for display
+            command_to_run = " ".join(folder_cmd)
+            log.info(f"Executing command: {command_to_run}")
+
+            # Run the command in the sd-scripts folder context
+            subprocess.run(folder_cmd, env=env, shell=False)
+
+        # Write the captions that are missing (or stale, with overwrite). With overwrite, add the
+        # prefix and/or postfix to those new captions only, so existing captions never get them twice
+        caption_incrementally(
+            folder=images_dir,
+            caption_ext=caption_ext,
+            model_id=caption_model_id("basic", caption_text=caption_text),
+            run_captioner=run_captioner,
+            prefix=prefix if overwrite else "",
+            postfix=postfix if overwrite else "",
+            incremental=incremental,
+            keep_existing=not overwrite,
+        )
 
-    # Check if overwrite option is enabled
-    if overwrite:
+        # Replace specified text in caption files if find and replace text is provided
+        if overwrite and find_text:
+            find_replace(
+                folder_path=images_dir,
+                caption_file_ext=caption_ext,
+                search_text=find_text,
+                replace_text=replace_text,
+            )
+    # Without caption text, edit the existing caption files if overwrite option is enabled
+    elif overwrite:
         # Add prefix and postfix to caption files or find and replace text in caption files
         if prefix or postfix or find_text:
             # Add prefix and/or postfix to caption files
@@ -109,7 +134,8 @@ def caption_images(
                     search_text=find_text,
                     replace_text=replace_text,
                 )
-    else:
+
+    if not overwrite:
         # Show a message if modification is not possible without overwrite option enabled
         if prefix or postfix:
             log.info(
@@ -209,6 +235,13 @@ def gradio_basic_caption_gui_tab(headless=False, default_images_dir=None):
                 interactive=True,
                 value=False,
             )
+            # Checkbox to skip images captioned by an earlier run
+            incremental = gr.Checkbox(
+                label="Only new or changed images",
+                info="With overwrite, keep captions already written with this caption text",
+                interactive=True,
+                value=True,
+            )
         # Row for caption prefix and text
         with gr.Row():
             # Textbox for caption prefix
@@ -260,6 +293,7 @@ def gradio_basic_caption_gui_tab(headless=False, default_images_dir=None):
                     postfix,
                     find_text,
                     replace_text,
+                    incremental,
                 ],
                 show_progress=False,
             )
@@ -1,17 +1,26 @@
-from PIL import Image
-from transformers import Blip2Processor, Blip2ForConditionalGeneration
-import torch
 import gradio as gr
 import os
 
+from .class_caption_engine import CaptionEngine, model_cache
+from .class_caption_manifest import CaptionManifest, caption_model_id
 from .common_gui import get_folder_path, scriptdir, list_dirs
 from .custom_logging import setup_logging
 
 # Set up logging
 log = setup_logging()
 
+DEFAULT_BATCH_SIZE = 4
+DEFAULT_NUM_WORKERS = 4
+
+
+BLIP2_MODEL_ID = "Salesforce/blip2-opt-2.7b"
+
+
+def load_model(model_id=BLIP2_MODEL_ID):
+    # torch and transformers are imported on first use; importing them at startup costs seconds of GUI launch time
+    import torch
+    from transformers import Blip2Processor, Blip2ForConditionalGeneration
 
-def load_model():
     # Set the device to GPU if available, otherwise use CPU
     if hasattr(torch, 'cuda') and torch.cuda.is_available():
         device = 'cuda'
@@ -22,16 +31,17 @@ def load_model():
 
 
     # Initialize the BLIP2 processor
-    processor = Blip2Processor.from_pretrained("Salesforce/blip2-opt-2.7b")
+    processor = Blip2Processor.from_pretrained(model_id)
     log.debug('Processor initialized: %s', processor)
 
     # Initialize the BLIP2 model
     model = Blip2ForConditionalGeneration.from_pretrained(
-        "Salesforce/blip2-opt-2.7b", torch_dtype=torch.float16
+        model_id, torch_dtype=torch.float16
     )
 
     # Move the model to the specified device
     model.to(device)
+    model.eval()
 
     return processor, model, device
 
@@ -79,60 +89,123 @@ def generate_caption(
     do_sample=True,
     temperature=1.0,
     top_p=0.0,
+    batch_size=DEFAULT_BATCH_SIZE,
+    num_workers=DEFAULT_NUM_WORKERS,
+    on_written=None,
 ):
     """
-    Fetches and processes each image in file_list, generates captions based on the image, and writes the generated captions to a file.
+    Generates captions for the images in file_list in batches and writes them next to the images.
+
+    Images are decoded and preprocessed on `num_workers` threads while the model generates the
+    previous batch, and caption files are written on a background thread.
 
     Parameters:
     - file_list: A list of file paths pointing to the images to be captioned.
     - processor: The preprocessor for the BLIP2 model.
     - model: The BLIP2 model to be used for generating captions.
     - device: The device on which the computation is performed.
-    - extension: The extension for the output text files.
+    - caption_file_ext: The extension for the output text files.
     - num_beams: Number of beams for beam search. Default: 5.
     - repetition_penalty: Penalty for repeating tokens. Default: 1.5.
     - length_penalty: Penalty for sentence length. Default: 1.2.
     - max_new_tokens: Maximum number of new tokens to generate. Default: 40.
     - min_new_tokens: Minimum number of new tokens to generate. Default: 20.
+    - batch_size: Number of images per generate call. Default: 4.
+    - num_workers: Number of image loading threads. Default: 4.
+    - on_written: Called with (file_path, caption) after each caption file is written.
+
+    Returns the engine statistics (images, failed, seconds, images_per_sec).
     """
-    for file_path in file_list:
-        image = Image.open(file_path)
-
-        inputs = processor(images=image, return_tensors="pt").to(device, torch.float16)
-
-        if top_p == 0.0:
-            generated_ids = model.generate(
-                **inputs,
-                num_beams=num_beams,
-                repetition_penalty=repetition_penalty,
-                length_penalty=length_penalty,
-                max_new_tokens=max_new_tokens,
-                min_new_tokens=min_new_tokens,
-            )
-        else:
-            generated_ids = model.generate(
-                **inputs,
-                do_sample=do_sample,
-                top_p=top_p,
-                max_new_tokens=max_new_tokens,
-                min_new_tokens=min_new_tokens,
-                temperature=temperature,
-            )
+    import torch
+    from PIL import Image
+
+    def load_image(file_path):
+        with Image.open(file_path) as image:
+            image = image.convert("RGB")
+        return processor(images=image, return_tensors="pt")["pixel_values"][0]
+
+    def collate(pixel_values):
+        return torch.stack(pixel_values).to(device, torch.float16)
+
+    if top_p == 0.0:
+        generate_kwargs = dict(
+            num_beams=num_beams,
+            repetition_penalty=repetition_penalty,
+            length_penalty=length_penalty,
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=min_new_tokens,
+        )
+    else:
+        generate_kwargs = dict(
+            do_sample=do_sample,
+            top_p=top_p,
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=min_new_tokens,
+            temperature=temperature,
+        )
 
-        generated_text = processor.batch_decode(
-            generated_ids, skip_special_tokens=True
-        )[0].strip()
+    def generate(pixel_values):
+        with torch.inference_mode():
+            generated_ids = model.generate(pixel_values=pixel_values, **generate_kwargs)
+        return [text.strip() for text in processor.batch_decode(generated_ids, skip_special_tokens=True)]
+
+    engine = CaptionEngine(
+        load_fn=load_image,
+        generate_fn=generate,
+        collate_fn=collate,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        caption_file_ext=caption_file_ext,
+        on_written=on_written,
+    )
+    return engine.run(file_list)
 
-        # Construct the output file path by replacing the original file extension with the specified extension
-        output_file_path = os.path.splitext(file_path)[0] + caption_file_ext
 
-        # Write the generated text to the output file
-        with open(output_file_path, "w", encoding="utf-8") as output_file:
-            output_file.write(generated_text)
+def caption_directory(directory_path, caption_file_ext, batch_size, incremental=True, **generate_kwargs):
+    """
+    Captions the images of directory_path with the resident BLIP2 model (loaded on first use).
+    With incremental, images already captioned with the same settings are skipped.
+    """
+    if not os.path.isdir(directory_path):
+        log.error(f"Directory {directory_path} does not exist.")
+        return
 
+    manifest = CaptionManifest(caption_file_ext, caption_model_id(f"blip2:{BLIP2_MODEL_ID}", **generate_kwargs))
+    image_files = get_images_in_directory(directory_path)
+    pending = manifest.pending(image_files) if incremental else image_files
+    if not pending:
+        log.info(f"All {len(image_files)} images in {directory_path} are already captioned with these settings.")
+        return
+    log.info(f"Captioning {len(pending)} of {len(image_files)} images...")
+
+    def on_written(file_path, _):
+        manifest.record(file_path)
         # Log the image file path with a message about the fact that the caption was generated
         log.info(f"{file_path} caption was generated")
 
+    try:
+        with model_cache.acquire(("BLIP2", BLIP2_MODEL_ID), load_model) as (processor, model, device):
+            generate_caption(
+                file_list=pending,
+                processor=processor,
+                model=model,
+                device=device,
+                caption_file_ext=caption_file_ext,
+                batch_size=int(batch_size),
+                on_written=on_written,
+                **generate_kwargs,
+            )
+    finally:
+        # Keep what was captioned even if the run stopped halfway
+        manifest.save()
+
+
+def unload_model():
+    if model_cache.unload(("BLIP2", BLIP2_MODEL_ID)):
+        log.info("BLIP2 model unloaded.")
+    else:
+        log.info("BLIP2 model is not loaded.")
+
 
 def caption_images_beam_search(
     directory_path,
@@ -142,6 +215,8 @@ def caption_images_beam_search(
     min_new_tokens,
     max_new_tokens,
     caption_file_ext,
+    batch_size=DEFAULT_BATCH_SIZE,
+    incremental=True,
 ):
     """
     Captions all images in the specified directory using the provided prompt.
@@ -151,23 +226,16 @@ def caption_images_beam_search(
     """
     log.info("BLIP2 captionning beam...")
 
-    if not os.path.isdir(directory_path):
-        log.error(f"Directory {directory_path} does not exist.")
-        return
-
-    processor, model, device = load_model()
-    image_files = get_images_in_directory(directory_path)
-    generate_caption(
-        file_list=image_files,
-        processor=processor,
-        model=model,
-        device=device,
+    caption_directory(
+        directory_path,
+        caption_file_ext,
+        batch_size,
+        incremental,
         num_beams=int(num_beams),
         repetition_penalty=float(repetition_penalty),
         length_penalty=length_penalty,
         min_new_tokens=int(min_new_tokens),
         max_new_tokens=int(max_new_tokens),
-        caption_file_ext=caption_file_ext,
     )
 
 
@@ -179,6 +247,8 @@ def caption_images_nucleus(
     min_new_tokens,
     max_new_tokens,
     caption_file_ext,
+    batch_size=DEFAULT_BATCH_SIZE,
+    incremental=True,
 ):
     """
     Captions all images in the specified directory using the provided prompt.
@@ -188,23 +258,16 @@ def caption_images_nucleus(
     """
     log.info("BLIP2 captionning nucleus...")
 
-    if not os.path.isdir(directory_path):
-        log.error(f"Directory {directory_path} does not exist.")
-        return
-
-    processor, model, device = load_model()
-    image_files = get_images_in_directory(directory_path)
-    generate_caption(
-        file_list=image_files,
-        processor=processor,
-        model=model,
-        device=device,
+    caption_directory(
+        directory_path,
+        caption_file_ext,
+        batch_size,
+        incremental,
         do_sample=do_sample,
         temperature=temperature,
         top_p=top_p,
         min_new_tokens=int(min_new_tokens),
         max_new_tokens=int(max_new_tokens),
-        caption_file_ext=caption_file_ext,
     )
 
 
@@ -276,6 +339,21 @@ def gradio_blip2_caption_gui_tab(headless=False, directory_path=None):
                 value=".txt",
                 interactive=True,
             )
+            batch_size = gr.Number(
+                value=DEFAULT_BATCH_SIZE,
+                label="Batch size",
+                info="Images per generate call; lower it if VRAM runs out",
+                interactive=True,
+                step=1,
+                minimum=1,
+                maximum=64,
+            )
+            incremental = gr.Checkbox(
+                label="Only new or changed images",
+                info="Skip images already captioned with these settings",
+                interactive=True,
+                value=True,
+            )
 
         with gr.Row():
             with gr.Tab("Beam search"):
@@ -322,6 +400,8 @@ def gradio_blip2_caption_gui_tab(headless=False, directory_path=None):
                         min_new_tokens,
                         max_new_tokens,
                         caption_file_ext,
+                        batch_size,
+                        incremental,
                     ],
                 )
             with gr.Tab("Nucleus sampling"):
@@ -360,5 +440,13 @@ def gradio_blip2_caption_gui_tab(headless=False, directory_path=None):
                         min_new_tokens,
                         max_new_tokens,
                         caption_file_ext,
+                        batch_size,
+                        incremental,
                     ],
                 )
+
+        unload_button = gr.Button(
+            value="Unload BLIP2 model",
+            interactive=True,
+        )
+        unload_button.click(unload_model)
@@ -2,7 +2,8 @@ import gradio as gr
 import subprocess
 import os
 import sys
-from .common_gui import get_folder_path, add_pre_postfix, scriptdir, list_dirs, setup_environment
+from .common_gui import get_folder_path, scriptdir, list_dirs, setup_environment
+from .class_caption_manifest import caption_incrementally, caption_model_id
 from .custom_logging import setup_logging
 
 # Set up logging
@@ -22,6 +23,7 @@ def caption_images(
     beam_search: bool,
     prefix: str = "",
     postfix: str = "",
+    incremental: bool = True,
 ) -> None:
     """
     Automatically generates captions for images in the specified directory using the BLIP model.
@@ -42,6 +44,7 @@ def caption_images(
         beam_search (bool): Whether to use beam search in the captioning process.
         prefix (str): The prefix to add to the captions.
         postfix (str): The postfix to add to the captions.
+        incremental (bool): Only caption images that are new or changed since the last run with these settings.
     """
     # Check if the image folder is provided
     if not train_data_dir:
@@ -77,9 +80,6 @@ def caption_images(
         run_cmd.append("--caption_extension")
         run_cmd.append(caption_file_ext)
 
-    # Add the directory containing the training data
-    run_cmd.append(rf"{train_data_dir}")
-
     # Add URL for caption model weights
     run_cmd.append("--caption_weights")
     run_cmd.append(
@@ -89,19 +89,33 @@ def caption_images(
     # Set up the environment
     env = setup_environment()
 
-    # Reconstruct the safe command string for display
-    command_to_run = " ".join(run_cmd)
-    log.info(f"Executing command: {command_to_run}")
+    def run_captioner(folder):
+        # Add the directory containing the training data (or the images to caption)
+        folder_cmd = run_cmd + [rf"{folder}"]
+
+        # Reconstruct the safe command string for display
+        command_to_run = " ".join(folder_cmd)
+        log.info(f"Executing command: {command_to_run}")
 
-    # Run the command in the sd-scripts folder context
-    subprocess.run(run_cmd, env=env, shell=False, cwd=rf"{scriptdir}/sd-scripts")
+        # Run the command in the sd-scripts folder context
+        subprocess.run(folder_cmd, env=env, shell=False, cwd=rf"{scriptdir}/sd-scripts")
 
-    # Add prefix and postfix
-    add_pre_postfix(
+    # Caption new or changed images only and add prefix and postfix to the captions just written
+    caption_incrementally(
         folder=train_data_dir,
-        caption_file_ext=caption_file_ext,
+        caption_ext=caption_file_ext,
+        model_id=caption_model_id(
+            "blip:model_large_caption",
+            num_beams=num_beams,
+            top_p=top_p,
+            max_length=max_length,
+            min_length=min_length,
+            beam_search=beam_search,
+        ),
+        run_captioner=run_captioner,
         prefix=prefix,
         postfix=postfix,
+        incremental=incremental,
     )
 
     log.info("...captioning done")
@@ -187,6 +201,12 @@ def gradio_blip_caption_gui_tab(headless=False, default_train_dir=None):
             top_p = gr.Number(value=0.9, label="Top p", interactive=True)
             max_length = gr.Number(value=75, label="Max length", interactive=True)
             min_length = gr.Number(value=5, label="Min length", interactive=True)
+            incremental = gr.Checkbox(
+                label="Only new or changed images",
+                info="Skip images already captioned with these settings",
+                interactive=True,
+                value=True,
+            )
 
         caption_button = gr.Button("Caption images")
 
@@ -203,6 +223,7 @@ def gradio_blip_caption_gui_tab(headless=False, default_train_dir=None):
                 beam_search,
                 prefix,
                 postfix,
+                incremental,
             ],
             show_progress=False,
         )
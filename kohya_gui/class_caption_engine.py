@@ -0,0 +1,271 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, Optional
+
+from .custom_logging import setup_logging
+
+# Set up logging
+log = setup_logging()
+
+
+class _CachedModel:
+    __slots__ = ("value", "refs", "loaded", "lock")
+
+    def __init__(self):
+        self.value = None
+        self.refs = 0
+        self.loaded = False
+        self.lock = threading.Lock()
+
+
+class ModelCache:
+    """
+    Keeps captioning models loaded between runs.
+
+    `acquire(key, loader)` loads the model on first use (concurrent callers wait for the same load)
+    and holds a reference until the block exits. Unreferenced models stay resident; beyond
+    `max_resident` the least recently used unreferenced one is dropped, and `unload()` drops them
+    on request (e.g. to free VRAM for training). A model in use is never unloaded.
+    """
+
+    def __init__(self, max_resident: int = 1):
+        self.max_resident = max_resident
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, key, loader: Callable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _CachedModel()
+            entry.refs += 1
+            self._entries.move_to_end(key)
+        try:
+            with entry.lock:
+                if not entry.loaded:
+                    log.info(f"Loading {key}...")
+                    entry.value = loader()
+                    entry.loaded = True
+                else:
+                    log.info(f"Using the loaded {key}")
+            self._evict()
+            yield entry.value
+        finally:
+            with self._lock:
+                entry.refs -= 1
+                if not entry.loaded and entry.refs == 0 and self._entries.get(key) is entry:
+                    del self._entries[key]  # the loader failed
+            self._evict()
+
+    def _evict(self):
+        with self._lock:
+            idle = [key for key, entry in self._entries.items() if entry.refs == 0 and entry.loaded]
+            while len(self._entries) > self.max_resident and idle:
+                self._drop(idle.pop(0))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        entry.value = None
+        entry.loaded = False
+        log.info(f"Unloaded {key}")
+        _release_accelerator_memory()
+
+    def unload(self, key=None) -> int:
+        """Drop one model (or every unreferenced one). Returns the number of models unloaded."""
+        with self._lock:
+            keys = [key] if key is not None else list(self._entries)
+            keys = [k for k in keys if k in self._entries and self._entries[k].refs == 0 and self._entries[k].loaded]
+            for k in keys:
+                self._drop(k)
+            return len(keys)
+
+    def loaded_keys(self) -> list:
+        with self._lock:
+            return [key for key, entry in self._entries.items() if entry.loaded]
+
+
+def _release_accelerator_memory():
+    import gc
+    import sys
+
+    gc.collect()
+    torch = sys.modules.get("torch")  # only if a model already imported it
+    if torch is not None and hasattr(torch, "cuda") and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+model_cache = ModelCache()
+
+
+class ImagePrefetcher:
+    """
+    Decodes and preprocesses images on a thread pool ahead of the model, DataLoader-style.
+
+    `load_fn(path)` returns one preprocessed sample (it runs on the worker threads, so PIL decoding
+    and resizing overlap with generation); `collate_fn(samples)` turns a batch of samples into the
+    model input on the consuming thread. At most `prefetch_batches` batches are in flight, which
+    bounds memory on large folders. Images that fail to load are logged and skipped.
+    """
+
+    def __init__(
+        self,
+        paths: List[str],
+        load_fn: Callable,
+        collate_fn: Callable = list,
+        batch_size: int = 8,
+        num_workers: int = 4,
+        prefetch_batches: int = 2,
+    ):
+        self.paths = list(paths)
+        self.load_fn = load_fn
+        self.collate_fn = collate_fn
+        self.batch_size = max(1, int(batch_size))
+        self.num_workers = max(1, int(num_workers))
+        self.prefetch_batches = max(1, int(prefetch_batches))
+        self.failed = []
+
+    def _load(self, path):
+        try:
+            return path, self.load_fn(path)
+        except Exception as e:
+            log.warning(f"Could not load {path}: {e}")
+            return path, None
+
+    def __iter__(self):
+        """Yields (paths, batch) in input order."""
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            batches = [self.paths[i : i + self.batch_size] for i in range(0, len(self.paths), self.batch_size)]
+            pending = []
+            for batch_paths in batches[: self.prefetch_batches]:
+                pending.append([pool.submit(self._load, path) for path in batch_paths])
+            next_batch = len(pending)
+            while pending:
+                futures = pending.pop(0)
+                if next_batch < len(batches):
+                    pending.append([pool.submit(self._load, path) for path in batches[next_batch]])
+                    next_batch += 1
+                loaded = [future.result() for future in futures]
+                self.failed.extend(path for path, sample in loaded if sample is None)
+                loaded = [(path, sample) for path, sample in loaded if sample is not None]
+                if loaded:
+                    yield [path for path, _ in loaded], self.collate_fn([sample for _, sample in loaded])
+
+
+class CaptionWriter:
+    """
+    Writes caption files on a background thread so the model never waits for the disk.
+
+    `put(image_path, caption)` queues `<image stem><caption_file_ext>`; `close()` waits for every
+    queued file and re-raises the first write error.
+    """
+
+    _STOP = object()
+
+    def __init__(self, caption_file_ext: str = ".txt", on_written: Optional[Callable] = None, max_queued: int = 1024):
+        self.caption_file_ext = caption_file_ext
+        self.on_written = on_written
+        self.written = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = threading.Thread(target=self._run, name="caption-writer", daemon=True)
+        self._thread.start()
+
+    def caption_path(self, image_path: str) -> str:
+        return os.path.splitext(image_path)[0] + self.caption_file_ext
+
+    def put(self, image_path: str, caption: str):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((image_path, caption))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            image_path, caption = item
+            try:
+                with open(self.caption_path(image_path), "w", encoding="utf-8") as f:
+                    f.write(caption)
+                self.written += 1
+                if self.on_written is not None:
+                    self.on_written(image_path, caption)
+            except Exception as e:
+                if self._error is None:
+                    self._error = e
+                log.error(f"Could not write the caption of {image_path}: {e}")
+
+    def close(self):
+        self._queue.put(self._STOP)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+class CaptionEngine:
+    """
+    Batched captioning: images from an ImagePrefetcher go through `generate_fn(batch) -> [caption]`
+    in batches of `batch_size`, and the captions are written by a CaptionWriter.
+
+    The model-specific parts are the three callables, so the engine runs the same with a real model
+    on GPU or a tiny stand-in on CPU (see tools/benchmark_caption_engine.py).
+    """
+
+    def __init__(
+        self,
+        load_fn: Callable,
+        generate_fn: Callable,
+        collate_fn: Callable = list,
+        batch_size: int = 8,
+        num_workers: int = 4,
+        prefetch_batches: int = 2,
+        caption_file_ext: str = ".txt",
+        on_written: Optional[Callable] = None,
+    ):
+        self.load_fn = load_fn
+        self.generate_fn = generate_fn
+        self.collate_fn = collate_fn
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.prefetch_batches = prefetch_batches
+        self.caption_file_ext = caption_file_ext
+        self.on_written = on_written
+
+    def run(self, paths: Iterable[str]) -> dict:
+        """Caption every image; returns {"images", "failed", "seconds", "images_per_sec"}."""
+        paths = list(paths)
+        prefetcher = ImagePrefetcher(
+            paths, self.load_fn, self.collate_fn, self.batch_size, self.num_workers, self.prefetch_batches
+        )
+        writer = CaptionWriter(self.caption_file_ext, self.on_written)
+        start = time.perf_counter()
+        captioned = 0
+        try:
+            for batch_paths, batch in prefetcher:
+                captions = self.generate_fn(batch)
+                if len(captions) != len(batch_paths):
+                    raise RuntimeError(f"generate_fn returned {len(captions)} captions for {len(batch_paths)} images")
+                for path, caption in zip(batch_paths, captions):
+                    writer.put(path, caption)
+                captioned += len(batch_paths)
+                log.debug(f"Captioned {captioned}/{len(paths)} images")
+        finally:
+            writer.close()
+        seconds = time.perf_counter() - start
+        stats = {
+            "images": writer.written,
+            "failed": len(prefetcher.failed),
+            "seconds": seconds,
+            "images_per_sec": writer.written / seconds if seconds > 0 else 0.0,
+        }
+        log.info(
+            f"Captioned {stats['images']} images in {seconds:.1f}s ({stats['images_per_sec']:.2f} images/sec)"
+            + (f", {stats['failed']} could not be read" if stats["failed"] else "")
+        )
+        return stats
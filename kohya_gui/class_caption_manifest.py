@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+from .custom_logging import setup_logging
+
+# Set up logging
+log = setup_logging()
+
+MANIFEST_CACHE_DIR = os.path.join(
+    os.environ.get("KOHYA_SS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "kohya_ss")),
+    "caption_manifests",
+)
+MANIFEST_VERSION = 1
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def caption_model_id(name: str, **settings) -> str:
+    """Identifies a captioner and the settings that change its output, e.g. "wd14:SmilingWolf/wd-v1-4-convnext-tagger-v2:1a2b3c4d5e6f"."""
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+    return f"{name}:{digest}"
+
+
+def _hash_file(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def list_images(folder: str, recursive: bool = False, extensions=IMAGE_EXTENSIONS) -> List[str]:
+    """Image paths in folder (and its subfolders if recursive), sorted."""
+    images = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        images.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(extensions))
+        if not recursive:
+            break
+    return images
+
+
+def add_pre_postfix_to_file(caption_path: str, prefix: str = "", postfix: str = "") -> None:
+    """Add prefix and/or postfix to one caption file, creating it if it does not exist."""
+    if prefix == "" and postfix == "":
+        return
+    try:
+        if not os.path.exists(caption_path):
+            # Determine the separator based on whether both prefix and postfix are provided
+            separator = " " if prefix and postfix else ""
+            content = f"{prefix}{separator}{postfix}"
+        else:
+            with open(caption_path, "r", encoding="utf-8") as f:
+                # Read the content of the caption file, stripping any trailing whitespace
+                content = f.read().rstrip()
+            prefix_separator = " " if prefix else ""
+            postfix_separator = " " if postfix else ""
+            content = f"{prefix}{prefix_separator}{content}{postfix_separator}{postfix}"
+        with open(caption_path, "w", encoding="utf-8") as f:
+            f.write(content)
+    except Exception as e:
+        log.error(f"Error writing to file {caption_path}: {e}")
+
+
+class CaptionManifest:
+    """
+    Records which images of a folder were captioned, by which captioner, so that a later run only
+    captions new or changed images.
+
+    Every folder that holds images gets a manifest under the cache dir (MANIFEST_CACHE_DIR, keyed
+    by the folder's absolute path, so nothing is written into the dataset itself) mapping caption
+    extension -> image name -> image size, image mtime, model id and the hash of the caption as
+    written. An image is captioned again when:
+
+      - its caption file is missing,
+      - the image changed (size or mtime), or
+      - it was captioned by another model id (another captioner, or other settings).
+
+    A caption whose hash no longer matches was edited by hand and is never overwritten. Captions
+    that exist without a manifest entry (written before this manifest existed, or by hand) are
+    kept as they are. With keep_existing=False both are captioned again instead: only captions
+    this model wrote and nobody changed since are skipped.
+    """
+
+    def __init__(self, caption_ext: str, model_id: str, keep_existing: bool = True):
+        self.caption_ext = caption_ext
+        self.model_id = model_id
+        self.keep_existing = keep_existing
+        self._folders = {}  # folder -> manifest data
+        self._dirty = set()
+
+    @staticmethod
+    def manifest_path(folder: str) -> str:
+        digest = hashlib.sha1(os.path.abspath(folder).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(MANIFEST_CACHE_DIR, f"{digest}.json")
+
+    def caption_path(self, image_path: str) -> str:
+        return os.path.splitext(image_path)[0] + self.caption_ext
+
+    def _entries(self, folder: str) -> Dict[str, dict]:
+        folder = os.path.abspath(folder)
+        data = self._folders.get(folder)
+        if data is None:
+            try:
+                with open(self.manifest_path(folder), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") != MANIFEST_VERSION or data.get("folder") != folder:
+                    data = None
+            except (OSError, ValueError):
+                data = None
+            if data is None:
+                data = {"version": MANIFEST_VERSION, "folder": folder, "captions": {}}
+            self._folders[folder] = data
+        return data["captions"].setdefault(self.caption_ext, {})
+
+    def needs_caption(self, image_path: str, folder_files=None) -> bool:
+        caption_path = self.caption_path(image_path)
+        if folder_files is not None:
+            if os.path.basename(caption_path) not in folder_files:
+                return True
+        elif not os.path.exists(caption_path):
+            return True
+        entry = self._entries(os.path.dirname(image_path)).get(os.path.basename(image_path))
+        if entry is None:
+            return not self.keep_existing  # captioned outside this manifest
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            return False
+        stale = (st.st_size, st.st_mtime_ns) != (entry["size"], entry["mtime_ns"]) or entry["model_id"] != self.model_id
+        if self.keep_existing:
+            if stale and _hash_file(caption_path) != entry["caption_hash"]:
+                log.debug(f"Keeping the hand-edited caption of {image_path}")
+                return False
+            return stale
+        return stale or _hash_file(caption_path) != entry["caption_hash"]
+
+    def pending(self, image_paths: List[str]) -> List[str]:
+        """The images that need a caption, in input order."""
+        listings = {}
+        pending = []
+        for image_path in image_paths:
+            folder = os.path.dirname(image_path)
+            if folder not in listings:
+                try:
+                    listings[folder] = set(os.listdir(folder or "."))
+                except OSError:
+                    listings[folder] = None
+            if self.needs_caption(image_path, listings[folder]):
+                pending.append(image_path)
+        return pending
+
+    def record(self, image_path: str):
+        """Remember the caption just written for image_path (after any prefix/postfix)."""
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            return
+        caption_hash = _hash_file(self.caption_path(image_path))
+        if caption_hash is None:
+            return
+        folder = os.path.abspath(os.path.dirname(image_path))
+        self._dirty.add(folder)
+        self._entries(folder)[os.path.basename(image_path)] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "model_id": self.model_id,
+            "caption_hash": caption_hash,
+        }
+
+    def save(self):
+        """Write the manifests of the folders that got new entries."""
+        for folder in sorted(self._dirty):
+            data = self._folders[folder]
+            # Forget images that were removed from the folder
+            for entries in data["captions"].values():
+                for name in [name for name in entries if not os.path.exists(os.path.join(folder, name))]:
+                    del entries[name]
+            try:
+                os.makedirs(MANIFEST_CACHE_DIR, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=MANIFEST_CACHE_DIR, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=1)
+                os.replace(tmp_path, self.manifest_path(folder))
+            except OSError as e:
+                log.warning(f"Could not save the caption manifest of {folder}: {e}")
+        self._dirty.clear()
+
+
+def _link_or_copy(source: str, target: str):
+    """Hard link, else symlink, else copy: the captioners only read the staged images."""
+    for link in (os.link, os.symlink):
+        try:
+            link(os.path.abspath(source), target)
+            return
+        except (OSError, NotImplementedError):
+            continue
+    shutil.copy2(source, target)
+
+
+def _caption_state(path: str):
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    except OSError:
+        return None
+
+
+def run_in_staging(folder: str, image_paths: List[str], caption_ext: str, run_captioner: Callable[[str], None]) -> List[str]:
+    """
+    Runs a folder-based captioner (sd-scripts' tag_images_by_wd14_tagger.py, make_captions.py, ...)
+    on image_paths only: the images are linked into a temporary folder with the same layout, the
+    captioner runs there, and the captions it writes are moved next to the original images.
+    Existing captions are staged too, for captioners that append to them.
+
+    Returns the images whose caption was written.
+    """
+    written = []
+    with tempfile.TemporaryDirectory(prefix="kohya_caption_") as staging:
+        staged = {}
+        for image_path in image_paths:
+            staged_path = os.path.join(staging, os.path.relpath(image_path, folder))
+            os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+            _link_or_copy(image_path, staged_path)
+            caption_path = os.path.splitext(image_path)[0] + caption_ext
+            staged_caption = os.path.splitext(staged_path)[0] + caption_ext
+            if os.path.exists(caption_path):
+                shutil.copy2(caption_path, staged_caption)
+            staged[image_path] = (staged_caption, _caption_state(staged_caption))
+
+        run_captioner(staging)
+
+        for image_path, (staged_caption, before) in staged.items():
+            after = _caption_state(staged_caption)
+            if after is not None and after != before:
+                shutil.move(staged_caption, os.path.splitext(image_path)[0] + caption_ext)
+                written.append(image_path)
+    return written
+
+
+def caption_incrementally(
+    folder: str,
+    caption_ext: str,
+    model_id: str,
+    run_captioner: Callable[[str], None],
+    recursive: bool = False,
+    prefix: str = "",
+    postfix: str = "",
+    incremental: bool = True,
+    keep_existing: bool = True,
+) -> List[str]:
+    """
+    Captions the images of folder that need it (all of them when incremental is False) with
+    run_captioner(folder_to_caption), adds prefix/postfix to the captions just written only, and
+    records them in the folders' caption manifests. Returns the images that were captioned.
+    """
+    manifest = CaptionManifest(caption_ext, model_id, keep_existing)
+    images = list_images(folder, recursive)
+    pending = manifest.pending(images) if incremental else images
+    if not pending:
+        log.info(f"All {len(images)} images in {folder} are already captioned with {model_id}; nothing to do.")
+        return []
+    log.info(f"Captioning {len(pending)} of {len(images)} images in {folder}...")
+
+    if len(pending) == len(images):
+        # Everything needs a caption: run on the folder itself, no staging needed
+        before = {image_path: _caption_state(manifest.caption_path(image_path)) for image_path in images}
+        run_captioner(folder)
+        written = [
+            image_path
+            for image_path in images
+            if _caption_state(manifest.caption_path(image_path)) not in (None, before[image_path])
+        ]
+    else:
+        written = run_in_staging(folder, pending, caption_ext, run_captioner)
+
+    for image_path in written:
+        add_pre_postfix_to_file(manifest.caption_path(image_path), prefix, postfix)
+        manifest.record(image_path)
+    manifest.save()
+    log.info(f"Wrote {len(written)} caption(s).")
+    return written
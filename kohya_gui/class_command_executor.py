@@ -1,4 +1,9 @@
+import asyncio
+import codecs
+import os
+import re
 import subprocess
+import sys
 import psutil
 import time
 import threading
@@ -10,6 +15,205 @@ from .custom_logging import setup_logging
 # Set up logging
 log = setup_logging()
 
+# tqdm progress line, e.g. "steps:  45%|####5     | 100/450 [01:23<04:50,  1.20it/s, avr_loss=0.0543]"
+_PROGRESS_STEP_PATTERN = re.compile(r"(\d+)/(\d+)\s*\[")
+_PROGRESS_METRIC_PATTERN = re.compile(r"(\w+)=([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)")
+
+
+class OutputBuffer:
+    """
+    Bounded ring buffer of process output lines with monotonically increasing line offsets.
+
+    Line N keeps offset N for the life of the run even after older lines are dropped, so clients
+    can ask for "lines since offset N" instead of copying the whole buffer on every poll.
+    Carriage-return updates (tqdm bars) replace the current progress line instead of adding lines.
+    Every change bumps `version`; threads wait on `changed`, asyncio code awaits wait_changed().
+    """
+
+    def __init__(self, max_lines: int = 500):
+        self.lines = deque(maxlen=max_lines)
+        self.next_offset = 0
+        self.progress = ""
+        self.progress_step = None
+        self.progress_total = None
+        self.progress_metrics = {}
+        self.exit_code = None
+        self.closed = False
+        self.version = 0
+        self.changed = threading.Condition()
+        self._async_waiters = set()
+
+    @property
+    def first_offset(self) -> int:
+        return self.next_offset - len(self.lines)
+
+    def _notify(self):
+        """Called with `changed` held, after every mutation."""
+        self.version += 1
+        self.changed.notify_all()
+        for loop, future in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve_future, future)
+            except RuntimeError:
+                pass  # the waiting event loop is already closed
+        self._async_waiters.clear()
+
+    async def wait_changed(self, version: int, timeout: float = None) -> int:
+        """Wait until `version` is stale (or timeout) and return the current version.
+
+        The waiter is a future resolved from the reader thread, so a waiting client holds no
+        thread and costs nothing while the process is silent.
+        """
+        loop = asyncio.get_running_loop()
+        with self.changed:
+            if self.version != version:
+                return self.version
+            waiter = (loop, loop.create_future())
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.changed:
+                self._async_waiters.discard(waiter)
+        return self.version
+
+    def clear(self):
+        with self.changed:
+            self.lines.clear()
+            self.next_offset = 0
+            self.progress = ""
+            self.progress_step = self.progress_total = None
+            self.progress_metrics = {}
+            self.exit_code = None
+            self.closed = False
+            self._notify()
+
+    def append_line(self, line: str):
+        with self.changed:
+            self.lines.append(line)
+            self.next_offset += 1
+            self.progress = ""
+            self._notify()
+
+    def set_progress(self, text: str):
+        step_match = _PROGRESS_STEP_PATTERN.search(text)
+        with self.changed:
+            self.progress = text
+            if step_match:
+                self.progress_step = int(step_match.group(1))
+                self.progress_total = int(step_match.group(2))
+                self.progress_metrics.update(
+                    (k, float(v)) for k, v in _PROGRESS_METRIC_PATTERN.findall(text)
+                )
+            self._notify()
+
+    def close(self, exit_code):
+        with self.changed:
+            self.exit_code = exit_code
+            self.closed = True
+            self._notify()
+
+    def lines_since(self, offset: int):
+        """(lines with offset >= `offset` still in the buffer, offset to pass next time)."""
+        with self.changed:
+            start = max(offset, self.first_offset) - self.first_offset
+            return [self.lines[i] for i in range(start, len(self.lines))], self.next_offset
+
+    def tail(self, n: int):
+        with self.changed:
+            if n <= 0 or n >= len(self.lines):
+                return list(self.lines)
+            return [self.lines[i] for i in range(len(self.lines) - n, len(self.lines))]
+
+
+def _resolve_future(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _OutputReader:
+    """
+    Reads a child's merged stdout/stderr in chunks on one thread per process (not per line).
+
+    On POSIX the pipe is non-blocking and waited on with a selector; Windows pipes cannot be
+    selected, so there the thread blocks in os.read() on whole chunks instead. Output is echoed to
+    the console unchanged (and to `log_file` if given; it is closed at EOF) and split into lines
+    for the buffer.
+    """
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, process: subprocess.Popen, buffer: OutputBuffer, echo: bool = True, log_file=None):
+        self.process = process
+        self.buffer = buffer
+        self.echo = echo
+        self.log_file = log_file
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.pending = ""
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        fd = self.process.stdout.fileno()
+        try:
+            if os.name == "nt":
+                while True:
+                    data = os.read(fd, self.CHUNK_SIZE)
+                    if not data:
+                        break
+                    self._feed(data)
+            else:
+                import selectors
+
+                os.set_blocking(fd, False)
+                with selectors.DefaultSelector() as selector:
+                    selector.register(fd, selectors.EVENT_READ)
+                    eof = False
+                    while not eof:
+                        for _ in selector.select(timeout=1.0):
+                            try:
+                                data = os.read(fd, self.CHUNK_SIZE)
+                            except BlockingIOError:
+                                continue
+                            if not data:
+                                eof = True
+                                break
+                            self._feed(data)
+            self._feed(b"", final=True)
+        except Exception as e:
+            log.debug(f"Output reader error: {e}")
+        finally:
+            self.process.stdout.close()
+            if self.log_file is not None:
+                self.log_file.close()
+            self.buffer.close(self.process.wait())
+
+    def _feed(self, data: bytes, final: bool = False):
+        text = self.decoder.decode(data, final=final)
+        if self.echo and text:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        if self.log_file is not None and text:
+            self.log_file.write(text)
+            self.log_file.flush()
+        text = self.pending + text
+        # Every complete "\n"-terminated segment is a line; within it, "\r" rewrites are collapsed to
+        # the last one. What follows the last "\n" is the line being drawn (e.g. a tqdm bar).
+        *complete, self.pending = text.split("\n")
+        for line in complete:
+            self.buffer.append_line(line.rstrip("\r").rsplit("\r", 1)[-1])
+        if "\r" in self.pending:
+            parts = [p for p in self.pending.split("\r") if p]
+            self.pending = parts[-1] if parts else ""
+            self.buffer.set_progress(self.pending)
+        if final and self.pending:
+            self.buffer.append_line(self.pending)
+            self.pending = ""
+
 
 class CommandExecutor:
     """
@@ -22,9 +226,8 @@ class CommandExecutor:
         """
         self.headless = headless
         self.process = None
-        self.output_buffer = deque(maxlen=500)  # 最大500行のログを保持
-        self.output_lock = threading.Lock()
-        self._reader_thread = None
+        self.output_buffer = OutputBuffer(max_lines=500)  # 最大500行のログを保持
+        self._reader = None
         
         with gr.Row():
             self.button_run = gr.Button("Start training", variant="primary")
@@ -44,57 +247,59 @@ class CommandExecutor:
         if self.process and self.process.poll() is None:
             log.info("The command is already running. Please wait for it to finish.")
         else:
-            # Clear output buffer
-            with self.output_lock:
-                self.output_buffer.clear()
+            self.output_buffer.clear()
 
             # Reconstruct the safe command string for display
             command_to_run = " ".join(run_cmd)
             log.info(f"Executing command: {command_to_run}")
 
-            # 出力キャプチャを無効化（元の動作）
-            # 注: 出力はコンソールに直接表示され、UIには表示されません
-            # kwargs.setdefault('stdout', subprocess.PIPE)
-            # kwargs.setdefault('stderr', subprocess.STDOUT)
-            # kwargs.setdefault('bufsize', 1)
-            # kwargs.setdefault('universal_newlines', True)
-            # kwargs.setdefault('encoding', 'utf-8')
-            # kwargs.setdefault('errors', 'replace')
+            # Capture stdout/stderr unless the caller redirected them; the reader still echoes
+            # everything to the console, so the terminal output is unchanged.
+            capture = "stdout" not in kwargs and "stderr" not in kwargs
+            if capture:
+                kwargs["stdout"] = subprocess.PIPE
+                kwargs["stderr"] = subprocess.STDOUT
+                # A piped child would otherwise block-buffer its prints.
+                kwargs["env"] = {**(kwargs.get("env") or os.environ), "PYTHONUNBUFFERED": "1"}
 
             # Execute the command securely
             self.process = subprocess.Popen(run_cmd, **kwargs)
             log.debug("Command executed.")
-            
-            # Background thread disabled (output capture is off)
-            # self._reader_thread = threading.Thread(target=self._read_output, daemon=True)
-            # self._reader_thread.start()
-    
-    def _read_output(self):
-        """Background thread to read process output."""
-        try:
-            if self.process and self.process.stdout:
-                for line in iter(self.process.stdout.readline, ''):
-                    if not line:
-                        break
-                    line = line.rstrip('\n\r')
-                    # ログにも出力
-                    print(line)
-                    # バッファに追加
-                    with self.output_lock:
-                        self.output_buffer.append(line)
-        except Exception as e:
-            log.debug(f"Output reader error: {e}")
-        finally:
-            if self.process and self.process.stdout:
-                self.process.stdout.close()
-    
+
+            self._reader = _OutputReader(self.process, self.output_buffer) if capture else None
+            if self._reader is not None:
+                self._reader.start()
+
+    def output_finished(self) -> bool:
+        """True once all output of the last command has been read (always True when output is not captured)."""
+        return self._reader is None or self.output_buffer.closed
+
+    @property
+    def output_offset(self) -> int:
+        """Offset the next captured line will get."""
+        return self.output_buffer.next_offset
+
+    def get_output_since(self, offset: int):
+        """(new lines since `offset`, next offset). Lines already dropped from the ring buffer are skipped."""
+        return self.output_buffer.lines_since(offset)
+
+    def get_progress(self) -> dict:
+        """Latest progress-bar state: the raw line, step/total and the numeric postfix metrics (e.g. avr_loss)."""
+        buffer = self.output_buffer
+        with buffer.changed:
+            return {
+                "text": buffer.progress,
+                "step": buffer.progress_step,
+                "total": buffer.progress_total,
+                "metrics": dict(buffer.progress_metrics),
+            }
+
     def get_output(self, last_n_lines: int = 50) -> str:
-        """Get the last N lines of output."""
-        with self.output_lock:
-            lines = list(self.output_buffer)
-            if last_n_lines > 0:
-                lines = lines[-last_n_lines:]
-            return '\n'.join(lines)
+        """Get the last N lines of output, followed by the current progress line if one is being drawn."""
+        lines = self.output_buffer.tail(last_n_lines)
+        if self.output_buffer.progress:
+            lines.append(self.output_buffer.progress)
+        return '\n'.join(lines)
 
     def kill_command(self):
         """
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from .class_directory_index import MTIME_GRACE_SECONDS, natural_sort_key
+from .custom_logging import setup_logging
+
+# Set up logging
+log = setup_logging()
+
+MANIFEST_CACHE_DIR = os.path.join(
+    os.environ.get("KOHYA_SS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "kohya_ss")),
+    "dataset_manifests",
+)
+MANIFEST_VERSION = 1
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif")
+CAPTION_EXTENSIONS = (".txt", ".caption")
+SCAN_WORKERS = 16
+
+# "<repeats>_<concept>", e.g. "40_sks dog"
+CONCEPT_FOLDER_PATTERN = re.compile(r"^(\d+)_(.+)$")
+
+
+class FolderEntry:
+    """One directory of a dataset: its sorted file names and subfolders, as listed at `scanned_at`."""
+
+    def __init__(self, rel_path: str, mtime_ns: int, files: List[str], subdirs: List[str], scanned_at: float = 0.0):
+        self.rel_path = rel_path
+        self.mtime_ns = mtime_ns
+        self.files = files
+        self.subdirs = subdirs
+        self.scanned_at = scanned_at
+        match = CONCEPT_FOLDER_PATTERN.match(os.path.basename(rel_path))
+        self.repeats = int(match.group(1)) if match else None
+        self.concept = match.group(2) if match else None
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.rel_path)
+
+    def images(self, extensions=IMAGE_EXTENSIONS) -> List[str]:
+        extensions = tuple(ext.lower() for ext in extensions)
+        return [name for name in self.files if name.lower().endswith(extensions)]
+
+    def captioned_images(self, caption_extension: str = ".txt", extensions=IMAGE_EXTENSIONS) -> List[str]:
+        stems = {os.path.splitext(name)[0] for name in self.files if name.lower().endswith(caption_extension.lower())}
+        return [name for name in self.images(extensions) if os.path.splitext(name)[0] in stems]
+
+    def duplicate_stems(self, extensions=IMAGE_EXTENSIONS) -> Dict[str, List[str]]:
+        """Stems used by more than one image (e.g. a.jpg and a.png), which sd-scripts cannot tell apart."""
+        by_stem = {}
+        for name in self.images(extensions):
+            by_stem.setdefault(os.path.splitext(name)[0], []).append(name)
+        return {stem: names for stem, names in by_stem.items() if len(names) > 1}
+
+    def to_dict(self) -> dict:
+        return {
+            "rel_path": self.rel_path,
+            "mtime_ns": self.mtime_ns,
+            "files": self.files,
+            "subdirs": self.subdirs,
+            "scanned_at": self.scanned_at,
+            # Derived values, for readers of the manifest file
+            "repeats": self.repeats,
+            "image_count": len(self.images()),
+            "captioned": {ext: len(self.captioned_images(ext)) for ext in CAPTION_EXTENSIONS},
+            "duplicate_stems": sorted(self.duplicate_stems()),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FolderEntry":
+        return cls(data["rel_path"], data["mtime_ns"], data["files"], data["subdirs"], data.get("scanned_at", 0.0))
+
+
+class DatasetManifest:
+    """
+    Contents of a training data folder, scanned once and shared by the dataset checks.
+
+    `folders` maps a path relative to the root ("" is the root itself) to its FolderEntry, down to
+    `max_depth` levels (None: all). The concept folders are the root's direct subfolders.
+    """
+
+    def __init__(self, root: str, max_depth: Optional[int], folders: Dict[str, FolderEntry]):
+        self.root = root
+        self.max_depth = max_depth
+        self.folders = folders
+
+    @property
+    def root_entry(self) -> FolderEntry:
+        return self.folders[""]
+
+    def concepts(self) -> List[FolderEntry]:
+        """The root's direct subfolders, naturally sorted (with or without a <repeats>_ prefix)."""
+        return [self.folders[name] for name in self.root_entry.subdirs if name in self.folders]
+
+    def path(self, entry: FolderEntry, name: str = "") -> str:
+        return os.path.join(self.root, entry.rel_path, name) if name else os.path.join(self.root, entry.rel_path)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": MANIFEST_VERSION,
+            "root": self.root,
+            "max_depth": self.max_depth,
+            "folders": [entry.to_dict() for entry in self.folders.values()],
+        }
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def _cache_path(root: str, max_depth: Optional[int]) -> str:
+    digest = hashlib.sha1(f"{root}|{max_depth}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(MANIFEST_CACHE_DIR, f"{digest}.json")
+
+
+def _load_cached(root: str, max_depth: Optional[int]) -> Dict[str, FolderEntry]:
+    with _manifests_lock:
+        manifest = _manifests.get((root, max_depth))
+    if manifest is not None:
+        return dict(manifest.folders)
+    try:
+        with open(_cache_path(root, max_depth), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION or data.get("root") != root:
+            return {}
+        return {entry["rel_path"]: FolderEntry.from_dict(entry) for entry in data["folders"]}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _save(manifest: DatasetManifest):
+    try:
+        os.makedirs(MANIFEST_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=MANIFEST_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest.to_dict(), f)
+        os.replace(tmp_path, _cache_path(manifest.root, manifest.max_depth))
+    except OSError as e:
+        log.debug(f"Could not save the dataset manifest of {manifest.root}: {e}")
+
+
+def _scan_folder(root: str, rel_path: str) -> FolderEntry:
+    path = os.path.join(root, rel_path)
+    scanned_at = time.time()
+    mtime_ns = os.stat(path).st_mtime_ns
+    files, subdirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                (subdirs if entry.is_dir() else files).append(entry.name)
+            except OSError:
+                continue
+    files.sort(key=natural_sort_key)
+    subdirs.sort(key=natural_sort_key)
+    return FolderEntry(rel_path, mtime_ns, files, subdirs, scanned_at)
+
+
+def scan_dataset(root: str, max_depth: Optional[int] = None, workers: int = SCAN_WORKERS) -> DatasetManifest:
+    """
+    Manifest of `root`, reusing every folder whose mtime is unchanged since the last scan.
+
+    max_depth limits the folders scanned: 0 is the root alone, 1 adds the concept folders, None
+    scans everything below. Folders are listed with os.scandir on a thread pool (one pass each,
+    no per-file stat). The manifest is kept in memory and under ~/.cache/kohya_ss/dataset_manifests,
+    never inside the dataset, so writing it does not change the dataset's mtimes.
+
+    As in DirectoryIndex, a folder listed within MTIME_GRACE_SECONDS of its mtime is listed again:
+    a change made in the same mtime tick would not move the mtime.
+    """
+    root = os.path.abspath(root)
+    cached = _load_cached(root, max_depth)
+    folders = {}
+
+    def refresh(rel_path):
+        entry = cached.get(rel_path)
+        try:
+            mtime_ns = os.stat(os.path.join(root, rel_path)).st_mtime_ns
+            if (
+                entry is not None
+                and entry.mtime_ns == mtime_ns
+                and entry.scanned_at - mtime_ns / 1e9 > MTIME_GRACE_SECONDS
+            ):
+                return entry
+            return _scan_folder(root, rel_path)
+        except OSError:
+            return None  # removed while scanning
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        level, depth = [""], 0
+        while level:
+            next_level = []
+            for entry in pool.map(refresh, level):
+                if entry is None:
+                    continue
+                folders[entry.rel_path] = entry
+                if max_depth is None or depth < max_depth:
+                    next_level.extend(os.path.join(entry.rel_path, name) for name in entry.subdirs)
+            level, depth = next_level, depth + 1
+
+        if "" not in folders:
+            raise FileNotFoundError(f"Dataset folder {root} does not exist")
+        changed = set(folders) != set(cached) or any(entry is not cached.get(key) for key, entry in folders.items())
+
+    manifest = DatasetManifest(root, max_depth, folders)
+    with _manifests_lock:
+        _manifests[(root, max_depth)] = manifest
+    if changed:
+        _save(manifest)
+    return manifest
@@ -0,0 +1,104 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Names the dropdown listings never show
+HIDDEN_NAMES = ("__pycache__",)
+
+# Filesystems with coarse timestamps (FAT, some NFS servers) can change a directory within the same
+# mtime tick; a listing taken that soon after the last change is not trusted on the next lookup.
+MTIME_GRACE_SECONDS = 2.0
+
+
+def natural_sort_key(s, regex=re.compile("([0-9]+)")):
+    return [int(text) if text.isdigit() else text.lower() for text in regex.split(s)]
+
+
+class _Listing:
+    """Sorted names of one directory, split into subdirectories and files, with files indexed by extension."""
+
+    __slots__ = ("mtime_ns", "scanned_at", "dirs", "files", "files_by_ext")
+
+    def __init__(self, mtime_ns, scanned_at, dirs, files):
+        self.mtime_ns = mtime_ns
+        self.scanned_at = scanned_at
+        self.dirs = dirs
+        self.files = files
+        self.files_by_ext = {}
+        for name in files:
+            self.files_by_ext.setdefault(os.path.splitext(name)[1].lower(), []).append(name)
+
+
+class DirectoryIndex:
+    """
+    Shared cache of directory listings for the GUI's path dropdowns.
+
+    A directory is read with one os.scandir() pass (the entry type comes from the directory itself,
+    so there is no stat per entry) and kept, naturally sorted, until the directory's mtime changes.
+    A lookup of an unchanged directory costs one stat, however many entries it has.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._listings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def listing(self, path: str) -> _Listing:
+        key = os.path.abspath(path)
+        mtime_ns = os.stat(key).st_mtime_ns
+        with self._lock:
+            listing = self._listings.get(key)
+            if (
+                listing is not None
+                and listing.mtime_ns == mtime_ns
+                and listing.scanned_at - mtime_ns / 1e9 > MTIME_GRACE_SECONDS
+            ):
+                self._listings.move_to_end(key)
+                return listing
+
+        scanned_at = time.time()
+        dirs, files = [], []
+        with os.scandir(key) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or entry.name in HIDDEN_NAMES:
+                    continue
+                try:
+                    (dirs if entry.is_dir() else files).append(entry.name)
+                except OSError:
+                    continue  # broken entry, e.g. removed while scanning
+        dirs.sort(key=natural_sort_key)
+        files.sort(key=natural_sort_key)
+        listing = _Listing(mtime_ns, scanned_at, dirs, files)
+
+        with self._lock:
+            self._listings[key] = listing
+            self._listings.move_to_end(key)
+            while len(self._listings) > self.max_entries:
+                self._listings.popitem(last=False)
+        return listing
+
+    def subdirs(self, path: str) -> list:
+        return list(self.listing(path).dirs)
+
+    def files(self, path: str, exts=None) -> list:
+        """File names, naturally sorted; with `exts` only those extensions (case-insensitive, e.g. ".safetensors")."""
+        listing = self.listing(path)
+        if exts is None:
+            return list(listing.files)
+        exts = {ext.lower() for ext in exts}
+        if len(exts) == 1:
+            return list(listing.files_by_ext.get(next(iter(exts)), []))
+        return [name for name in listing.files if os.path.splitext(name)[1].lower() in exts]
+
+    def invalidate(self, path: str = None):
+        """Forget one directory (or everything), e.g. after writing files into it."""
+        with self._lock:
+            if path is None:
+                self._listings.clear()
+            else:
+                self._listings.pop(os.path.abspath(path), None)
+
+
+directory_index = DirectoryIndex()
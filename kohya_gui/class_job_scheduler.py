@@ -0,0 +1,645 @@
+import itertools
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+import gradio as gr
+import psutil
+
+from .class_command_executor import OutputBuffer, _OutputReader
+from .custom_logging import setup_logging
+
+# Set up logging
+log = setup_logging()
+
+DEFAULT_STATE_DIR = os.path.join(
+    os.environ.get("KOHYA_SS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "kohya_ss")),
+    "jobs",
+)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"  # was running when the GUI stopped
+EXITED = "exited"  # adopted from an earlier session and ended; its exit code is unknown
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED, INTERRUPTED, EXITED)
+
+
+@dataclass
+class Job:
+    """One queued command line. Only the dataclass fields are persisted; process and output are per session."""
+
+    id: str
+    command: List[str]
+    name: str = ""
+    priority: int = 0
+    gpus: int = 1
+    env: dict = field(default_factory=dict)  # overrides on top of os.environ, not the whole environment
+    cwd: Optional[str] = None
+    seq: int = 0
+    status: str = QUEUED
+    exit_code: Optional[int] = None
+    slots: list = field(default_factory=list)
+    pid: Optional[int] = None
+    pid_create_time: Optional[float] = None  # with pid, identifies the process across GUI restarts
+    log_path: str = ""
+    submitted_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def __post_init__(self):
+        self.output_buffer = OutputBuffer(max_lines=500)
+        self.process = None
+        self._reader = None
+        self._cancel_requested = False
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+
+class JobScheduler:
+    """
+    Persistent priority queue of training command lines, run on GPU slots.
+
+    Jobs run in (priority desc, submission order). The head of the queue is started as soon as
+    `job.gpus` slots are free and fewer than `max_concurrent` jobs run; a job that does not fit yet
+    blocks the ones behind it, so a multi-GPU job cannot be starved by single-GPU jobs.
+    A job is pinned to its slots with CUDA_VISIBLE_DEVICES. A slot of None leaves the variable as
+    it is, so `JobScheduler(gpu_slots=[None, None])` runs two jobs side by side on a machine
+    without GPUs (e.g. dummy `python -c ...` commands).
+
+    The queue is saved to `<state_dir>/queue.json` on every change. Each job writes its output
+    straight to `<state_dir>/<job id>.log`, which the scheduler follows, so a job does not depend
+    on the GUI that started it. After a restart queued jobs are still queued and start on start()
+    (or the next submit()). A job that is still running (the previous GUI exited with
+    shutdown(kill=False), or crashed) is adopted: it keeps its GPU slots and its log is followed
+    again. Jobs whose process is gone are marked interrupted (or queued again with
+    requeue_interrupted=True).
+
+    Creating a scheduler has no side effects; open() loads the queue and takes ownership of it.
+    Only one scheduler owns a state dir: it holds an OS-level lock on `<state_dir>/owner.lock`,
+    which also records the owner's pid and create time. A scheduler that cannot take the lock (a
+    second GUI on another port) opens the queue read-only: it shows the jobs as saved by the owner
+    and never starts, kills or saves anything. Until open() every scheduler is read-only.
+    """
+
+    def __init__(
+        self,
+        gpu_slots=None,
+        max_concurrent: int = 0,
+        state_dir: str = DEFAULT_STATE_DIR,
+        requeue_interrupted: bool = False,
+        echo: bool = True,
+    ):
+        self.gpu_slots = list(gpu_slots) if gpu_slots else [None]
+        self.max_concurrent = max_concurrent or len(self.gpu_slots)
+        self.state_dir = state_dir
+        self.state_path = os.path.join(state_dir, "queue.json")
+        self.requeue_interrupted = requeue_interrupted
+        self.echo = echo
+        self.jobs = {}
+        self.read_only = True
+        self._opened = False
+        self._lock = threading.RLock()
+        self._seq = itertools.count()
+        self._shutting_down = False
+        self._owner_lock = _OwnerLock(os.path.join(state_dir, "owner.lock"))
+
+    def open(self) -> "JobScheduler":
+        """Load the queue and take ownership of it if no other GUI runs it. Does nothing the second time."""
+        if self._opened:
+            return self
+        self._opened = True
+        self.read_only = not self._owner_lock.acquire()
+        with self._lock:
+            self.jobs = {}
+            self._load(self.requeue_interrupted)
+            self._save()
+        if self.read_only:
+            log.warning(
+                f"The job queue in {self.state_dir} is run by another GUI ({self._owner_lock.owner()}); "
+                "showing it read-only"
+            )
+        elif self.jobs:
+            log.info(f"Loaded {len(self.jobs)} job(s) from {self.state_path}")
+        return self
+
+    # --- persistence ---
+    def _load(self, requeue_interrupted: bool):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = []
+        for entry in saved:
+            try:
+                job = Job(**entry)
+            except TypeError:
+                log.warning(f"Skipping unreadable job entry in {self.state_path}: {entry}")
+                continue
+            self.jobs[job.id] = job
+            if job.status != RUNNING or self.read_only:
+                continue
+            survivor = _surviving_process(job)
+            if survivor is not None:
+                log.info(f"Job {job.name} ({job.id}) is still running as pid {job.pid} from an earlier session; following it")
+                self._follow(job, _AdoptedProcess(survivor))
+                continue
+            job.status = QUEUED if requeue_interrupted else INTERRUPTED
+            job.slots, job.pid, job.pid_create_time = [], None, None
+            if job.status == INTERRUPTED:
+                job.finished_at = time.time()
+        if self.jobs:
+            self._seq = itertools.count(max(job.seq for job in self.jobs.values()) + 1)
+
+    def _reload(self):
+        """Read the owner's latest queue again (read-only schedulers only)."""
+        with self._lock:
+            self.jobs = {}
+            self._load(requeue_interrupted=False)
+
+    def _check_owner(self):
+        if not self._opened:
+            raise RuntimeError(f"The job queue in {self.state_dir} is not open")
+        if self.read_only:
+            raise RuntimeError(f"The job queue in {self.state_dir} is run by another GUI ({self._owner_lock.owner()})")
+
+    def _save(self):
+        if self.read_only:
+            return
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump([job.to_dict() for job in self._ordered()], f, indent=2)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            log.warning(f"Could not save the job queue to {self.state_path}: {e}")
+
+    def _ordered(self):
+        return sorted(self.jobs.values(), key=lambda job: (-job.priority, job.seq))
+
+    # --- queue ---
+    def submit(
+        self,
+        command,
+        name: str = "",
+        priority: int = 0,
+        gpus: int = 1,
+        env: dict = None,
+        cwd: str = None,
+    ) -> Job:
+        """Queue a command line (list of arguments) and start it if a slot is free.
+
+        `env` may be a full environment (e.g. setup_environment()); only the entries that differ
+        from os.environ are stored with the job.
+        """
+        self._check_owner()
+        if gpus < 1 or gpus > len(self.gpu_slots):
+            raise ValueError(f"A job can use 1 to {len(self.gpu_slots)} GPU slot(s), not {gpus}")
+        env_overrides = {k: v for k, v in (env or {}).items() if os.environ.get(k) != v}
+        with self._lock:
+            job_id = uuid.uuid4().hex[:12]
+            job = Job(
+                id=job_id,
+                command=[str(arg) for arg in command],
+                name=name or job_id,
+                priority=priority,
+                gpus=gpus,
+                env=env_overrides,
+                cwd=cwd,
+                seq=next(self._seq),
+                log_path=os.path.join(self.state_dir, f"{job_id}.log"),
+                submitted_at=time.time(),
+            )
+            self.jobs[job.id] = job
+            log.info(f"Queued job {job.name} ({job.id}) with priority {priority}")
+            self._dispatch()
+            self._save()
+            return job
+
+    def cancel(self, job_id: str) -> bool:
+        """Remove a queued job from the queue or kill a running one. False if the job already finished."""
+        self._check_owner()
+        with self._lock:
+            job = self.jobs[job_id]
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                self._save()
+                return True
+            if job.status != RUNNING:
+                return False
+            job._cancel_requested = True
+            process = job.process
+        # The watcher thread records the exit and starts the next job.
+        _kill_process_tree(process.pid)
+        return True
+
+    def retry(self, job_id: str) -> Job:
+        """Queue a finished job's command again as a new job with the same settings."""
+        job = self.get(job_id)
+        return self.submit(job.command, name=job.name, priority=job.priority, gpus=job.gpus, env=job.env, cwd=job.cwd)
+
+    def clear_finished(self):
+        """Forget finished jobs and delete their logs."""
+        self._check_owner()
+        with self._lock:
+            for job in [job for job in self.jobs.values() if job.is_finished]:
+                del self.jobs[job.id]
+                try:
+                    os.remove(job.log_path)
+                except OSError:
+                    pass
+            self._save()
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self.jobs[job_id]
+
+    def list_jobs(self) -> List[Job]:
+        """All jobs: running first, then queued in start order, then finished (newest first)."""
+        if self.read_only:
+            self._reload()
+        with self._lock:
+            ordered = self._ordered()
+        running = [job for job in ordered if job.status == RUNNING]
+        queued = [job for job in ordered if job.status == QUEUED]
+        finished = sorted((job for job in ordered if job.is_finished), key=lambda job: -(job.finished_at or 0))
+        return running + queued + finished
+
+    def is_idle(self) -> bool:
+        with self._lock:
+            return not any(job.status in (QUEUED, RUNNING) for job in self.jobs.values())
+
+    # --- output ---
+    def get_output(self, job_id: str, last_n_lines: int = 50) -> str:
+        """Last N lines of a job's output; for jobs from an earlier session, read from its log file."""
+        job = self.get(job_id)
+        if job.process is None:
+            return _tail_file(job.log_path, last_n_lines)
+        lines = job.output_buffer.tail(last_n_lines)
+        if job.output_buffer.progress:
+            lines.append(job.output_buffer.progress)
+        return "\n".join(lines)
+
+    def get_output_since(self, job_id: str, offset: int):
+        """(new lines since `offset`, next offset) of a job started in this session."""
+        return self.get(job_id).output_buffer.lines_since(offset)
+
+    # --- running ---
+    def start(self):
+        """Start the jobs that are queued and fit on the free slots (nothing on a read-only queue)."""
+        if self.read_only:
+            return
+        with self._lock:
+            self._dispatch()
+            self._save()
+
+    def _dispatch(self):
+        """Start queued jobs while the head of the queue fits. Called with the lock held."""
+        running = [job for job in self.jobs.values() if job.status == RUNNING]
+        busy = {slot for job in running for slot in job.slots}
+        free = [index for index in range(len(self.gpu_slots)) if index not in busy]
+        for job in self._ordered():
+            if job.status != QUEUED:
+                continue
+            if len(running) >= self.max_concurrent or job.gpus > len(free):
+                break
+            job.slots, free = free[: job.gpus], free[job.gpus :]
+            self._start(job)
+            running.append(job)
+
+    def _start(self, job: Job):
+        env = {**os.environ, **job.env, "PYTHONUNBUFFERED": "1"}
+        devices = [self.gpu_slots[index] for index in job.slots]
+        if all(device is not None for device in devices):
+            env["CUDA_VISIBLE_DEVICES"] = ",".join(str(device) for device in devices)
+        job.status, job.started_at, job.exit_code = RUNNING, time.time(), None
+        log.info(f"Starting job {job.name} ({job.id}) on slot(s) {devices}: {' '.join(job.command)}")
+        try:
+            os.makedirs(os.path.dirname(job.log_path), exist_ok=True)
+            # The job writes to its log file itself (not to a pipe of this process), so it can
+            # outlive the GUI and be adopted by the next one
+            with open(job.log_path, "wb") as log_file:
+                process = subprocess.Popen(job.command, cwd=job.cwd, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        except OSError as e:
+            log.error(f"Could not start job {job.name} ({job.id}): {e}")
+            job.status, job.finished_at, job.slots = FAILED, time.time(), []
+            job.output_buffer.append_line(str(e))
+            job.output_buffer.close(None)
+            return
+        job.pid = process.pid
+        try:
+            job.pid_create_time = psutil.Process(job.pid).create_time()
+        except psutil.Error:
+            job.pid_create_time = None
+        self._follow(job, process)
+
+    def _follow(self, job: Job, process):
+        """Follow a running job's log into its output buffer and record its exit when it ends."""
+        job.process = process
+        job._reader = _LogFileReader(process, job.output_buffer, job.log_path, echo=self.echo)
+        job._reader.start()
+        threading.Thread(target=self._watch, args=(job,), daemon=True).start()
+
+    def _watch(self, job: Job):
+        job._reader.thread.join()
+        exit_code = job.process.wait()
+        with self._lock:
+            if self.read_only:
+                return  # shut down: the next owner records the exit
+            job.exit_code = exit_code
+            job.finished_at = time.time()
+            if job._cancel_requested:
+                job.status = CANCELLED
+            elif self._shutting_down:
+                job.status = INTERRUPTED
+            elif exit_code is None:
+                job.status = EXITED
+            else:
+                job.status = SUCCEEDED if exit_code == 0 else FAILED
+            job.slots = []
+            log.info(f"Job {job.name} ({job.id}) {job.status} with exit code {exit_code}")
+            self._dispatch()
+            self._save()
+
+    def shutdown(self, kill: bool = True, timeout: float = 10):
+        """Stop dispatching and kill running jobs, recorded as interrupted. Registered with atexit by the GUI.
+
+        With kill=False running jobs are left alone and stay running in the saved queue; the next
+        JobScheduler adopts them on load. Either way the queue is then released to the next owner.
+        """
+        if self.read_only:
+            return
+        with self._lock:
+            self._shutting_down = True
+            self.max_concurrent = 0
+            running = [job for job in self.jobs.values() if job.status == RUNNING and job.process is not None]
+        if not kill:
+            self._release()
+            return
+        for job in running:
+            _kill_process_tree(job.process.pid)
+        for job in running:
+            try:
+                job.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                log.warning(f"Job {job.name} ({job.id}) did not exit within {timeout}s")
+        # At interpreter exit the watcher threads may not get to record the exit, so do it here
+        with self._lock:
+            for job in running:
+                if job.status == RUNNING:
+                    job.status, job.exit_code = INTERRUPTED, job.process.poll()
+                    job.finished_at, job.slots = time.time(), []
+            self._save()
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            self._save()
+            self.read_only = True
+            self._owner_lock.release()
+
+
+class _OwnerLock:
+    """
+    OS-level exclusive lock on a file, held by the one scheduler that runs a state dir. The OS
+    drops it when the owning process exits, however it exits, so a stale lock never blocks.
+    The file records the owner's pid and create time for the message shown to other GUIs.
+    """
+
+    # Windows locks byte ranges that other processes cannot read, so lock one past the owner info
+    WINDOWS_LOCK_OFFSET = 4096
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self) -> bool:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            f = open(self.path, "a+", encoding="utf-8")
+        except OSError as e:
+            log.warning(f"Could not open {self.path}: {e}")
+            return False
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                os.lseek(f.fileno(), self.WINDOWS_LOCK_OFFSET, os.SEEK_SET)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        json.dump({"pid": os.getpid(), "create_time": psutil.Process().create_time()}, f)
+        f.flush()
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                os.lseek(self._file.fileno(), self.WINDOWS_LOCK_OFFSET, os.SEEK_SET)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        self._file.close()  # also drops the POSIX flock
+        self._file = None
+
+    def owner(self) -> str:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                owner = json.load(f)
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(owner["create_time"]))
+            return f"pid {owner['pid']}, started {started}"
+        except (OSError, ValueError, KeyError, TypeError):
+            return "unknown pid"
+
+
+class _AdoptedProcess:
+    """Popen-like handle of a job process started by an earlier GUI session. Its exit code is unknown (None)."""
+
+    def __init__(self, process: psutil.Process):
+        self._process = process
+        self.pid = process.pid
+
+    def poll(self):
+        return None
+
+    def wait(self, timeout: float = None):
+        try:
+            self._process.wait(timeout)
+        except psutil.TimeoutExpired:
+            raise subprocess.TimeoutExpired(str(self.pid), timeout)
+        except psutil.NoSuchProcess:
+            pass
+        return None
+
+    def is_running(self) -> bool:
+        return self._process.is_running()
+
+
+class _LogFileReader(_OutputReader):
+    """
+    Follows a job's log file (written by the job itself) into its output buffer until the process
+    exits. Output already in the file, e.g. of an adopted job, is buffered but not echoed again.
+    """
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, process, buffer: OutputBuffer, log_path: str, echo: bool = True):
+        super().__init__(process, buffer, echo=echo)
+        self.log_path = log_path
+
+    def _running(self) -> bool:
+        if isinstance(self.process, _AdoptedProcess):
+            return self.process.is_running()
+        return self.process.poll() is None
+
+    def _run(self):
+        try:
+            with open(self.log_path, "rb") as f:
+                echo, self.echo = self.echo, False
+                self._feed(f.read())
+                self.echo = echo
+                while True:
+                    running = self._running()
+                    data = f.read(self.CHUNK_SIZE)
+                    if data:
+                        self._feed(data)
+                    elif not running:
+                        break
+                    else:
+                        time.sleep(self.POLL_INTERVAL)
+            self._feed(b"", final=True)
+        except Exception as e:
+            log.debug(f"Output reader error: {e}")
+        finally:
+            self.buffer.close(self.process.wait())
+
+
+def _surviving_process(job: Job) -> Optional[psutil.Process]:
+    """The process of a job saved as running, if it is still alive (and the pid was not reused)."""
+    if job.pid is None or not psutil.pid_exists(job.pid):
+        return None
+    try:
+        process = psutil.Process(job.pid)
+        if job.pid_create_time is not None:
+            same = abs(process.create_time() - job.pid_create_time) < 1.0
+        else:
+            same = process.cmdline() == job.command
+    except psutil.Error:
+        return None
+    return process if same else None
+
+
+def _kill_process_tree(pid: int):
+    try:
+        parent = psutil.Process(pid)
+        for child in parent.children(recursive=True):
+            child.kill()
+        parent.kill()
+    except psutil.NoSuchProcess:
+        pass
+    except Exception as e:
+        log.info(f"Error when terminating process {pid}: {e}")
+
+
+def _tail_file(path: str, n: int) -> str:
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            lines = f.read().rstrip("\n").split("\n")
+    except OSError:
+        return ""
+    return "\n".join(line.rsplit("\r", 1)[-1] for line in lines[-n:])
+
+
+def parse_gpu_slots(value) -> list:
+    """GPU slots from config: "0,1,2,3" or [0, 1]; empty means one slot that keeps the current devices."""
+    if isinstance(value, str):
+        value = [v.strip() for v in value.split(",") if v.strip()]
+    return [str(v) for v in value or []] or [None]
+
+
+class JobQueueGUI:
+    """Job queue panel: the list of jobs, and output / cancel for the selected job id."""
+
+    HEADERS = ["Job ID", "Name", "Status", "Priority", "GPUs", "Exit code", "Submitted"]
+
+    def __init__(self, scheduler: JobScheduler):
+        self.scheduler = scheduler
+
+        with gr.Accordion("Job queue", open=False):
+            # A callable value is read again on every page load, after the queue was opened
+            self.jobs_table = gr.Dataframe(headers=self.HEADERS, value=self.job_rows, interactive=False)
+            with gr.Row():
+                self.job_id = gr.Textbox(label="Job ID", placeholder="Job ID from the table above")
+                self.button_refresh = gr.Button("Refresh")
+                self.button_cancel = gr.Button("Cancel job", variant="stop")
+                self.button_clear = gr.Button("Clear finished")
+            self.job_output = gr.Textbox(label="Job output", lines=15, max_lines=15, interactive=False)
+
+        self.button_refresh.click(self.refresh, inputs=[self.job_id], outputs=[self.jobs_table, self.job_output], show_progress=False)
+        self.job_id.submit(self.refresh, inputs=[self.job_id], outputs=[self.jobs_table, self.job_output], show_progress=False)
+        self.button_cancel.click(self.cancel, inputs=[self.job_id], outputs=[self.jobs_table, self.job_output], show_progress=False)
+        self.button_clear.click(self.clear_finished, inputs=[self.job_id], outputs=[self.jobs_table, self.job_output], show_progress=False)
+
+    def job_rows(self):
+        return [
+            [
+                job.id,
+                job.name,
+                job.status,
+                job.priority,
+                job.gpus,
+                "" if job.exit_code is None else job.exit_code,
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job.submitted_at)),
+            ]
+            for job in self.scheduler.list_jobs()
+        ]
+
+    def refresh(self, job_id: str = ""):
+        job_id = (job_id or "").strip()
+        output = self.scheduler.get_output(job_id) if job_id in self.scheduler.jobs else ""
+        return self.job_rows(), output
+
+    def cancel(self, job_id: str):
+        job_id = (job_id or "").strip()
+        try:
+            if job_id not in self.scheduler.jobs:
+                log.error(f"Unknown job id: {job_id}")
+            elif not self.scheduler.cancel(job_id):
+                log.info(f"Job {job_id} has already finished.")
+        except RuntimeError as e:
+            log.error(f"Could not cancel job {job_id}: {e}")
+        return self.refresh(job_id)
+
+    def clear_finished(self, job_id: str):
+        try:
+            self.scheduler.clear_finished()
+        except RuntimeError as e:
+            log.error(f"Could not clear the finished jobs: {e}")
+        return self.refresh(job_id)
@@ -0,0 +1,159 @@
+import contextlib
+import json
+import platform
+import sys
+import threading
+import time
+from importlib.abc import MetaPathFinder
+
+# Imported by kohya_gui.py before gradio and the GUI modules, so this module only uses the standard library.
+
+
+class _TimingLoader:
+    """Wraps a module loader and times exec_module(); everything else is delegated."""
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self._profiler._time_import(module.__name__):
+            self._loader.exec_module(module)
+
+
+class _ImportTimer(MetaPathFinder):
+    """Meta path finder that asks the other finders for the spec and wraps its loader."""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self._local = threading.local()
+
+    def find_spec(self, name, path, target=None):
+        if getattr(self._local, "busy", False):
+            return None
+        self._local.busy = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(name, path, target)
+                if spec is not None:
+                    if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                        spec.loader = _TimingLoader(spec.loader, self.profiler)
+                    return spec
+            return None
+        finally:
+            self._local.busy = False
+
+
+class StartupProfiler:
+    """
+    Records where GUI startup time goes: per-module import times (self and cumulative, like
+    `python -X importtime`), grouped by kohya_gui module / top-level package, and named sections
+    such as the config load and each *_tab() construction.
+
+    Disabled profilers keep the same interface and cost nothing, so call sites need no checks.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self.imports = {}  # module name -> [self seconds, cumulative seconds]
+        self.sections = []  # (name, seconds)
+        self._stack = []  # [module name, start, seconds spent in nested imports]
+        self._finder = None
+        if enabled:
+            self._finder = _ImportTimer(self)
+            sys.meta_path.insert(0, self._finder)
+
+    @classmethod
+    def from_argv(cls, argv=None):
+        """Enabled if --profile-startup is on the command line; checked before argparse runs so imports are timed too."""
+        return cls(enabled="--profile-startup" in (sys.argv if argv is None else argv))
+
+    @contextlib.contextmanager
+    def _time_import(self, name):
+        # Imports on other threads would corrupt the nesting; time only the main thread.
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        frame = [name, time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            cumulative = time.perf_counter() - frame[1]
+            self.imports[name] = [cumulative - frame[2], cumulative]
+            if self._stack:
+                self._stack[-1][2] += cumulative
+
+    @contextlib.contextmanager
+    def section(self, name: str):
+        """Time a named block (e.g. one tab's construction)."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections.append((name, time.perf_counter() - start))
+
+    def stop(self):
+        if self._finder is not None and self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+        self._finder = None
+
+    @staticmethod
+    def group_of(module_name: str) -> str:
+        """kohya_gui.lora_gui -> kohya_gui.lora_gui, gradio.components.button -> gradio."""
+        parts = module_name.split(".")
+        if parts[0] in ("kohya_gui", "minimal"):
+            return ".".join(parts[:2])
+        return parts[0]
+
+    def report(self) -> dict:
+        groups = {}
+        for name, (self_time, _) in self.imports.items():
+            group = groups.setdefault(self.group_of(name), {"self_seconds": 0.0, "modules": 0})
+            group["self_seconds"] += self_time
+            group["modules"] += 1
+        return {
+            "total_seconds": time.perf_counter() - self.start,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "sections": [{"name": name, "seconds": seconds} for name, seconds in self.sections],
+            "imports": {
+                "modules_imported": len(self.imports),
+                "self_seconds": sum(self_time for self_time, _ in self.imports.values()),
+                "groups": dict(sorted(groups.items(), key=lambda item: -item[1]["self_seconds"])),
+                "modules": [
+                    {"name": name, "self_seconds": self_time, "cumulative_seconds": cumulative}
+                    for name, (self_time, cumulative) in sorted(self.imports.items(), key=lambda item: -item[1][1])
+                ],
+            },
+        }
+
+    def write_report(self, path: str) -> dict:
+        report = self.report()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        return report
+
+    @staticmethod
+    def summary(report: dict, top: int = 15) -> str:
+        lines = [f"Startup total: {report['total_seconds']:.2f}s"]
+        for section in report["sections"]:
+            lines.append(f"  {section['name']:<32} {section['seconds']:8.2f}s")
+        imports = report["imports"]
+        lines.append(f"Imports: {imports['modules_imported']} modules, {imports['self_seconds']:.2f}s")
+        for name, group in list(imports["groups"].items())[:top]:
+            lines.append(f"  {name:<32} {group['self_seconds']:8.2f}s  ({group['modules']} modules)")
+        return "\n".join(lines)
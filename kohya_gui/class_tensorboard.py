@@ -1,16 +1,13 @@
+import importlib.util
 import os
 import gradio as gr
 import subprocess
 import time
 import webbrowser
 
-try:
-    os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
-    import tensorflow  # Attempt to import tensorflow to check if it is installed
-
-    visibility = True
-except ImportError:
-    visibility = False
+# Only check that tensorflow is installed; importing it here would add seconds to GUI startup
+os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
+visibility = importlib.util.find_spec("tensorflow") is not None
 
 from easygui import msgbox
 from threading import Thread, Event
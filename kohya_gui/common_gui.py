@@ -6,6 +6,9 @@ from easygui import msgbox, ynbox
 from typing import Optional
 from .custom_logging import setup_logging
 from .sd_modeltype import SDModelType
+from .class_directory_index import directory_index, natural_sort_key
+from .class_dataset_manifest import scan_dataset
+from .class_caption_manifest import add_pre_postfix_to_file
 
 import os
 import re
@@ -226,93 +229,55 @@ def create_refresh_button(refresh_component, refresh_method, refreshed_args, ele
     return refresh_button
 
 
-def list_dirs(path):
+def _listing_dir(path):
+    """Directory to list for a dropdown value: the path itself, or its parent for a file or partly typed path."""
     if path is None or path == "None" or path == "":
-        return
+        return None
 
     if not os.path.exists(path):
         path = os.path.dirname(path)
         if not os.path.exists(path):
-            return
+            return None
 
     if not os.path.isdir(path):
         path = os.path.dirname(path)
+    return path
 
-    def natural_sort_key(s, regex=re.compile("([0-9]+)")):
-        return [
-            int(text) if text.isdigit() else text.lower() for text in regex.split(s)
-        ]
 
-    subdirs = [
-        (item, os.path.join(path, item))
-        for item in os.listdir(path)
-        if os.path.isdir(os.path.join(path, item))
-    ]
-    subdirs = [
-        filename
-        for item, filename in subdirs
-        if item[0] != "." and item not in ["__pycache__"]
-    ]
-    subdirs = sorted(subdirs, key=natural_sort_key)
+def _with_parents(path, entries):
     if os.path.dirname(path) != "":
-        dirs = [os.path.dirname(path), path] + subdirs
+        entries = [os.path.dirname(path), path] + entries
     else:
-        dirs = [path] + subdirs
+        entries = [path] + entries
 
     if os.sep == "\\":
-        dirs = [d.replace("\\", "/") for d in dirs]
-    for d in dirs:
-        yield d
+        entries = [d.replace("\\", "/") for d in entries]
+    return entries
 
 
-def list_files(path, exts=None, all=False):
-    if path is None or path == "None" or path == "":
+def list_dirs(path):
+    path = _listing_dir(path)
+    if path is None:
         return
 
-    if not os.path.exists(path):
-        path = os.path.dirname(path)
-        if not os.path.exists(path):
-            return
-
-    if not os.path.isdir(path):
-        path = os.path.dirname(path)
+    # Listings come from the shared directory index, refreshed when the directory's mtime changes
+    subdirs = [os.path.join(path, item) for item in directory_index.subdirs(path)]
+    for d in _with_parents(path, subdirs):
+        yield d
 
-    files = [
-        (item, os.path.join(path, item))
-        for item in os.listdir(path)
-        if all or os.path.isfile(os.path.join(path, item))
-    ]
-    files = [
-        filename
-        for item, filename in files
-        if item[0] != "." and item not in ["__pycache__"]
-    ]
-    exts = set(exts) if exts is not None else None
 
-    def natural_sort_key(s, regex=re.compile("([0-9]+)")):
-        return [
-            int(text) if text.isdigit() else text.lower() for text in regex.split(s)
-        ]
+def list_files(path, exts=None, all=False):
+    path = _listing_dir(path)
+    if path is None:
+        return
 
-    files = sorted(files, key=natural_sort_key)
-    if os.path.dirname(path) != "":
-        files = [os.path.dirname(path), path] + files
-    else:
-        files = [path] + files
+    names = directory_index.files(path, exts)
+    if all:
+        # Subdirectories are listed too, so the dropdown can be used to navigate
+        names = sorted(names + directory_index.subdirs(path), key=natural_sort_key)
 
-    if os.sep == "\\":
-        files = [d.replace("\\", "/") for d in files]
-
-    for filename in files:
-        if exts is not None:
-            if os.path.isdir(filename):
-                yield filename
-            _, ext = os.path.splitext(filename)
-            if ext.lower() not in exts:
-                continue
-            yield filename
-        else:
-            yield filename
+    for filename in _with_parents(path, [os.path.join(path, item) for item in names]):
+        yield filename
 
 
 def update_my_data(my_data):
@@ -785,38 +750,8 @@ def add_pre_postfix(
     for image_file in image_files:
         # Construct the caption file name by appending the caption file extension to the image file name
         caption_file_name = f"{os.path.splitext(image_file)[0]}{caption_file_ext}"
-        # Construct the full path to the caption file
-        caption_file_path = os.path.join(folder, caption_file_name)
-
-        # Check if the caption file does not exist
-        if not os.path.exists(caption_file_path):
-            # Create a new caption file with the specified prefix and/or postfix
-            try:
-                with open(caption_file_path, "w", encoding="utf-8") as f:
-                    # Determine the separator based on whether both prefix and postfix are provided
-                    separator = " " if prefix and postfix else ""
-                    f.write(f"{prefix}{separator}{postfix}")
-            except Exception as e:
-                log.error(f"Error writing to file {caption_file_path}: {e}")
-        else:
-            # Open the existing caption file for reading and writing
-            try:
-                with open(caption_file_path, "r+", encoding="utf-8") as f:
-                    # Read the content of the caption file, stripping any trailing whitespace
-                    content = f.read().rstrip()
-                    # Move the file pointer to the beginning of the file
-                    f.seek(0, 0)
-
-                    # Determine the separator based on whether only prefix is provided
-                    prefix_separator = " " if prefix else ""
-                    # Determine the separator based on whether only postfix is provided
-                    postfix_separator = " " if postfix else ""
-                    # Write the updated content to the caption file, adding prefix and/or postfix
-                    f.write(
-                        f"{prefix}{prefix_separator}{content}{postfix_separator}{postfix}"
-                    )
-            except Exception as e:
-                log.error(f"Error writing to file {caption_file_path}: {e}")
+        # Construct the full path to the caption file and add the prefix and/or postfix (creating it if needed)
+        add_pre_postfix_to_file(os.path.join(folder, caption_file_name), prefix, postfix)
 
 
 def has_ext_files(folder_path: str, file_extension: str) -> bool:
@@ -1222,12 +1157,9 @@ def verify_image_folder_pattern(folder_path: str) -> bool:
     # Example of a valid pattern matching name: 123_example_folder
     pattern = r"^\d+_\w+"
 
-    # Get the list of sub-folders in the directory
-    subfolders = [
-        os.path.join(folder_path, subfolder)
-        for subfolder in os.listdir(folder_path)
-        if os.path.isdir(os.path.join(folder_path, subfolder))
-    ]
+    # Get the list of sub-folders in the directory (from the shared dataset manifest)
+    manifest = scan_dataset(folder_path, max_depth=1)
+    subfolders = [manifest.path(concept) for concept in manifest.concepts()]
 
     # Check the pattern of each sub-folder
     matching_subfolders = [
@@ -1340,7 +1272,7 @@ def check_duplicate_filenames(
     """
     Checks for duplicate image filenames in a given folder path.
 
-    This function walks through the directory structure of the given folder path,
+    This function goes through every folder of the dataset manifest of the given folder path,
     and logs a warning if it finds files with the same name but different image extensions.
     This can lead to issues during training if not handled properly.
 
@@ -1357,38 +1289,18 @@ def check_duplicate_filenames(
         f"Checking for duplicate image filenames in training data directory {folder_path}..."
     )
 
-    # Walk through the directory structure
-    for root, dirs, files in os.walk(folder_path):
-        # Initialize a dictionary to store filenames and their paths
-        filenames = {}
-
-        # Process each file in the current directory
-        for file in files:
-            # Split the filename and extension
-            filename, extension = os.path.splitext(file)
-
-            # Check if the extension is in the list of image extensions
-            if extension.lower() in image_extension:
-                # Construct the full path to the file
-                full_path = os.path.join(root, file)
-
-                # Check if the filename is already in the dictionary
-                if filename in filenames:
-                    # If it is, compare the existing path with the current path
-                    existing_path = filenames[filename]
-                    if existing_path != full_path:
-                        # Log a warning if the paths are different
-                        log.warning(
-                            f"...same filename '{filename}' with different image extension found. This will cause training issues. Rename one of the file."
-                        )
-                        log.warning(f"  Existing file: {existing_path}")
-                        log.warning(f"  Current file: {full_path}")
-
-                        # Set the duplicate flag to True
-                        duplicate = True
-                else:
-                    # If not, add the filename and path to the dictionary
-                    filenames[filename] = full_path
+    # Every folder below folder_path, listed once by the dataset manifest
+    manifest = scan_dataset(folder_path)
+    for entry in manifest.folders.values():
+        for filename, files in entry.duplicate_stems(image_extension).items():
+            log.warning(
+                f"...same filename '{filename}' with different image extension found. This will cause training issues. Rename one of the file."
+            )
+            for file in files:
+                log.warning(f"  File: {manifest.path(entry, file)}")
+
+            # Set the duplicate flag to True
+            duplicate = True
 
     # If no duplicates were found, log a message indicating validation
     if not duplicate:
@@ -3,6 +3,7 @@ import re
 import gradio as gr
 from easygui import msgbox, boolbox
 from .common_gui import get_folder_path, scriptdir, list_dirs, create_refresh_button
+from .class_dataset_manifest import scan_dataset
 
 from .custom_logging import setup_logging
 
@@ -31,26 +32,20 @@ def dataset_balancing(concept_repeats, folder, insecure):
 
     pattern = re.compile(r"^\d+_.+$")
 
-    # Iterate over the subdirectories in the selected folder
-    for subdir in os.listdir(folder):
+    # Iterate over the subdirectories in the selected folder (listed once by the dataset manifest)
+    for concept in scan_dataset(folder, max_depth=1).concepts():
+        subdir = concept.name
         if pattern.match(subdir) or insecure:
             # Calculate the number of repeats for the current subdirectory
-            # Get a list of all the files in the folder
-            files = os.listdir(os.path.join(folder, subdir))
-
             # Filter the list to include only image files
-            image_files = [
-                f
-                for f in files
-                if f.endswith((".jpg", ".jpeg", ".png", ".gif", ".webp"))
-            ]
+            image_files = concept.images((".jpg", ".jpeg", ".png", ".gif", ".webp"))
 
             # Count the number of image files
             images = len(image_files)
 
             if images == 0:
                 log.info(
-                    f"No images of type .jpg, .jpeg, .png, .gif, .webp were found in {os.listdir(os.path.join(folder, subdir))}"
+                    f"No images of type .jpg, .jpeg, .png, .gif, .webp were found in {concept.files}"
                 )
 
             # Check if the subdirectory name starts with a number inside braces,
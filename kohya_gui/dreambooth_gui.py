@@ -32,6 +32,7 @@ from .class_advanced_training import AdvancedTraining
 from .class_sd3 import sd3Training
 from .class_folders import Folders
 from .class_command_executor import CommandExecutor
+from .class_dataset_manifest import scan_dataset
 from .class_huggingface import HuggingFace
 from .class_metadata import MetaData
 from .class_sdxl_parameters import SDXLParameters
@@ -736,33 +737,21 @@ def train_model(
             log.error("Train data dir is empty")
             return TRAIN_BUTTON_VISIBLE
 
-        # Get a list of all subfolders in train_data_dir
-        subfolders = [
-            f
-            for f in os.listdir(train_data_dir)
-            if os.path.isdir(os.path.join(train_data_dir, f))
-        ]
+        # Get a list of all subfolders in train_data_dir (from the shared dataset manifest)
+        subfolders = scan_dataset(train_data_dir, max_depth=1).concepts()
 
         total_steps = 0
 
         # Loop through each subfolder and extract the number of repeats
-        for folder in subfolders:
+        for concept in subfolders:
+            folder = concept.name
             try:
                 # Extract the number of repeats from the folder name
                 repeats = int(folder.split("_")[0])
                 log.info(f"Folder {folder}: {repeats} repeats found")
 
                 # Count the number of images in the folder
-                num_images = len(
-                    [
-                        f
-                        for f, lower_f in (
-                            (file, file.lower())
-                            for file in os.listdir(os.path.join(train_data_dir, folder))
-                        )
-                        if lower_f.endswith((".jpg", ".jpeg", ".png", ".webp"))
-                    ]
-                )
+                num_images = len(concept.images((".jpg", ".jpeg", ".png", ".webp")))
 
                 log.info(f"Folder {folder}: {num_images} images found")
 
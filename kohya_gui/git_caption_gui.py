@@ -2,7 +2,8 @@ import gradio as gr
 import subprocess
 import os
 import sys
-from .common_gui import get_folder_path, add_pre_postfix, scriptdir, list_dirs, setup_environment
+from .common_gui import get_folder_path, scriptdir, list_dirs, setup_environment
+from .class_caption_manifest import caption_incrementally, caption_model_id
 
 from .custom_logging import setup_logging
 
@@ -21,6 +22,7 @@ def caption_images(
     model_id,
     prefix,
     postfix,
+    incremental=True,
 ):
     # Check for images_dir_input
     if train_data_dir == "":
@@ -55,25 +57,28 @@ def caption_images(
         run_cmd.append("--caption_extension")
         run_cmd.append(caption_ext)
 
-    # Add the directory containing the training data
-    run_cmd.append(fr"{train_data_dir}")
-
     env = setup_environment()
 
-    # Reconstruct the safe command string for display
-    command_to_run = " ".join(run_cmd)
-    log.info(f"Executing command: {command_to_run}")
-            
-    # Run the command in the sd-scripts folder context
-    subprocess.run(run_cmd, env=env)
+    def run_captioner(folder):
+        # Add the directory containing the training data (or the images to caption)
+        folder_cmd = run_cmd + [fr"{folder}"]
+
+        # Reconstruct the safe command string for display
+        command_to_run = " ".join(folder_cmd)
+        log.info(f"Executing command: {command_to_run}")
 
+        # Run the command in the sd-scripts folder context
+        subprocess.run(folder_cmd, env=env)
 
-    # Add prefix and postfix
-    add_pre_postfix(
+    # Caption new or changed images only and add prefix and postfix to the captions just written
+    caption_incrementally(
         folder=train_data_dir,
-        caption_file_ext=caption_ext,
+        caption_ext=caption_ext,
+        model_id=caption_model_id(f"git:{model_id or 'default'}", max_length=max_length),
+        run_captioner=run_captioner,
         prefix=prefix,
         postfix=postfix,
+        incremental=incremental,
     )
 
     log.info("...captioning done")
@@ -163,6 +168,12 @@ def gradio_git_caption_gui_tab(
                 placeholder="(Optional) model id for GIT in Hugging Face",
                 interactive=True,
             )
+            incremental = gr.Checkbox(
+                label="Only new or changed images",
+                info="Skip images already captioned with these settings",
+                interactive=True,
+                value=True,
+            )
 
         caption_button = gr.Button("Caption images")
 
@@ -177,6 +188,7 @@ def gradio_git_caption_gui_tab(
                 model_id,
                 prefix,
                 postfix,
+                incremental,
             ],
             show_progress=False,
         )
@@ -1,7 +1,9 @@
+import atexit
 import gradio as gr
 import json
 import math
 import os
+import tempfile
 import time
 import toml
 
@@ -35,6 +37,8 @@ from .class_sd3 import sd3Training
 from .class_sdxl_parameters import SDXLParameters
 from .class_folders import Folders
 from .class_command_executor import CommandExecutor
+from .class_dataset_manifest import scan_dataset
+from .class_job_scheduler import JobQueueGUI, JobScheduler, parse_gpu_slots
 from .class_tensorboard import TensorboardManager
 from .class_sample_images import SampleImages, create_prompt_file
 from .class_lora_tab import LoRATools
@@ -56,6 +60,9 @@ log = setup_logging()
 # Setup command executor
 executor = None
 
+# Queue for training runs added with "Queue training" (shared by all sessions)
+job_scheduler = None
+
 # Setup huggingface
 huggingface = None
 use_shell = False
@@ -982,6 +989,7 @@ def train_model(
     sd3_text_encoder_batch_size,
     weighting_scheme,
     sd3_checkbox,
+    queue_job=False,
 ):
     # Get list of function parameters and values
     parameters = list(locals().items())
@@ -993,7 +1001,7 @@ def train_model(
         gr.Textbox(value=train_state_value),
     ]
 
-    if executor.is_running():
+    if executor.is_running() and not queue_job:
         log.error("Training is already running. Can't start another training session.")
         return TRAIN_BUTTON_VISIBLE
 
@@ -1137,33 +1145,21 @@ def train_model(
             log.error("Train data dir is empty")
             return TRAIN_BUTTON_VISIBLE
 
-        # Get a list of all subfolders in train_data_dir
-        subfolders = [
-            f
-            for f in os.listdir(train_data_dir)
-            if os.path.isdir(os.path.join(train_data_dir, f))
-        ]
+        # Get a list of all subfolders in train_data_dir (from the shared dataset manifest)
+        subfolders = scan_dataset(train_data_dir, max_depth=1).concepts()
 
         total_steps = 0
 
         # Loop through each subfolder and extract the number of repeats
-        for folder in subfolders:
+        for concept in subfolders:
+            folder = concept.name
             try:
                 # Extract the number of repeats from the folder name
                 repeats = int(folder.split("_")[0])
                 log.info(f"Folder {folder}: {repeats} repeats found")
 
                 # Count the number of images in the folder
-                num_images = len(
-                    [
-                        f
-                        for f, lower_f in (
-                            (file, file.lower())
-                            for file in os.listdir(os.path.join(train_data_dir, folder))
-                        )
-                        if lower_f.endswith((".jpg", ".jpeg", ".png", ".webp"))
-                    ]
-                )
+                num_images = len(concept.images((".jpg", ".jpeg", ".png", ".webp")))
 
                 log.info(f"Folder {folder}: {num_images} images found")
 
@@ -1779,6 +1775,11 @@ def train_model(
     current_datetime = datetime.now()
     formatted_datetime = current_datetime.strftime("%Y%m%d-%H%M%S")
     tmpfilename = rf"{output_dir}/config_lora-{formatted_datetime}.toml"
+    if queue_job and not print_only:
+        # A queued job reads its config only when it starts, so each one needs a file of its own:
+        # two jobs queued in the same second must not overwrite each other's settings
+        fd, tmpfilename = tempfile.mkstemp(dir=output_dir, prefix=f"config_lora-{formatted_datetime}-", suffix=".toml")
+        os.close(fd)
 
     # Save the updated TOML data back to the file
     with open(tmpfilename, "w", encoding="utf-8") as toml_file:
@@ -1812,12 +1813,22 @@ def train_model(
         SaveConfigFile(
             parameters=parameters,
             file_path=file_path,
-            exclusion=["file_path", "save_as", "headless", "print_only"],
+            exclusion=["file_path", "save_as", "headless", "print_only", "queue_job"],
         )
 
         # log.info(run_cmd)
         env = setup_environment()
 
+        if queue_job:
+            # The toml config stays in output_dir, so the command line is valid until the job runs
+            gpus = int(num_processes or 1) if multi_gpu else 1
+            try:
+                job = job_scheduler.submit(run_cmd, name=output_name, gpus=gpus, env=env)
+                log.info(f"Training queued as job {job.id}.")
+            except (ValueError, RuntimeError) as e:
+                log.error(f"Could not queue the training: {e}")
+            return TRAIN_BUTTON_VISIBLE
+
         # Run the command
 
         executor.execute_command(run_cmd=run_cmd, env=env)
@@ -1831,6 +1842,20 @@ def train_model(
         )
 
 
+def start_job_queue():
+    """
+    Open the job queue and start the jobs queued by a previous session. Called only once the GUI is
+    about to serve, so building the UI (e.g. --profile-startup) never touches the queue.
+    """
+    if job_scheduler is None:
+        return
+    job_scheduler.open()
+    if not job_scheduler.read_only:
+        # Kill queued trainings with the GUI instead of leaving them running unattended
+        atexit.register(job_scheduler.shutdown)
+        job_scheduler.start()
+
+
 def lora_tab(
     train_data_dir_input=gr.Dropdown(),
     reg_data_dir_input=gr.Dropdown(),
@@ -2790,9 +2815,20 @@ def lora_tab(
         global executor
         executor = CommandExecutor(headless=headless)
 
+        global job_scheduler
+        if job_scheduler is None:
+            job_scheduler = JobScheduler(
+                gpu_slots=parse_gpu_slots(config.get("job_scheduler.gpu_slots", "")),
+                max_concurrent=config.get("job_scheduler.max_concurrent", 0),
+                requeue_interrupted=config.get("job_scheduler.requeue_interrupted", False),
+            )
+
         with gr.Column(), gr.Group():
             with gr.Row():
                 button_print = gr.Button("Print training command")
+                button_queue = gr.Button("Queue training")
+
+        job_queue = JobQueueGUI(job_scheduler)
 
         # Setup gradio tensorboard buttons
         TensorboardManager(headless=headless, logging_dir=folders.logging_dir)
@@ -3096,6 +3132,17 @@ def lora_tab(
             show_progress=False,
         )
 
+        button_queue.click(
+            train_model,
+            inputs=[dummy_headless] + [dummy_db_false] + settings_list + [dummy_db_true],
+            show_progress=False,
+        ).then(
+            job_queue.refresh,
+            inputs=[job_queue.job_id],
+            outputs=[job_queue.jobs_table, job_queue.job_output],
+            show_progress=False,
+        )
+
     with gr.Tab("Tools"):
         lora_tools = LoRATools(headless=headless)
 
@@ -1,6 +1,7 @@
 import gradio as gr
 from easygui import msgbox, boolbox
 from .common_gui import get_folder_path, scriptdir, list_dirs
+from .class_dataset_manifest import scan_dataset
 from math import ceil
 import os
 import re
@@ -24,6 +25,14 @@ def _get_caption_path(image_file, images_dir, caption_ext):
     return caption_file_path
 
 
+def _list_images(images_dir):
+    """
+    Image file names in images_dir, naturally sorted, from the shared dataset manifest
+    (re-listed only when the folder changes, so paging does not re-read large folders)
+    """
+    return scan_dataset(images_dir, max_depth=0).root_entry.images(IMAGE_EXTENSIONS)
+
+
 def _get_quick_tags(quick_tags_text):
     """
     Gets a list of tags from the quick tags text box
@@ -137,8 +146,7 @@ def import_tags_from_captions(
         ):
             return empty_return()
 
-    images_list = os.listdir(images_dir)
-    image_files = [f for f in images_list if f.lower().endswith(IMAGE_EXTENSIONS)]
+    image_files = _list_images(images_dir)
 
     # Use a set for lookup but store order with list
     tags = []
@@ -185,10 +193,7 @@ def load_images(images_dir, caption_ext, loaded_images_dir, page, max_page):
         return empty_return()
 
     # Load Images
-    images_list = os.listdir(images_dir)
-    total_images = len(
-        [True for f in images_list if f.lower().endswith(IMAGE_EXTENSIONS)]
-    )
+    total_images = len(_list_images(images_dir))
     return [images_dir, 1, ceil(total_images / IMAGES_TO_SHOW)]
 
 
@@ -204,8 +209,7 @@ def update_images(
     """
 
     # Load Images
-    images_list = os.listdir(images_dir)
-    image_files = [f for f in images_list if f.lower().endswith(IMAGE_EXTENSIONS)]
+    image_files = _list_images(images_dir)
 
     # Quick tags
     quick_tags, quick_tags_set = _get_quick_tags(quick_tags_text or "")
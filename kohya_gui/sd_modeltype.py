@@ -1,9 +1,21 @@
 from os.path import isfile
-from safetensors import safe_open
 import enum
+import json
+import os
+import struct
+import tempfile
+import threading
 
 # methodology is based on https://github.com/AUTOMATIC1111/stable-diffusion-webui/blob/82a973c04367123ae98bd9abdf80d9eda9b910e2/modules/sd_models.py#L379-L403
 
+# Detected types are remembered per (path, size, mtime) so the GUI does not re-read multi-GB
+# checkpoint headers (often on network storage) every time a model path changes.
+MODEL_TYPE_CACHE_PATH = os.path.join(
+    os.environ.get("KOHYA_SS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "kohya_ss")),
+    "model_types.json",
+)
+MAX_HEADER_SIZE = 100 * 1024 * 1024  # same limit safetensors itself applies
+
 
 class ModelType(enum.Enum):
     UNKNOWN = 0
@@ -14,6 +26,136 @@ class ModelType(enum.Enum):
     FLUX1 = 5
 
 
+# (type, exact keys, key prefixes) in priority order; the first rule that matches wins.
+_DETECTION_RULES = [
+    (ModelType.SD3, ["model.diffusion_model.x_embedder.proj.weight"], []),
+    (
+        ModelType.FLUX1,
+        [
+            "model.diffusion_model.double_blocks.0.img_attn.norm.key_norm.scale",
+            "double_blocks.0.img_attn.norm.key_norm.scale",
+        ],
+        [],
+    ),
+    (ModelType.SDXL, [], ["conditioner."]),
+    (ModelType.SD2, [], ["cond_stage_model.model."]),
+    (ModelType.SD1, [], ["model."]),
+]
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def read_safetensors_keys(path):
+    """Tensor names of a .safetensors file, from one read of the 8-byte length and the JSON header."""
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        if header_size > MAX_HEADER_SIZE:
+            raise ValueError(f"Header too large: {header_size}")
+        header = json.loads(f.read(header_size))
+    return [k for k in header if k != "__metadata__"]
+
+
+class _KeyTrie:
+    """Trie over the dot-separated components of state dict keys."""
+
+    _END = object()
+
+    def __init__(self, keys):
+        self.root = {}
+        for key in keys:
+            node = self.root
+            for part in key.split("."):
+                node = node.setdefault(part, {})
+            node[self._END] = True
+
+    def _node(self, parts):
+        node = self.root
+        for part in parts:
+            node = node.get(part)
+            if node is None:
+                return None
+        return node
+
+    def has_key(self, key):
+        node = self._node(key.split("."))
+        return node is not None and self._END in node
+
+    def has_prefix(self, prefix):
+        # Detection prefixes end at a component boundary ("conditioner."), so they map to a trie node.
+        node = self._node(prefix.rstrip(".").split("."))
+        return bool(node) and any(k is not self._END for k in node)
+
+
+def classify_keys(keys):
+    trie = _KeyTrie(keys)
+    for model_type, exact_keys, prefixes in _DETECTION_RULES:
+        if any(trie.has_key(k) for k in exact_keys) or any(
+            trie.has_prefix(p) for p in prefixes
+        ):
+            return model_type
+    return ModelType.UNKNOWN
+
+
+def _load_cache():
+    global _cache
+    if _cache is None:
+        try:
+            with open(MODEL_TYPE_CACHE_PATH, "r", encoding="utf-8") as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _save_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(MODEL_TYPE_CACHE_PATH), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(MODEL_TYPE_CACHE_PATH), suffix=".tmp"
+        )
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, MODEL_TYPE_CACHE_PATH)
+    except OSError:
+        pass  # the cache is an optimization only
+
+
+def detect_model_type(path):
+    """ModelType of a checkpoint file, from the persistent cache when the file is unchanged."""
+    try:
+        real_path = os.path.realpath(path)
+        st = os.stat(real_path)
+    except OSError:
+        return ModelType.UNKNOWN
+
+    with _cache_lock:
+        entry = _load_cache().get(real_path)
+        if (
+            entry
+            and entry.get("size") == st.st_size
+            and entry.get("mtime_ns") == st.st_mtime_ns
+            and entry.get("model_type") in ModelType.__members__
+        ):
+            return ModelType[entry["model_type"]]
+
+    try:
+        model_type = classify_keys(read_safetensors_keys(real_path))
+    except Exception:
+        # Not cached: the read may have failed only for now (file still being copied, network share)
+        return ModelType.UNKNOWN
+
+    with _cache_lock:
+        cache = _load_cache()
+        cache[real_path] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "model_type": model_type.name,
+        }
+        _save_cache(cache)
+    return model_type
+
+
 class SDModelType:
     def __init__(self, safetensors_path):
         self.model_type = ModelType.UNKNOWN
@@ -21,32 +163,8 @@ class SDModelType:
         if not isfile(safetensors_path):
             return
 
-        try:
-            st = safe_open(filename=safetensors_path, framework="numpy", device="cpu")
-
-            # print(st.keys())
-
-            def hasKeyPrefix(pfx):
-                return any(k.startswith(pfx) for k in st.keys())
-
-            if "model.diffusion_model.x_embedder.proj.weight" in st.keys():
-                self.model_type = ModelType.SD3
-            elif (
-                "model.diffusion_model.double_blocks.0.img_attn.norm.key_norm.scale"
-                in st.keys()
-                or "double_blocks.0.img_attn.norm.key_norm.scale" in st.keys()
-            ):
-                # print("flux1 model detected...")
-                self.model_type = ModelType.FLUX1
-            elif hasKeyPrefix("conditioner."):
-                self.model_type = ModelType.SDXL
-            elif hasKeyPrefix("cond_stage_model.model."):
-                self.model_type = ModelType.SD2
-            elif hasKeyPrefix("model."):
-                self.model_type = ModelType.SD1
-        except:
-            pass
-        
+        self.model_type = detect_model_type(safetensors_path)
+
         # print(f"Model type: {self.model_type}")
 
     def Is_SD1(self):
@@ -2,12 +2,12 @@ import gradio as gr
 import subprocess
 from .common_gui import (
     get_folder_path,
-    add_pre_postfix,
     scriptdir,
     list_dirs,
     get_executable_path, setup_environment,
 )
 from .class_gui_config import KohyaSSGUIConfig
+from .class_caption_manifest import caption_incrementally, caption_model_id
 import os
 
 from .custom_logging import setup_logging
@@ -40,6 +40,7 @@ def caption_images(
     use_rating_tags_as_last_tag: bool,
     remove_underscore: bool,
     thresh: float,
+    incremental: bool = True,
 ) -> None:
     # Check for images_dir_input
     if train_data_dir == "":
@@ -114,24 +115,47 @@ def caption_images(
     if use_rating_tags_as_last_tag:
         run_cmd.append("--use_rating_tags_as_last_tag")
 
-    # Add the directory containing the training data
-    run_cmd.append(rf"{train_data_dir}")
-
     env = setup_environment()
 
-    # Reconstruct the safe command string for display
-    command_to_run = " ".join(run_cmd)
-    log.info(f"Executing command: {command_to_run}")
-
-    # Run the command in the sd-scripts folder context
-    subprocess.run(run_cmd, env=env)
+    def run_captioner(folder):
+        # Add the directory containing the training data (or the images to caption)
+        folder_cmd = run_cmd + [rf"{folder}"]
+
+        # Reconstruct the safe command string for display
+        command_to_run = " ".join(folder_cmd)
+        log.info(f"Executing command: {command_to_run}")
+
+        # Run the command in the sd-scripts folder context
+        subprocess.run(folder_cmd, env=env)
+
+    # Every setting that changes the tags is part of the model id, so changing one re-captions the folder
+    model_id = caption_model_id(
+        f"wd14:{repo_id}",
+        append_tags=append_tags,
+        caption_separator=caption_separator,
+        character_tag_expand=character_tag_expand,
+        character_threshold=character_threshold,
+        general_threshold=general_threshold,
+        remove_underscore=remove_underscore,
+        tag_replacement=tag_replacement,
+        thresh=thresh,
+        undesired_tags=undesired_tags,
+        use_rating_tags=use_rating_tags,
+        use_rating_tags_as_last_tag=use_rating_tags_as_last_tag,
+        always_first_tags=always_first_tags,
+    )
 
-    # Add prefix and postfix
-    add_pre_postfix(
+    # Caption new or changed images only and add the prefix to the captions just written. When
+    # appending, captions this tagger did not write (by hand, or before the manifest) get the tags too
+    caption_incrementally(
         folder=train_data_dir,
-        caption_file_ext=caption_extension,
-        prefix=always_first_tags,
+        caption_ext=caption_extension,
+        model_id=model_id,
+        run_captioner=run_captioner,
         recursive=recursive,
+        prefix=always_first_tags,
+        incremental=incremental,
+        keep_existing=not append_tags,
     )
 
     log.info("...captioning done")
@@ -301,6 +325,11 @@ def gradio_wd14_caption_gui_tab(
                 value=config.get("wd14_caption.recursive", False),
                 info="Tag subfolders images as well",
             )
+            incremental = gr.Checkbox(
+                label="Only new or changed images",
+                value=config.get("wd14_caption.incremental", True),
+                info="Skip images already captioned with these settings",
+            )
             remove_underscore = gr.Checkbox(
                 label="Remove underscore",
                 value=config.get("wd14_caption.remove_underscore", True),
@@ -396,6 +425,7 @@ def gradio_wd14_caption_gui_tab(
                 use_rating_tags_as_last_tag,
                 remove_underscore,
                 thresh,
+                incremental,
             ],
             show_progress=False,
         )
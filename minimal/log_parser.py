@@ -0,0 +1,175 @@
+"""
+学習ログのインクリメンタルパーサー
+
+CommandExecutor の行オフセット付きバッファから、前回以降の新しい行だけを読み込み、
+エポックごとの loss 集計（件数・合計・最小・最大・EMA）とエポック時間を保持する。
+1 回の更新コストは新しい行数に比例し、500 行のバッファが一周しても統計は失われない。
+"""
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+EPOCH_PATTERN = re.compile(r'epoch\s+(\d+)/(\d+)', re.IGNORECASE)
+LOSS_PATTERN = re.compile(r'loss[:\s=]+([0-9.]+)', re.IGNORECASE)
+STEP_PATTERN = re.compile(r'(\d+)/(\d+)\s*\[')
+# tqdm の経過時間: "[01:23<04:50" / "[1:02:03<..."
+ELAPSED_PATTERN = re.compile(r'\[(?:(\d+):)?(\d+):(\d+)<')
+# ログ行頭のタイムスタンプ: "2024-05-01 12:34:56" / "[12:34:56]" / "12:34:56"
+TIMESTAMP_PATTERN = re.compile(r'^\s*(?:\d{4}-\d{2}-\d{2}[ T])?\[?(\d{1,2}):(\d{2}):(\d{2})')
+
+
+@dataclass
+class EpochStats:
+    """1 エポック分の loss 集計"""
+    count: int = 0
+    total: float = 0.0
+    min: float = float('inf')
+    max: float = float('-inf')
+    ema: Optional[float] = None
+    duration: Optional[float] = None
+
+    def add(self, value: float, ema_alpha: float):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.ema = value if self.ema is None else ema_alpha * value + (1 - ema_alpha) * self.ema
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class TrainingLogParser:
+    """
+    ストリーミング方式の学習ログパーサー
+
+    エポック時間はログ自体の時刻から求める: tqdm の経過時間を優先し、無ければログ行頭の
+    タイムスタンプを使う（どちらも無い場合は時間を表示しない）。
+    """
+
+    def __init__(self, ema_alpha: float = 0.1):
+        self.ema_alpha = ema_alpha
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.epochs = {}
+        self.current_epoch = 0
+        self.total_epochs = None
+        self.current_step = None
+        self.total_steps = None
+        self._clock = None          # (source, seconds) 最後に見えたログ時刻
+        self._epoch_start = None    # 現在のエポック開始時の _clock
+        self._last_loss_step = None
+        self._day_offset = 0
+        self._last_wall = None
+
+    # --- 入力 ---
+    def update(self, executor) -> bool:
+        """executor の新しい行と現在の進捗行を取り込む。統計が変わったら True
+
+        新しい学習を始める時は呼び出し側で reset() すること（バッファのオフセットからは判定しない）
+        """
+        progress = executor.get_progress()
+        lines, self.offset = executor.get_output_since(self.offset)
+        changed = self.feed_lines(lines)
+        # 完了した行の方が新しい場合は、古い進捗スナップショットを使わない
+        if progress["step"] is not None and (self.current_step is None or progress["step"] > self.current_step):
+            self.current_step, self.total_steps = progress["step"], progress["total"]
+            loss = next((v for k, v in progress["metrics"].items() if 'loss' in k), None)
+            if loss is not None and self.current_epoch > 0:
+                self._add_loss(loss, progress["step"])
+                changed = True
+        return changed
+
+    def feed_lines(self, lines) -> bool:
+        for line in lines:
+            self._feed_line(line)
+        return bool(lines)
+
+    def finish(self):
+        """学習終了時: 最後のエポックの時間を確定する"""
+        self._close_epoch()
+
+    def _feed_line(self, line: str):
+        elapsed = ELAPSED_PATTERN.search(line)
+        if elapsed:
+            hours, minutes, seconds = elapsed.groups()
+            self._clock = ('elapsed', int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds))
+        else:
+            timestamp = TIMESTAMP_PATTERN.match(line)
+            if timestamp:
+                wall = int(timestamp.group(1)) * 3600 + int(timestamp.group(2)) * 60 + int(timestamp.group(3))
+                if self._last_wall is not None and wall + 12 * 3600 < self._last_wall:
+                    self._day_offset += 24 * 3600  # 日付をまたいだ
+                self._last_wall = wall
+                if self._clock is None or self._clock[0] == 'wall':
+                    self._clock = ('wall', wall + self._day_offset)
+
+        step = None
+        step_match = STEP_PATTERN.search(line)
+        if step_match:
+            step = int(step_match.group(1))
+            self.current_step, self.total_steps = step, int(step_match.group(2))
+
+        epoch_match = EPOCH_PATTERN.search(line)
+        if epoch_match:
+            new_epoch = int(epoch_match.group(1))
+            self.total_epochs = int(epoch_match.group(2))
+            if new_epoch != self.current_epoch:
+                self._close_epoch()
+                self.current_epoch = new_epoch
+                self._epoch_start = self._clock
+
+        loss_match = LOSS_PATTERN.search(line)
+        # 同じステップの loss は進捗行で取り込み済み
+        if loss_match and self.current_epoch > 0 and (step is None or step != self._last_loss_step):
+            try:
+                self._add_loss(float(loss_match.group(1)), step)
+            except ValueError:
+                pass
+
+    def _add_loss(self, value: float, step: Optional[int]):
+        self.epochs.setdefault(self.current_epoch, EpochStats()).add(value, self.ema_alpha)
+        if step is not None:
+            self._last_loss_step = step
+
+    def _close_epoch(self):
+        if self.current_epoch <= 0 or self._epoch_start is None or self._clock is None:
+            return
+        if self._clock[0] != self._epoch_start[0]:
+            return
+        stats = self.epochs.setdefault(self.current_epoch, EpochStats())
+        if stats.duration is None:
+            stats.duration = max(0, self._clock[1] - self._epoch_start[1])
+
+    # --- 出力 ---
+    def format_stats(self) -> str:
+        """エポック統計の表示用テキスト（統計が無ければ空文字列）"""
+        if not self.epochs and self.current_epoch == 0:
+            return ""
+
+        stats_lines = [
+            "",
+            "📈 Epoch Statistics:",
+            "-" * 40
+        ]
+        for epoch in sorted(self.epochs):
+            stats = self.epochs[epoch]
+            time_str = ""
+            if stats.duration is not None:
+                time_str = f" | Time: {int(stats.duration // 60)}m {int(stats.duration % 60)}s"
+            if stats.count:
+                stats_lines.append(
+                    f"  Epoch {epoch}: Avg Loss={stats.mean:.4f} (Min={stats.min:.4f}, Max={stats.max:.4f}, EMA={stats.ema:.4f}){time_str}"
+                )
+            else:
+                stats_lines.append(f"  Epoch {epoch}: no loss values{time_str}")
+
+        if self.current_epoch > 0:
+            total = f"/{self.total_epochs}" if self.total_epochs else ""
+            step = f" | Step {self.current_step}/{self.total_steps}" if self.current_step is not None else ""
+            stats_lines.append(f"\n🔄 Current: Epoch {self.current_epoch}{total}{step}")
+
+        return '\n'.join(stats_lines)
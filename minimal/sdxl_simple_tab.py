@@ -1,5 +1,6 @@
 import gradio as gr
 import os
+import threading
 from pathlib import Path
 from typing import Any
 import logging
@@ -21,6 +22,19 @@ from minimal.presets import (
 # tomlモジュールをインポート
 import toml
 
+from minimal.log_parser import TrainingLogParser
+
+
+class TrainingSession:
+    """ブラウザセッションごとの学習進捗の状態（gr.State で保持し、セッション間で共有しない）"""
+
+    def __init__(self):
+        # 学習ログの統計は新しい行だけを読み込んで更新する
+        self.log_parser = TrainingLogParser()
+        self.stopped_by_user = False
+        # 進捗ストリーム（イベントループ）と停止ボタン（ワーカースレッド）が同時に触るため
+        self.lock = threading.Lock()
+
 def load_user_config() -> dict:
     """
     config.tomlからユーザー設定を動的に読み込む
@@ -280,6 +294,8 @@ class SDXLSimpleTab:
                 # hidden の状態変数（ボタン状態管理用）
                 import time
                 self.run_state = gr.Textbox(value=str(time.time()), visible=False)
+                # 学習進捗の状態（ログパーサー・停止フラグ）はセッションごとに持つ
+                self.training_session = gr.State(TrainingSession)
                 
                 # トレーニングサマリー（開始時に表示）
                 self.training_summary = gr.Textbox(
@@ -311,9 +327,6 @@ class SDXLSimpleTab:
                     show_copy_button=True,
                     autoscroll=True
                 )
-                
-                # 定期更新用タイマー（1秒間隔）
-                self.progress_timer = gr.Timer(value=1, active=False)
             
             # イベント接続
             # フォルダ選択ボタン
@@ -391,192 +404,105 @@ class SDXLSimpleTab:
             )
             
             # 学習開始ボタン
-            # start_training() は (train_button, stop_button, run_state, training_summary, timer) を返す
+            # start_training() は (train_button, stop_button, run_state, training_summary) を返す
             from kohya_gui.lora_gui import executor
             
             self.train_button.click(
                 fn=self.start_training,
-                inputs=self._get_all_inputs(),
-                outputs=[self.train_button, self.stop_button, self.run_state, self.training_summary, self.progress_timer],
+                inputs=self._get_all_inputs() + [self.training_session],
+                outputs=[self.train_button, self.stop_button, self.run_state, self.training_summary],
                 show_progress=True
             )
             
-            # タイマーで定期的に進捗ログを更新
-            # タイマーで定期的に進捗ログとエポック統計を更新
-            self.progress_timer.tick(
-                fn=self._update_progress_log,
-                outputs=[self.output_log, self.epoch_stats, self.progress_timer],
-                show_progress=False
-            )
-            
-            # run_state が変更されたら、トレーニング終了を待ってボタン状態を復元
+            # run_state が変更されたら（学習開始）、新しい出力があった時だけ進捗ログとエポック統計を送り、
+            # 終了時にボタン状態を復元する。待機中はスレッドを占有しないため、同時接続数は制限しない
             self.run_state.change(
-                fn=self._wait_and_stop_timer,
-                outputs=[self.train_button, self.stop_button, self.progress_timer, self.output_log, self.epoch_stats],
-                show_progress=False
+                fn=self._stream_progress,
+                inputs=[self.training_session],
+                outputs=[self.train_button, self.stop_button, self.output_log, self.epoch_stats],
+                show_progress=False,
+                concurrency_limit=None
             )
             
             # 学習停止ボタン
             self.stop_button.click(
                 fn=self._stop_training,
-                outputs=[self.train_button, self.stop_button, self.progress_timer, self.output_log, self.epoch_stats],
+                inputs=[self.training_session],
+                outputs=[self.train_button, self.stop_button, self.output_log, self.epoch_stats],
                 show_progress=False
             )
     
-    def _parse_epoch_stats(self, full_output: str) -> str:
-        """ログからエポックごとの統計情報を抽出"""
-        import re
-        
-        lines = full_output.split('\n')
-        epoch_stats = []
-        current_epoch = 0
-        epoch_losses = {}
-        epoch_times = {}
-        start_time = None
-        last_epoch_time = None
-        
-        for line in lines:
-            # エポック開始を検出: "epoch 1/6" パターン
-            epoch_match = re.search(r'epoch\s+(\d+)/(\d+)', line, re.IGNORECASE)
-            if epoch_match:
-                new_epoch = int(epoch_match.group(1))
-                if new_epoch != current_epoch:
-                    if current_epoch > 0 and last_epoch_time:
-                        # 前のエポックの時間を記録
-                        import time
-                        now = time.time()
-                        if current_epoch not in epoch_times:
-                            epoch_times[current_epoch] = now - last_epoch_time
-                    current_epoch = new_epoch
-                    import time
-                    last_epoch_time = time.time()
-            
-            # loss値を検出: "loss: 0.0543" または "loss=0.0543" パターン
-            loss_match = re.search(r'loss[:\s=]+([0-9.]+)', line, re.IGNORECASE)
-            if loss_match and current_epoch > 0:
-                loss_val = float(loss_match.group(1))
-                if current_epoch not in epoch_losses:
-                    epoch_losses[current_epoch] = []
-                epoch_losses[current_epoch].append(loss_val)
-            
-            # ステップ進捗を検出: "step 100/450" または進捗バー
-            step_match = re.search(r'(\d+)/(\d+)\s*\[', line)
-            if step_match:
-                current_step = int(step_match.group(1))
-                total_steps = int(step_match.group(2))
-        
-        # 統計情報を生成
-        if not epoch_losses and current_epoch == 0:
-            return ""
-        
-        stats_lines = [
-            "",
-            "📈 Epoch Statistics:",
-            "-" * 40
-        ]
-        
-        for epoch in sorted(epoch_losses.keys()):
-            losses = epoch_losses[epoch]
-            avg_loss = sum(losses) / len(losses) if losses else 0
-            min_loss = min(losses) if losses else 0
-            max_loss = max(losses) if losses else 0
-            
-            time_str = ""
-            if epoch in epoch_times:
-                mins = int(epoch_times[epoch] // 60)
-                secs = int(epoch_times[epoch] % 60)
-                time_str = f" | Time: {mins}m {secs}s"
-            
-            stats_lines.append(
-                f"  Epoch {epoch}: Avg Loss={avg_loss:.4f} (Min={min_loss:.4f}, Max={max_loss:.4f}){time_str}"
-            )
-        
-        # 現在のエポック情報
-        if current_epoch > 0:
-            stats_lines.append(f"\n🔄 Current: Epoch {current_epoch}")
-        
-        return '\n'.join(stats_lines)
-    
-    def _update_progress_log(self):
-        """タイマーで呼び出され、executorの出力を取得してUIを更新"""
-        from kohya_gui.lora_gui import executor
-        
-        if executor.is_running():
-            output = executor.get_output(last_n_lines=50)  # より多くのログを表示
-            full_output = executor.get_output(last_n_lines=500)  # 統計用に全ログ取得
-            epoch_stats = self._parse_epoch_stats(full_output)
-            
-            if output:
-                return (
-                    gr.Textbox(value=output),
-                    gr.Textbox(value=epoch_stats) if epoch_stats else gr.Textbox(),
-                    gr.Timer(active=True)
-                )
-            else:
-                return (
-                    gr.Textbox(value="Training in progress..."),
-                    gr.Textbox(),
-                    gr.Timer(active=True)
-                )
-        else:
-            # トレーニング終了
-            output = executor.get_output(last_n_lines=30)
-            full_output = executor.get_output(last_n_lines=500)
-            epoch_stats = self._parse_epoch_stats(full_output)
-            
-            # 終了コードを確認
-            exit_code = executor.process.poll() if executor.process else None
-            if exit_code is not None and exit_code != 0:
-                final_msg = output + f"\n\n❌ Training failed! (Exit code: {exit_code})"
-                status_msg = "❌ Error" if not epoch_stats else epoch_stats + f"\n\n❌ Error (code: {exit_code})"
-            else:
-                final_msg = output + "\n\n✅ Training completed!" if output else "✅ Training completed!"
-                status_msg = epoch_stats + "\n\n✅ Complete!" if epoch_stats else ""
-            
-            return (
-                gr.Textbox(value=final_msg),
-                gr.Textbox(value=status_msg) if status_msg else gr.Textbox(),
-                gr.Timer(active=False)
-            )
+    def _collect_epoch_stats(self, executor, session: TrainingSession, finished: bool = False) -> str:
+        """前回以降の新しいログ行だけをセッションのパーサーに渡し、エポック統計テキストを返す"""
+        with session.lock:
+            session.log_parser.update(executor)
+            if finished:
+                session.log_parser.finish()
+            return session.log_parser.format_stats()
     
-    def _wait_and_stop_timer(self):
-        """トレーニング終了を待ってタイマーを停止し、ボタン状態を復元"""
-        from kohya_gui.lora_gui import executor
-        
-        while executor.is_running():
-            import time
-            time.sleep(1)
-        
-        # 最終出力を取得
+    def _final_messages(self, executor, session: TrainingSession):
+        """学習終了時の (出力ログ, エポック統計) メッセージ"""
         output = executor.get_output(last_n_lines=30)
-        full_output = executor.get_output(last_n_lines=500)
-        epoch_stats = self._parse_epoch_stats(full_output)
+        epoch_stats = self._collect_epoch_stats(executor, session, finished=True)
         
         # 終了コードを確認
         exit_code = executor.process.poll() if executor.process else None
-        if exit_code is not None and exit_code != 0:
+        if session.stopped_by_user:
+            final_msg = output + "\n\n⚠️ Training stopped by user." if output else "⚠️ Training stopped by user."
+            status_msg = epoch_stats + "\n\n⚠️ Stopped" if epoch_stats else ""
+        elif exit_code is not None and exit_code != 0:
             final_msg = output + f"\n\n❌ Training failed! (Exit code: {exit_code})"
             status_msg = "❌ Error" if not epoch_stats else epoch_stats + f"\n\n❌ Error (code: {exit_code})"
         else:
             final_msg = output + "\n\n✅ Training completed!" if output else "✅ Training completed!"
             status_msg = epoch_stats + "\n\n✅ Complete!" if epoch_stats else ""
+        return final_msg, status_msg
+    
+    async def _stream_progress(self, session: TrainingSession):
+        """学習中、executor に新しい出力か状態変化（終了など）があった時だけ UI を更新する
         
-        return (
+        待機は OutputBuffer.wait_changed()（イベントループ上の future）で行うため、
+        出力が無い間はスレッドもCPUも使わない。
+        """
+        import asyncio
+        from kohya_gui.lora_gui import executor
+        
+        session.stopped_by_user = False
+        buffer = executor.output_buffer
+        version = -1
+        while executor.is_running() or not executor.output_finished():
+            # 出力を捕捉していない場合に終了を検出できるよう、タイムアウト付きで待つ
+            new_version = await buffer.wait_changed(version, timeout=5)
+            if new_version == version:
+                continue  # タイムアウト: 変化が無ければ UI は更新しない
+            version = new_version
+            output = executor.get_output(last_n_lines=50)  # より多くのログを表示
+            epoch_stats = self._collect_epoch_stats(executor, session)
+            yield (
+                gr.Button(),
+                gr.Button(),
+                gr.Textbox(value=output if output else "Training in progress..."),
+                gr.Textbox(value=epoch_stats) if epoch_stats else gr.Textbox()
+            )
+            # tqdm の高頻度な更新はまとめて送る
+            await asyncio.sleep(0.5)
+        
+        final_msg, status_msg = self._final_messages(executor, session)
+        yield (
             gr.Button(visible=True),   # train_button
             gr.Button(visible=False),  # stop_button
-            gr.Timer(active=False),    # timer
             gr.Textbox(value=final_msg),  # output_log
             gr.Textbox(value=status_msg) if status_msg else gr.Textbox()  # epoch_stats
         )
     
-    def _stop_training(self):
+    def _stop_training(self, session: TrainingSession):
         """トレーニングを停止"""
         from kohya_gui.lora_gui import executor
         
         # 停止前に統計を取得
-        full_output = executor.get_output(last_n_lines=500)
-        epoch_stats = self._parse_epoch_stats(full_output)
+        epoch_stats = self._collect_epoch_stats(executor, session)
         
+        session.stopped_by_user = True
         executor.kill_command()
         
         output = executor.get_output(last_n_lines=30)
@@ -585,7 +511,6 @@ class SDXLSimpleTab:
         return (
             gr.Button(visible=True),   # train_button
             gr.Button(visible=False),  # stop_button
-            gr.Timer(active=False),    # timer
             gr.Textbox(value=final_msg),  # output_log
             gr.Textbox(value=epoch_stats + "\n\n⚠️ Stopped") if epoch_stats else gr.Textbox()  # epoch_stats
         )
@@ -1216,7 +1141,8 @@ class SDXLSimpleTab:
         cache_latents,
         cache_latents_to_disk,
         save_model_as,
-        save_precision
+        save_precision,
+        session: TrainingSession = None
     ):
         """
         学習開始 - Design_Requirement_001.md に基づく実装（5ステップフロー）
@@ -1229,14 +1155,13 @@ class SDXLSimpleTab:
         """
         import time
         
-        # エラー時の戻り値ヘルパー（train_button表示、stop_button非表示、timer停止）
+        # エラー時の戻り値ヘルパー（train_button表示、stop_button非表示）
         def error_return(msg):
             return (
                 gr.Button(visible=True),   # train_button を表示
                 gr.Button(visible=False),  # stop_button を非表示
                 gr.Textbox(),              # run_state（変更なし）
-                gr.Textbox(value=msg),     # training_summary: エラーメッセージ
-                gr.Timer(active=False)     # timer: 停止
+                gr.Textbox(value=msg)      # training_summary: エラーメッセージ
             )
         
         try:
@@ -1314,6 +1239,10 @@ class SDXLSimpleTab:
             # ステップ5: train_model() 関数を既存と同じ方法で呼び出す
             # headless, print_only は位置引数として渡す（キーワード引数だと*settings_listと競合）
             from kohya_gui.lora_gui import train_model
+            # 新しい学習の統計は最初から集計し直す（前回の学習の続きとして解析しない）
+            if session is not None:
+                with session.lock:
+                    session.log_parser.reset()
             result = train_model(
                 self.headless,  # 位置引数: headless
                 False,          # 位置引数: print_only
@@ -1326,9 +1255,8 @@ class SDXLSimpleTab:
                 return (
                     train_btn,
                     stop_btn,
-                    run_state_textbox,  # run_state: 状態管理用
-                    gr.Textbox(value=training_summary),  # training_summary: サマリー表示
-                    gr.Timer(active=True)  # timer: 進捗更新を開始
+                    run_state_textbox,  # run_state: 状態管理用（変更で進捗ストリームを開始）
+                    gr.Textbox(value=training_summary)  # training_summary: サマリー表示
                 )
             else:
                 return error_return("学習が完了しました")
@@ -0,0 +1,125 @@
+"""
+Benchmark tools/group_images.py against the previous per-image implementation on a synthetic folder.
+
+--count small images with a mix of portrait, square and landscape sizes are written to a temporary
+folder, each with a caption file. The legacy path opens every image four times (twice for the sort
+key, once for the group ratio, once to crop or pad), holds each group's images in memory and lists
+the folder again for every image to find its sidecars. The new path reads the sizes from the image
+headers, plans the groups with NumPy and decodes each image once in a worker process.
+
+Both runs must produce the same files with the same bytes; the speedup is reported:
+
+    python tools/benchmark_group_images.py --count 20000 --group_size 8 --workers 4
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import group_images
+from group_images import ImageProcessor, crop_image, pad_image
+
+
+def write_dataset(folder, count, seed):
+    rng = np.random.default_rng(seed)
+    ratios = rng.choice([2 / 3, 3 / 4, 1.0, 4 / 3, 3 / 2, 16 / 9], size=count) * np.exp(rng.normal(0, 0.05, size=count))
+    heights = rng.integers(48, 129, size=count)
+    widths = np.maximum(1, np.round(heights * ratios)).astype(int)
+    colors = rng.integers(0, 256, size=(count, 3))
+    for i in range(count):
+        name = f"{i:06d}"
+        Image.new("RGB", (int(widths[i]), int(heights[i])), tuple(int(c) for c in colors[i])).save(os.path.join(folder, f"{name}.png"))
+        with open(os.path.join(folder, f"{name}.txt"), "w") as f:
+            f.write(f"caption {i}")
+
+
+def legacy_process_images(processor):
+    """The per-image pipeline group_images.py used before the header-only, single-decode rewrite."""
+    images = processor.get_image_paths()
+    sorted_images = sorted(images, key=lambda path: Image.open(path).size[0] / Image.open(path).size[1])
+    groups = [sorted_images[i:i + processor.group_size] for i in range(0, len(sorted_images), processor.group_size)]
+    for group_index, group in enumerate(groups):
+        aspect_ratios = []
+        for path in group:
+            with Image.open(path) as img:
+                aspect_ratios.append(img.size[0] / img.size[1])
+        avg_aspect_ratio = np.mean(aspect_ratios)
+        processed = []
+        for path in group:
+            with Image.open(path) as img:
+                processed.append(pad_image(img, avg_aspect_ratio) if processor.pad else crop_image(img, avg_aspect_ratio))
+        max_width = max(img.width for img in processed)
+        max_height = max(img.height for img in processed)
+        os.makedirs(processor.output_folder, exist_ok=True)
+        for j, img in enumerate(processed):
+            final_file_name = f"group-{group_index+1}-{j+1}-{os.path.splitext(os.path.basename(group[j]))[0]}"
+            img.resize((max_width, max_height)).convert('RGB').save(os.path.join(processor.output_folder, f"{final_file_name}.jpg"), quality=70)
+            if processor.caption:
+                processor.create_caption_file(group[j], group_index, final_file_name)
+        if not processor.do_not_copy_other_files:
+            for j, path in enumerate(group):
+                dirpath, original_filename = os.path.split(path)
+                original_basename, original_ext = os.path.splitext(original_filename)
+                for filename in os.listdir(dirpath):
+                    if filename.endswith('.npz'):
+                        continue
+                    basename, ext = os.path.splitext(filename)
+                    if basename == original_basename and ext != original_ext:
+                        shutil.copy2(os.path.join(dirpath, filename), os.path.join(processor.output_folder, f"group-{group_index+1}-{j+1}-{filename}"))
+
+
+def digest_folder(folder):
+    digests = {}
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), "rb") as f:
+            digests[name] = hashlib.sha1(f.read()).hexdigest()
+    return digests
+
+
+def main(args):
+    group_images.log.setLevel("WARNING")  # one line per image would dominate the timings
+    with tempfile.TemporaryDirectory() as root:
+        input_folder = os.path.join(root, "input")
+        os.makedirs(input_folder)
+        start = time.perf_counter()
+        write_dataset(input_folder, args.count, args.seed)
+        print(f"wrote {args.count} images in {time.perf_counter() - start:.1f}s")
+
+        timings = {}
+        outputs = {}
+        for name in ("legacy", "new"):
+            output_folder = os.path.join(root, name)
+            processor = ImageProcessor(input_folder, output_folder, args.group_size, False, False, args.pad, True, ".caption", args.workers)
+            start = time.perf_counter()
+            if name == "legacy":
+                legacy_process_images(processor)
+            else:
+                processor.process_images()
+            timings[name] = time.perf_counter() - start
+            outputs[name] = digest_folder(output_folder)
+            print(f"{name:>6}: {timings[name]:8.2f}s  {args.count / timings[name]:8.1f} images/sec  {len(outputs[name])} files")
+
+    print(f"speedup: {timings['legacy'] / timings['new']:.2f}x")
+    if outputs["legacy"] != outputs["new"]:
+        differing = sorted(set(outputs["legacy"].items()) ^ set(outputs["new"].items()))
+        print(f"FAIL: the outputs differ ({len(differing)} entries), e.g. {differing[:3]}")
+        sys.exit(1)
+    print("outputs are identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20000, help="Number of synthetic images")
+    parser.add_argument("--group_size", type=int, default=8, help="Number of images in each group")
+    parser.add_argument("--pad", action="store_true", help="Pad images instead of cropping them")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for the new pipeline (default: CPU count)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic sizes")
+    main(parser.parse_args())
@@ -0,0 +1,90 @@
+"""
+Benchmark the group optimizer of group_images_recommended_size on synthetic aspect ratios.
+
+For every group size in --min_group..--max_group the optimizer splits --count sorted ratios into
+groups and picks the images to leave out; the time per group size and the average crop loss are
+reported next to the loss of the naive split (consecutive groups, leftovers dropped at the end).
+
+--verify first checks the optimizer against an exhaustive search (every choice of left-out images)
+on small random inputs.
+
+    python tools/benchmark_group_optimizer.py --count 10000 --min_group 2 --max_group 64 --verify
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from group_images_recommended_size import crop_losses, optimize_groups
+
+
+def synthetic_ratios(count, rng):
+    """A mix of common photo/illustration ratios (portrait, square, landscape) with jitter."""
+    centers = np.array([2 / 3, 3 / 4, 1.0, 4 / 3, 3 / 2, 16 / 9])
+    ratios = rng.choice(centers, size=count) * np.exp(rng.normal(0, 0.05, size=count))
+    return np.sort(ratios)
+
+
+def group_loss(ratios, indices, group_size):
+    kept = ratios[list(indices)]
+    groups = kept.reshape(-1, group_size)
+    return float(sum(crop_losses(group, group.mean()).sum() for group in groups))
+
+
+def exhaustive(ratios, group_size):
+    n = len(ratios)
+    n_removed = n % group_size
+    best = np.inf
+    for removed in itertools.combinations(range(n), n_removed):
+        kept = [i for i in range(n) if i not in removed]
+        best = min(best, group_loss(ratios, kept, group_size))
+    return best / (n - n_removed)
+
+
+def verify(rng, trials):
+    for _ in range(trials):
+        n = int(rng.integers(2, 13))
+        group_size = int(rng.integers(1, n + 1))
+        ratios = synthetic_ratios(n, rng)
+        _, _, loss = optimize_groups(ratios, group_size)
+        expected = exhaustive(ratios, group_size)
+        if not np.isclose(loss, expected, atol=1e-9):
+            print(f"MISMATCH n={n} group_size={group_size}: optimizer {loss:.9f}, exhaustive {expected:.9f}")
+            return False
+    print(f"verify: {trials} random inputs match the exhaustive search")
+    return True
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    if args.verify and not verify(rng, args.verify_trials):
+        sys.exit(1)
+
+    ratios = synthetic_ratios(args.count, rng)
+    total = 0.0
+    print(f"{'group':>5} {'time':>9} {'loss':>9} {'naive':>9} {'left out':>8}")
+    for group_size in range(args.min_group, min(args.max_group, args.count) + 1):
+        start = time.perf_counter()
+        starts, removed, loss = optimize_groups(ratios, group_size)
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        n_kept = args.count - args.count % group_size
+        naive = group_loss(ratios, range(n_kept), group_size) / n_kept
+        print(f"{group_size:5d} {elapsed * 1000:7.2f}ms {loss:9.5f} {naive:9.5f} {len(removed):8d}")
+    print(f"total {total:.3f}s for {args.count} ratios")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10000, help="Number of synthetic aspect ratios")
+    parser.add_argument("--min_group", type=int, default=2, help="Smallest group size")
+    parser.add_argument("--max_group", type=int, default=64, help="Largest group size")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--verify", action="store_true", help="Check against an exhaustive search on small inputs first")
+    parser.add_argument("--verify_trials", type=int, default=200, help="Number of small inputs to check")
+    main(parser.parse_args())
@@ -0,0 +1,185 @@
+"""
+Benchmark kohya_ss GUI startup.
+
+Each run starts a fresh interpreter, so nothing is shared between runs except the OS file cache
+(the first run is the closest to a cold start). Two numbers are reported per run:
+
+  import time         importing gradio and the GUI tab modules, as kohya_gui.py does before building the UI
+  time to first page  launching kohya_gui.py (--headless --noverify) until its page answers HTTP 200
+
+With --profile, one `kohya_gui.py --profile-startup` run also reports the config load, each tab's
+construction time and the slowest import groups. Every run uses a temporary KOHYA_SS_CACHE_DIR,
+so the benchmark never sees (or starts) the user's queued trainings. The script exits with status 1 when a median is
+over its budget (--max_* seconds, 0 disables a check), so it can guard against startup regressions:
+
+    python tools/benchmark_gui_startup.py --runs 3 --profile --max_import_time 8 --max_first_page_time 15
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GUI_MODULES = [
+    "kohya_gui.dreambooth_gui",
+    "kohya_gui.finetune_gui",
+    "kohya_gui.textual_inversion_gui",
+    "kohya_gui.utilities",
+    "kohya_gui.lora_gui",
+    "kohya_gui.class_lora_tab",
+]
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import gradio
+gradio_time = time.perf_counter() - start
+for module in {modules!r}:
+    __import__(module)
+print(gradio_time, time.perf_counter() - start)
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import_time(env):
+    """(gradio import seconds, total import seconds) in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(modules=GUI_MODULES)],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    gradio_time, total_time = map(float, result.stdout.split()[-2:])
+    return gradio_time, total_time
+
+
+def measure_first_page(config, timeout, env):
+    """Seconds from launching kohya_gui.py until its page answers, or None on timeout / early exit."""
+    port = free_port()
+    command = [
+        sys.executable, os.path.join(REPO_DIR, "kohya_gui.py"),
+        "--headless", "--noverify", "--listen", "127.0.0.1", "--server_port", str(port), "--config", config,
+    ]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                return None
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.1)
+        return None
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def profile_startup(config, timeout, env):
+    """Report of one `kohya_gui.py --profile-startup` run."""
+    fd, report_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        subprocess.run(
+            [
+                sys.executable, os.path.join(REPO_DIR, "kohya_gui.py"), "--headless", "--config", config,
+                "--profile-startup", "--profile-startup-report", report_path,
+            ],
+            cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True, timeout=timeout,
+        )
+        with open(report_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(report_path)
+
+
+def summary(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return "failed"
+    return f"first {values[0]:6.2f}s  median {statistics.median(values):6.2f}s  min {min(values):6.2f}s"
+
+
+def main(args):
+    with tempfile.TemporaryDirectory(prefix="kohya_ss_benchmark_") as cache_dir:
+        run_benchmark(args, {**os.environ, "KOHYA_SS_CACHE_DIR": cache_dir})
+
+
+def run_benchmark(args, env):
+    gradio_times, import_times, page_times = [], [], []
+    for run in range(args.runs):
+        gradio_time, import_time = measure_import_time(env)
+        page_time = None if args.skip_launch else measure_first_page(args.config, args.timeout, env)
+        gradio_times.append(gradio_time)
+        import_times.append(import_time)
+        page_times.append(page_time)
+        page = "-" if page_time is None else f"{page_time:.2f}s"
+        print(f"run {run + 1}: import {import_time:.2f}s (gradio {gradio_time:.2f}s), first page {page}")
+
+    print()
+    print(f"gradio import      {summary(gradio_times)}")
+    print(f"GUI import         {summary(import_times)}")
+    if not args.skip_launch:
+        print(f"time to first page {summary(page_times)}")
+
+    build_time = None
+    if args.profile:
+        report = profile_startup(args.config, args.timeout, env)
+        sections = {section["name"]: section["seconds"] for section in report["sections"]}
+        build_time = sections.get("initialize_ui_interface")
+        print(f"\n--profile-startup: total {report['total_seconds']:.2f}s")
+        for name, seconds in sections.items():
+            print(f"  {name:<28} {seconds:7.2f}s")
+        print("  slowest import groups:")
+        for name, group in list(report["imports"]["groups"].items())[:10]:
+            print(f"    {name:<26} {group['self_seconds']:7.2f}s ({group['modules']} modules)")
+
+    checks = [
+        ("GUI import", import_times, args.max_import_time),
+        ("time to first page", page_times, args.max_first_page_time),
+        ("UI construction", [build_time], args.max_build_time),
+    ]
+    failed = False
+    for name, values, budget in checks:
+        values = [v for v in values if v is not None]
+        if not budget or not values:
+            continue
+        median = statistics.median(values)
+        if median > budget:
+            print(f"FAIL: {name} median {median:.2f}s is over the {budget:.2f}s budget")
+            failed = True
+    if not args.skip_launch and args.max_first_page_time and None in page_times:
+        print("FAIL: the GUI did not serve its first page in every run")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="Number of fresh-interpreter runs")
+    parser.add_argument("--config", type=str, default="./config.toml", help="GUI config file passed to kohya_gui.py")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for the first page")
+    parser.add_argument("--skip_launch", action="store_true", help="Only measure the import time")
+    parser.add_argument("--profile", action="store_true", help="Also run kohya_gui.py --profile-startup once and report its sections")
+    parser.add_argument("--max_import_time", type=float, default=10, help="Budget for the median GUI import time in seconds (0 = no check)")
+    parser.add_argument("--max_first_page_time", type=float, default=20, help="Budget for the median time to first page in seconds (0 = no check)")
+    parser.add_argument("--max_build_time", type=float, default=10, help="Budget for building the UI (initialize_ui_interface, needs --profile) in seconds (0 = no check)")
+    main(parser.parse_args())
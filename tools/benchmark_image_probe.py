@@ -0,0 +1,99 @@
+"""
+Benchmark the header probe and its sqlite cache on synthetic images.
+
+Writes --count small files with valid PNG / JPEG (with an EXIF orientation) / WebP headers and
+random sizes into a temporary folder, then times sorting them by aspect ratio three ways: a cold
+probe (no cache), a first run through an empty cache, and a warm run where every size comes from
+the cache (one stat per image). Probed sizes are checked against the sizes that were written.
+
+    python tools/benchmark_image_probe.py --count 50000
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import image_probe
+
+
+def png_header(width, height):
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = b"IHDR" + ihdr
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", len(ihdr)) + chunk + struct.pack(">I", zlib.crc32(chunk))
+
+
+def jpeg_header(width, height, orientation):
+    tiff = b"MM\x00\x2a" + struct.pack(">I", 8) + struct.pack(">H", 1) + struct.pack(">HHIHH", 0x0112, 3, 1, orientation, 0) + b"\x00" * 4
+    app1 = b"Exif\x00\x00" + tiff
+    sof = struct.pack(">BHHB", 8, height, width, 3) + b"\x01\x11\x00\x02\x11\x01\x03\x11\x01"
+    return b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + b"\xff\xc0" + struct.pack(">H", len(sof) + 2) + sof
+
+
+def webp_header(width, height):
+    vp8x = b"\x00\x00\x00\x00" + (width - 1).to_bytes(3, "little") + (height - 1).to_bytes(3, "little")
+    body = b"WEBP" + b"VP8X" + struct.pack("<I", len(vp8x)) + vp8x
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def write_images(folder, count, seed):
+    rng = random.Random(seed)
+    expected = {}
+    for i in range(count):
+        width, height = rng.randint(256, 4096), rng.randint(256, 4096)
+        kind = i % 3
+        if kind == 0:
+            path, data, display = os.path.join(folder, f"{i:06d}.png"), png_header(width, height), (width, height)
+        elif kind == 1:
+            orientation = rng.choice((1, 6))
+            path, data = os.path.join(folder, f"{i:06d}.jpg"), jpeg_header(width, height, orientation)
+            display = (height, width) if orientation == 6 else (width, height)
+        else:
+            path, data, display = os.path.join(folder, f"{i:06d}.webp"), webp_header(width, height), (width, height)
+        with open(path, "wb") as f:
+            f.write(data)
+        expected[path] = display
+    return expected
+
+
+def sort_by_aspect_ratio(paths, cache):
+    infos = image_probe.probe_many(paths, cache)
+    return sorted(paths, key=lambda path: infos[path].display_aspect_ratio), infos
+
+
+def timed(label, paths, cache, expected):
+    start = time.perf_counter()
+    _, infos = sort_by_aspect_ratio(paths, cache)
+    elapsed = time.perf_counter() - start
+    wrong = sum(1 for path in paths if infos[path] is None or infos[path].display_size != expected[path])
+    print(f"{label:<18} {elapsed:7.3f}s  {len(paths) / elapsed:10.0f} images/s  {wrong} wrong size(s)")
+    return elapsed, wrong
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"Writing {args.count} synthetic image headers...")
+        expected = write_images(folder, args.count, args.seed)
+        paths = sorted(expected)
+        cache = image_probe.ProbeCache(os.path.join(folder, "probe.sqlite"))
+
+        timed("no cache", paths, None, expected)
+        timed("cold cache", paths, cache, expected)
+        warm, wrong = timed("warm cache", paths, cache, expected)
+
+    if wrong or (args.max_warm_time and warm > args.max_warm_time):
+        print(f"FAIL: warm sort took {warm:.3f}s (budget {args.max_warm_time:.3f}s), {wrong} wrong size(s)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=50000, help="Number of synthetic images")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the image sizes")
+    parser.add_argument("--max_warm_time", type=float, default=1.0, help="Budget for the warm-cache sort in seconds (0 = no check)")
+    main(parser.parse_args())
@@ -0,0 +1,93 @@
+"""
+Benchmark the exact and randomized SVD backends on SDXL-shaped weight deltas.
+
+Deltas are synthetic (random orthogonal factors with a power-law spectrum, like a fine-tuning
+delta), so no checkpoint is needed. For every shape and rank it reports wall time of both
+methods, the speedup, the Frobenius norm retained by the rank-r reconstruction and the
+randomized method's accuracy-guard residual / fallback.
+
+    python tools/benchmark_svd_backend.py --ranks 4 16 32 64 128 --device cpu
+"""
+
+import argparse
+import time
+
+import torch
+
+import svd_backend
+
+# (name, out_features, in_features); conv 3x3 layers are given flattened to (out, in * 9).
+SDXL_LAYER_SHAPES = [
+    ("attn1.to_q 320", 320, 320),
+    ("attn1.to_q 640", 640, 640),
+    ("attn1.to_q 1280", 1280, 1280),
+    ("attn2.to_k 640x2048", 640, 2048),
+    ("attn2.to_k 1280x2048", 1280, 2048),
+    ("ff.net.0.proj 1280", 10240, 1280),
+    ("ff.net.2 1280", 1280, 5120),
+    ("conv 3x3 320", 320, 2880),
+    ("conv 3x3 640", 640, 5760),
+    ("conv 3x3 1280", 1280, 11520),
+]
+
+
+def synthetic_delta(out_features, in_features, decay, device, seed):
+    generator = torch.Generator(device="cpu").manual_seed(seed)
+    k = min(out_features, in_features)
+    U, _ = torch.linalg.qr(torch.randn(out_features, k, generator=generator))
+    V, _ = torch.linalg.qr(torch.randn(in_features, k, generator=generator))
+    S = torch.arange(1, k + 1, dtype=torch.float32).pow(-decay) * 1e-2
+    return ((U * S) @ V.T).to(device)
+
+
+def retained_fro(A, U, S, Vh, rank):
+    reconstruction = (U[:, :rank] * S[:rank]) @ Vh[:rank]
+    return 1.0 - float(torch.linalg.matrix_norm(A - reconstruction)) / float(torch.linalg.matrix_norm(A))
+
+
+def timed(fn, device, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        result = fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(args):
+    device = torch.device(args.device)
+    print(f"{'layer':24} {'rank':>5} {'exact s':>9} {'rand s':>9} {'speedup':>8} {'fro exact':>10} {'fro rand':>10} {'residual':>9} fallback")
+    totals = {"exact": 0.0, "randomized": 0.0}
+    for index, (name, out_features, in_features) in enumerate(SDXL_LAYER_SHAPES):
+        A = synthetic_delta(out_features, in_features, args.decay, device, seed=index)
+        exact_time, (U, S, Vh) = timed(lambda: svd_backend.svd(A), device, args.repeats)
+        for rank in args.ranks:
+            rank = min(rank, out_features, in_features)
+            rand_time, (Ur, Sr, Vhr, info) = timed(
+                lambda: svd_backend.svd(A, rank, "randomized", args.oversample, args.power_iterations, args.tolerance, return_info=True),
+                device, args.repeats,
+            )
+            totals["exact"] += exact_time
+            totals["randomized"] += rand_time
+            residual = "-" if info["residual"] is None else f"{info['residual']:.2e}"
+            print(
+                f"{name:24} {rank:5d} {exact_time:9.4f} {rand_time:9.4f} {exact_time / rand_time:7.1f}x "
+                f"{retained_fro(A, U, S, Vh, rank):10.2%} {retained_fro(A, Ur, Sr, Vhr, rank):10.2%} {residual:>9} {info['fallback']}"
+            )
+    print(f"\nTotal: exact {totals['exact']:.3f}s, randomized {totals['randomized']:.3f}s ({totals['exact'] / totals['randomized']:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ranks", type=int, nargs="+", default=[4, 16, 32, 64, 128], help="Ranks to extract")
+    parser.add_argument("--device", type=str, default="cpu", help="Device to run the SVDs on")
+    parser.add_argument("--decay", type=float, default=1.0, help="Power-law exponent of the synthetic spectrum (larger = faster decay)")
+    parser.add_argument("--oversample", type=int, default=svd_backend.DEFAULT_OVERSAMPLE, help="Extra sketch columns for the randomized method")
+    parser.add_argument("--power_iterations", type=int, default=svd_backend.DEFAULT_POWER_ITERATIONS, help="Subspace iterations for the randomized method")
+    parser.add_argument("--tolerance", type=float, default=svd_backend.DEFAULT_TOLERANCE, help="Accuracy-guard residual above which the exact SVD is used")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed repetitions per measurement (best is reported)")
+    main(parser.parse_args())
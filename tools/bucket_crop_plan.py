@@ -0,0 +1,239 @@
+"""
+Bucket-aware crop planner and executor used by crop_images_to_n_buckets.py --resolution.
+
+The buckets are the ones sd-scripts builds from the same training options (resolution,
+min_bucket_reso, max_bucket_reso, bucket_reso_steps). Each image goes to the bucket that crops the
+fewest of its pixels, computed for all images at once from the header sizes:
+
+    buckets = make_bucket_resolutions((1024, 1024), 256, 2048, 64)
+    plan = plan_crops(image_paths, infos, buckets, output_dir="cropped")
+    save_plan(plan, "plan.json")
+    stats = apply_plan(plan, workers=8)
+
+The plan is plain JSON (source, target, bucket, crop box in display orientation and sidecar
+files per image), so it can be reviewed or edited before it is applied. The executor decodes each
+image once in a worker process, center crops it to the bucket's aspect ratio and resizes it to the
+bucket resolution. An image that already has a bucket's exact size lands in that bucket at training
+time with no further crop or resize.
+"""
+
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+PLAN_VERSION = 1
+
+
+def make_bucket_resolutions(max_reso, min_size=256, max_size=1024, divisible=64):
+    """Sorted (width, height) buckets, as sd-scripts' library.model_util.make_bucket_resolutions builds them."""
+    max_width, max_height = max_reso
+    max_area = max_width * max_height
+
+    resos = set()
+    width = int(math.sqrt(max_area) // divisible) * divisible
+    resos.add((width, width))
+
+    width = min_size
+    while width <= max_size:
+        height = min(max_size, int((max_area // width) // divisible) * divisible)
+        if height >= min_size:
+            resos.add((width, height))
+            resos.add((height, width))
+        width += divisible
+
+    return sorted(resos)
+
+
+def assign_buckets(widths, heights, buckets):
+    """
+    Index into buckets of the bucket that crops the smallest fraction of each image, and that fraction.
+
+    Scaling an image of ratio r to cover a bucket of ratio b keeps min(r / b, b / r) of its pixels,
+    so the best bucket is the one closest in log aspect ratio.
+    """
+    ratios = np.asarray(widths, dtype=np.float64) / np.asarray(heights, dtype=np.float64)
+    bucket_ratios = np.array([w / h for w, h in buckets], dtype=np.float64)
+    cropped = 1.0 - np.minimum(ratios[:, None] / bucket_ratios[None, :], bucket_ratios[None, :] / ratios[:, None])
+    best = np.argmin(cropped, axis=1)
+    return best, cropped[np.arange(len(ratios)), best]
+
+
+def crop_boxes(widths, heights, bucket_sizes):
+    """(left, top, right, bottom) center crops of each image to its bucket's aspect ratio, as an (N, 4) array."""
+    widths = np.asarray(widths, dtype=np.int64)
+    heights = np.asarray(heights, dtype=np.int64)
+    bucket_sizes = np.asarray(bucket_sizes, dtype=np.int64).reshape(-1, 2)
+    # Compare w / h with bw / bh in integers to avoid cropping a single pixel off exact matches
+    wider = widths * bucket_sizes[:, 1] > heights * bucket_sizes[:, 0]
+    crop_widths = np.where(wider, np.maximum(1, np.round(heights * bucket_sizes[:, 0] / bucket_sizes[:, 1])), widths).astype(np.int64)
+    crop_heights = np.where(wider, heights, np.maximum(1, np.round(widths * bucket_sizes[:, 1] / bucket_sizes[:, 0]))).astype(np.int64)
+    lefts = (widths - crop_widths) // 2
+    tops = (heights - crop_heights) // 2
+    return np.stack([lefts, tops, lefts + crop_widths, tops + crop_heights], axis=1)
+
+
+def _stem_index(folder):
+    index = {}
+    for name in os.listdir(folder):
+        index.setdefault(os.path.splitext(name)[0], []).append(name)
+    return index
+
+
+def plan_crops(image_paths, infos, buckets, output_dir, use_original_name=False, copy_sidecars=True):
+    """
+    Crop plan (a JSON-serializable dict) for the readable images of image_paths.
+
+    infos maps each path to its image_probe.ImageInfo (or None to skip it). Targets are
+    `<output_dir>/<original name>` with use_original_name, else `bucket_<w>x<h>_<i>.jpg`. Sidecar
+    files (same stem, another extension, e.g. captions) are copied next to their target.
+    """
+    paths = [path for path in image_paths if infos.get(path) is not None]
+    sizes = np.array([infos[path].display_size for path in paths], dtype=np.int64).reshape(-1, 2)
+    best, cropped = assign_buckets(sizes[:, 0], sizes[:, 1], buckets) if paths else (np.zeros(0, int), np.zeros(0))
+    bucket_sizes = np.array(buckets, dtype=np.int64)[best].reshape(-1, 2)
+    boxes = crop_boxes(sizes[:, 0], sizes[:, 1], bucket_sizes)
+
+    stem_indexes = {}
+    counts = {}
+    images = []
+    for path, (bucket_width, bucket_height), box, fraction in zip(paths, bucket_sizes.tolist(), boxes.tolist(), cropped.tolist()):
+        folder, name = os.path.split(path)
+        stem = os.path.splitext(name)[0]
+        index = counts.get((bucket_width, bucket_height), 0)
+        counts[(bucket_width, bucket_height)] = index + 1
+        target_name = name if use_original_name else f"bucket_{bucket_width}x{bucket_height}_{index}.jpg"
+        target = os.path.join(output_dir, target_name)
+        sidecars = []
+        if copy_sidecars:
+            if folder not in stem_indexes:
+                stem_indexes[folder] = _stem_index(folder or ".")
+            target_stem = os.path.splitext(target)[0]
+            sidecars = [
+                [os.path.join(folder, other), target_stem + os.path.splitext(other)[1]]
+                for other in sorted(stem_indexes[folder].get(stem, []))
+                if other != name
+            ]
+        images.append({
+            "source": path,
+            "target": target,
+            "bucket": [bucket_width, bucket_height],
+            "crop": box,
+            "cropped_fraction": round(fraction, 6),
+            "sidecars": sidecars,
+        })
+
+    return {
+        "version": PLAN_VERSION,
+        "buckets": [list(bucket) for bucket in buckets],
+        "images": images,
+        "skipped": [path for path in image_paths if infos.get(path) is None],
+        "mean_cropped_fraction": float(cropped.mean()) if len(cropped) else 0.0,
+    }
+
+
+def bucket_counts(plan):
+    """{(width, height): number of images} of a plan, sorted by bucket."""
+    counts = {}
+    for image in plan["images"]:
+        bucket = tuple(image["bucket"])
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return dict(sorted(counts.items()))
+
+
+def save_plan(plan, path):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".crop_plan_", suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_plan(path):
+    with open(path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported crop plan version {plan.get('version')} in {path}")
+    return plan
+
+
+def _apply_one(source, target, crop, bucket, quality):
+    """Worker: decode source once, crop it, resize it to the bucket and write target atomically."""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)  # the crop box is in display orientation, like cv2.imread
+        image = image.crop(tuple(crop))
+        if image.size != tuple(bucket):
+            image = image.resize(tuple(bucket), Image.LANCZOS)
+        save_kwargs = {}
+        if os.path.splitext(target)[1].lower() in (".jpg", ".jpeg"):
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            save_kwargs["quality"] = quality
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target) or ".", prefix=".crop_", suffix=os.path.splitext(target)[1])
+        os.close(fd)
+        try:
+            image.save(tmp_path, **save_kwargs)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return target
+
+
+def apply_plan(plan, workers=None, max_in_flight=None, quality=95, log=print):
+    """
+    Apply a crop plan on a process pool. Returns {"written", "failed", "sidecars", "seconds", "images_per_sec"}.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    stats = {"written": 0, "failed": 0, "sidecars": 0}
+    start = time.perf_counter()
+
+    images = plan["images"]
+    if images:
+        with ProcessPoolExecutor(max_workers=min(workers, len(images))) as pool:
+            pending = {}
+            queued = iter(images)
+            while True:
+                while len(pending) < max_in_flight:
+                    image = next(queued, None)
+                    if image is None:
+                        break
+                    future = pool.submit(_apply_one, image["source"], image["target"], image["crop"], image["bucket"], quality)
+                    pending[future] = image
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image = pending.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        log(f"Error processing {image['source']}: {e}")
+                        stats["failed"] += 1
+                        continue
+                    stats["written"] += 1
+                    for sidecar_source, sidecar_target in image["sidecars"]:
+                        try:
+                            shutil.copy2(sidecar_source, sidecar_target)
+                            stats["sidecars"] += 1
+                        except OSError as e:
+                            log(f"Error copying {sidecar_source}: {e}")
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["images_per_sec"] = stats["written"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    log(
+        f"Wrote {stats['written']} image(s) in {stats['seconds']:.1f}s ({stats['images_per_sec']:.1f} images/sec), "
+        f"failed {stats['failed']}, copied {stats['sidecars']} sidecar file(s)"
+    )
+    return stats
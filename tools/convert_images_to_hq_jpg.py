@@ -1,8 +1,8 @@
 import argparse
-import glob
 import os
 from pathlib import Path
-from PIL import Image
+
+from image_convert import add_engine_arguments, convert_images, plan_conversions
 
 
 def writable_dir(target_path):
@@ -16,35 +16,23 @@ def writable_dir(target_path):
     else:
         raise argparse.ArgumentTypeError(f"Directory '{path}' does not exist.")
 
-def main(directory, in_ext, quality, delete_originals):
+def main(directory, in_ext, quality, delete_originals, recursive=False, output_dir=None, workers=None, max_in_flight=None, refresh=False):
     out_ext = "jpg"
 
-    # Create the file pattern string using the input file extension
-    file_pattern = f"*.{in_ext}"
-
-    # Get the list of files in the directory that match the file pattern
-    files = glob.glob(os.path.join(directory, file_pattern))
-
-    # Iterate over the list of files
-    for file in files:
-        # Open the image file
-        img = Image.open(file)
-
-        # Create a new file path with the output file extension
-        new_path = Path(file).with_suffix(f".{out_ext}")
-
-        # Check if the output file already exists
-        if new_path.exists():
-            # Skip the conversion if the output file already exists
-            print(f"Skipping {file} because {new_path} already exists")
-            continue
-
-        # Save the image to the new file as high-quality JPEG
-        img.save(new_path, quality=quality, optimize=True)
+    # Find the *.<in_ext> files and the path of each converted image
+    jobs = plan_conversions(directory, in_ext, out_ext, recursive=recursive, output_dir=output_dir)
 
-        # Optionally, delete the original file
-        if delete_originals:
-            os.remove(file)
+    # Save the images as high-quality JPEG on a process pool, skipping the existing targets
+    return convert_images(
+        jobs,
+        image_format="JPEG",
+        save_kwargs={"quality": quality, "optimize": True},
+        workers=workers,
+        max_in_flight=max_in_flight,
+        delete_originals=delete_originals,
+        rgb_only=True,
+        refresh=refresh,
+    )
 
 
 if __name__ == "__main__":
@@ -58,8 +46,11 @@ if __name__ == "__main__":
                         help="the JPEG quality (0-100)")
     parser.add_argument("--delete_originals", action="store_true",
                         help="whether to delete the original files after conversion")
+    add_engine_arguments(parser)
     
     # Parse the command-line arguments
     args = parser.parse_args()
     
-    main(directory=args.directory, in_ext=args.in_ext, quality=args.quality, delete_originals=args.delete_originals)
+    main(directory=args.directory, in_ext=args.in_ext, quality=args.quality, delete_originals=args.delete_originals,
+         recursive=args.recursive, output_dir=args.output_dir, workers=args.workers, max_in_flight=args.max_in_flight,
+         refresh=args.refresh)
@@ -1,7 +1,8 @@
 import argparse
 from pathlib import Path
 import os
-from PIL import Image
+
+from image_convert import add_engine_arguments, convert_images, plan_conversions
 
 def writable_dir(target_path):
     """ Check if a path is a valid directory and that it can be written to. """
@@ -25,46 +26,23 @@ def main():
                         help="the output file extension")
     parser.add_argument("--delete_originals", action="store_true",
                         help="whether to delete the original files after conversion")
+    add_engine_arguments(parser)
 
     # Parse the command-line arguments
     args = parser.parse_args()
-    directory = Path(args.directory)
-    in_ext = args.in_ext
-    delete_originals = args.delete_originals
-
-    # Create the file pattern string using the input file extension
-    file_pattern = f"*.{in_ext}"
-
-    # Get the list of files in the directory that match the file pattern
-    files = list(directory.glob(file_pattern))
-
-    # Iterate over the list of files
-    for file in files:
-        try:
-            # Open the image file
-            img = Image.open(file)
-
-            # Create a new file path with the output file extension
-            new_path = file.with_suffix(f".{args.out_ext}")
-            print(new_path)
-
-            # Check if the output file already exists
-            if new_path.exists():
-                # Skip the conversion if the output file already exists
-                print(f"Skipping {file} because {new_path} already exists")
-                continue
-
-            # Save the image to the new file as lossless
-            img.save(new_path, lossless=True)
-
-            # Close the image file
-            img.close()
 
-            # Optionally, delete the original file
-            if delete_originals:
-                file.unlink()
-        except Exception as e:
-            print(f"Error processing {file}: {e}")
+    # Find the *.<in_ext> files and the path of each converted image
+    jobs = plan_conversions(args.directory, args.in_ext, args.out_ext, recursive=args.recursive, output_dir=args.output_dir)
+
+    # Save the images as lossless on a process pool, skipping the existing targets
+    convert_images(
+        jobs,
+        save_kwargs={"lossless": True},
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        delete_originals=args.delete_originals,
+        refresh=args.refresh,
+    )
 
 
 if __name__ == "__main__":
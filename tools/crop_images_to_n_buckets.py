@@ -3,41 +3,55 @@
 # of that batch, and saves the cropped images in a specified directory. The user provides 
 # the paths to the input directory and the output directory, as well as the desired batch 
 # size. The program drops any images that do not fit exactly into the batches.
+#
+# With --resolution it instead plans a crop per image for the buckets training will use (the
+# same resolution, min/max bucket reso and steps), writes the plan as JSON and applies it on a
+# process pool, see bucket_crop_plan.py.
 
 import os
 import cv2
 import argparse
 import shutil
+import numpy as np
 
-def aspect_ratio(img_path):
+import bucket_crop_plan
+import image_probe
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+def aspect_ratio(img_path, cache=None):
     """
     Calculate and return the aspect ratio of an image.
     
     Parameters:
     img_path: A string representing the path to the input image.
+    cache: An optional image_probe.ProbeCache holding image sizes between runs.
     
     Returns:
-    float: Aspect ratio of the input image, defined as width / height.
-           Returns None if the image cannot be read.
+    float: Aspect ratio of the input image, defined as width / height, after the EXIF
+           orientation is applied (as cv2.imread does). Returns None if the image cannot be read.
     """
-    try:
-        image = cv2.imread(img_path)
-        if image is None:
-            raise ValueError("Image not found or could not be read.")
-        height, width = image.shape[:2]
-        return float(width) / float(height)
-    except Exception as e:
-        print(f"Error: {e}")
+    info = image_probe.probe_many([img_path], cache)[img_path]
+    if info is None:
+        print(f"Error: Image not found or could not be read: {img_path}")
         return None
+    return info.display_aspect_ratio
 
-def sort_images_by_aspect_ratio(path):
-    """Sort all images in a folder by aspect ratio"""
+def list_images(path):
+    """Paths of the images in a folder, sorted by name"""
+    return [os.path.join(path, filename) for filename in sorted(os.listdir(path)) if filename.endswith(IMAGE_EXTENSIONS)]
+
+def sort_images_by_aspect_ratio(path, cache=None):
+    """Sort all images in a folder by aspect ratio, reading only the image headers (through `cache` if given)"""
+    paths = list_images(path)
+    infos = image_probe.probe_many(paths, cache)
     images = []
-    for filename in os.listdir(path):
-        if filename.endswith(".jpg") or filename.endswith(".jpeg") or filename.endswith(".png") or filename.endswith(".webp"):
-            print(filename)
-            img_path = os.path.join(path, filename)
-            images.append((img_path, aspect_ratio(img_path)))
+    for img_path in paths:
+        info = infos[img_path]
+        if info is None:
+            print(f"Error: Image not found or could not be read: {img_path}")
+            continue
+        images.append((img_path, info.display_aspect_ratio))
     # sort the list of tuples based on the aspect ratio
     sorted_images = sorted(images, key=lambda x: x[1])
     return sorted_images
@@ -175,7 +189,7 @@ def copy_related_files(img_path, save_path):
         print(f"Error: {e}")  # Handle errors from os.listdir()
 
 def save_resized_cropped_images(group, folder_name, group_number, avg_aspect_ratio, use_original_name=False):
-    """Crop and resize all images in the input group to the smallest resolution, and save them to a folder.
+    """Crop all images in the input group to the group's average aspect ratio, and save them to a folder.
 
     Args:
         group: A list of tuples, where each tuple contains the path to an image and its aspect ratio.
@@ -188,22 +202,9 @@ def save_resized_cropped_images(group, folder_name, group_number, avg_aspect_rat
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
 
-    # get the smallest size of the images
-    smallest_res = float("inf")
-    for img_path, _ in group:
-        image = cv2.imread(img_path)
-        cropped_image = center_crop_image(image, avg_aspect_ratio)
-        height, width = cropped_image.shape[:2]
-        image_res = height * width
-        if image_res < smallest_res:
-            smallest_res = image_res
-            small_height, small_width = height, width
-
-    # resize all images to the smallest resolution of the images in the group
     for i, (img_path, aspect_ratio) in enumerate(group):
         image = cv2.imread(img_path)
         cropped_image = center_crop_image(image, avg_aspect_ratio)
-        # resized_image = cv2.resize(cropped_image, (small_width, small_height))
         if use_original_name:
             save_name = os.path.basename(img_path)
         else:
@@ -217,15 +218,62 @@ def save_resized_cropped_images(group, folder_name, group_number, avg_aspect_rat
         print(f"Saved {save_name} to {folder_name}")
         
 
+def crop_to_buckets(args):
+    """Plan (or load) the bucket crop plan, write it and apply it"""
+    plan_file = args.plan_file or os.path.join(args.output_dir, 'crop_plan.json')
+    if args.apply_plan:
+        print(f"Loading crop plan {plan_file}...")
+        plan = bucket_crop_plan.load_plan(plan_file)
+    else:
+        if not os.path.exists(args.input_dir):
+            print(f"Error: Input directory does not exist: {args.input_dir}")
+            return
+        reso = [int(size) for size in args.resolution.split(',')]
+        reso = (reso[0], reso[-1])
+        buckets = bucket_crop_plan.make_bucket_resolutions(reso, args.min_bucket_reso, args.max_bucket_reso, args.bucket_reso_steps)
+        print(f"Planning crops for {len(buckets)} buckets at {reso[0]}x{reso[1]} in {args.input_dir}...")
+        paths = list_images(args.input_dir)
+        infos = image_probe.probe_many(paths, image_probe.cache_from_args(args))
+        plan = bucket_crop_plan.plan_crops(paths, infos, buckets, args.output_dir, args.use_original_name)
+        for img_path in plan['skipped']:
+            print(f"Error: Image not found or could not be read: {img_path}")
+        bucket_crop_plan.save_plan(plan, plan_file)
+        print(f"Wrote crop plan for {len(plan['images'])} images to {plan_file}")
+
+    for (width, height), count in bucket_crop_plan.bucket_counts(plan).items():
+        print(f"  {width}x{height}: {count} images")
+    print(f"Average cropped area: {plan['mean_cropped_fraction']:.2%}")
+
+    if not args.plan_only:
+        print('Cropping images...')
+        bucket_crop_plan.apply_plan(plan, args.workers)
+    print('Done')
+
 def main():
     parser = argparse.ArgumentParser(description='Sort images and crop them based on aspect ratio')
     parser.add_argument('input_dir', type=str, help='Path to the directory containing images')
     parser.add_argument('output_dir', type=str, help='Path to the directory to save the cropped images')
-    parser.add_argument('batch_size', type=int, help='Size of the batches to create')
+    parser.add_argument('batch_size', type=int, nargs='?', help='Size of the batches to create (not used with --resolution)')
     parser.add_argument('--use_original_name', action='store_true', help='Whether to use original file names for the saved images')
+    image_probe.add_cache_arguments(parser)
+    buckets = parser.add_argument_group('bucket crop plan', 'Crop every image for the aspect ratio bucket training will put it in, instead of batch groups')
+    buckets.add_argument('--resolution', type=str, default=None, help='Training resolution, "size" or "width,height"')
+    buckets.add_argument('--min_bucket_reso', type=int, default=256, help='Minimum bucket resolution')
+    buckets.add_argument('--max_bucket_reso', type=int, default=1024, help='Maximum bucket resolution')
+    buckets.add_argument('--bucket_reso_steps', type=int, default=64, help='Steps of the bucket resolution')
+    buckets.add_argument('--plan_file', type=str, default=None, help='Where to write (or read, with --apply_plan) the JSON crop plan (default: <output_dir>/crop_plan.json)')
+    buckets.add_argument('--plan_only', action='store_true', help='Only write the crop plan, do not crop the images')
+    buckets.add_argument('--apply_plan', action='store_true', help='Apply an existing crop plan from --plan_file instead of planning again')
+    buckets.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: CPU count)')
 
     args = parser.parse_args()
 
+    if args.resolution is not None or args.apply_plan:
+        crop_to_buckets(args)
+        return
+    if args.batch_size is None:
+        parser.error('batch_size is required unless --resolution or --apply_plan is given')
+
     print(f"Sorting images by aspect ratio in {args.input_dir}...")
     if not os.path.exists(args.input_dir):
         print(f"Error: Input directory does not exist: {args.input_dir}")
@@ -238,7 +286,7 @@ def main():
             print(f"Error: Failed to create output directory: {args.output_dir}")
             return
 
-    sorted_images = sort_images_by_aspect_ratio(args.input_dir)
+    sorted_images = sort_images_by_aspect_ratio(args.input_dir, image_probe.cache_from_args(args))
     total_images = len(sorted_images)
     print(f'Total images: {total_images}')
 
@@ -0,0 +1,261 @@
+"""
+On-disk cache of `fine-tuned - base` weight deltas, shared by the extraction tools.
+
+A cache entry is keyed by the content hashes of both checkpoints plus a namespace (the key space
+the deltas are stored under, e.g. raw state-dict keys or diffusers LoRA module names). It holds:
+
+  <base hash>_<ft hash>_<namespace>.safetensors   per-layer fp32 deltas (all-zero deltas are not stored)
+  <base hash>_<ft hash>_<namespace>.index.json    shape, max-abs and Frobenius norm of every layer
+                                                  (and, if the writer was given it, torch.allclose(base, ft))
+
+Readers memory-map the safetensors file and can decide whether a layer is identical from the index
+alone, so repeated extraction runs over the same model pair never reload either checkpoint.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import torch
+import safetensors
+
+from safetensors_writer import SafetensorsStreamWriter
+
+CACHE_VERSION = 1
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def file_sha256(path, memo_path=None):
+    """sha256 of a file. With memo_path, results are remembered per (path, size, mtime) so unchanged checkpoints are hashed once."""
+    real_path = os.path.realpath(path)
+    st = os.stat(real_path)
+    memo = {}
+    if memo_path and os.path.exists(memo_path):
+        try:
+            with open(memo_path, "r", encoding="utf-8") as f:
+                memo = json.load(f)
+        except (OSError, ValueError):
+            memo = {}
+    entry = memo.get(real_path)
+    if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+        return entry["sha256"]
+
+    digest = hashlib.sha256()
+    with open(real_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    sha = digest.hexdigest()
+
+    if memo_path:
+        memo[real_path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha}
+        write_json_atomic(memo_path, memo)
+    return sha
+
+
+def open_state_dict(path):
+    """State dict for a checkpoint. .safetensors files are opened lazily (header only); others are loaded with torch.load."""
+    if path.endswith(".safetensors"):
+        return _SafetensorsView(path)
+    raw = torch.load(path, map_location="cpu")
+    return raw.get("state_dict", raw) if not isinstance(raw, OrderedDict) and hasattr(raw, "get") else raw
+
+
+class _SafetensorsView:
+    def __init__(self, path):
+        self._handle = safetensors.safe_open(path, framework="pt", device="cpu")
+        self._keys = list(self._handle.keys())
+        self._key_set = set(self._keys)
+
+    def __contains__(self, key):
+        return key in self._key_set
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def __getitem__(self, key):
+        return self._handle.get_tensor(key)
+
+
+class DeltaCache:
+    """Delta cache entry for one (base, fine-tuned, namespace) triple inside cache_dir."""
+
+    def __init__(self, cache_dir, base_model_path, ft_model_path, namespace="state_dict"):
+        os.makedirs(cache_dir, exist_ok=True)
+        memo_path = os.path.join(cache_dir, "hashes.json")
+        self.base_model_path = base_model_path
+        self.ft_model_path = ft_model_path
+        self.namespace = namespace
+        self.base_sha256 = file_sha256(base_model_path, memo_path)
+        self.ft_sha256 = file_sha256(ft_model_path, memo_path)
+        stem = f"{self.base_sha256[:16]}_{self.ft_sha256[:16]}_{namespace}"
+        self.data_path = os.path.join(cache_dir, stem + ".safetensors")
+        self.index_path = os.path.join(cache_dir, stem + ".index.json")
+        self.index = None
+        self._handle = None
+
+    @property
+    def exists(self):
+        if not (os.path.exists(self.data_path) and os.path.exists(self.index_path)):
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("version") == CACHE_VERSION
+        except (OSError, ValueError):
+            return False
+
+    @property
+    def records_allclose(self):
+        """True if the entry exists and every delta layer has its allclose flag. Reads the index only."""
+        if not self.exists:
+            return False
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            layers = json.load(f)["layers"]
+        return all("allclose" in entry for entry in layers.values() if entry["kind"] == "delta")
+
+    def open(self):
+        """Load the index and memory-map the delta file. Returns self."""
+        if self.index is None:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+            self._handle = safetensors.safe_open(self.data_path, framework="pt", device="cpu")
+        return self
+
+    # --- Reading ---
+    @property
+    def layers(self):
+        return self.open().index["layers"]
+
+    def keys(self, kind="delta"):
+        return [k for k, v in self.layers.items() if kind is None or v["kind"] == kind]
+
+    def __contains__(self, key):
+        return key in self.layers
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def shape(self, key):
+        return tuple(self.layers[key]["shape"])
+
+    def max_abs(self, key):
+        return self.layers[key]["max_abs"]
+
+    def fro_norm(self, key):
+        return self.layers[key]["fro"]
+
+    def is_identical(self, key, atol=0.0):
+        """True when every element of the delta is within atol of zero (same as torch.allclose(delta, 0, atol=atol))."""
+        return self.layers[key]["kind"] == "delta" and self.max_abs(key) <= atol
+
+    def allclose(self, key):
+        """torch.allclose(base, ft) as recorded when the layer was written, or None if it was not recorded."""
+        return self.layers[key].get("allclose")
+
+    def get(self, key):
+        """The stored tensor: the fp32 delta for 'delta' layers, the fine-tuned tensor for 'ft_only' keys."""
+        entry = self.layers[key]
+        if not entry["stored"]:
+            return torch.zeros(entry["shape"], dtype=torch.float32)
+        return self._handle.get_tensor(key)
+
+    __getitem__ = get
+
+    # --- Writing ---
+    def writer(self, **extra_index):
+        """Incremental writer; the entry only becomes visible once the writer is closed."""
+        return DeltaCacheWriter(self, extra_index)
+
+    def build_from_state_dicts(self, base_sd, ft_sd, keys=None, progress=None):
+        """Fill the cache with `ft - base` for every common floating-point key (or `keys`), plus keys only present in ft_sd.
+
+        Mirrors extract_model_difference: keys with mismatched shapes or non-float dtypes are recorded as skipped,
+        keys only in the base model are listed in the index but not stored.
+        """
+        base_keys, ft_keys = list(base_sd), list(ft_sd)
+        base_key_set, ft_key_set = set(base_keys), set(ft_keys)
+        keys = [k for k in ft_keys if k in base_key_set] if keys is None else list(keys)
+        only_in_ft = [k for k in ft_keys if k not in base_key_set]
+        only_in_base = [k for k in base_keys if k not in ft_key_set]
+        skipped = {}
+        with self.writer(only_in_base=only_in_base, skipped=skipped) as writer:
+            for key in (progress(keys) if progress else keys):
+                base_tensor, ft_tensor = base_sd[key], ft_sd[key]
+                if not (base_tensor.is_floating_point() and ft_tensor.is_floating_point()):
+                    skipped[key] = "non_float"
+                elif base_tensor.shape != ft_tensor.shape:
+                    skipped[key] = "shape_mismatch"
+                else:
+                    writer.add(key, ft_tensor.to(torch.float32) - base_tensor.to(torch.float32))
+            for key in only_in_ft:
+                writer.add(key, ft_sd[key], kind="ft_only")
+        return self.open()
+
+    def build(self, progress=None):
+        """Build the cache straight from the two checkpoint paths, reading one layer pair at a time for .safetensors inputs."""
+        return self.build_from_state_dicts(open_state_dict(self.base_model_path), open_state_dict(self.ft_model_path), progress=progress)
+
+    def open_or_build(self, progress=None):
+        return self.open() if self.exists else self.build(progress=progress)
+
+
+class DeltaCacheWriter:
+    """Writes one delta cache entry: tensors are streamed to disk, the index is written on close()."""
+
+    def __init__(self, cache, extra_index):
+        self.cache = cache
+        self.extra_index = extra_index
+        self.layers = OrderedDict()
+        self.stream = SafetensorsStreamWriter(cache.data_path)
+
+    def add(self, key, tensor, kind="delta", allclose=None):
+        tensor = tensor.detach().cpu()
+        if kind == "delta":
+            tensor = tensor.to(torch.float32)
+        stats_source = tensor.to(torch.float32) if tensor.is_floating_point() else tensor.to(torch.float64)
+        max_abs = float(stats_source.abs().max()) if stats_source.numel() else 0.0
+        fro = float(torch.linalg.vector_norm(stats_source)) if stats_source.numel() else 0.0
+        stored = kind != "delta" or max_abs > 0.0
+        self.layers[key] = {"kind": kind, "shape": list(tensor.shape), "max_abs": max_abs, "fro": fro, "stored": stored}
+        if allclose is not None:
+            self.layers[key]["allclose"] = bool(allclose)
+        if stored:
+            self.stream.add(key, tensor)
+
+    def close(self):
+        # Unmap an older entry before it is replaced: Windows cannot replace a file that is still mapped
+        self.cache.index, self.cache._handle = None, None
+        self.stream.close({"base_sha256": self.cache.base_sha256, "ft_sha256": self.cache.ft_sha256, "namespace": self.cache.namespace})
+        index = {
+            "version": CACHE_VERSION, "namespace": self.cache.namespace,
+            "base": {"path": os.path.abspath(self.cache.base_model_path), "sha256": self.cache.base_sha256},
+            "ft": {"path": os.path.abspath(self.cache.ft_model_path), "sha256": self.cache.ft_sha256},
+            "layers": self.layers, **self.extra_index,
+        }
+        write_json_atomic(self.cache.index_path, index)
+
+    def abort(self):
+        self.stream.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
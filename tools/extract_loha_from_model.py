@@ -3,7 +3,7 @@ import os
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from safetensors.torch import save_file, load_file
+from safetensors.torch import load_file
 import safetensors
 from tqdm import tqdm
 import math
@@ -14,10 +14,16 @@ import sys
 import glob
 import traceback
 import re
+import queue
+import time
+import threading
 from enum import Enum, auto
 
+from delta_cache import DeltaCache, open_state_dict
+from safetensors_writer import ResumableSafetensorsWriter
+
 # --- Global variables ---
-extracted_loha_state_dict_global = OrderedDict()
+output_writer_global = None # ResumableSafetensorsWriter: extracted tensors go to '<save_to>.partial' as layers finish
 layer_optimization_stats_global = []
 args_global = None 
 processed_layers_this_session_count_global = 0
@@ -32,6 +38,10 @@ outer_pbar_global = None
 main_loop_completed_scan_flag_global = False
 params_to_seed_optimizer_global = {}
 skipped_vae_layers_count = 0 # Ensure this is a global if accessed in main and other places
+worker_pool_global = None # Coordinator side of --workers
+worker_models_global = None # Worker side: (base, ft) LazyStateDicts when workers read layers themselves
+is_worker_process_global = False
+delta_cache_global = None # DeltaCache when --delta_cache_dir is used
 
 # --- Logging Helper ---
 class LogType(Enum):
@@ -39,6 +49,7 @@ class LogType(Enum):
     RANK_INCREASED_INFO = auto()
     INITIAL_PARAMS_LOADED = auto()
     INITIAL_PARAMS_KAIMING_NORMAL = auto()
+    INITIAL_PARAMS_SVD = auto()
     INSUFFICIENT_PROGRESS_STOP = auto()
     PROJECTION_STOP = auto()
     INSUFFICIENT_PROGRESS_LOG_ONLY = auto()
@@ -58,7 +69,7 @@ def log_layer_optimization_event(log_type: LogType, layer_name: str, **kwargs):
         return
     if not args_global.verbose_layer_debug:
         if log_type in [
-            LogType.INITIAL_PARAMS_LOADED, LogType.INITIAL_PARAMS_KAIMING_NORMAL,
+            LogType.INITIAL_PARAMS_LOADED, LogType.INITIAL_PARAMS_KAIMING_NORMAL, LogType.INITIAL_PARAMS_SVD,
             LogType.EMA_PROJECTION_SKIPPED_HISTORY, LogType.EMA_PROJECTION_INCONCLUSIVE_FALLBACK_RAW
         ]:
             return
@@ -78,6 +89,8 @@ def log_layer_optimization_event(log_type: LogType, layer_name: str, **kwargs):
         msg = f"    R:{kwargs['rank']} Initialized from existing LoHA."
     elif log_type == LogType.INITIAL_PARAMS_KAIMING_NORMAL:
         msg = f"    R:{kwargs['rank']} Initialized Kaiming/Normal (Attempt {kwargs.get('attempt', 1)})."
+    elif log_type == LogType.INITIAL_PARAMS_SVD:
+        msg = f"    R:{kwargs['rank']} Initialized from truncated SVD (Attempt {kwargs.get('attempt', 1)}, Init Loss: {kwargs['init_loss']:.2e})."
     elif log_type == LogType.INSUFFICIENT_PROGRESS_STOP:
         msg = f"Att {kwargs['attempt']}(R:{kwargs['rank']}): Stop - RawProg Low (Imprv: {kwargs['rel_imprv']:.1e} < {kwargs['min_ratio']:.1e}; Loss: {kwargs['current_loss']:.2e})."
     elif log_type == LogType.PROJECTION_STOP:
@@ -134,13 +147,38 @@ def _get_closest_ema_value_before_iter(target_iter: int, ema_history: list[tuple
             if best_match_iter is not None and target_iter - hist_iter > getattr(args_global, 'projection_sample_interval', 20) * 2: break
     return (best_match_iter, best_match_loss) if best_match_iter is not None else (ema_history[0] if ema_history else (None, None))
 
+def svd_init_loha_factors(delta_W_2d: torch.Tensor, rank: int, alpha: float) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """LoHA factors with (alpha/rank) * (w1_a@w1_b) * (w2_a@w2_b) close to the rank-`rank` SVD of delta_W_2d.
+
+    w1 carries the truncated SVD, singular values sqrt-split between w1_a and w1_b; w2 starts as a
+    near-constant matrix (small noise breaks the symmetry between its rank components). The overall
+    scale is split so both Hadamard operands have the same RMS. Returned in fp32 on delta_W_2d's device.
+    """
+    out_dim, in_dim = delta_W_2d.shape
+    target = delta_W_2d.float() * (rank / alpha if alpha else 1.0)
+    U, S, Vh = torch.linalg.svd(target, full_matrices=False)
+    q = min(rank, S.numel())
+    rms = (S[:q].pow(2).sum() / (out_dim * in_dim)).sqrt()
+    g = rms.sqrt().clamp_min(1e-8) # w1 product ~ target / g, w2 product ~ g
+    sqrt_s = (S[:q] / g).sqrt()
+    w1_a = torch.zeros(out_dim, rank, device=target.device)
+    w1_b = torch.empty(rank, in_dim, device=target.device).normal_(std=0.02)
+    w1_a[:, :q] = U[:, :q] * sqrt_s
+    w1_b[:q] = sqrt_s[:, None] * Vh[:q]
+    w2_scale = (g / rank).sqrt()
+    w2_a = w2_scale * (1 + 0.01 * torch.randn(out_dim, rank, device=target.device))
+    w2_b = w2_scale * (1 + 0.01 * torch.randn(rank, in_dim, device=target.device))
+    return w1_a, w1_b, w2_a, w2_b
+
 def initialize_loha_parameters(
     out_dim: int, current_rank: int, in_dim_effective_k_ops: int,
     device: str, dtype: torch.dtype, layer_name: str, attempt_idx: int,
     is_continuation_attempt: bool,
     existing_params_to_load: dict | None = None,
     warm_start_status: str | None = None,
-    prev_rank_for_warm_start: int | None = None
+    prev_rank_for_warm_start: int | None = None,
+    svd_init_target: torch.Tensor | None = None,
+    initial_alpha: float | None = None
 ):
     hada_w1_a_p = nn.Parameter(torch.empty(out_dim, current_rank, device=device, dtype=dtype))
     hada_w1_b_p = nn.Parameter(torch.empty(current_rank, in_dim_effective_k_ops, device=device, dtype=dtype))
@@ -172,6 +210,14 @@ def initialize_loha_parameters(
                 for p_slice in [hada_w1_b_p.data[prev_rank_for_warm_start:, :], hada_w2_b_p.data[prev_rank_for_warm_start:, :]]:
                     nn.init.normal_(p_slice, std=0.02)
             initialized_from_external_or_warm_start = True
+        if not initialized_from_external_or_warm_start and svd_init_target is not None:
+            svd_factors = svd_init_loha_factors(svd_init_target.reshape(out_dim, in_dim_effective_k_ops), current_rank, initial_alpha if initial_alpha is not None else current_rank)
+            for p, f in zip([hada_w1_a_p, hada_w1_b_p, hada_w2_a_p, hada_w2_b_p], svd_factors): p.data.copy_(f.to(device, dtype))
+            if args_global.verbose_layer_debug:
+                scale = (initial_alpha if initial_alpha is not None else current_rank) / current_rank
+                init_loss = F.mse_loss(scale * (svd_factors[0] @ svd_factors[1]) * (svd_factors[2] @ svd_factors[3]), svd_init_target.reshape(out_dim, in_dim_effective_k_ops).float()).item()
+                log_layer_optimization_event(LogType.INITIAL_PARAMS_SVD, layer_name, rank=current_rank, attempt=attempt_idx + 1, init_loss=init_loss)
+            initialized_from_external_or_warm_start = True
         if not initialized_from_external_or_warm_start:
             log_layer_optimization_event(LogType.INITIAL_PARAMS_KAIMING_NORMAL, layer_name, rank=current_rank, attempt=attempt_idx + 1)
             for p in [hada_w1_a_p, hada_w2_a_p]: nn.init.kaiming_uniform_(p.data, a=math.sqrt(5))
@@ -298,10 +344,6 @@ def get_module_shape_info_from_weight(weight_tensor: torch.Tensor):
     elif len(weight_tensor.shape) == 2: is_conv = False; out_dim, in_dim = weight_tensor.shape; return out_dim, in_dim, None, None, False
     return None
 
-def generate_intermediate_filename(base_save_path: str, num_total_completed_layers: int) -> str:
-    base, ext = os.path.splitext(base_save_path)
-    return f"{base}_resume_L{num_total_completed_layers}{ext}"
-
 def prepare_save_metadata(
     script_args: argparse.Namespace,
     output_filename: str, 
@@ -353,28 +395,25 @@ def prepare_save_metadata(
     }
     return sf_meta, json_meta
 
-def perform_graceful_save(output_path_to_save: str):
-    global extracted_loha_state_dict_global, layer_optimization_stats_global, args_global, \
+def perform_graceful_save(final: bool = False):
+    """Checkpoint '<save_to>.partial' (final=False) or finish it as args.save_to with its _extraction_metadata.json (final=True)."""
+    global output_writer_global, layer_optimization_stats_global, args_global, \
            processed_layers_this_session_count_global, save_attempted_on_interrupt, \
            skipped_identical_count_global, skipped_other_reason_count_global, keys_scanned_this_run_global, \
            all_completed_module_prefixes_ever_global, skipped_good_initial_loss_count_global
 
     total_processed_ever = len(all_completed_module_prefixes_ever_global)
-    if not extracted_loha_state_dict_global and not total_processed_ever:
-        print(f"No layers to save to {output_path_to_save}. Aborted.")
+    if output_writer_global is None or (not len(output_writer_global) and not total_processed_ever):
+        print(f"No layers to save to {args_global.save_to if args_global else 'output'}. Aborted.")
         return False
     if not args_global: 
         print("Error: Global args not set for saving metadata.")
         return False
 
-    save_dtype = {"fp16": torch.float16, "bf16": torch.bfloat16}.get(args_global.save_weights_dtype, torch.bfloat16)
-    final_sd = OrderedDict(
-        (k, v.to(save_dtype) if hasattr(v, 'is_floating_point') and v.is_floating_point() else v)
-        for k, v in extracted_loha_state_dict_global.items()
-    )
-    print(f"\nSaving LoHA for {total_processed_ever} modules ({processed_layers_this_session_count_global} this session) to {output_path_to_save}")
+    output_path_to_save = args_global.save_to if final else output_writer_global.partial_path
+    print(f"\n{'Saving' if final else 'Checkpointing'} LoHA for {total_processed_ever} modules ({processed_layers_this_session_count_global} this session) to {output_path_to_save}")
     sf_meta, json_meta = prepare_save_metadata(
-        script_args=args_global, output_filename=os.path.basename(output_path_to_save),
+        script_args=args_global, output_filename=os.path.basename(args_global.save_to),
         total_completed_modules=total_processed_ever,
         processed_this_run=processed_layers_this_session_count_global,
         skipped_identical_this_run=skipped_identical_count_global,
@@ -385,46 +424,41 @@ def perform_graceful_save(output_path_to_save: str):
         layer_opt_stats_this_run=layer_optimization_stats_global,
         is_interrupted_save=save_attempted_on_interrupt
     )
-    temp_sf_path, temp_json_path = None, None
+    temp_json_path = None
     try:
-        if output_path_to_save.endswith(".safetensors"):
-            temp_sf_path = output_path_to_save + ".part"
+        if not final:
+            # Tensors are already on disk; this only makes them durable and records what is complete.
+            output_writer_global.checkpoint(sf_meta)
+            print(f"Checkpointed: {output_path_to_save} ({len(output_writer_global)} tensors)")
+        elif output_path_to_save.endswith(".safetensors"):
             final_json_path = os.path.splitext(output_path_to_save)[0] + "_extraction_metadata.json"
             temp_json_path = final_json_path + ".part"
-            save_file(final_sd, temp_sf_path, metadata=sf_meta)
             with open(temp_json_path, 'w') as f: json.dump(json_meta, f, indent=4)
-            os.replace(temp_sf_path, output_path_to_save)
+            output_writer_global.close(sf_meta)
             os.replace(temp_json_path, final_json_path)
             print(f"Saved: {output_path_to_save} and {final_json_path}")
         else:
+            final_sd = OrderedDict((k, output_writer_global.get_tensor(k)) for k in output_writer_global.keys())
             torch.save({'state_dict': final_sd, '__metadata__': sf_meta, '__extended_metadata__': json_meta}, output_path_to_save)
+            output_writer_global.discard()
             print(f"Saved (basic .pt): {output_path_to_save}")
         return True
     except Exception as e:
         print(f"Error saving to {output_path_to_save}: {e}"); traceback.print_exc()
-        if temp_sf_path and os.path.exists(temp_sf_path):
-            try: os.remove(temp_sf_path)
-            except OSError: pass
         if temp_json_path and os.path.exists(temp_json_path):
             try: os.remove(temp_json_path)
             except OSError: pass
         return False
 
-def cleanup_intermediate_files(final_intended_path: str, for_resume_management: bool = False, keep_n: int = 0):
+def cleanup_intermediate_files(final_intended_path: str):
+    """Removes '_resume_L{count}' files written by older versions of this script."""
     output_dir = os.path.dirname(final_intended_path); base_name, save_ext = os.path.splitext(os.path.basename(final_intended_path))
     if not output_dir: output_dir = "."
     intermediate_pattern = os.path.join(output_dir, f"{base_name}_resume_L*{save_ext}")
-    files_to_consider = [{'path': fp, 'l_count': int(m.group(1))} for fp in glob.glob(intermediate_pattern) if (m := re.search(r'_resume_L(\d+)', os.path.basename(fp)))]
-    if not files_to_consider: return
+    files_to_delete = [{'path': fp, 'l_count': int(m.group(1))} for fp in glob.glob(intermediate_pattern) if (m := re.search(r'_resume_L(\d+)', os.path.basename(fp)))]
+    if not files_to_delete: return
     cleaned_count = 0
-    if for_resume_management:
-        if keep_n <= 0 or len(files_to_consider) <= keep_n: return
-        files_to_consider.sort(key=lambda x: x['l_count'])
-        files_to_delete = files_to_consider[:-keep_n]
-        if args_global and args_global.verbose: print(f"  Resume Manager: Found {len(files_to_consider)} files. Deleting {len(files_to_delete)} oldest to keep {keep_n}.")
-    else:
-        files_to_delete = files_to_consider
-        if args_global and args_global.verbose: print(f"  Cleaning ALL {len(files_to_delete)} intermediate files...")
+    if args_global and args_global.verbose: print(f"  Cleaning ALL {len(files_to_delete)} intermediate files...")
     for file_info in files_to_delete:
         try:
             os.remove(file_info['path'])
@@ -464,20 +498,33 @@ def find_best_resume_file(intended_final_path: str) -> tuple[str | None, int]:
     if best_file_path: print(f"  Selected '{os.path.basename(best_file_path)}' for resume (est. {max_completed_modules} modules).")
     return best_file_path, max_completed_modules
 
+def import_loha_tensors(writer: ResumableSafetensorsWriter, loaded_sd: dict, final_save_dtype_torch: torch.dtype, keep_prefixes: set | None = None) -> int:
+    """Copy tensors of a finished/legacy LoHA into the output writer, floating-point ones cast to the save dtype.
+    With keep_prefixes, only those modules (and biases) are taken."""
+    count = 0
+    for k, v in loaded_sd.items():
+        if keep_prefixes is None or ".".join(k.split('.')[:-1]) in keep_prefixes or k.endswith(".bias"):
+            writer.add(k, v.to(final_save_dtype_torch) if v.is_floating_point() else v)
+            count += 1
+    return count
+
 def handle_resume_or_continue_loha(
     current_args: argparse.Namespace,
-    extracted_sd_ref: OrderedDict,
     params_to_seed_opt_ref: dict,
     prev_completed_prefixes_ref: set,
     all_completed_prefixes_ref: set
-):
+) -> ResumableSafetensorsWriter:
+    """Opens the output writer for this run. Resumes '<save_to>.partial' when present; older '_resume_L' files and an
+    existing final output are still accepted and imported into a fresh partial file."""
+    final_save_dtype_torch = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}.get(current_args.save_weights_dtype, torch.bfloat16)
     if current_args.continue_training_from_loha:
         print(f"\nMode: Continue/Refine from LoHA: {current_args.continue_training_from_loha}")
         if not os.path.exists(current_args.continue_training_from_loha):
             print(f"  Error: LoHA not found: {current_args.continue_training_from_loha}"); sys.exit(1)
+        writer = ResumableSafetensorsWriter(current_args.save_to, resume=False)
         try:
             loaded_sd = load_file(current_args.continue_training_from_loha, device='cpu')
-            extracted_sd_ref.update(loaded_sd) 
+            import_loha_tensors(writer, loaded_sd, final_save_dtype_torch)
             module_prefixes = {".".join(k.split('.')[:-1]) for k in loaded_sd if ".hada_w1_a" in k}
             loaded_count = 0
             for prefix in module_prefixes:
@@ -488,54 +535,56 @@ def handle_resume_or_continue_loha(
                     loaded_count += 1
                 elif current_args.verbose:
                     tqdm.write(f"  Info: Module {prefix} from LoHA missing components. Will treat as new if encountered.")
-            print(f"  Loaded {len(extracted_sd_ref)} tensors. Identified {loaded_count} full LoHA modules for re-optimization.")
+            print(f"  Loaded {len(writer)} tensors. Identified {loaded_count} full LoHA modules for re-optimization.")
             del loaded_sd
             if os.path.exists(current_args.save_to) and not current_args.overwrite:
                 print(f"  Warning: Output {current_args.save_to} exists and may be overwritten.")
             elif os.path.exists(current_args.save_to) and current_args.overwrite:
                 print(f"  Info: Output {current_args.save_to} will be overwritten due to --overwrite.")
         except Exception as e:
-            print(f"  Error loading LoHA for continuation: {e}."); traceback.print_exc(); sys.exit(1)
-    elif not current_args.overwrite:
-        print(f"\nMode: Standard extraction. Checking resume states for: {current_args.save_to}")
-        resume_file, num_modules_resume = find_best_resume_file(current_args.save_to) 
-        if resume_file:
-            print(f"  Attempting resume from: {resume_file} (est. {num_modules_resume} modules).")
-            try:
-                completed_in_file = set()
-                with safetensors.safe_open(resume_file, framework="pt", device="cpu") as f:
-                    meta = f.metadata()
-                    if meta and "ss_completed_loha_modules" in meta:
-                        completed_in_file = set(json.loads(meta["ss_completed_loha_modules"]))
-                loaded_sd_resume = load_file(resume_file, device='cpu')
-                if not completed_in_file and loaded_sd_resume: 
-                    completed_in_file = {".".join(k.split('.')[:-1]) for k in loaded_sd_resume if k.endswith(".hada_w1_a")}
-                res_tensor_count = 0
-                if completed_in_file:
-                    for k, v in loaded_sd_resume.items():
-                        module_prefix_of_key = ".".join(k.split('.')[:-1])
-                        if module_prefix_of_key in completed_in_file or k.endswith(".bias"): 
-                            extracted_sd_ref[k] = v
-                            res_tensor_count += 1
-                    prev_completed_prefixes_ref.update(completed_in_file)
-                    all_completed_prefixes_ref.update(completed_in_file) 
-                    print(f"  Loaded {len(prev_completed_prefixes_ref)} module prefixes, {res_tensor_count} tensors for resume.")
-                elif loaded_sd_resume: 
-                    extracted_sd_ref.update(loaded_sd_resume)
-                    inferred_completed = {".".join(k.split('.')[:-1]) for k in loaded_sd_resume if k.endswith(".hada_w1_a")}
-                    prev_completed_prefixes_ref.update(inferred_completed)
-                    all_completed_prefixes_ref.update(inferred_completed)
-                    print(f"  Loaded all {len(loaded_sd_resume)} tensors from resume file (metadata for completed modules missing/empty, inferred {len(inferred_completed)}).")
-                del loaded_sd_resume
-            except Exception as e:
-                print(f"  Error loading resume file '{resume_file}': {e}. Starting fresh.")
-                extracted_sd_ref.clear()
-                prev_completed_prefixes_ref.clear()
-                all_completed_prefixes_ref.clear()
-        else:
-            print("  No suitable existing LoHA to resume from. Starting fresh.")
-    elif current_args.overwrite:
+            print(f"  Error loading LoHA for continuation: {e}."); traceback.print_exc(); writer.discard(); sys.exit(1)
+        return writer
+    if current_args.overwrite:
         print(f"\nMode: Standard extraction with --overwrite. Final output {current_args.save_to} will be overwritten.")
+        return ResumableSafetensorsWriter(current_args.save_to, resume=False)
+
+    print(f"\nMode: Standard extraction. Checking resume states for: {current_args.save_to}")
+    writer = ResumableSafetensorsWriter(current_args.save_to, resume=True)
+    if writer.resumed:
+        completed_in_file = set(json.loads(writer.metadata.get("ss_completed_loha_modules", "[]")))
+        prev_completed_prefixes_ref.update(completed_in_file)
+        all_completed_prefixes_ref.update(completed_in_file)
+        print(f"  Resuming {writer.partial_path}: {len(completed_in_file)} module prefixes, {len(writer)} tensors.")
+        return writer
+    resume_file, num_modules_resume = find_best_resume_file(current_args.save_to) 
+    if not resume_file:
+        print("  No suitable existing LoHA to resume from. Starting fresh.")
+        return writer
+    print(f"  Attempting resume from: {resume_file} (est. {num_modules_resume} modules).")
+    try:
+        completed_in_file = set()
+        with safetensors.safe_open(resume_file, framework="pt", device="cpu") as f:
+            meta = f.metadata()
+            if meta and "ss_completed_loha_modules" in meta:
+                completed_in_file = set(json.loads(meta["ss_completed_loha_modules"]))
+        loaded_sd_resume = load_file(resume_file, device='cpu')
+        if not completed_in_file and loaded_sd_resume: 
+            completed_in_file = {".".join(k.split('.')[:-1]) for k in loaded_sd_resume if k.endswith(".hada_w1_a")}
+            res_tensor_count = import_loha_tensors(writer, loaded_sd_resume, final_save_dtype_torch)
+            print(f"  Loaded all {res_tensor_count} tensors from resume file (metadata for completed modules missing/empty, inferred {len(completed_in_file)}).")
+        else:
+            res_tensor_count = import_loha_tensors(writer, loaded_sd_resume, final_save_dtype_torch, completed_in_file)
+            print(f"  Loaded {len(completed_in_file)} module prefixes, {res_tensor_count} tensors for resume.")
+        prev_completed_prefixes_ref.update(completed_in_file)
+        all_completed_prefixes_ref.update(completed_in_file)
+        del loaded_sd_resume
+    except Exception as e:
+        print(f"  Error loading resume file '{resume_file}': {e}. Starting fresh.")
+        writer.discard()
+        writer = ResumableSafetensorsWriter(current_args.save_to, resume=False)
+        prev_completed_prefixes_ref.clear()
+        all_completed_prefixes_ref.clear()
+    return writer
 
 def print_script_summary(
     layer_stats: list[dict],
@@ -587,8 +636,7 @@ def setup_and_print_configuration(current_args: argparse.Namespace):
     if current_args.target_loss: print(f"Target Loss: {current_args.target_loss:.2e} (min iters: {current_args.min_iterations} for target check)")
     else: print(f"No Target Loss. Min iters for any early stop: {current_args.min_iterations}.")
     print(f"Max Iters/Layer: {current_args.max_iterations}, Max Rank Retries: {current_args.max_rank_retries}, Rank Incr Factor: {current_args.rank_increase_factor}")
-    if current_args.save_every_n_layers > 0: print(f"Save every {current_args.save_every_n_layers} processed layers enabled.")
-    if current_args.keep_n_resume_files > 0: print(f"Keeping the {current_args.keep_n_resume_files} most recent resume files.")
+    if current_args.save_every_n_layers > 0: print(f"Checkpoint every {current_args.save_every_n_layers} processed layers enabled.")
     if current_args.progress_check_interval > 0:
         first_eval_iter = current_args.progress_check_start_iter + current_args.progress_check_interval
         print(f"Progress Check: Enabled. Interval: {current_args.progress_check_interval} iters, Min Rel. Loss Decrease: {current_args.min_progress_loss_ratio:.1e}.")
@@ -598,7 +646,88 @@ def setup_and_print_configuration(current_args: argparse.Namespace):
     else: print("Progress Check: Disabled (and Projection Check disabled).")
     return current_args
 
-def load_models(base_model_path: str, ft_model_path: str) -> tuple[OrderedDict, OrderedDict]:
+class LazyStateDict:
+    """Read-only, dict-like view of a .safetensors checkpoint. Only the header is parsed up front; tensors are read on access via safe_open."""
+    def __init__(self, path: str):
+        self.path = path
+        self._handle = safetensors.safe_open(path, framework="pt", device="cpu")
+        self._keys = list(self._handle.keys())
+        self._key_set = set(self._keys)
+
+    def __contains__(self, key): return key in self._key_set
+    def __iter__(self): return iter(self._keys)
+    def __len__(self): return len(self._keys)
+    def keys(self): return list(self._keys)
+
+    def __getitem__(self, key: str) -> torch.Tensor:
+        if key not in self._key_set: raise KeyError(key)
+        return self._handle.get_tensor(key)
+
+    def shape(self, key: str) -> tuple:
+        return tuple(self._handle.get_slice(key).get_shape())
+
+def tensor_shape(state_dict, key: str) -> tuple:
+    return state_dict.shape(key) if isinstance(state_dict, LazyStateDict) else tuple(state_dict[key].shape)
+
+def compute_delta_fp32(base_model_sd, ft_model_sd, key: str) -> torch.Tensor:
+    return ft_model_sd[key].to(dtype=torch.float32) - base_model_sd[key].to(dtype=torch.float32)
+
+class DeltaPrefetcher:
+    """Computes fp32 deltas for `keys` on a background thread, in order, at most `window` layers ahead of the consumer.
+
+    The thread opens its own safe_open handles. The consumer must request keys in the same order;
+    keys it skips (e.g. once --max_layers is hit) are dropped from the queue when a later key is requested.
+    """
+    _DONE = object()
+
+    def __init__(self, base_model_path: str, ft_model_path: str, keys: list[str], window: int):
+        self._keys = set(keys)
+        self._queue = queue.Queue(maxsize=max(1, window))
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(base_model_path, ft_model_path, list(keys)), name="loha-delta-prefetch", daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1); return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, base_model_path: str, ft_model_path: str, keys: list[str]):
+        try:
+            base_sd, ft_sd = LazyStateDict(base_model_path), LazyStateDict(ft_model_path)
+            for key in keys:
+                if not self._put((key, compute_delta_fp32(base_sd, ft_sd, key), None)): return
+        except Exception as e:
+            self._put((None, None, e))
+        self._put(self._DONE)
+
+    def __contains__(self, key): return key in self._keys
+
+    def get(self, key: str) -> torch.Tensor:
+        while True:
+            item = self._queue.get()
+            if item is self._DONE: raise KeyError(f"Prefetcher finished before '{key}' was read.")
+            item_key, delta, error = item
+            if error is not None: raise error
+            if item_key == key: return delta
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join(timeout=5)
+
+def load_models(base_model_path: str, ft_model_path: str, stream: bool = False) -> tuple:
+    if stream:
+        if base_model_path.endswith(".safetensors") and ft_model_path.endswith(".safetensors"):
+            print(f"\nOpening base model (streaming): {base_model_path}")
+            print(f"Opening fine-tuned model (streaming): {ft_model_path}")
+            try:
+                return LazyStateDict(base_model_path), LazyStateDict(ft_model_path)
+            except Exception as e:
+                print(f"Error opening models for streaming: {e}"); traceback.print_exc(); sys.exit(1)
+        print("Warning: --stream_models needs two .safetensors files. Falling back to full load.")
     print(f"\nLoading base model: {base_model_path}")
     try:
         base_sd_raw = load_file(base_model_path, device='cpu') if base_model_path.endswith(".safetensors") else torch.load(base_model_path, map_location='cpu')
@@ -613,6 +742,26 @@ def load_models(base_model_path: str, ft_model_path: str) -> tuple[OrderedDict,
         print(f"Error loading fine-tuned model: {e}"); traceback.print_exc(); sys.exit(1)
     return base_model_sd, ft_model_sd
 
+def loha_prefix_for_module(original_module_path: str) -> str:
+    if "model.diffusion_model." in original_module_path: return "lora_unet_" + original_module_path.split("model.diffusion_model.")[-1].replace(".", "_")
+    if "first_stage_model." in original_module_path: return "lora_vae_" + original_module_path.split("first_stage_model.")[-1].replace(".", "_")
+    return "lora_" + original_module_path.replace(".", "_")
+
+def is_vae_module(original_module_path: str) -> bool:
+    return any(vp in original_module_path for vp in [".encoder.", ".decoder.", ".quant_conv."]) and any(tp in original_module_path for tp in ["first_stage_model.", "autoencoder."])
+
+def compute_retry_rank_and_alpha(rank_base: int, initial_rank: int, initial_alpha: float, rank_increase_factor: float) -> tuple[int, float]:
+    new_rank = max(rank_base + 1, math.ceil(rank_base * rank_increase_factor))
+    alpha_to_rank_ratio = initial_alpha / float(initial_rank) if initial_rank > 0 else 1.0
+    return new_rank, alpha_to_rank_ratio * float(new_rank)
+
+def resolve_warm_start(best_result: dict, new_rank: int) -> tuple[str | None, dict | None, int | None]:
+    prev_rank = best_result.get('final_rank_used')
+    if 'hada_w1_a' not in best_result: return 'no_prior_params_for_warm_start', None, prev_rank
+    if args_global.no_warm_start: return 'skipped_no_warm_start_arg', None, prev_rank
+    if prev_rank < new_rank: return 'applied', best_result, prev_rank
+    return 'skipped_cannot_warm_start', None, prev_rank
+
 def optimize_loha_for_layer(
     layer_name: str, delta_W_target: torch.Tensor, out_dim: int, in_dim_effective: int,
     k_h: int, k_w: int, initial_rank_for_layer: int, initial_alpha_for_layer: float,
@@ -654,17 +803,8 @@ def optimize_loha_for_layer(
         prev_rank_for_warm_start_log = None
         if attempt_idx > 0:
             log_layer_optimization_event(LogType.RANK_RETRY_STARTING, layer_name, prev_rank=rank_base_for_next_increase, prev_best_loss=best_result_so_far.get('final_loss', float('inf')))
-            new_rank_float = rank_base_for_next_increase * rank_increase_factor
-            increased_rank = math.ceil(new_rank_float)
-            current_rank_for_this_attempt = max(rank_base_for_next_increase + 1, increased_rank)
-            original_alpha_to_rank_ratio = initial_alpha_for_layer / float(initial_rank_for_layer) if initial_rank_for_layer > 0 else 1.0
-            alpha_init_for_this_attempt = original_alpha_to_rank_ratio * float(current_rank_for_this_attempt)
-            prev_rank_for_warm_start_log = best_result_so_far.get('final_rank_used')
-            if 'hada_w1_a' in best_result_so_far and not args_global.no_warm_start:
-                if prev_rank_for_warm_start_log < current_rank_for_this_attempt: current_warm_start_status = 'applied'; params_for_initialization = best_result_so_far
-                else: current_warm_start_status = 'skipped_cannot_warm_start'
-            elif args_global.no_warm_start and 'hada_w1_a' in best_result_so_far: current_warm_start_status = 'skipped_no_warm_start_arg'
-            elif 'hada_w1_a' not in best_result_so_far: current_warm_start_status = 'no_prior_params_for_warm_start'
+            current_rank_for_this_attempt, alpha_init_for_this_attempt = compute_retry_rank_and_alpha(rank_base_for_next_increase, initial_rank_for_layer, initial_alpha_for_layer, rank_increase_factor)
+            current_warm_start_status, params_for_initialization, prev_rank_for_warm_start_log = resolve_warm_start(best_result_so_far, current_rank_for_this_attempt)
             log_layer_optimization_event(LogType.RANK_INCREASED_INFO, layer_name, new_rank=current_rank_for_this_attempt, new_alpha=alpha_init_for_this_attempt, warm_start_status=current_warm_start_status, prev_rank_for_warm_start=prev_rank_for_warm_start_log)
         elif is_initial_call_with_existing_params:
             params_for_initialization = existing_loha_layer_parameters
@@ -674,14 +814,15 @@ def optimize_loha_for_layer(
             out_dim, current_rank_for_this_attempt, (in_dim_effective * k_ops), device, dtype, layer_name, attempt_idx,
             (attempt_idx == 0 and is_initial_call_with_existing_params),
             params_for_initialization, current_warm_start_status,
-            prev_rank_for_warm_start_log if current_warm_start_status == 'applied' else None
+            prev_rank_for_warm_start_log if current_warm_start_status == 'applied' else None,
+            delta_W_target if args_global.init_method == 'svd' else None, alpha_init_for_this_attempt
         )
         alpha_param = nn.Parameter(torch.tensor(alpha_init_for_this_attempt, device=device, dtype=dtype))
         params_to_optimize = [hada_w1_a_p, hada_w1_b_p, hada_w2_a_p, hada_w2_b_p, alpha_param]
         optimizer = torch.optim.AdamW(params_to_optimize, lr=lr, weight_decay=weight_decay)
         scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=max(10, int(max_iterations * 0.05)), factor=0.5, min_lr=max(1e-7, lr * 0.001))
         iter_pbar_desc = f"Opt Att {attempt_idx+1}/{max_rank_retries+1} (R:{current_rank_for_this_attempt}){' [LastRank]' if is_last_rank_attempt else ''}: {layer_name}"
-        iter_pbar = tqdm(range(max_iterations), desc=iter_pbar_desc, leave=False, dynamic_ncols=True, position=1, mininterval=0.5)
+        iter_pbar = tqdm(range(max_iterations), desc=iter_pbar_desc, leave=False, dynamic_ncols=True, position=1, mininterval=0.5, disable=is_worker_process_global)
         
         current_attempt_final_loss = float('inf'); current_attempt_stopped_early_by_loss = False
         current_attempt_insufficient_progress = False; current_attempt_stopped_by_projection = False
@@ -825,6 +966,445 @@ def optimize_loha_for_layer(
     return best_result_so_far
 
 
+class BatchedAdamW:
+    """AdamW over stacked per-layer tensors (dim 0 = layer) with one learning rate per layer.
+
+    Mirrors torch.optim.AdamW (betas=(0.9, 0.999), eps=1e-8, no amsgrad) so a batch of layers
+    steps exactly like the same layers would with their own optimizers.
+    """
+    def __init__(self, params: list[torch.Tensor], lr: float, weight_decay: float, betas: tuple[float, float] = (0.9, 0.999), eps: float = 1e-8):
+        self.params = params
+        self.lr = torch.full((params[0].shape[0],), lr, device=params[0].device, dtype=params[0].dtype)
+        self.weight_decay, self.betas, self.eps = weight_decay, betas, eps
+        self.exp_avg = [torch.zeros_like(p) for p in params]
+        self.exp_avg_sq = [torch.zeros_like(p) for p in params]
+        self.step_count = 0
+
+    def zero_grad(self):
+        for p in self.params: p.grad = None
+
+    @torch.no_grad()
+    def step(self, active_mask: torch.Tensor):
+        self.step_count += 1
+        beta1, beta2 = self.betas
+        bias_correction1 = 1 - beta1 ** self.step_count
+        bias_correction2_sqrt = math.sqrt(1 - beta2 ** self.step_count)
+        lr = self.lr * active_mask
+        for p, exp_avg, exp_avg_sq in zip(self.params, self.exp_avg, self.exp_avg_sq):
+            if p.grad is None: continue
+            lr_b = lr.view((-1,) + (1,) * (p.dim() - 1))
+            p.mul_(1 - lr_b * self.weight_decay)
+            exp_avg.lerp_(p.grad, 1 - beta1)
+            exp_avg_sq.mul_(beta2).addcmul_(p.grad, p.grad, value=1 - beta2)
+            denom = (exp_avg_sq.sqrt() / bias_correction2_sqrt).add_(self.eps)
+            p.sub_((lr_b / bias_correction1) * exp_avg / denom)
+
+    def select(self, keep: torch.Tensor):
+        """Drop finished layers from the batch. `keep` indexes the rows that stay."""
+        self.params = [p.detach()[keep].requires_grad_(True) for p in self.params]
+        self.exp_avg = [t[keep] for t in self.exp_avg]
+        self.exp_avg_sq = [t[keep] for t in self.exp_avg_sq]
+        self.lr = self.lr[keep]
+
+class BatchedReduceLROnPlateau:
+    """Per-layer ReduceLROnPlateau ('min' mode, rel threshold 1e-4, no cooldown) for BatchedAdamW."""
+    def __init__(self, optimizer: BatchedAdamW, patience: int, factor: float, min_lr: float, threshold: float = 1e-4, eps: float = 1e-8):
+        self.optimizer = optimizer
+        self.patience, self.factor, self.min_lr, self.threshold, self.eps = patience, factor, min_lr, threshold, eps
+        num_rows = optimizer.lr.shape[0]
+        self.best = [float('inf')] * num_rows
+        self.num_bad_epochs = [0] * num_rows
+
+    def step(self, losses: list[float], active: list[bool]):
+        lrs = None
+        for row, loss in enumerate(losses):
+            if not active[row]: continue
+            if loss < self.best[row] * (1.0 - self.threshold): self.best[row], self.num_bad_epochs[row] = loss, 0
+            else: self.num_bad_epochs[row] += 1
+            if self.num_bad_epochs[row] > self.patience:
+                if lrs is None: lrs = self.optimizer.lr.tolist()
+                new_lr = max(lrs[row] * self.factor, self.min_lr)
+                if lrs[row] - new_lr > self.eps: lrs[row] = new_lr
+                self.num_bad_epochs[row] = 0
+        if lrs is not None:
+            self.optimizer.lr = torch.tensor(lrs, device=self.optimizer.lr.device, dtype=self.optimizer.lr.dtype)
+
+    def select(self, keep_rows: list[int]):
+        self.best = [self.best[r] for r in keep_rows]
+        self.num_bad_epochs = [self.num_bad_epochs[r] for r in keep_rows]
+
+def optimize_loha_batch(
+    layer_names: list[str], delta_W_targets: list[torch.Tensor], out_dim: int, in_dim_effective: int,
+    k_h: int, k_w: int, initial_rank_for_layer: int, initial_alpha_for_layer: float,
+    lr: float = 1e-3, max_iterations: int = 1000, min_iterations: int = 100,
+    target_loss: float = None, weight_decay: float = 1e-4,
+    device: str = 'cuda', dtype: torch.dtype = torch.float32,
+    is_conv: bool = True, max_rank_retries: int = 0, rank_increase_factor: float = 1.25
+) -> list[dict]:
+    """Batched counterpart of optimize_loha_for_layer for layers sharing shape, rank and alpha.
+
+    All layers of one rank attempt are stacked and stepped together. Each layer keeps its own
+    learning-rate schedule, early-stop checks and EMA projection; layers that stop are masked out
+    of the update and periodically compacted away. Layers that still need a rank retry move on
+    together, since they share the same next rank. Returns one result dict per layer, in the same
+    format optimize_loha_for_layer returns.
+    """
+    num_layers = len(layer_names)
+    in_dim_k_ops = in_dim_effective * (k_h * k_w if is_conv else 1)
+    all_targets = torch.stack([t.reshape(out_dim, in_dim_k_ops) for t in delta_W_targets]).to(device, dtype=dtype)
+    best_results = [{
+        'final_loss': float('inf'), 'stopped_early_by_loss': False, 'stopped_by_insufficient_progress': False,
+        'stopped_by_projection': False, 'projection_type_used': 'none', 'iterations_done': 0,
+        'final_rank_used': initial_rank_for_layer, 'interrupted_mid_layer': False, 'final_projected_loss_on_stop': None
+    } for _ in range(num_layers)]
+    pending_layers = list(range(num_layers))
+    current_rank_for_this_attempt = initial_rank_for_layer
+    alpha_init_for_this_attempt = initial_alpha_for_layer
+    rank_base_for_next_increase = initial_rank_for_layer
+
+    prog_check_interval_val = args_global.progress_check_interval
+    min_prog_ratio_val = args_global.min_progress_loss_ratio
+    iter_to_begin_first_progress_window = args_global.progress_check_start_iter
+    adv_proj_decay_cap_min_val = getattr(args_global, 'advanced_projection_decay_cap_min', 0.5)
+    adv_proj_decay_cap_max_val = getattr(args_global, 'advanced_projection_decay_cap_max', 1.05)
+    proj_sample_interval_val = getattr(args_global, 'projection_sample_interval', 20)
+    proj_ema_alpha_val = getattr(args_global, 'projection_ema_alpha', 0.1)
+    proj_min_ema_hist_val = getattr(args_global, 'projection_min_ema_history', 5)
+
+    def mark_interrupted(layer_indices, iterations_done):
+        for j in layer_indices:
+            best_results[j].update({'interrupted_mid_layer': True, 'projection_type_used': 'interrupted', 'iterations_done': iterations_done})
+        return best_results
+
+    for attempt_idx in range(max_rank_retries + 1):
+        if not pending_layers: break
+        is_last_rank_attempt = (attempt_idx == max_rank_retries)
+        if save_attempted_on_interrupt:
+            return mark_interrupted(pending_layers, 0)
+
+        if attempt_idx > 0:
+            for j in pending_layers:
+                log_layer_optimization_event(LogType.RANK_RETRY_STARTING, layer_names[j], prev_rank=rank_base_for_next_increase, prev_best_loss=best_results[j]['final_loss'])
+            current_rank_for_this_attempt, alpha_init_for_this_attempt = compute_retry_rank_and_alpha(rank_base_for_next_increase, initial_rank_for_layer, initial_alpha_for_layer, rank_increase_factor)
+
+        initial_params = []
+        for j in pending_layers:
+            warm_start_status, params_for_initialization, prev_rank_for_warm_start = None, None, None
+            if attempt_idx > 0:
+                warm_start_status, params_for_initialization, prev_rank_for_warm_start = resolve_warm_start(best_results[j], current_rank_for_this_attempt)
+                log_layer_optimization_event(LogType.RANK_INCREASED_INFO, layer_names[j], new_rank=current_rank_for_this_attempt, new_alpha=alpha_init_for_this_attempt, warm_start_status=warm_start_status, prev_rank_for_warm_start=prev_rank_for_warm_start)
+            initial_params.append(initialize_loha_parameters(
+                out_dim, current_rank_for_this_attempt, in_dim_k_ops, device, dtype, layer_names[j], attempt_idx, False,
+                params_for_initialization, warm_start_status, prev_rank_for_warm_start if warm_start_status == 'applied' else None,
+                all_targets[j] if args_global.init_method == 'svd' else None, alpha_init_for_this_attempt
+            ))
+        stacked_params = [torch.stack([p[n].data for p in initial_params]).requires_grad_(True) for n in range(4)]
+        stacked_params.append(torch.full((len(pending_layers),), alpha_init_for_this_attempt, device=device, dtype=dtype, requires_grad=True))
+        del initial_params
+        optimizer = BatchedAdamW(stacked_params, lr=lr, weight_decay=weight_decay)
+        scheduler = BatchedReduceLROnPlateau(optimizer, patience=max(10, int(max_iterations * 0.05)), factor=0.5, min_lr=max(1e-7, lr * 0.001))
+        targets = all_targets[torch.tensor(pending_layers, device=all_targets.device)]
+
+        # Row r of the stacked tensors belongs to layer row_layers[r]; row_states[r] holds that layer's
+        # scalar bookkeeping, the same variables optimize_loha_for_layer keeps per attempt.
+        row_layers = list(pending_layers)
+        row_states = [{
+            'final_loss': float('inf'), 'stopped_early_by_loss': False, 'insufficient_progress': False,
+            'stopped_by_projection': False, 'projection_type': 'none', 'iterations_done': 0,
+            'loss_at_window_start': float('inf'), 'window_started': False, 'rel_imprv_history': [],
+            'final_projected_loss': None, 'ema_history': [], 'ema_value': None, 'ema_sampled_at': 0
+        } for _ in row_layers]
+        active = [True] * len(row_layers)
+        finished_states = {}
+
+        def snapshot_row(row):
+            w1a, w1b, w2a, w2b, alpha_p = optimizer.params
+            row_states[row].update({
+                'hada_w1_a': w1a[row].detach().cpu().clone().contiguous(), 'hada_w1_b': w1b[row].detach().cpu().clone().contiguous(),
+                'hada_w2_a': w2a[row].detach().cpu().clone().contiguous(), 'hada_w2_b': w2b[row].detach().cpu().clone().contiguous(),
+                'alpha': alpha_p[row].detach().cpu().clone().contiguous()
+            })
+            finished_states[row_layers[row]] = row_states[row]
+
+        iter_pbar_desc = f"Batch Opt Att {attempt_idx+1}/{max_rank_retries+1} (R:{current_rank_for_this_attempt}){' [LastRank]' if is_last_rank_attempt else ''}: {len(row_layers)} layers {out_dim}x{in_dim_k_ops}"
+        iter_pbar = tqdm(range(max_iterations), desc=iter_pbar_desc, leave=False, dynamic_ncols=True, position=1, mininterval=0.5)
+        for i in iter_pbar:
+            current_iterations_done = i + 1
+            if save_attempted_on_interrupt:
+                iter_pbar.close()
+                return mark_interrupted(pending_layers, i)
+
+            for row, st in enumerate(row_states):
+                if active[row] and prog_check_interval_val > 0 and not st['window_started'] and current_iterations_done >= iter_to_begin_first_progress_window:
+                    st['loss_at_window_start'] = st['final_loss']
+                    st['window_started'] = True
+
+            optimizer.zero_grad()
+            w1a, w1b, w2a, w2b, alpha_p = optimizer.params
+            eff_alpha_scale = (alpha_p / current_rank_for_this_attempt).view(-1, 1, 1)
+            delta_W_loha = eff_alpha_scale * torch.bmm(w1a, w1b) * torch.bmm(w2a, w2b)
+            per_layer_loss = (delta_W_loha - targets).pow(2).mean(dim=(1, 2))
+            active_mask = torch.tensor(active, device=per_layer_loss.device, dtype=per_layer_loss.dtype)
+            (per_layer_loss * active_mask).sum().backward()
+            optimizer.step(active_mask)
+            losses = per_layer_loss.detach().tolist()
+            scheduler.step(losses, active)
+
+            for row, st in enumerate(row_states):
+                if not active[row]: continue
+                layer_name, loss_value = layer_names[row_layers[row]], losses[row]
+                if i == 0 and st['window_started'] and st['loss_at_window_start'] == float('inf'):
+                    st['loss_at_window_start'] = loss_value
+                st['final_loss'], st['iterations_done'] = loss_value, current_iterations_done
+
+                if target_loss is not None and prog_check_interval_val > 0 and current_iterations_done % proj_sample_interval_val == 0:
+                    st['ema_value'] = proj_ema_alpha_val * loss_value + (1 - proj_ema_alpha_val) * st['ema_value'] if st['ema_value'] is not None else loss_value
+                    st['ema_history'].append((current_iterations_done, st['ema_value']))
+
+                if target_loss is not None and current_iterations_done >= min_iterations and loss_value <= target_loss:
+                    log_layer_optimization_event(LogType.TARGET_LOSS_REACHED_IN_ATTEMPT, layer_name, attempt=attempt_idx+1, rank=current_rank_for_this_attempt, target_loss=target_loss, iter=current_iterations_done)
+                    st['stopped_early_by_loss'] = True; active[row] = False; continue
+
+                if prog_check_interval_val > 0 and st['window_started'] and \
+                   (current_iterations_done >= iter_to_begin_first_progress_window + prog_check_interval_val) and \
+                   (((current_iterations_done - iter_to_begin_first_progress_window) % prog_check_interval_val) == 0):
+                    perform_early_stop_checks = not is_last_rank_attempt
+                    stop_insufficient_prog, _ = check_insufficient_progress(
+                        loss_value, st['loss_at_window_start'], min_prog_ratio_val, target_loss,
+                        perform_early_stop_checks, layer_name, attempt_idx, current_rank_for_this_attempt
+                    )
+                    if stop_insufficient_prog:
+                        st['insufficient_progress'] = True; active[row] = False; continue
+                    if target_loss is not None and loss_value > target_loss:
+                        window_start = st['loss_at_window_start']
+                        raw_rel_imprv = (window_start - loss_value) / window_start if window_start > 1e-12 and window_start > loss_value else 0.0
+                        stop_projection, proj_details = check_loss_projection(
+                            st['ema_history'], loss_value, raw_rel_imprv, target_loss,
+                            max_iterations, current_iterations_done, prog_check_interval_val,
+                            proj_min_ema_hist_val, adv_proj_decay_cap_min_val, adv_proj_decay_cap_max_val,
+                            perform_early_stop_checks, layer_name, attempt_idx, current_rank_for_this_attempt,
+                            st['rel_imprv_history']
+                        )
+                        if proj_details:
+                            st['projection_type'] = proj_details.get('proj_type', 'none')
+                            if stop_projection: st['final_projected_loss'] = proj_details.get('proj_final_loss')
+                        if stop_projection:
+                            st['stopped_by_projection'] = True; active[row] = False; continue
+                    st['loss_at_window_start'] = loss_value
+
+            for row in range(len(row_layers)):
+                if not active[row] and row_layers[row] not in finished_states: snapshot_row(row)
+            num_active = sum(active)
+            if num_active == 0: break
+            if num_active <= len(active) // 2:
+                keep_rows = [row for row, is_active in enumerate(active) if is_active]
+                keep = torch.tensor(keep_rows, device=targets.device)
+                optimizer.select(keep); scheduler.select(keep_rows)
+                targets = targets[keep]
+                row_layers = [row_layers[r] for r in keep_rows]
+                row_states = [row_states[r] for r in keep_rows]
+                active = [True] * len(keep_rows)
+            iter_pbar.set_postfix_str(f"Active={num_active}/{len(pending_layers)}, MaxLoss={max(st['final_loss'] for st, a in zip(row_states, active) if a):.3e}")
+        iter_pbar.close()
+        for row in range(len(row_layers)):
+            if row_layers[row] not in finished_states: snapshot_row(row)
+
+        next_pending_layers = []
+        for j in pending_layers:
+            st, best, layer_name = finished_states[j], best_results[j], layer_names[j]
+            if st['final_loss'] < best['final_loss'] or (st['final_loss'] == best['final_loss'] and current_rank_for_this_attempt < best['final_rank_used']):
+                log_layer_optimization_event(LogType.NEW_BEST_RESULT_FOR_LAYER, layer_name, attempt=attempt_idx+1, rank=current_rank_for_this_attempt, loss=st['final_loss'])
+                best.update({
+                    'hada_w1_a': st['hada_w1_a'], 'hada_w1_b': st['hada_w1_b'], 'hada_w2_a': st['hada_w2_a'], 'hada_w2_b': st['hada_w2_b'],
+                    'alpha': st['alpha'], 'final_loss': st['final_loss'],
+                    'stopped_early_by_loss': st['stopped_early_by_loss'],
+                    'stopped_by_insufficient_progress': st['insufficient_progress'],
+                    'stopped_by_projection': st['stopped_by_projection'],
+                    'projection_type_used': st['projection_type'],
+                    'iterations_done': st['iterations_done'], 'final_rank_used': current_rank_for_this_attempt,
+                    'interrupted_mid_layer': False,
+                    'final_projected_loss_on_stop': st['final_projected_loss'] if st['stopped_by_projection'] else None
+                })
+            stopped_by_any_flag = st['stopped_early_by_loss'] or st['insufficient_progress'] or st['stopped_by_projection']
+            if st['stopped_early_by_loss']:
+                log_layer_optimization_event(LogType.TARGET_LOSS_MET_STOP_ALL_RETRIES, layer_name)
+                continue
+            if is_last_rank_attempt:
+                if not stopped_by_any_flag:
+                    check_insufficient_progress(st['final_loss'], st['loss_at_window_start'], min_prog_ratio_val, target_loss, False, layer_name, attempt_idx, current_rank_for_this_attempt)
+                    if target_loss and st['final_loss'] > target_loss and prog_check_interval_val > 0:
+                        window_start = st['loss_at_window_start']
+                        raw_rel_imprv = (window_start - st['final_loss']) / window_start if window_start > 1e-12 and window_start > st['final_loss'] else 0.0
+                        _, proj_log_details_last = check_loss_projection(
+                            st['ema_history'], st['final_loss'], raw_rel_imprv, target_loss,
+                            max_iterations, st['iterations_done'], prog_check_interval_val,
+                            proj_min_ema_hist_val, adv_proj_decay_cap_min_val, adv_proj_decay_cap_max_val,
+                            False, layer_name, attempt_idx, current_rank_for_this_attempt,
+                            st['rel_imprv_history']
+                        )
+                        if proj_log_details_last:
+                            best['projection_type_used'] = proj_log_details_last.get('proj_type', best['projection_type_used'])
+                            best['final_projected_loss_on_stop'] = proj_log_details_last.get('proj_final_loss', best['final_projected_loss_on_stop'])
+                log_layer_optimization_event(LogType.LAST_RANK_ATTEMPT_SUMMARY, layer_name, target_loss=target_loss,
+                                             final_loss_for_layer=best['final_loss'], final_rank_for_layer=best['final_rank_used'])
+                continue
+            if st['iterations_done'] < max_iterations and not stopped_by_any_flag:
+                log_layer_optimization_event(LogType.ATTEMPT_EARLY_FINISH_NO_STOP_FLAG, layer_name, attempt=attempt_idx+1, rank=current_rank_for_this_attempt, iters_done=st['iterations_done'], max_iters=max_iterations)
+            reason_kwargs = {'attempt': attempt_idx + 1, 'rank': current_rank_for_this_attempt, 'is_last_rank_attempt': is_last_rank_attempt}
+            if st['stopped_by_projection']:
+                reason_kwargs.update({'reason_type': 'projection_unreachable', 'target_loss': target_loss, 'proj_final_loss': st['final_projected_loss'], 'proj_type': st['projection_type']})
+            elif st['insufficient_progress']:
+                reason_kwargs.update({'reason_type': 'insufficient_progress'})
+            elif st['iterations_done'] >= max_iterations:
+                reason_kwargs.update({'reason_type': 'max_iterations_no_target' if target_loss else 'max_iterations_no_target_set', 'current_loss': st['final_loss']})
+            if 'reason_type' in reason_kwargs:
+                log_layer_optimization_event(LogType.ATTEMPT_ENDED_WILL_RETRY, layer_name, **reason_kwargs)
+            next_pending_layers.append(j)
+        pending_layers = next_pending_layers
+        rank_base_for_next_increase = current_rank_for_this_attempt
+
+    for best in best_results:
+        for key, default_val in [('stopped_early_by_loss', False), ('stopped_by_insufficient_progress', False),
+                                 ('stopped_by_projection', False), ('projection_type_used', 'none'),
+                                 ('interrupted_mid_layer', False), ('final_projected_loss_on_stop', None),
+                                 ('final_rank_used', initial_rank_for_layer)]:
+            best.setdefault(key, default_val)
+    return best_results
+
+def commit_optimized_layer(
+    loha_key_prefix: str, original_module_path: str, initial_rank_opt: int, opt_results: dict,
+    base_model_sd, ft_model_sd, final_save_dtype_torch: torch.dtype
+) -> bool:
+    global processed_layers_this_session_count_global, skipped_other_reason_count_global
+    if not opt_results.get('interrupted_mid_layer') and 'hada_w1_a' in opt_results :
+        for p_name, p_val in opt_results.items():
+            if p_name not in ['final_loss', 'stopped_early_by_loss', 'stopped_by_insufficient_progress', 'stopped_by_projection', 'projection_type_used', 'iterations_done', 'final_rank_used', 'interrupted_mid_layer', 'final_projected_loss_on_stop']:
+                if torch.is_tensor(p_val): output_writer_global.add(f'{loha_key_prefix}.{p_name}', p_val.to(final_save_dtype_torch))
+        final_rank_used = opt_results['final_rank_used']
+        stat_entry = {"name": str(loha_key_prefix),"original_name": str(original_module_path),"initial_rank_attempted": int(initial_rank_opt),"final_rank_used": int(final_rank_used),"rank_was_increased": bool(final_rank_used > initial_rank_opt),"final_loss": float(opt_results['final_loss']),"alpha_final": float(opt_results['alpha'].item()) if isinstance(opt_results.get('alpha'), torch.Tensor) else float(opt_results.get('alpha', 0.0)),"iterations_done": int(opt_results['iterations_done']),"stopped_early_by_loss_target": bool(opt_results['stopped_early_by_loss']),"stopped_by_insufficient_progress": bool(opt_results.get('stopped_by_insufficient_progress', False)),"stopped_by_projection": bool(opt_results.get('stopped_by_projection', False)),"projection_type_used": str(opt_results.get('projection_type_used', 'none')),"final_projected_loss_on_stop": float(l_val) if (l_val := opt_results.get('final_projected_loss_on_stop')) is not None else None,"skipped_reopt_due_to_initial_good_loss": False,"interrupted_mid_layer": bool(opt_results.get('interrupted_mid_layer', False))}
+        layer_optimization_stats_global.append(stat_entry)
+        all_completed_module_prefixes_ever_global.add(loha_key_prefix)
+        stop_reason_short = ""
+        if opt_results['stopped_early_by_loss']: stop_reason_short = ", Stop:LossTarget"
+        elif opt_results.get('stopped_by_projection', False): stop_reason_short = f", Stop:Proj({opt_results.get('projection_type_used','?')})"
+        elif opt_results['stopped_by_insufficient_progress']: stop_reason_short = ", Stop:RawProg"
+        tqdm.write(f"  Layer {loha_key_prefix} Opt. Done. R_used: {final_rank_used}, FinalLoss: {opt_results['final_loss']:.4e}, Iters: {opt_results['iterations_done']}{stop_reason_short}")
+        if args_global.use_bias:
+            bias_key = f"{original_module_path}.bias"
+            if delta_cache_global is not None:
+                bias_changed = bias_key in delta_cache_global.layers and not delta_cache_global.is_identical(bias_key, args_global.atol_fp32_check)
+            else:
+                bias_changed = bias_key in ft_model_sd and (bias_key not in base_model_sd or not torch.allclose(base_model_sd[bias_key], ft_model_sd[bias_key], atol=args_global.atol_fp32_check))
+            if bias_changed:
+                output_writer_global.add(bias_key, ft_model_sd[bias_key].cpu().to(final_save_dtype_torch))
+                if args_global.verbose: tqdm.write(f"    Saved differing/new bias for {bias_key}")
+        processed_layers_this_session_count_global += 1
+        return True
+    tqdm.write(f"  Optimization for {loha_key_prefix} did not yield saveable results (Interrupt: {opt_results.get('interrupted_mid_layer', 'N/A')}, Loss: {opt_results.get('final_loss', 'N/A')})")
+    if not opt_results.get('interrupted_mid_layer', False) and 'hada_w1_a' not in opt_results :
+        skipped_other_reason_count_global += 1
+        all_completed_module_prefixes_ever_global.add(loha_key_prefix)
+    return False
+
+def record_identical_layer(loha_key_prefix: str):
+    global skipped_identical_count_global
+    if args_global.verbose_layer_debug: tqdm.write(f"  Skipping {loha_key_prefix} (weights identical atol={args_global.atol_fp32_check:.1e}).")
+    skipped_identical_count_global += 1
+    all_completed_module_prefixes_ever_global.add(loha_key_prefix)
+
+def loaded_loha_initial_loss(seed_data: dict, delta_W_fp32: torch.Tensor, out_dim: int, in_dim_effective: int, k_h: int, k_w: int, is_conv: bool, device: str, dtype: torch.dtype) -> float | None:
+    loaded_params_cpu = seed_data['params']
+    if not all(k_ in loaded_params_cpu for k_ in ['hada_w1_a', 'hada_w1_b', 'hada_w2_a', 'hada_w2_b']): return None
+    with torch.no_grad():
+        w1a,w1b,w2a,w2b = (loaded_params_cpu[p].to(device, dtype) for p in ['hada_w1_a','hada_w1_b','hada_w2_a','hada_w2_b'])
+        alpha_v = torch.tensor(seed_data['alpha'], device=device, dtype=dtype)
+        eff_a_s = alpha_v / seed_data['rank']; delta_W_target_c = delta_W_fp32.to(device, dtype)
+        init_loha_d = eff_a_s * (w1a@w1b).view(out_dim,in_dim_effective,k_h,k_w) * (w2a@w2b).view(out_dim,in_dim_effective,k_h,k_w) if is_conv else eff_a_s * (w1a@w1b) * (w2a@w2b)
+        return F.mse_loss(init_loha_d, delta_W_target_c).item()
+
+def record_skipped_good_initial_layer(loha_key_prefix: str, original_module_path: str, loaded_rank: int, loaded_alpha: float, init_loss: float):
+    global processed_layers_this_session_count_global, skipped_good_initial_loss_count_global
+    tqdm.write(f"  Skip Re-Opt {loha_key_prefix}: Loaded (R:{loaded_rank}, A:{loaded_alpha:.2f}) meets target. Loss: {init_loss:.4e} <= {args_global.target_loss:.4e}")
+    stat_entry_skip = {"name": str(loha_key_prefix), "original_name": str(original_module_path),"initial_rank_attempted": int(loaded_rank), "final_rank_used": int(loaded_rank),"rank_was_increased": False, "final_loss": float(init_loss),"alpha_final": float(loaded_alpha), "iterations_done": 0,"stopped_early_by_loss_target": True, "stopped_by_insufficient_progress": False,"stopped_by_projection": False, "projection_type_used": "none","final_projected_loss_on_stop": None,"skipped_reopt_due_to_initial_good_loss": True, "interrupted_mid_layer": False}
+    layer_optimization_stats_global.append(stat_entry_skip)
+    all_completed_module_prefixes_ever_global.add(loha_key_prefix)
+    processed_layers_this_session_count_global += 1; skipped_good_initial_loss_count_global += 1
+
+def resolve_layer_opt_settings(is_conv: bool, seed_data: dict | None) -> tuple[int, float, dict | None, int]:
+    """Initial rank/alpha, params to load and rank-retry budget for one layer; seed_data is set for re-opt targets."""
+    initial_rank_opt = args_global.conv_rank if is_conv and args_global.conv_rank is not None else args_global.rank
+    initial_alpha_opt = args_global.initial_conv_alpha if is_conv else args_global.initial_alpha
+    existing_params_init = None; max_retries_layer = args_global.max_rank_retries
+    if seed_data is not None:
+        initial_rank_opt, initial_alpha_opt = seed_data['rank'], seed_data['alpha']
+        existing_params_init = seed_data['params']
+        base_rank_est = args_global.conv_rank if is_conv and args_global.conv_rank is not None else args_global.rank
+        if initial_rank_opt > base_rank_est and args_global.max_rank_retries > 0 :
+            est_retries_used = 0; cur_sim_rank = float(base_rank_est)
+            for _ in range(args_global.max_rank_retries + 10):
+                if cur_sim_rank >= initial_rank_opt: break
+                cur_sim_rank = max(math.ceil(cur_sim_rank * args_global.rank_increase_factor), cur_sim_rank + 1); est_retries_used += 1
+            max_retries_layer = max(0, args_global.max_rank_retries - est_retries_used)
+            if args_global.verbose: tqdm.write(f"    Using loaded R:{initial_rank_opt}, A:{initial_alpha_opt:.1f}. Max further retries for layer: {max_retries_layer}.")
+    return initial_rank_opt, initial_alpha_opt, existing_params_init, max_retries_layer
+
+def init_extraction_worker(cli_args: argparse.Namespace, num_threads: int, read_models: bool):
+    global args_global, worker_models_global, is_worker_process_global
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the coordinator owns Ctrl+C and the interrupt save
+    args_global = cli_args
+    is_worker_process_global = True
+    torch.set_num_threads(num_threads)
+    if read_models:
+        if cli_args.delta_cache_dir:
+            worker_models_global = DeltaCache(cli_args.delta_cache_dir, cli_args.base_model_path, cli_args.ft_model_path).open()
+        else:
+            worker_models_global = (LazyStateDict(cli_args.base_model_path), LazyStateDict(cli_args.ft_model_path))
+
+def run_layer_task(key_name: str, loha_key_prefix: str, original_module_path: str, delta_W_fp32: torch.Tensor | None, seed_data: dict | None) -> dict:
+    """Worker side of --workers: identical check, re-opt pre-check and optimization for one layer.
+
+    Reads the layer itself when delta_W_fp32 is None. Touches no shared state; the returned dict is
+    applied by the coordinator through apply_layer_task_result.
+    """
+    task = {'key_name': key_name, 'loha_key_prefix': loha_key_prefix, 'original_module_path': original_module_path}
+    if delta_W_fp32 is None:
+        delta_W_fp32 = worker_models_global.get(key_name) if isinstance(worker_models_global, DeltaCache) else compute_delta_fp32(*worker_models_global, key_name)
+    out_dim, in_dim_effective, k_h, k_w, is_conv = get_module_shape_info_from_weight(delta_W_fp32)
+    if torch.allclose(delta_W_fp32, torch.zeros_like(delta_W_fp32), atol=args_global.atol_fp32_check):
+        return {**task, 'status': 'identical'}
+    target_opt_dtype = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}.get(args_global.precision, torch.float32)
+    if seed_data is not None and args_global.target_loss is not None:
+        try:
+            init_loss = loaded_loha_initial_loss(seed_data, delta_W_fp32, out_dim, in_dim_effective, k_h, k_w, is_conv, args_global.device, target_opt_dtype)
+            if init_loss is not None and init_loss <= args_global.target_loss:
+                return {**task, 'status': 'skipped_good_initial', 'loaded_rank': seed_data['rank'], 'loaded_alpha': seed_data['alpha'], 'initial_loss': init_loss}
+        except Exception as e_c: tqdm.write(f"    Warn: Pre-opt loss check failed for {loha_key_prefix}: {e_c}. Optimizing.")
+    initial_rank_opt, initial_alpha_opt, existing_params_init, max_retries_layer = resolve_layer_opt_settings(is_conv, seed_data)
+    opt_results = optimize_loha_for_layer(loha_key_prefix, delta_W_fp32, out_dim, in_dim_effective, k_h, k_w, initial_rank_opt, initial_alpha_opt, args_global.lr, args_global.max_iterations, args_global.min_iterations, args_global.target_loss, args_global.weight_decay, args_global.device, target_opt_dtype, is_conv, args_global.verbose_layer_debug, max_retries_layer, args_global.rank_increase_factor, existing_params_init)
+    return {**task, 'status': 'optimized', 'initial_rank_opt': initial_rank_opt, 'opt_results': opt_results}
+
+def apply_layer_task_result(result: dict, base_model_sd, ft_model_sd, final_save_dtype_torch: torch.dtype) -> bool:
+    """Coordinator side of --workers. Returns True when the layer counts as processed (for periodic saves)."""
+    global skipped_other_reason_count_global
+    loha_key_prefix, status = result['loha_key_prefix'], result['status']
+    if status == 'identical':
+        record_identical_layer(loha_key_prefix)
+        return False
+    if status == 'skipped_good_initial':
+        record_skipped_good_initial_layer(loha_key_prefix, result['original_module_path'], result['loaded_rank'], result['loaded_alpha'], result['initial_loss'])
+        return True
+    if status == 'optimized':
+        return commit_optimized_layer(loha_key_prefix, result['original_module_path'], result['initial_rank_opt'], result['opt_results'], base_model_sd, ft_model_sd, final_save_dtype_torch)
+    tqdm.write(f"  Worker failed on {loha_key_prefix}: {result.get('error')}. Layer left for a later run.")
+    skipped_other_reason_count_global += 1
+    return False
+
+def perform_periodic_save_if_due(total_candidates_to_scan: int):
+    if args_global.save_every_n_layers > 0 and processed_layers_this_session_count_global > 0 and processed_layers_this_session_count_global % args_global.save_every_n_layers == 0 and keys_scanned_this_run_global < total_candidates_to_scan:
+        tqdm.write(f"\n--- Periodic Checkpoint: Processed {processed_layers_this_session_count_global} layers this session ---")
+        perform_graceful_save(final=False)
+
+
 def handle_interrupt(signum, frame):
     # ... (remains the same) ...
     global save_attempted_on_interrupt, outer_pbar_global, args_global, all_completed_module_prefixes_ever_global
@@ -832,27 +1412,61 @@ def handle_interrupt(signum, frame):
     if save_attempted_on_interrupt: print("Save already attempted. Exiting."); return
     save_attempted_on_interrupt = True
     if outer_pbar_global: outer_pbar_global.close()
+    if worker_pool_global is not None: worker_pool_global.terminate()
     if args_global and args_global.save_to:
-        save_path = generate_intermediate_filename(args_global.save_to, len(all_completed_module_prefixes_ever_global))
-        print(f"Attempting interrupt save to: {save_path}")
-        if perform_graceful_save(save_path) and args_global.keep_n_resume_files > 0:
-            cleanup_intermediate_files(args_global.save_to, True, args_global.keep_n_resume_files)
+        print("Attempting interrupt checkpoint. Rerun the same command to resume.")
+        perform_graceful_save(final=False)
     else: print("Cannot perform interrupt save: args not defined.")
     print("Exiting.")
     sys.exit(0)
 
 
+def run_init_benchmark(cli_args: argparse.Namespace):
+    """--benchmark_init: time each --init_method on the same layers. Rank retries are disabled so iteration counts compare one attempt."""
+    global args_global
+    args_global = cli_args
+    target_opt_dtype = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}.get(cli_args.precision, torch.float32)
+    base_model_sd, ft_model_sd = load_models(cli_args.base_model_path, cli_args.ft_model_path, stream=cli_args.stream_models)
+    layers = []
+    for key_name in sorted(k for k in base_model_sd if k.endswith('.weight') and k in ft_model_sd and len(tensor_shape(base_model_sd, k)) in [2,4] and tensor_shape(base_model_sd, k) == tensor_shape(ft_model_sd, k)):
+        if len(layers) >= cli_args.benchmark_init: break
+        if is_vae_module(key_name[:-len(".weight")]): continue
+        delta_W_fp32 = compute_delta_fp32(base_model_sd, ft_model_sd, key_name)
+        if not torch.allclose(delta_W_fp32, torch.zeros_like(delta_W_fp32), atol=cli_args.atol_fp32_check):
+            layers.append((loha_prefix_for_module(key_name[:-len(".weight")]), delta_W_fp32))
+    print(f"Benchmarking init methods on {len(layers)} layers (target loss: {cli_args.target_loss}, max iters: {cli_args.max_iterations}).")
+    totals = {}
+    for init_method in ["kaiming", "svd"]:
+        cli_args.init_method = init_method
+        torch.manual_seed(0)
+        rows = []
+        for loha_key_prefix, delta_W_fp32 in layers:
+            out_dim, in_dim_effective, k_h, k_w, is_conv = get_module_shape_info_from_weight(delta_W_fp32)
+            initial_rank_opt, initial_alpha_opt, _, _ = resolve_layer_opt_settings(is_conv, None)
+            if str(cli_args.device).startswith("cuda"): torch.cuda.synchronize()
+            t_start = time.perf_counter()
+            opt_results = optimize_loha_for_layer(loha_key_prefix, delta_W_fp32, out_dim, in_dim_effective, k_h, k_w, initial_rank_opt, initial_alpha_opt, cli_args.lr, cli_args.max_iterations, cli_args.min_iterations, cli_args.target_loss, cli_args.weight_decay, cli_args.device, target_opt_dtype, is_conv, cli_args.verbose_layer_debug, 0, cli_args.rank_increase_factor, None)
+            if str(cli_args.device).startswith("cuda"): torch.cuda.synchronize()
+            rows.append((loha_key_prefix, opt_results['iterations_done'], time.perf_counter() - t_start, opt_results['final_loss'], opt_results['stopped_early_by_loss']))
+            tqdm.write(f"  [{init_method:>7}] {loha_key_prefix}: {rows[-1][1]} iters, {rows[-1][2]:.2f}s, loss {rows[-1][3]:.3e}{' (target met)' if rows[-1][4] else ''}")
+        totals[init_method] = (sum(r[1] for r in rows), sum(r[2] for r in rows), sum(r[4] for r in rows), sum(r[3] for r in rows) / max(1, len(rows)))
+    print(f"\n{'init':>8} | {'iters':>8} | {'time (s)':>9} | {'target met':>10} | {'mean loss':>10}")
+    for init_method, (iters, seconds, met, mean_loss) in totals.items():
+        print(f"{init_method:>8} | {iters:>8} | {seconds:>9.2f} | {met:>5}/{len(layers):<4} | {mean_loss:>10.3e}")
+    if totals["kaiming"][1] > 0 and totals["svd"][1] > 0:
+        print(f"svd vs kaiming: {totals['kaiming'][0] / max(1, totals['svd'][0]):.2f}x fewer iterations, {totals['kaiming'][1] / totals['svd'][1]:.2f}x faster.")
+
 def main(cli_args):
-    global args_global, extracted_loha_state_dict_global, layer_optimization_stats_global, \
+    global args_global, output_writer_global, layer_optimization_stats_global, \
            processed_layers_this_session_count_global, save_attempted_on_interrupt, outer_pbar_global, \
            skipped_identical_count_global, skipped_other_reason_count_global, keys_scanned_this_run_global, \
            previously_completed_module_prefixes_global, all_completed_module_prefixes_ever_global, \
            main_loop_completed_scan_flag_global, params_to_seed_optimizer_global, skipped_good_initial_loss_count_global, \
-           skipped_vae_layers_count 
+           skipped_vae_layers_count, worker_pool_global, delta_cache_global
 
     args_global = cli_args
     signal.signal(signal.SIGINT, handle_interrupt) 
-    extracted_loha_state_dict_global.clear(); layer_optimization_stats_global.clear()
+    layer_optimization_stats_global.clear()
     params_to_seed_optimizer_global.clear(); previously_completed_module_prefixes_global.clear()
     all_completed_module_prefixes_ever_global.clear()
     processed_layers_this_session_count_global = skipped_identical_count_global = skipped_other_reason_count_global = 0
@@ -862,25 +1476,105 @@ def main(cli_args):
     args_global = setup_and_print_configuration(args_global)
     target_opt_dtype = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}.get(args_global.precision, torch.float32)
     final_save_dtype_torch = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}.get(args_global.save_weights_dtype, torch.bfloat16)
-    handle_resume_or_continue_loha(
-        args_global, extracted_loha_state_dict_global, params_to_seed_optimizer_global,
+    output_writer_global = handle_resume_or_continue_loha(
+        args_global, params_to_seed_optimizer_global,
         previously_completed_module_prefixes_global, all_completed_module_prefixes_ever_global
     )
-    base_model_sd, ft_model_sd = load_models(args_global.base_model_path, args_global.ft_model_path)
-    all_candidate_keys = sorted([k for k in base_model_sd if k.endswith('.weight') and k in ft_model_sd and base_model_sd[k].shape == ft_model_sd[k].shape and (len(base_model_sd[k].shape) in [2,4])])
+    delta_cache = None
+    if args_global.delta_cache_dir:
+        delta_cache = DeltaCache(args_global.delta_cache_dir, args_global.base_model_path, args_global.ft_model_path)
+        print(f"\n{'Using' if delta_cache.exists else 'Building'} delta cache: {delta_cache.data_path}")
+        delta_cache.open_or_build(progress=lambda keys: tqdm(keys, desc="Building delta cache", dynamic_ncols=True))
+        delta_cache_global = delta_cache
+        # Only differing biases are ever read from the fine-tuned model, and only with --use_bias.
+        base_model_sd, ft_model_sd = None, open_state_dict(args_global.ft_model_path) if args_global.use_bias else None
+        all_candidate_keys = sorted(k for k in delta_cache.keys() if k.endswith('.weight') and len(delta_cache.shape(k)) in [2,4])
+    else:
+        base_model_sd, ft_model_sd = load_models(args_global.base_model_path, args_global.ft_model_path, stream=args_global.stream_models)
+        all_candidate_keys = sorted([k for k in base_model_sd if k.endswith('.weight') and k in ft_model_sd and tensor_shape(base_model_sd, k) == tensor_shape(ft_model_sd, k) and (len(tensor_shape(base_model_sd, k)) in [2,4])])
     total_candidates_to_scan = len(all_candidate_keys) 
     print(f"Found {total_candidates_to_scan} candidate '.weight' keys for LoHA extraction.")
+    worker_pool, workers_read_models = None, False
+    layer_batch_size = args_global.layer_batch_size
+    if args_global.workers > 1:
+        if layer_batch_size > 1:
+            print("Warning: --layer_batch_size is ignored with --workers; each worker optimizes one layer at a time.")
+            layer_batch_size = 0
+        workers_read_models = delta_cache is not None or (args_global.base_model_path.endswith(".safetensors") and args_global.ft_model_path.endswith(".safetensors"))
+        threads_per_worker = args_global.threads_per_worker or max(1, (os.cpu_count() or 1) // args_global.workers)
+        print(f"Starting {args_global.workers} worker processes ({threads_per_worker} torch threads each, {'workers read layers from disk' if workers_read_models else 'deltas sent from coordinator'}).")
+        worker_pool = torch.multiprocessing.get_context("spawn").Pool(
+            args_global.workers, initializer=init_extraction_worker, initargs=(args_global, threads_per_worker, workers_read_models)
+        )
+        worker_pool_global = worker_pool
+    delta_prefetcher = None
+    if isinstance(base_model_sd, LazyStateDict) and args_global.prefetch_layers > 0 and not workers_read_models:
+        keys_to_prefetch = []
+        for k in all_candidate_keys:
+            prefix = loha_prefix_for_module(k[:-len(".weight")])
+            is_reopt = args_global.continue_training_from_loha and prefix in params_to_seed_optimizer_global
+            if not is_vae_module(k[:-len(".weight")]) and (prefix not in all_completed_module_prefixes_ever_global or is_reopt):
+                keys_to_prefetch.append(k)
+        delta_prefetcher = DeltaPrefetcher(args_global.base_model_path, args_global.ft_model_path, keys_to_prefetch, args_global.prefetch_layers)
     outer_pbar_global = tqdm(total=total_candidates_to_scan, desc="Scanning Layers", dynamic_ncols=True, position=0)
-    
+
+    # --layer_batch_size: new layers are queued per (shape, rank, alpha) and optimized together.
+    pending_batches = {}
+    queued_layers_count = 0
+
+    # --workers: layers are handed to the pool; results come back through task_results and are
+    # applied here, on the main thread, so all global state is still updated in one place.
+    task_results = queue.Queue()
+    tasks_in_flight = 0
+
+    def read_layer_delta(key_name):
+        if delta_cache is not None: return delta_cache.get(key_name)
+        if delta_prefetcher is not None and key_name in delta_prefetcher: return delta_prefetcher.get(key_name)
+        return compute_delta_fp32(base_model_sd, ft_model_sd, key_name)
+
+    def submit_layer_task(key_name, loha_key_prefix, original_module_path, delta_W_fp32, seed_data):
+        nonlocal tasks_in_flight
+        tasks_in_flight += 1
+        failure = {'key_name': key_name, 'loha_key_prefix': loha_key_prefix, 'original_module_path': original_module_path, 'status': 'error'}
+        worker_pool.apply_async(
+            run_layer_task, (key_name, loha_key_prefix, original_module_path, delta_W_fp32, seed_data),
+            callback=task_results.put, error_callback=lambda e: task_results.put({**failure, 'error': e})
+        )
+
+    def collect_layer_results(max_in_flight):
+        nonlocal tasks_in_flight
+        while tasks_in_flight > max_in_flight and not save_attempted_on_interrupt:
+            try:
+                result = task_results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            tasks_in_flight -= 1
+            if apply_layer_task_result(result, base_model_sd, ft_model_sd, final_save_dtype_torch):
+                perform_periodic_save_if_due(total_candidates_to_scan)
+
+    def run_pending_batch(group_key):
+        nonlocal queued_layers_count
+        batch = pending_batches.pop(group_key)
+        queued_layers_count -= len(batch)
+        b_out_dim, b_in_dim_effective, b_k_h, b_k_w, b_is_conv, b_rank, b_alpha = group_key
+        if args_global.verbose: tqdm.write(f"\n--- NewOpt Batch of {len(batch)} layers (R:{b_rank}, Shape: {b_out_dim}x{b_in_dim_effective}{f'x{b_k_h}x{b_k_w}' if b_is_conv else ''}) ---")
+        outer_pbar_global.set_description_str(f"NewOpt Batch x{len(batch)} (Scan {keys_scanned_this_run_global}/{total_candidates_to_scan}, Done: {processed_layers_this_session_count_global})")
+        batch_results = optimize_loha_batch(
+            [prefix for prefix, _, _ in batch], [delta for _, _, delta in batch], b_out_dim, b_in_dim_effective, b_k_h, b_k_w,
+            b_rank, b_alpha, args_global.lr, args_global.max_iterations, args_global.min_iterations, args_global.target_loss,
+            args_global.weight_decay, args_global.device, target_opt_dtype, b_is_conv, args_global.max_rank_retries, args_global.rank_increase_factor
+        )
+        for (prefix, module_path, _), opt_results in zip(batch, batch_results):
+            if commit_optimized_layer(prefix, module_path, b_rank, opt_results, base_model_sd, ft_model_sd, final_save_dtype_torch):
+                perform_periodic_save_if_due(total_candidates_to_scan)
+
     try:
         for key_name in all_candidate_keys:
             if save_attempted_on_interrupt: break
             keys_scanned_this_run_global += 1; outer_pbar_global.update(1)
             original_module_path = key_name[:-len(".weight")]
-            loha_key_prefix = "lora_" + original_module_path.replace(".", "_")
-            if "model.diffusion_model." in original_module_path: loha_key_prefix = "lora_unet_" + original_module_path.split("model.diffusion_model.")[-1].replace(".", "_")
-            elif "first_stage_model." in original_module_path: loha_key_prefix = "lora_vae_" + original_module_path.split("first_stage_model.")[-1].replace(".", "_")
-            if any(vp in original_module_path for vp in [".encoder.", ".decoder.", ".quant_conv."]) and any(tp in original_module_path for tp in ["first_stage_model.", "autoencoder."]):
+            loha_key_prefix = loha_prefix_for_module(original_module_path)
+            if is_vae_module(original_module_path):
                 if args_global.verbose_layer_debug: tqdm.write(f"  Skipping VAE layer: {original_module_path}")
                 skipped_vae_layers_count += 1; skipped_other_reason_count_global += 1
                 all_completed_module_prefixes_ever_global.add(loha_key_prefix)
@@ -889,97 +1583,73 @@ def main(cli_args):
             if loha_key_prefix in all_completed_module_prefixes_ever_global and not is_reopt_target:
                 if args_global.verbose_layer_debug: tqdm.write(f"  Skipping {loha_key_prefix} (already processed/resumed, not re-opt target).")
                 continue
-            if args_global.max_layers is not None and args_global.max_layers > 0 and processed_layers_this_session_count_global >= args_global.max_layers:
-                if args_global.verbose and processed_layers_this_session_count_global == args_global.max_layers:
+            max_layers_set = args_global.max_layers is not None and args_global.max_layers > 0
+            if max_layers_set and tasks_in_flight and processed_layers_this_session_count_global + tasks_in_flight >= args_global.max_layers:
+                collect_layer_results(max_in_flight=0)  # in-flight layers may turn out identical; settle them before deciding
+            if max_layers_set and processed_layers_this_session_count_global + queued_layers_count + tasks_in_flight >= args_global.max_layers:
+                if args_global.verbose and processed_layers_this_session_count_global + queued_layers_count + tasks_in_flight == args_global.max_layers:
                     tqdm.write(f"\nMax_layers ({args_global.max_layers}) for new/re-optimized hit. Scan continues to find all identical/skipped layers.")
                 outer_pbar_global.set_description_str(f"Scan {keys_scanned_this_run_global}/{total_candidates_to_scan} (Max Layers Reached)")
                 continue
-            base_W = base_model_sd[key_name].to(dtype=torch.float32)
-            ft_W = ft_model_sd[key_name].to(dtype=torch.float32)
-            out_dim, in_dim_effective, k_h, k_w, is_conv = get_module_shape_info_from_weight(base_W)
-            delta_W_fp32 = (ft_W - base_W)
+            if delta_cache is not None and delta_cache.is_identical(key_name, args_global.atol_fp32_check):
+                record_identical_layer(loha_key_prefix)
+                continue
+            seed_data = params_to_seed_optimizer_global[loha_key_prefix] if is_reopt_target else None
+            if worker_pool is not None:
+                delta_for_worker = None if workers_read_models else read_layer_delta(key_name)
+                submit_layer_task(key_name, loha_key_prefix, original_module_path, delta_for_worker, seed_data)
+                outer_pbar_global.set_description_str(f"Workers x{args_global.workers} (Scan {keys_scanned_this_run_global}/{total_candidates_to_scan}, InFlight: {tasks_in_flight}, Done: {processed_layers_this_session_count_global})")
+                collect_layer_results(max_in_flight=args_global.workers * 2)
+                continue
+            delta_W_fp32 = read_layer_delta(key_name)
+            out_dim, in_dim_effective, k_h, k_w, is_conv = get_module_shape_info_from_weight(delta_W_fp32)
             if torch.allclose(delta_W_fp32, torch.zeros_like(delta_W_fp32), atol=args_global.atol_fp32_check):
-                if args_global.verbose_layer_debug: tqdm.write(f"  Skipping {loha_key_prefix} (weights identical atol={args_global.atol_fp32_check:.1e}).")
-                skipped_identical_count_global += 1
-                all_completed_module_prefixes_ever_global.add(loha_key_prefix)
+                record_identical_layer(loha_key_prefix)
                 continue
             current_key_processed_or_skipped_good = False 
             should_skip_due_to_pre_existing_good_loss = False
-            if is_reopt_target and args_global.target_loss is not None:
-                seed_data = params_to_seed_optimizer_global[loha_key_prefix]
-                loaded_params_cpu = seed_data['params']; loaded_rank_check = seed_data['rank']; loaded_alpha_check = seed_data['alpha']
-                if all(k_ in loaded_params_cpu for k_ in ['hada_w1_a', 'hada_w1_b', 'hada_w2_a', 'hada_w2_b']):
-                    try:
-                        with torch.no_grad():
-                            w1a,w1b,w2a,w2b = (loaded_params_cpu[p].to(args_global.device, target_opt_dtype) for p in ['hada_w1_a','hada_w1_b','hada_w2_a','hada_w2_b'])
-                            alpha_v = torch.tensor(loaded_alpha_check, device=args_global.device, dtype=target_opt_dtype)
-                            eff_a_s = alpha_v / loaded_rank_check; delta_W_target_c = delta_W_fp32.to(args_global.device, target_opt_dtype)
-                            init_loha_d = eff_a_s * (w1a@w1b).view(out_dim,in_dim_effective,k_h,k_w) * (w2a@w2b).view(out_dim,in_dim_effective,k_h,k_w) if is_conv else eff_a_s * (w1a@w1b) * (w2a@w2b)
-                            init_loss_c = F.mse_loss(init_loha_d, delta_W_target_c).item()
-                            if init_loss_c <= args_global.target_loss:
-                                tqdm.write(f"  Skip Re-Opt {loha_key_prefix}: Loaded (R:{loaded_rank_check}, A:{loaded_alpha_check:.2f}) meets target. Loss: {init_loss_c:.4e} <= {args_global.target_loss:.4e}")
-                                stat_entry_skip = {"name": str(loha_key_prefix), "original_name": str(original_module_path),"initial_rank_attempted": int(loaded_rank_check), "final_rank_used": int(loaded_rank_check),"rank_was_increased": False, "final_loss": float(init_loss_c),"alpha_final": float(loaded_alpha_check), "iterations_done": 0,"stopped_early_by_loss_target": True, "stopped_by_insufficient_progress": False,"stopped_by_projection": False, "projection_type_used": "none","final_projected_loss_on_stop": None,"skipped_reopt_due_to_initial_good_loss": True, "interrupted_mid_layer": False}
-                                layer_optimization_stats_global.append(stat_entry_skip)
-                                all_completed_module_prefixes_ever_global.add(loha_key_prefix)
-                                processed_layers_this_session_count_global += 1; skipped_good_initial_loss_count_global += 1
-                                should_skip_due_to_pre_existing_good_loss = True; current_key_processed_or_skipped_good = True
-                                outer_pbar_global.set_description_str(f"Scan {keys_scanned_this_run_global}/{total_candidates_to_scan} (New/ReOpt: {processed_layers_this_session_count_global - skipped_good_initial_loss_count_global}, SkipGood:{skipped_good_initial_loss_count_global})")
-                            elif args_global.verbose_layer_debug: tqdm.write(f"    Initial loss for loaded {loha_key_prefix}: {init_loss_c:.4e}. Re-optimizing.")
-                    except Exception as e_c: tqdm.write(f"    Warn: Pre-opt loss check failed for {loha_key_prefix}: {e_c}. Optimizing.");
+            if seed_data is not None and args_global.target_loss is not None:
+                try:
+                    init_loss_c = loaded_loha_initial_loss(seed_data, delta_W_fp32, out_dim, in_dim_effective, k_h, k_w, is_conv, args_global.device, target_opt_dtype)
+                    if init_loss_c is not None and init_loss_c <= args_global.target_loss:
+                        record_skipped_good_initial_layer(loha_key_prefix, original_module_path, seed_data['rank'], seed_data['alpha'], init_loss_c)
+                        should_skip_due_to_pre_existing_good_loss = True; current_key_processed_or_skipped_good = True
+                        outer_pbar_global.set_description_str(f"Scan {keys_scanned_this_run_global}/{total_candidates_to_scan} (New/ReOpt: {processed_layers_this_session_count_global - skipped_good_initial_loss_count_global}, SkipGood:{skipped_good_initial_loss_count_global})")
+                    elif init_loss_c is not None and args_global.verbose_layer_debug: tqdm.write(f"    Initial loss for loaded {loha_key_prefix}: {init_loss_c:.4e}. Re-optimizing.")
+                except Exception as e_c: tqdm.write(f"    Warn: Pre-opt loss check failed for {loha_key_prefix}: {e_c}. Optimizing.")
             if not should_skip_due_to_pre_existing_good_loss:
+                if layer_batch_size > 1 and seed_data is None:
+                    initial_rank_opt, initial_alpha_opt, _, _ = resolve_layer_opt_settings(is_conv, None)
+                    group_key = (out_dim, in_dim_effective, k_h, k_w, is_conv, initial_rank_opt, initial_alpha_opt)
+                    pending_batches.setdefault(group_key, []).append((loha_key_prefix, original_module_path, delta_W_fp32))
+                    queued_layers_count += 1
+                    if len(pending_batches[group_key]) >= layer_batch_size:
+                        run_pending_batch(group_key)
+                    elif queued_layers_count >= layer_batch_size * 4:
+                        run_pending_batch(max(pending_batches, key=lambda k: len(pending_batches[k])))
+                    continue
                 current_op_mode_str = "ReOpt" if is_reopt_target else "NewOpt"
                 if args_global.verbose: tqdm.write(f"\n--- {current_op_mode_str} Layer {processed_layers_this_session_count_global + 1 - skipped_good_initial_loss_count_global}: {loha_key_prefix} (Orig: {original_module_path}) ---")
-                initial_rank_opt = args_global.conv_rank if is_conv and args_global.conv_rank is not None else args_global.rank
-                initial_alpha_opt = args_global.initial_conv_alpha if is_conv else args_global.initial_alpha
-                existing_params_init = None; max_retries_layer = args_global.max_rank_retries
-                if is_reopt_target:
-                    seed_data = params_to_seed_optimizer_global[loha_key_prefix]
-                    initial_rank_opt, initial_alpha_opt = seed_data['rank'], seed_data['alpha']
-                    existing_params_init = seed_data['params']
-                    base_rank_est = args_global.conv_rank if is_conv and args_global.conv_rank is not None else args_global.rank
-                    if initial_rank_opt > base_rank_est and args_global.max_rank_retries > 0 :
-                        est_retries_used = 0; cur_sim_rank = float(base_rank_est)
-                        for _ in range(args_global.max_rank_retries + 10):
-                            if cur_sim_rank >= initial_rank_opt: break
-                            cur_sim_rank = max(math.ceil(cur_sim_rank * args_global.rank_increase_factor), cur_sim_rank + 1); est_retries_used += 1
-                        max_retries_layer = max(0, args_global.max_rank_retries - est_retries_used)
-                        if args_global.verbose: tqdm.write(f"    Using loaded R:{initial_rank_opt}, A:{initial_alpha_opt:.1f}. Max further retries for layer: {max_retries_layer}.")
+                initial_rank_opt, initial_alpha_opt, existing_params_init, max_retries_layer = resolve_layer_opt_settings(is_conv, seed_data)
                 outer_pbar_global.set_description_str(f"{current_op_mode_str} L{processed_layers_this_session_count_global + 1 - skipped_good_initial_loss_count_global} (Scan {keys_scanned_this_run_global}/{total_candidates_to_scan}, SkipGood:{skipped_good_initial_loss_count_global})")
                 opt_results = optimize_loha_for_layer(loha_key_prefix, delta_W_fp32, out_dim, in_dim_effective, k_h, k_w, initial_rank_opt, initial_alpha_opt, args_global.lr, args_global.max_iterations, args_global.min_iterations, args_global.target_loss, args_global.weight_decay, args_global.device, target_opt_dtype, is_conv, args_global.verbose_layer_debug, max_retries_layer, args_global.rank_increase_factor, existing_params_init)
-                if not opt_results.get('interrupted_mid_layer') and 'hada_w1_a' in opt_results :
-                    for p_name, p_val in opt_results.items():
-                        if p_name not in ['final_loss', 'stopped_early_by_loss', 'stopped_by_insufficient_progress', 'stopped_by_projection', 'projection_type_used', 'iterations_done', 'final_rank_used', 'interrupted_mid_layer', 'final_projected_loss_on_stop']:
-                            if torch.is_tensor(p_val): extracted_loha_state_dict_global[f'{loha_key_prefix}.{p_name}'] = p_val.to(final_save_dtype_torch)
-                    final_rank_used = opt_results['final_rank_used']
-                    stat_entry = {"name": str(loha_key_prefix),"original_name": str(original_module_path),"initial_rank_attempted": int(initial_rank_opt),"final_rank_used": int(final_rank_used),"rank_was_increased": bool(final_rank_used > initial_rank_opt),"final_loss": float(opt_results['final_loss']),"alpha_final": float(opt_results['alpha'].item()) if isinstance(opt_results.get('alpha'), torch.Tensor) else float(opt_results.get('alpha', 0.0)),"iterations_done": int(opt_results['iterations_done']),"stopped_early_by_loss_target": bool(opt_results['stopped_early_by_loss']),"stopped_by_insufficient_progress": bool(opt_results.get('stopped_by_insufficient_progress', False)),"stopped_by_projection": bool(opt_results.get('stopped_by_projection', False)),"projection_type_used": str(opt_results.get('projection_type_used', 'none')),"final_projected_loss_on_stop": float(l_val) if (l_val := opt_results.get('final_projected_loss_on_stop')) is not None else None,"skipped_reopt_due_to_initial_good_loss": False,"interrupted_mid_layer": bool(opt_results.get('interrupted_mid_layer', False))}
-                    layer_optimization_stats_global.append(stat_entry)
-                    all_completed_module_prefixes_ever_global.add(loha_key_prefix)
-                    stop_reason_short = ""
-                    if opt_results['stopped_early_by_loss']: stop_reason_short = ", Stop:LossTarget"
-                    elif opt_results.get('stopped_by_projection', False): stop_reason_short = f", Stop:Proj({opt_results.get('projection_type_used','?')})"
-                    elif opt_results['stopped_by_insufficient_progress']: stop_reason_short = ", Stop:RawProg"
-                    tqdm.write(f"  Layer {loha_key_prefix} Opt. Done. R_used: {final_rank_used}, FinalLoss: {opt_results['final_loss']:.4e}, Iters: {opt_results['iterations_done']}{stop_reason_short}")
-                    if args_global.use_bias:
-                        bias_key = f"{original_module_path}.bias"
-                        if bias_key in ft_model_sd and (bias_key not in base_model_sd or not torch.allclose(base_model_sd[bias_key], ft_model_sd[bias_key], atol=args_global.atol_fp32_check)):
-                            extracted_loha_state_dict_global[bias_key] = ft_model_sd[bias_key].cpu().to(final_save_dtype_torch)
-                            if args_global.verbose: tqdm.write(f"    Saved differing/new bias for {bias_key}")
-                    processed_layers_this_session_count_global += 1
-                    current_key_processed_or_skipped_good = True 
-                else:
-                     tqdm.write(f"  Optimization for {loha_key_prefix} did not yield saveable results (Interrupt: {opt_results.get('interrupted_mid_layer', 'N/A')}, Loss: {opt_results.get('final_loss', 'N/A')})")
-                     if not opt_results.get('interrupted_mid_layer', False) and 'hada_w1_a' not in opt_results :
-                         skipped_other_reason_count_global += 1
-                         all_completed_module_prefixes_ever_global.add(loha_key_prefix)
-            if current_key_processed_or_skipped_good: 
-                if args_global.save_every_n_layers > 0 and processed_layers_this_session_count_global > 0 and processed_layers_this_session_count_global % args_global.save_every_n_layers == 0 and keys_scanned_this_run_global < total_candidates_to_scan: 
-                    periodic_save_path = generate_intermediate_filename(args_global.save_to, len(all_completed_module_prefixes_ever_global))
-                    tqdm.write(f"\n--- Periodic Save: Processed {processed_layers_this_session_count_global} layers this session. Saving to {periodic_save_path} ---")
-                    if perform_graceful_save(periodic_save_path) and args_global.keep_n_resume_files > 0:
-                        cleanup_intermediate_files(args_global.save_to, True, args_global.keep_n_resume_files)
+                if commit_optimized_layer(loha_key_prefix, original_module_path, initial_rank_opt, opt_results, base_model_sd, ft_model_sd, final_save_dtype_torch):
+                    current_key_processed_or_skipped_good = True
+            if current_key_processed_or_skipped_good:
+                perform_periodic_save_if_due(total_candidates_to_scan)
+        if worker_pool is not None:
+            collect_layer_results(max_in_flight=0)
+        if not save_attempted_on_interrupt:
+            for group_key in list(pending_batches):
+                run_pending_batch(group_key)
         if not save_attempted_on_interrupt and keys_scanned_this_run_global == total_candidates_to_scan:
             main_loop_completed_scan_flag_global = True
     finally:
+        if delta_prefetcher is not None: delta_prefetcher.close()
+        if worker_pool is not None:
+            worker_pool.terminate(); worker_pool.join()
+            worker_pool_global = None
+        delta_cache_global = None
         if outer_pbar_global: outer_pbar_global.close()
 
     if not save_attempted_on_interrupt:
@@ -996,17 +1666,14 @@ def main(cli_args):
         )
         
         is_fully_complete = main_loop_completed_scan_flag_global and len(all_completed_module_prefixes_ever_global) >= total_candidates_to_scan
-        actual_save_path = args_global.save_to if is_fully_complete else generate_intermediate_filename(args_global.save_to, len(all_completed_module_prefixes_ever_global))
+        actual_save_path = args_global.save_to if is_fully_complete else output_writer_global.partial_path
         reason_for_save_path = "Saving to final path (all candidates processed/skipped)" if is_fully_complete else \
-                               ("Run incomplete (scan not finished or --max_layers hit)." if not main_loop_completed_scan_flag_global else "Full scan done, but not all layers processed/accounted for (e.g. new errors).")
+                               ("Run incomplete (scan not finished or --max_layers hit). Rerun to resume." if not main_loop_completed_scan_flag_global else "Full scan done, but not all layers processed/accounted for (e.g. new errors). Rerun to resume.")
         print(f"\n{reason_for_save_path}: {actual_save_path}")
-        if perform_graceful_save(output_path_to_save=actual_save_path):
-            if args_global.keep_n_resume_files > 0 and not is_fully_complete : 
-                 cleanup_intermediate_files(args_global.save_to, True, args_global.keep_n_resume_files)
-            if is_fully_complete and actual_save_path == args_global.save_to :
-                print("\nCleaning up ALL intermediate resume files (from this script's previous runs)...")
-                cleanup_intermediate_files(args_global.save_to, False)
-    else: print("\nProcess interrupted. Graceful save to intermediate file attempted.")
+        if perform_graceful_save(final=is_fully_complete) and is_fully_complete:
+            print("\nCleaning up legacy intermediate resume files (from this script's previous runs)...")
+            cleanup_intermediate_files(args_global.save_to)
+    else: print("\nProcess interrupted. Checkpoint of the partial output attempted.")
 
 def post_process_cli_args(parsed_args: argparse.Namespace) -> argparse.Namespace:
     if parsed_args.verbose_layer_debug:
@@ -1031,7 +1698,7 @@ def post_process_cli_args(parsed_args: argparse.Namespace) -> argparse.Namespace
     return parsed_args
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Extract LoHA parameters. Saves intermediate files like 'name_resume_L{count}.safetensors'.")
+    parser = argparse.ArgumentParser(description="Extract LoHA parameters. Progress is kept in '<save_to>.partial', which a rerun resumes.")
     parser.add_argument("base_model_path", type=str, help="Path to base model (.pt, .pth, .safetensors)")
     parser.add_argument("ft_model_path", type=str, help="Path to fine-tuned model (.pt, .pth, .safetensors)")
     parser.add_argument("save_to", type=str, help="Path for FINAL LoHA output (recommended .safetensors).")
@@ -1057,6 +1724,8 @@ if __name__ == "__main__":
     parser.add_argument("--precision", type=str, default="fp32", choices=["fp32", "fp16", "bf16"], help="Optimization precision.")
     parser.add_argument("--save_weights_dtype", type=str, default="bf16", choices=["fp32", "fp16", "bf16"], help="Dtype for saved LoHA weights.")
     parser.add_argument("--atol_fp32_check", type=float, default=1e-6, help="Tolerance for identical weight check.")
+    parser.add_argument("--init_method", type=str, default="kaiming", choices=["kaiming", "svd"], help="Init for fresh LoHA factors: 'kaiming' (Kaiming/normal noise) or 'svd' (start near the target from its truncated SVD).")
+    parser.add_argument("--benchmark_init", type=int, default=0, help="Benchmark mode: optimize the first N differing layers once per --init_method choice, report iterations and wall time to --target_loss, then exit without saving.")
     parser.add_argument("--no_warm_start", action="store_true", help="Disable warm-starting higher rank attempts from previous best.")
     parser.add_argument("--use_bias", action="store_true", help="Save differing bias terms into LoHA.")
     parser.add_argument("--dropout", type=float, default=0.0, help="General dropout (metadata only).")
@@ -1068,9 +1737,18 @@ if __name__ == "__main__":
     parser.add_argument("--projection_sample_interval", type=int, default=20, help="Loss sample interval for EMA (iterations).")
     parser.add_argument("--projection_ema_alpha", type=float, default=0.1, help="Smoothing factor for EMA.")
     parser.add_argument("--projection_min_ema_history", type=int, default=5, help="Min EMA samples for EMA-based projection.")
-    parser.add_argument("--save_every_n_layers", type=int, default=0, help="Save intermediate LoHA every N processed layers (0 to disable).")
-    parser.add_argument("--keep_n_resume_files", type=int, default=0, help="Keep only N most recent intermediate resume files (0 to keep all).")
+    parser.add_argument("--workers", type=int, default=0, help="Optimize layers in N worker processes fed from a shared work queue (0 or 1 for a single process).")
+    parser.add_argument("--threads_per_worker", type=int, default=None, help="torch threads per worker process with --workers. Defaults to CPU count / workers.")
+    parser.add_argument("--delta_cache_dir", type=str, default=None, help="Directory for the shared delta cache (see delta_cache.py). Built on first use for this model pair, then reused: identical layers are skipped from its index and neither model is loaded again.")
+    parser.add_argument("--stream_models", action="store_true", help="Open .safetensors models lazily with safe_open and read one layer pair at a time instead of loading both models into RAM.")
+    parser.add_argument("--prefetch_layers", type=int, default=4, help="With --stream_models, number of layer deltas read ahead on a background thread (0 to read on demand).")
+    parser.add_argument("--layer_batch_size", type=int, default=0, help="Optimize up to N new layers with identical shape/rank together in one batched optimizer (0 or 1 to optimize layer by layer).")
+    parser.add_argument("--save_every_n_layers", type=int, default=0, help="Checkpoint the partial output (fsync + resume journal) every N processed layers (0 to disable).")
+    parser.add_argument("--keep_n_resume_files", type=int, default=0, help="Deprecated, ignored: resume state now lives in a single '<save_to>.partial' file instead of '_resume_L' files.")
     
     raw_parsed_args = parser.parse_args()
     processed_args = post_process_cli_args(raw_parsed_args)
-    main(processed_args)
\ No newline at end of file
+    if processed_args.benchmark_init > 0:
+        run_init_benchmark(setup_and_print_configuration(processed_args))
+    else:
+        main(processed_args)
\ No newline at end of file
@@ -1,13 +1,18 @@
 import sys
 import os
 import argparse
+import contextlib
 import json
 import time
 import torch
-from safetensors.torch import load_file, save_file
 from tqdm import tqdm
 import logging # Import for logging
 
+from delta_cache import DeltaCache
+from svd_cache import SpectrumCache
+import svd_backend
+from safetensors_writer import write_safetensors
+
 # NEW: Add diffusers import for model loading
 try:
     from diffusers import StableDiffusionPipeline, StableDiffusionXLPipeline
@@ -157,6 +162,10 @@ def _str_to_dtype(p):
     return None
 
 def save_to_file(file_name, state_dict_to_save, dtype, metadata=None):
+    if os.path.splitext(file_name)[1] == ".safetensors":
+        # Tensors are cast and written one at a time instead of building a cast copy of the whole dict.
+        write_safetensors(file_name, state_dict_to_save, metadata=metadata, dtype=dtype)
+        return
     state_dict_final = {}
     for key, value in state_dict_to_save.items():
         if isinstance(value, torch.Tensor) and dtype is not None:
@@ -164,10 +173,7 @@ def save_to_file(file_name, state_dict_to_save, dtype, metadata=None):
         else:
             state_dict_final[key] = value
 
-    if os.path.splitext(file_name)[1] == ".safetensors":
-        save_file(state_dict_final, file_name, metadata=metadata)
-    else:
-        torch.save(state_dict_final, file_name)
+    torch.save(state_dict_final, file_name)
 
 def _build_local_sai_metadata(title, creation_time, is_v2_flag, is_v_param_flag, is_sdxl_flag):
     metadata = {}
@@ -285,14 +291,15 @@ def _construct_lora_weights_from_svd_components(U_full, S_all_values, Vh_full, r
     Vh_clamped = Vh_clamped.to(target_device_for_final_weights, dtype=target_dtype_for_final_weights).contiguous()
     return U_clamped, Vh_clamped
 
-def _log_svd_stats(lora_module_name, S_all_values, rank_used, min_sv_for_calc=MIN_SV):
+def _log_svd_stats(lora_module_name, S_all_values, rank_used, min_sv_for_calc=MIN_SV, fro_orig_total=None):
     if not S_all_values.numel():
         logger.info(f"{lora_module_name:75} | rank: {rank_used}, SVD not performed (empty singular values).")
         return
     S_cpu = S_all_values.to('cpu')
     s_sum_total = float(torch.sum(S_cpu))
     s_sum_rank = float(torch.sum(S_cpu[:rank_used]))
-    fro_orig_total = float(torch.sqrt(torch.sum(S_cpu.pow(2))))
+    # A truncated (randomized) spectrum does not contain the whole norm, so callers then pass it in.
+    if fro_orig_total is None: fro_orig_total = float(torch.sqrt(torch.sum(S_cpu.pow(2))))
     fro_reconstructed_rank = float(torch.sqrt(torch.sum(S_cpu[:rank_used].pow(2))))
     ratio_sv = float('inf')
     if rank_used > 0 and S_cpu[rank_used - 1].abs() > min_sv_for_calc:
@@ -336,32 +343,15 @@ def _prepare_lora_metadata(output_path, is_v2_flag, kohya_base_model_version_str
         final_metadata.update(sai_metadata_content)
     return final_metadata
 
-# --- Main SVD Function ---
-def svd(
-    model_org=None, model_tuned=None, save_to=None, dim=4, v2=None, sdxl=None, 
-    conv_dim=None, v_parameterization=None, device=None, save_precision=None,
-    clamp_quantile=0.99, min_diff=0.01, no_metadata=False, load_precision=None,
-    load_original_model_to=None, load_tuned_model_to=None,
-    dynamic_method=None, dynamic_param=None, verbose=False,
-):
-    actual_v_parameterization = v2 if v_parameterization is None else v_parameterization
-    load_dtype_torch = _str_to_dtype(load_precision)
-    save_dtype_torch = _str_to_dtype(save_precision) if save_precision else torch.float
-    
-    svd_computation_device = torch.device(device if device else "cuda" if torch.cuda.is_available() else "cpu")
-    logger.info(f"Using SVD computation device: {svd_computation_device}")
-    diff_calculation_device = torch.device("cpu")
-    logger.info(f"Calculating weight differences on: {diff_calculation_device}")
-    final_weights_device = torch.device("cpu")
-
+def _diffs_from_models(model_org, model_tuned, v2, sdxl, conv_dim, load_original_model_to, load_tuned_model_to,
+                       load_dtype_torch, diff_calculation_device, min_diff, delta_cache=None):
+    """Load both models, diff every LoRA-able module and, with a delta cache, store the diffs for later runs."""
     if not sdxl:
         text_encoders_o, unet_o = _load_sd_model_components(model_org, v2, load_original_model_to, load_dtype_torch)
         text_encoders_t, unet_t = _load_sd_model_components(model_tuned, v2, load_tuned_model_to, load_dtype_torch)
-        kohya_model_version = _local_get_model_version_str_for_sd1_sd2(v2, actual_v_parameterization)
     else:
         text_encoders_o, unet_o = _load_sdxl_model_components(model_org, load_original_model_to, load_dtype_torch)
         text_encoders_t, unet_t = _load_sdxl_model_components(model_tuned, load_tuned_model_to, load_dtype_torch)
-        kohya_model_version = _LOCAL_MODEL_VERSION_SDXL_BASE_V1_0
     
     # Determine lora_conv_dim_init based on conv_dim argument for network creation
     # The original script used init_dim_val (1) if conv_dim was None.
@@ -413,31 +403,138 @@ def svd(
     if text_encoder_different: # Only add TE loras if they were deemed different
         lora_names_to_process.update(p.lora_name for p in lora_network_o.text_encoder_loras)
     lora_names_to_process.update(p.lora_name for p in lora_network_o.unet_loras)
+    identical_names = {name for name in lora_names_to_process if name in all_diffs and not torch.any(all_diffs[name])}
+    if identical_names:
+        logger.info(f"Skipping {len(identical_names)} modules with identical weights.")
+        lora_names_to_process -= identical_names
+    module_stats = {name: (tuple(diff.shape), float(diff.abs().max())) for name, diff in {**te_diffs, **unet_diffs}.items()}
+
+    if delta_cache is not None:
+        logger.info(f"Writing weight differences to delta cache: {delta_cache.data_path}")
+        with delta_cache.writer() as writer:
+            for lora_name, diff in {**te_diffs, **unet_diffs}.items():
+                writer.add(lora_name, diff)
+    return all_diffs, lora_names_to_process, module_stats
+
+def _select_modules_from_index(index, min_diff):
+    """lora_names_to_process for a cache index (DeltaCache or SpectrumCache), with the same TE and identical-module rules as _diffs_from_models."""
+    te_names = [name for name in index.keys() if name.startswith("lora_te")]
+    unet_names = [name for name in index.keys() if not name.startswith("lora_te")]
+    text_encoder_different = any(index.max_abs(name) > min_diff for name in te_names)
+    if not text_encoder_different:
+        logger.warning("Text encoders are considered identical based on min_diff. Not extracting TE LoRA.")
+    lora_names_to_process = set(unet_names)
+    if text_encoder_different:
+        lora_names_to_process.update(te_names)
+    identical_names = {name for name in lora_names_to_process if index.is_identical(name)}
+    if identical_names:
+        logger.info(f"Skipping {len(identical_names)} modules with identical weights.")
+        lora_names_to_process -= identical_names
+    return lora_names_to_process
+
+def _diffs_from_cache(delta_cache, min_diff):
+    """Same result as _diffs_from_models, from the delta cache index alone; diffs are read lazily from the memory-mapped file."""
+    module_stats = {name: (delta_cache.shape(name), delta_cache.max_abs(name)) for name in delta_cache.keys()}
+    return delta_cache, _select_modules_from_index(delta_cache, min_diff), module_stats
+
+def _diff_cache_namespace(sdxl, v2, load_precision, conv_dim):
+    # Deltas depend on how the pipelines load the models, so that is part of the cache namespace.
+    return f"lora_{'sdxl' if sdxl else 'v2' if v2 else 'v1'}_{load_precision or 'native'}_{'conv' if conv_dim and conv_dim > 0 else 'linear'}"
+
+# --- Main SVD Function ---
+def svd(
+    model_org=None, model_tuned=None, save_to=None, dim=4, v2=None, sdxl=None, 
+    conv_dim=None, v_parameterization=None, device=None, save_precision=None,
+    clamp_quantile=0.99, min_diff=0.01, no_metadata=False, load_precision=None,
+    load_original_model_to=None, load_tuned_model_to=None,
+    dynamic_method=None, dynamic_param=None, verbose=False, delta_cache_dir=None,
+    svd_cache_dir=None, svd_cache_max_rank=None, svd_method="exact",
+):
+    actual_v_parameterization = v2 if v_parameterization is None else v_parameterization
+    load_dtype_torch = _str_to_dtype(load_precision)
+    save_dtype_torch = _str_to_dtype(save_precision) if save_precision else torch.float
     
+    svd_computation_device = torch.device(device if device else "cuda" if torch.cuda.is_available() else "cpu")
+    logger.info(f"Using SVD computation device: {svd_computation_device}")
+    diff_calculation_device = torch.device("cpu")
+    logger.info(f"Calculating weight differences on: {diff_calculation_device}")
+    final_weights_device = torch.device("cpu")
+
+    kohya_model_version = _LOCAL_MODEL_VERSION_SDXL_BASE_V1_0 if sdxl else _local_get_model_version_str_for_sd1_sd2(v2, actual_v_parameterization)
+    namespace = _diff_cache_namespace(sdxl, v2, load_precision, conv_dim)
+    delta_cache = DeltaCache(delta_cache_dir, model_org, model_tuned, namespace) if delta_cache_dir else None
+    max_requested_rank = max(dim, conv_dim or dim)
+    spectrum_cache = None
+    if svd_cache_dir:
+        spectrum_cache = SpectrumCache(svd_cache_dir, model_org, model_tuned, namespace, max(svd_cache_max_rank or 0, max_requested_rank))
+
+    # With a spectrum cache that covers every selected module at the requested rank, no diff is needed at all.
+    all_diffs, lora_names_to_process, module_stats = None, None, None
+    if spectrum_cache is not None and spectrum_cache.exists:
+        cached_names = _select_modules_from_index(spectrum_cache.open(), min_diff)
+        if spectrum_cache.covers(cached_names, max_requested_rank):
+            logger.info(f"Reading SVD spectra from cache: {spectrum_cache.data_path}")
+            lora_names_to_process = cached_names
+        else:
+            logger.info(f"SVD spectrum cache does not cover rank {max_requested_rank} for every module, recomputing.")
+    if lora_names_to_process is None:
+        if delta_cache is not None and delta_cache.exists:
+            logger.info(f"Reading weight differences from delta cache: {delta_cache.data_path}")
+            all_diffs, lora_names_to_process, module_stats = _diffs_from_cache(delta_cache.open(), min_diff)
+        else:
+            all_diffs, lora_names_to_process, module_stats = _diffs_from_models(
+                model_org, model_tuned, v2, sdxl, conv_dim, load_original_model_to, load_tuned_model_to,
+                load_dtype_torch, diff_calculation_device, min_diff, delta_cache
+            )
+    spectrum_writer = spectrum_cache.writer() if spectrum_cache is not None and all_diffs is not None else None
+    # Dynamic methods choose the rank from the whole spectrum and the spectrum cache stores all of S, so both need exact SVD.
+    if svd_method != "exact" and (dynamic_method or spectrum_writer is not None):
+        logger.info(f"--svd_method {svd_method} needs a fixed rank and no spectrum cache write, using exact SVD.")
+        svd_method = "exact"
+
+    if spectrum_writer is not None:
+        for lora_name, (diff_shape, max_abs) in module_stats.items():
+            spectrum_writer.add_module(lora_name, diff_shape, max_abs)
+
     logger.info("Extracting and resizing LoRA via SVD")
     lora_weights = {}
-    with torch.no_grad():
+    # The spectrum writer is closed when the loop completes and aborted (no .tmp files left) when it fails
+    with torch.no_grad(), spectrum_writer or contextlib.nullcontext():
         for lora_name in tqdm(lora_names_to_process):
-            if lora_name not in all_diffs:
+            fro_total = None
+            if all_diffs is None:
+                diff_shape = spectrum_cache.shape(lora_name)
+                U_full, S_full, Vh_full = spectrum_cache.get(lora_name)
+            elif lora_name not in all_diffs:
                 logger.warning(f"Skipping {lora_name} as no diff was calculated for it (e.g., Text Encoders were identical).")
                 continue
-            original_diff_tensor = all_diffs[lora_name]
-            is_conv2d_layer = len(original_diff_tensor.size()) == 4
-            kernel_s = original_diff_tensor.size()[2:4] if is_conv2d_layer else None
+            else:
+                original_diff_tensor = all_diffs[lora_name]
+                diff_shape = tuple(original_diff_tensor.size())
+            is_conv2d_layer = len(diff_shape) == 4
+            kernel_s = diff_shape[2:4] if is_conv2d_layer else None
             is_conv2d_3x3_layer = is_conv2d_layer and kernel_s != (1, 1)
-            module_true_out_channels, module_true_in_channels = original_diff_tensor.size()[0:2]
-            mat_for_svd = original_diff_tensor.to(svd_computation_device, dtype=torch.float)
-            if is_conv2d_layer:
-                if is_conv2d_3x3_layer: mat_for_svd = mat_for_svd.flatten(start_dim=1)
-                else: mat_for_svd = mat_for_svd.squeeze()
-            if mat_for_svd.numel() == 0 or mat_for_svd.shape[0] == 0 or mat_for_svd.shape[1] == 0 :
-                logger.warning(f"Skipping SVD for {lora_name} due to empty/invalid shape: {mat_for_svd.shape}")
-                continue
-            try:
-                U_full, S_full, Vh_full = torch.linalg.svd(mat_for_svd)
-            except Exception as e:
-                logger.error(f"SVD failed for {lora_name} with shape {mat_for_svd.shape}. Error: {e}")
-                continue
+            module_true_out_channels, module_true_in_channels = diff_shape[0:2]
+            if all_diffs is not None:
+                mat_for_svd = original_diff_tensor.to(svd_computation_device, dtype=torch.float)
+                if is_conv2d_layer:
+                    if is_conv2d_3x3_layer: mat_for_svd = mat_for_svd.flatten(start_dim=1)
+                    else: mat_for_svd = mat_for_svd.squeeze()
+                if mat_for_svd.numel() == 0 or mat_for_svd.shape[0] == 0 or mat_for_svd.shape[1] == 0 :
+                    logger.warning(f"Skipping SVD for {lora_name} due to empty/invalid shape: {mat_for_svd.shape}")
+                    continue
+                try:
+                    if svd_method == "exact":
+                        U_full, S_full, Vh_full = svd_backend.svd(mat_for_svd)
+                    else:
+                        module_rank = min(conv_dim if is_conv2d_3x3_layer else dim, *mat_for_svd.shape)
+                        U_full, S_full, Vh_full = svd_backend.svd(mat_for_svd, module_rank, svd_method)
+                        fro_total = svd_backend.frobenius_norm(mat_for_svd)
+                except Exception as e:
+                    logger.error(f"SVD failed for {lora_name} with shape {mat_for_svd.shape}. Error: {e}")
+                    continue
+                if spectrum_writer is not None:
+                    spectrum_writer.add(lora_name, U_full, S_full, Vh_full)
             
             # Max rank for SVD is based on 'dim' for linear and 'conv_dim' for conv3x3
             # The original `current_max_rank` logic was:
@@ -445,7 +542,7 @@ def svd(
             # Here, `dim` is args.dim and `conv_dim` is args.conv_dim (defaulted to args.dim)
             module_specific_max_rank = conv_dim if is_conv2d_3x3_layer else dim
             
-            eff_out_dim, eff_in_dim = mat_for_svd.shape[0], mat_for_svd.shape[1]
+            eff_out_dim, eff_in_dim = U_full.shape[0], Vh_full.shape[1]
             rank = _determine_rank(S_full, dynamic_method, dynamic_param,
                                    module_specific_max_rank, eff_in_dim, eff_out_dim, MIN_SV)
             U_clamped, Vh_clamped = _construct_lora_weights_from_svd_components(
@@ -455,7 +552,10 @@ def svd(
                 final_weights_device, save_dtype_torch
             )
             lora_weights[lora_name] = (U_clamped, Vh_clamped)
-            if verbose: _log_svd_stats(lora_name, S_full, rank, MIN_SV)
+            if verbose: _log_svd_stats(lora_name, S_full, rank, MIN_SV, fro_total)
+
+    if spectrum_writer is not None:
+        logger.info(f"SVD spectra cached up to rank {spectrum_cache.max_rank}: {spectrum_cache.data_path}")
 
     lora_sd = {}
     for lora_name, (up_weight, down_weight) in lora_weights.items():
@@ -464,7 +564,7 @@ def svd(
         # Alpha is set to the rank (dim of down_weight's 0th axis, which is rank)
         lora_sd[lora_name + ".alpha"] = torch.tensor(down_weight.size()[0], dtype=save_dtype_torch, device=final_weights_device)
 
-    del text_encoders_o, unet_o, lora_network_o, all_diffs # Clean up original models and placeholders
+    del all_diffs # Clean up the diffs (the models were released by _diffs_from_models)
     if 'torch' in sys.modules and hasattr(torch, 'cuda') and torch.cuda.is_available():
         torch.cuda.empty_cache()
         
@@ -506,6 +606,10 @@ def setup_parser():
     parser.add_argument("--load_tuned_model_to", type=str, default=None, help="Device for tuned model (e.g. 'cpu', 'cuda:0'). Defaults to CPU for SD1/2, honored for SDXL.")
     parser.add_argument("--dynamic_param", type=float, help="Parameter for dynamic rank reduction")
     parser.add_argument("--verbose", action="store_true", help="Show detailed rank reduction info for each module")
+    parser.add_argument("--svd_cache_dir", type=str, default=None, help="Directory for cached truncated SVD spectra. Later runs at any rank <= the cached max rank, with any dynamic method, reuse them instead of decomposing again.")
+    parser.add_argument("--svd_cache_max_rank", type=int, default=None, help="Rank up to which U/Vh are cached (S is always kept in full). Defaults to max(dim, conv_dim); set it to the largest rank you plan to sweep.")
+    parser.add_argument("--svd_method", type=str, default="exact", choices=svd_backend.SVD_METHODS, help="SVD backend. 'randomized' computes only the leading dim (+ oversampling) singular triplets and falls back to exact when its accuracy check fails; 'auto' uses it only where it saves work. Ignored with --dynamic_method or when writing --svd_cache_dir.")
+    parser.add_argument("--delta_cache_dir", type=str, default=None, help="Directory of the shared delta cache. The first run for a model pair stores the module diffs; later runs read them instead of loading either model.")
     parser.add_argument(
         "--dynamic_method", type=str,
         choices=[None, "sv_ratio", "sv_fro", "sv_cumulative", "sv_knee", "sv_rel_decrease", "sv_cumulative_knee"],
@@ -4,7 +4,9 @@ from collections import OrderedDict
 import os
 import argparse # Import argparse
 
-def extract_model_differences(base_model_path, finetuned_model_path, output_delta_path=None, save_dtype_str="float32"):
+from delta_cache import DeltaCache
+
+def extract_model_differences(base_model_path, finetuned_model_path, output_delta_path=None, save_dtype_str="float32", delta_cache_dir=None):
     """
     Calculates the difference between the state dictionaries of a fine-tuned model
     and a base model.
@@ -16,10 +18,16 @@ def extract_model_differences(base_model_path, finetuned_model_path, output_delt
                                            .safetensors file. If None, not saved.
         save_dtype_str (str, optional): Data type to save the delta weights ('float32', 'float16', 'bfloat16').
                                         Defaults to 'float32'.
+        delta_cache_dir (str, optional): Directory of the shared delta cache. When an entry for this
+                                         model pair exists, deltas are read from it instead of loading
+                                         either model; otherwise it is built first.
     Returns:
         OrderedDict: A state dictionary containing the delta weights.
                      Returns None if loading fails or other critical errors.
     """
+    if delta_cache_dir:
+        return _report_and_save(*_differences_from_cache(base_model_path, finetuned_model_path, delta_cache_dir), output_delta_path, save_dtype_str)
+
     print(f"Loading base model from: {base_model_path}")
     try:
         # Ensure model is loaded to CPU to avoid CUDA issues if not needed for diffing
@@ -90,6 +98,21 @@ def extract_model_differences(base_model_path, finetuned_model_path, output_delt
             print(f"  ... and {len(keys_only_in_base) - 5} more.")
 
 
+    return _report_and_save(delta_state_dict, diff_count, unique_to_finetuned_count, skipped_count, error_count, output_delta_path, save_dtype_str)
+
+
+def _differences_from_cache(base_model_path, finetuned_model_path, delta_cache_dir):
+    cache = DeltaCache(delta_cache_dir, base_model_path, finetuned_model_path)
+    print(f"{'Reading' if cache.exists else 'Building'} delta cache: {cache.data_path}")
+    cache.open_or_build()
+    delta_state_dict = OrderedDict((key, cache.get(key)) for key in cache.keys(kind=None))
+    keys_only_in_base = cache.index.get("only_in_base", [])
+    if keys_only_in_base:
+        print(f"\nWarning: {len(keys_only_in_base)} key(s) are present only in the base model and will not be in the delta file.")
+    return delta_state_dict, len(cache.keys("delta")), len(cache.keys("ft_only")), len(cache.index.get("skipped", {})), 0
+
+
+def _report_and_save(delta_state_dict, diff_count, unique_to_finetuned_count, skipped_count, error_count, output_delta_path, save_dtype_str):
     print(f"\nDifference calculation complete.")
     print(f"  {diff_count} layers successfully diffed.")
     print(f"  {unique_to_finetuned_count} layers unique to fine-tuned model (added as is).")
@@ -136,6 +159,9 @@ if __name__ == "__main__":
     parser.add_argument("--save_dtype", type=str, default="float32", choices=["float32", "float16", "bfloat16"],
                         help="Data type for saving the delta weights. Choose from 'float32', 'float16', 'bfloat16'. "
                              "Defaults to 'float32'.")
+    parser.add_argument("--delta_cache_dir", type=str, default=None,
+                        help="Optional: Directory of the shared delta cache. Reuses the cached deltas for this model pair "
+                             "(building them on first use) instead of loading both models.")
 
     args = parser.parse_args()
 
@@ -166,7 +192,8 @@ if __name__ == "__main__":
         args.base_model_path,
         args.finetuned_model_path,
         output_delta_path=output_delta_file,
-        save_dtype_str=args.save_dtype
+        save_dtype_str=args.save_dtype,
+        delta_cache_dir=args.delta_cache_dir
     )
 
     if differences:
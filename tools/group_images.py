@@ -1,9 +1,11 @@
 import argparse
 import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from PIL import Image, ImageOps
 import os
 import numpy as np
 
+import image_probe
 from library.utils import setup_logging
 import logging
 
@@ -11,9 +13,86 @@ import logging
 setup_logging()
 log = logging.getLogger(__name__)
 
+
+def crop_image(img, avg_aspect_ratio):
+    img_aspect_ratio = img.width / img.height
+    if img_aspect_ratio > avg_aspect_ratio:
+        # Too wide, reduce width
+        new_width = avg_aspect_ratio * img.height
+        left = (img.width - new_width) / 2
+        right = left + new_width
+        img = img.crop((left, 0, right, img.height))
+    else:
+        # Too tall, reduce height
+        new_height = img.width / avg_aspect_ratio
+        top = (img.height - new_height) / 2
+        bottom = top + new_height
+        img = img.crop((0, top, img.width, bottom))
+    return img
+
+
+def pad_image(img, avg_aspect_ratio):
+    img_aspect_ratio = img.width / img.height
+    if img_aspect_ratio < avg_aspect_ratio:
+        # Too tall, increase width
+        new_width = avg_aspect_ratio * img.height
+        pad_width = int((new_width - img.width) / 2)
+        img = ImageOps.expand(img, border=(pad_width, 0), fill='black')
+    else:
+        # Too wide, increase height
+        new_height = img.width / avg_aspect_ratio
+        pad_height = int((new_height - img.height) / 2)
+        img = ImageOps.expand(img, border=(0, pad_height), fill='black')
+    return img
+
+
+def processed_sizes(widths, heights, avg_aspect_ratios, pad):
+    """
+    (width, height) arrays of the images after crop_image / pad_image, computed from the sizes alone.
+
+    Mirrors the PIL arithmetic exactly: crop boxes are rounded (half to even, like round()), pad
+    borders are truncated, so the group's output size is known before any image is decoded.
+    """
+    widths = widths.astype(np.float64)
+    heights = heights.astype(np.float64)
+    ratios = widths / heights
+    if pad:
+        taller = ratios < avg_aspect_ratios
+        pad_width = np.trunc((avg_aspect_ratios * heights - widths) / 2)
+        pad_height = np.trunc((widths / avg_aspect_ratios - heights) / 2)
+        out_widths = np.where(taller, widths + 2 * pad_width, widths)
+        out_heights = np.where(taller, heights, heights + 2 * pad_height)
+    else:
+        wider = ratios > avg_aspect_ratios
+        new_widths = avg_aspect_ratios * heights
+        left = (widths - new_widths) / 2
+        new_heights = widths / avg_aspect_ratios
+        top = (heights - new_heights) / 2
+        out_widths = np.where(wider, np.round(left + new_widths) - np.round(left), widths)
+        out_heights = np.where(wider, heights, np.round(top + new_heights) - np.round(top))
+    return out_widths.astype(np.int64), out_heights.astype(np.int64)
+
+
+def _process_image(source_path, output_path, avg_aspect_ratio, target_size, pad):
+    """Worker: decode one image once, crop or pad it to the group's ratio, resize and save it."""
+    with Image.open(source_path) as img:
+        img = pad_image(img, avg_aspect_ratio) if pad else crop_image(img, avg_aspect_ratio)
+        img = img.resize(target_size)
+        img.convert('RGB').save(output_path, quality=70)
+    return output_path
+
+
 class ImageProcessor:
+    """
+    Sorts images by aspect ratio, splits them into groups of group_size and crops (or pads) every
+    image of a group to the group's mean ratio, resized to the largest processed size in the group.
 
-    def __init__(self, input_folder, output_folder, group_size, include_subfolders, do_not_copy_other_files, pad, caption, caption_ext):
+    The sizes come from one header-only pass (image_probe, optionally cached), the grouping and the
+    output sizes are computed with NumPy, and a process pool decodes, transforms and saves each
+    image exactly once. Sidecar files are looked up in a stem index built once per folder.
+    """
+
+    def __init__(self, input_folder, output_folder, group_size, include_subfolders, do_not_copy_other_files, pad, caption, caption_ext, workers=None, cache=None):
         self.input_folder = input_folder
         self.output_folder = output_folder
         self.group_size = group_size
@@ -23,6 +102,8 @@ class ImageProcessor:
         self.caption = caption
         self.caption_ext = caption_ext
         self.image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.tiff')
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache  # image_probe.ProbeCache, or None to read every header
 
     def get_image_paths(self):
         images = []
@@ -35,72 +116,45 @@ class ImageProcessor:
             images = [os.path.join(self.input_folder, f) for f in os.listdir(self.input_folder) if f.endswith(self.image_extensions)]
         return images
 
-    def group_images(self, images):
-        sorted_images = sorted(images, key=lambda path: Image.open(path).size[0] / Image.open(path).size[1])
-        groups = [sorted_images[i:i+self.group_size] for i in range(0, len(sorted_images), self.group_size)]
-        return groups
-
-    def process_group(self, group, group_index):
-        if len(group) > 0:
-            aspect_ratios = self.get_aspect_ratios(group)
-            avg_aspect_ratio = np.mean(aspect_ratios)
-            if self.pad:
-                padded_images = self.pad_images(group, avg_aspect_ratio)
-                self.resize_and_save_images(padded_images, group_index, group)
+    def read_sizes(self, images):
+        """(readable image paths, widths, heights) from the image headers."""
+        infos = image_probe.probe_many(images, self.cache)
+        readable = []
+        for path in images:
+            if infos[path] is None:
+                log.warning(f"Skipping unreadable image: {path}")
             else:
-                cropped_images = self.crop_images(group, avg_aspect_ratio)
-                self.resize_and_save_images(cropped_images, group_index, group)
-            if not self.do_not_copy_other_files:
-                self.copy_other_files(group, group_index)
-
-    def get_aspect_ratios(self, group):
-        aspect_ratios = []
-        for path in group:
-            with Image.open(path) as img:
-                width, height = img.size
-                aspect_ratios.append(width / height)
-        return aspect_ratios
-
-    def crop_images(self, group, avg_aspect_ratio):
-        cropped_images = []
-        for j, path in enumerate(group):
-            with Image.open(path) as img:
-                log.info(f"  Processing image {j+1}: {path}")
-                img = self.crop_image(img, avg_aspect_ratio)
-                cropped_images.append(img)
-        return cropped_images
-
-    def crop_image(self, img, avg_aspect_ratio):
-        img_aspect_ratio = img.width / img.height
-        if img_aspect_ratio > avg_aspect_ratio:
-            # Too wide, reduce width
-            new_width = avg_aspect_ratio * img.height
-            left = (img.width - new_width) / 2
-            right = left + new_width
-            img = img.crop((left, 0, right, img.height))
-        else:
-            # Too tall, reduce height
-            new_height = img.width / avg_aspect_ratio
-            top = (img.height - new_height) / 2
-            bottom = top + new_height
-            img = img.crop((0, top, img.width, bottom))
-        return img
-
-    def resize_and_save_images(self, cropped_images, group_index, source_paths):
-        max_width = max(img.width for img in cropped_images)
-        max_height = max(img.height for img in cropped_images)
-        for j, img in enumerate(cropped_images):
-            img = img.resize((max_width, max_height))
-            os.makedirs(self.output_folder, exist_ok=True)
-            original_filename = os.path.basename(source_paths[j])
-            filename_without_ext = os.path.splitext(original_filename)[0]
-            final_file_name = f"group-{group_index+1}-{j+1}-{filename_without_ext}"
-            output_path = os.path.join(self.output_folder, f"{final_file_name}.jpg")
-            log.info(f"  Saving processed image to {output_path}")
-            img.convert('RGB').save(output_path, quality=70)
-            
-            if self.caption:
-                self.create_caption_file(source_paths[j], group_index, final_file_name)
+                readable.append(path)
+        widths = np.array([infos[path].width for path in readable], dtype=np.int64)
+        heights = np.array([infos[path].height for path in readable], dtype=np.int64)
+        return readable, widths, heights
+
+    def plan_groups(self, images, widths, heights):
+        """
+        Per image in output order: (path, group index, index in group, group mean ratio, output size).
+        """
+        order = np.argsort(widths / heights, kind='stable')
+        widths, heights = widths[order], heights[order]
+        ratios = widths / heights
+        group_index = np.arange(len(order)) // self.group_size
+        starts = np.arange(0, len(order), self.group_size)
+        avg_ratios = (np.add.reduceat(ratios, starts) / np.diff(np.append(starts, len(order))))[group_index]
+        out_widths, out_heights = processed_sizes(widths, heights, avg_ratios, self.pad)
+        target_widths = np.maximum.reduceat(out_widths, starts)[group_index]
+        target_heights = np.maximum.reduceat(out_heights, starts)[group_index]
+        index_in_group = np.arange(len(order)) - starts[group_index]
+        return [
+            (images[i], int(g), int(j), float(avg), (int(tw), int(th)))
+            for i, g, j, avg, tw, th in zip(order, group_index, index_in_group, avg_ratios, target_widths, target_heights)
+        ]
+
+    def build_stem_index(self, images):
+        """(folder, stem) -> file names in that folder, listing each folder once."""
+        index = {}
+        for dirpath in sorted({os.path.dirname(path) for path in images}):
+            for filename in os.listdir(dirpath):
+                index.setdefault((dirpath, os.path.splitext(filename)[0]), []).append(filename)
+        return index
 
     def create_caption_file(self, source_path, group_index, caption_filename):
         dirpath = os.path.dirname(source_path)
@@ -110,60 +164,56 @@ class ImageProcessor:
         with open(caption_path, 'w') as f:
             f.write(caption)
 
-
-    def copy_other_files(self, group, group_index):
-        for j, path in enumerate(group):
-            dirpath, original_filename = os.path.split(path)
-            original_basename, original_ext = os.path.splitext(original_filename)
-            for filename in os.listdir(dirpath):
-                if filename.endswith('.npz'):  # Skip .npz
-                    continue
-                basename, ext = os.path.splitext(filename)
-                if basename == original_basename and ext != original_ext:
-                    shutil.copy2(os.path.join(dirpath, filename), os.path.join(self.output_folder, f"group-{group_index+1}-{j+1}-{filename}"))
+    def copy_other_files(self, path, group_index, j, stem_index):
+        dirpath, original_filename = os.path.split(path)
+        original_basename, original_ext = os.path.splitext(original_filename)
+        for filename in stem_index.get((dirpath, original_basename), []):
+            if filename.endswith('.npz'):  # Skip .npz
+                continue
+            if os.path.splitext(filename)[1] != original_ext:
+                shutil.copy2(os.path.join(dirpath, filename), os.path.join(self.output_folder, f"group-{group_index+1}-{j+1}-{filename}"))
 
     def process_images(self):
-        images = self.get_image_paths()
-        groups = self.group_images(images)
-        for i, group in enumerate(groups):
-            log.info(f"Processing group {i+1} with {len(group)} images...")
-            self.process_group(group, i)
-            
-    def process_group(self, group, group_index):
-        if len(group) > 0:
-            aspect_ratios = self.get_aspect_ratios(group)
-            avg_aspect_ratio = np.mean(aspect_ratios)
-            if self.pad:
-                padded_images = self.pad_images(group, avg_aspect_ratio)
-                self.resize_and_save_images(padded_images, group_index, group)
-            else:
-                cropped_images = self.crop_images(group, avg_aspect_ratio)
-                self.resize_and_save_images(cropped_images, group_index, group)
-            if not self.do_not_copy_other_files:
-                self.copy_other_files(group, group_index)
-
-    def pad_images(self, group, avg_aspect_ratio):
-        padded_images = []
-        for j, path in enumerate(group):
-            with Image.open(path) as img:
-                log.info(f"  Processing image {j+1}: {path}")
-                img = self.pad_image(img, avg_aspect_ratio)
-                padded_images.append(img)
-        return padded_images
-
-    def pad_image(self, img, avg_aspect_ratio):
-        img_aspect_ratio = img.width / img.height
-        if img_aspect_ratio < avg_aspect_ratio:
-            # Too tall, increase width
-            new_width = avg_aspect_ratio * img.height
-            pad_width = int((new_width - img.width) / 2)
-            img = ImageOps.expand(img, border=(pad_width, 0), fill='black')
-        else:
-            # Too wide, increase height
-            new_height = img.width / avg_aspect_ratio
-            pad_height = int((new_height - img.height) / 2)
-            img = ImageOps.expand(img, border=(0, pad_height), fill='black')
-        return img
+        images, widths, heights = self.read_sizes(self.get_image_paths())
+        if not images:
+            log.info("No images found.")
+            return
+        plan = self.plan_groups(images, widths, heights)
+        stem_index = None if self.do_not_copy_other_files else self.build_stem_index(images)
+        os.makedirs(self.output_folder, exist_ok=True)
+        log.info(f"Processing {len(plan)} images in {plan[-1][1] + 1} groups on {self.workers} worker(s)...")
+
+        max_in_flight = self.workers * 4
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = {}
+            queued = iter(plan)
+            while True:
+                while len(pending) < max_in_flight:
+                    item = next(queued, None)
+                    if item is None:
+                        break
+                    path, group_index, j, avg_aspect_ratio, target_size = item
+                    filename_without_ext = os.path.splitext(os.path.basename(path))[0]
+                    final_file_name = f"group-{group_index+1}-{j+1}-{filename_without_ext}"
+                    output_path = os.path.join(self.output_folder, f"{final_file_name}.jpg")
+                    future = pool.submit(_process_image, path, output_path, avg_aspect_ratio, target_size, self.pad)
+                    pending[future] = (item, final_file_name)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    (path, group_index, j, _, _), final_file_name = pending.pop(future)
+                    try:
+                        output_path = future.result()
+                    except Exception as e:
+                        log.error(f"  Could not process {path}: {e}")
+                        continue
+                    log.info(f"  Saved processed image {path} to {output_path}")
+                    if self.caption:
+                        self.create_caption_file(path, group_index, final_file_name)
+                    if stem_index is not None:
+                        self.copy_other_files(path, group_index, j, stem_index)
+
 
 def main():
     parser = argparse.ArgumentParser(description='Process groups of images.')
@@ -175,10 +225,12 @@ def main():
     parser.add_argument('--pad', action='store_true', help='Pad images instead of cropping them')
     parser.add_argument('--caption', action='store_true', help='Create a caption file for each image')
     parser.add_argument('--caption_ext', type=str, default='.txt', help='Extension for the caption file')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    image_probe.add_cache_arguments(parser)
 
     args = parser.parse_args()
 
-    processor = ImageProcessor(args.input_folder, args.output_folder, args.group_size, args.include_subfolders, args.do_not_copy_other_files, args.pad, args.caption, args.caption_ext)
+    processor = ImageProcessor(args.input_folder, args.output_folder, args.group_size, args.include_subfolders, args.do_not_copy_other_files, args.pad, args.caption, args.caption_ext, args.workers, image_probe.cache_from_args(args))
     processor.process_images()
 
 if __name__ == "__main__":
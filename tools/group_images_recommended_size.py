@@ -1,19 +1,20 @@
 import argparse
-from PIL import Image
 import os
 import numpy as np
-import itertools
+
+import image_probe
 
 class ImageProcessor:
 
-    def __init__(self, input_folder, min_group, max_group, include_subfolders, pad):
+    def __init__(self, input_folder, min_group, max_group, include_subfolders, pad, cache=None):
         self.input_folder = input_folder
         self.min_group = min_group
         self.max_group = max_group
         self.include_subfolders = include_subfolders
         self.pad = pad
         self.image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
-        self.losses = []  # List to store loss values for each image
+        self.cache = cache  # image_probe.ProbeCache, or None to read every header
+        self.sizes = {}  # path -> ImageInfo, read once from the image headers
 
     def get_image_paths(self):
         images = []
@@ -26,77 +27,32 @@ class ImageProcessor:
             images = [os.path.join(self.input_folder, f) for f in os.listdir(self.input_folder) if f.endswith(self.image_extensions)]
         return images
 
-    def group_images(self, images, group_size):
-        sorted_images = sorted(images, key=lambda path: Image.open(path).size[0] / Image.open(path).size[1])
-        groups = [sorted_images[i:i+group_size] for i in range(0, len(sorted_images), group_size)]
-        return groups
-
-    def process_group(self, group):
-        if len(group) > 0:
-            aspect_ratios = self.get_aspect_ratios(group)
-            avg_aspect_ratio = np.mean(aspect_ratios)
-            self.calculate_losses(group, avg_aspect_ratio)
-
-    def get_aspect_ratios(self, group):
-        aspect_ratios = []
-        for path in group:
-            with Image.open(path) as img:
-                width, height = img.size
-                aspect_ratios.append(width / height)
-        return aspect_ratios
-
-    def calculate_losses(self, group, avg_aspect_ratio):
-        for j, path in enumerate(group):
-            with Image.open(path) as img:
-                loss = self.calculate_loss(img, avg_aspect_ratio)
-                self.losses.append((path, loss))  # Add (path, loss) tuple to the list
-
-    def calculate_loss(self, img, avg_aspect_ratio):
-        img_aspect_ratio = img.width / img.height
-        if img_aspect_ratio > avg_aspect_ratio:
-            # Too wide, reduce width
-            new_width = avg_aspect_ratio * img.height
-            loss = abs(img.width - new_width) / img.width  # Calculate loss value
-        else:
-            # Too tall, reduce height
-            new_height = img.width / avg_aspect_ratio
-            loss = abs(img.height - new_height) / img.height  # Calculate loss value
-        return loss
-
-    def monte_carlo_optimization(self, groups):
-        best_groups = groups.copy()
-        best_loss = np.inf
-        best_removed_images = []
-
-        for group in groups:
-            num_images = len(group)
-            all_combinations = []
-            # Generate all possible combinations of images to remove
-            for r in range(1, num_images + 1):
-                combinations = list(itertools.combinations(group, r))
-                all_combinations.extend(combinations)
-
-            for combination in all_combinations:
-                self.losses = []  # Reset losses for each combination
-                remaining_images = list(set(group) - set(combination))
-                self.process_group(remaining_images)
-                avg_loss = np.mean(self.losses)
-
-                if avg_loss < best_loss:
-                    best_loss = avg_loss
-                    best_groups[best_groups.index(group)] = remaining_images
-                    best_removed_images = combination
-
-        return best_groups, best_loss, best_removed_images
+    def load_sizes(self, images):
+        infos = image_probe.probe_many(images, self.cache)
+        unreadable = [path for path, info in infos.items() if info is None]
+        for path in unreadable:
+            print(f"Skipping unreadable image: {path}")
+        self.sizes = {path: info for path, info in infos.items() if info is not None}
+        return [path for path in images if path in self.sizes]
+
+    def optimize_groups(self, images, group_size):
+        """Best groups of `group_size` images and the images left out, with the average crop loss of the kept images."""
+        sorted_images = sorted(images, key=lambda path: self.sizes[path].aspect_ratio)
+        ratios = np.array([self.sizes[path].aspect_ratio for path in sorted_images], dtype=np.float64)
+        starts, removed, avg_loss = optimize_groups(ratios, group_size)
+        groups = [sorted_images[start:start+group_size] for start in starts]
+        removed_images = [sorted_images[i] for i in removed]
+        return groups, avg_loss, removed_images
 
     def process_images(self):
-        images = self.get_image_paths()
+        images = self.load_sizes(self.get_image_paths())
         num_images = len(images)
         results = []
 
         for group_size in range(self.min_group, self.max_group + 1):
-            groups = self.group_images(images, group_size)
-            optimized_groups, avg_loss, removed_images = self.monte_carlo_optimization(groups)
+            if group_size > num_images:
+                break
+            optimized_groups, avg_loss, removed_images = self.optimize_groups(images, group_size)
             num_remaining = num_images % group_size
 
             results.append((group_size, avg_loss, num_remaining, optimized_groups, removed_images))
@@ -110,6 +66,79 @@ class ImageProcessor:
             print(f"Removed Images: {removed_images}")
 
 
+def crop_losses(ratios, target_ratio):
+    """Fraction of each image cropped away to reach target_ratio (width lost if wider, height lost if taller)."""
+    return np.where(ratios > target_ratio, 1 - target_ratio / ratios, 1 - ratios / target_ratio)
+
+
+def window_crop_costs(ratios, group_size):
+    """
+    Total crop loss of every window ratios[s:s+group_size] cropped to its mean ratio, for all s at once.
+
+    ratios must be sorted. Inside a window the images at or below the mean lose (1 - a / m) and those
+    above it lose (1 - m / a), so with prefix sums of a and 1 / a and the split point found by binary
+    search each window costs O(1) whatever the group size.
+    """
+    n = len(ratios)
+    starts = np.arange(n - group_size + 1)
+    ends = starts + group_size
+    prefix = np.concatenate(([0.0], np.cumsum(ratios)))
+    prefix_inv = np.concatenate(([0.0], np.cumsum(1 / ratios)))
+    means = (prefix[ends] - prefix[starts]) / group_size
+    split = np.clip(np.searchsorted(ratios, means, side="right"), starts, ends)
+    below = (split - starts) - (prefix[split] - prefix[starts]) / means
+    above = (ends - split) - means * (prefix_inv[ends] - prefix_inv[split])
+    return np.maximum(below + above, 0.0)
+
+
+def optimize_groups(ratios, group_size):
+    """
+    Split sorted aspect ratios into n // group_size groups of group_size images, leaving out the
+    n % group_size images that minimize the total crop loss (each group cropped to its mean ratio).
+
+    In sorted order the optimal groups are runs of consecutive images with the left-out images
+    between them, so with d images left out before group g the group starts at g * group_size + d:
+
+        best[g + 1][d] = cost[g * group_size + d] + min(best[g][0..d])
+
+    The loop runs over the groups and each step is vectorized over d, so the whole search is
+    O(n / group_size * (n % group_size)) NumPy work instead of trying every subset of every group.
+
+    Returns (group start indices, left-out indices, average crop loss of the kept images).
+    """
+    n = len(ratios)
+    n_groups, n_removed = divmod(n, group_size)
+    if n_groups == 0:
+        return [], list(range(n)), 0.0
+    costs = window_crop_costs(np.asarray(ratios, dtype=np.float64), group_size)
+
+    offsets = np.arange(n_removed + 1)
+    best = costs[offsets]  # first group, starting after d left-out images
+    parents = np.empty((n_groups, n_removed + 1), dtype=np.int64)
+    parents[0] = 0
+    for g in range(1, n_groups):
+        # Cheapest earlier state d' <= d, via a running minimum and the index where it was reached
+        running_min = np.minimum.accumulate(best)
+        positions = np.where(best == running_min, offsets, 0)
+        parents[g] = np.maximum.accumulate(positions)
+        best = running_min + costs[g * group_size + offsets]
+
+    # The images after the last group make up the remaining left-outs
+    d = int(np.argmin(best))
+    total_loss = float(best[d])
+    starts = []
+    for g in range(n_groups - 1, -1, -1):
+        starts.append(g * group_size + d)
+        d = int(parents[g][d])
+    starts.reverse()
+
+    kept = np.zeros(n, dtype=bool)
+    for start in starts:
+        kept[start:start + group_size] = True
+    removed = np.flatnonzero(~kept).tolist()
+    return starts, removed, total_loss / (n_groups * group_size)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Process groups of images.')
     parser.add_argument('input_folder', type=str, help='Input folder containing images')
@@ -117,10 +146,11 @@ def main():
     parser.add_argument('max_group', type=int, help='Maximum group size')
     parser.add_argument('--include_subfolders', action='store_true', help='Include subfolders in search for images')
     parser.add_argument('--pad', action='store_true', help='Pad images instead of cropping them')
+    image_probe.add_cache_arguments(parser)
 
     args = parser.parse_args()
 
-    processor = ImageProcessor(args.input_folder, args.min_group, args.max_group, args.include_subfolders, args.pad)
+    processor = ImageProcessor(args.input_folder, args.min_group, args.max_group, args.include_subfolders, args.pad, image_probe.cache_from_args(args))
     processor.process_images()
 
 
@@ -0,0 +1,206 @@
+"""
+Parallel image conversion engine shared by convert_images_to_webp.py and convert_images_to_hq_jpg.py.
+
+    jobs = plan_conversions("dataset", "png", "webp", recursive=True)
+    stats = convert_images(jobs, save_kwargs={"lossless": True}, workers=8)
+
+Each image is decoded and encoded in a worker process (WebP lossless and optimized JPEG encoding
+are CPU-bound, so threads would not help). At most `max_in_flight` images are queued at a time,
+so memory stays flat on folders of any size.
+
+Outputs are written to a temporary file next to the target and renamed into place, so an
+interrupted run never leaves a truncated image. A target that already exists is skipped, which
+makes re-runs idempotent and never touches an unrelated file that happens to share the stem
+(a hand-made a.jpg next to a.png). With refresh, a target older than its source is converted
+again instead, so only use it where every target was written by this tool. With an output folder,
+caption and other sidecar files that share the image's stem (a.txt, a.caption, a.npz, ...) are
+copied along when their size or mtime differ.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Files with these extensions are images of their own, never sidecars of an image with the same stem
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff", ".avif", ".jxl")
+
+ConversionJob = namedtuple("ConversionJob", ["source", "target", "sidecars"])
+
+
+def _is_fresh(source, target):
+    """True if target exists, is not empty and is at least as new as source."""
+    try:
+        target_stat = os.stat(target)
+        return target_stat.st_size > 0 and target_stat.st_mtime_ns >= os.stat(source).st_mtime_ns
+    except OSError:
+        return False
+
+
+def plan_conversions(directory, in_ext, out_ext, recursive=False, output_dir=None):
+    """
+    ConversionJobs for the *.<in_ext> files of directory (and its subfolders if recursive).
+
+    Targets go next to their sources, or under output_dir with the same folder layout. Sidecars
+    (other non-image files with the same stem) are only listed when output_dir is set, since in
+    place they already sit next to the converted image.
+    """
+    in_suffix = "." + in_ext.lower().lstrip(".")
+    out_suffix = "." + out_ext.lstrip(".")
+    jobs = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        by_stem = {}
+        for name in files:
+            by_stem.setdefault(os.path.splitext(name)[0], []).append(name)
+        target_root = root if output_dir is None else os.path.join(output_dir, os.path.relpath(root, directory))
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() != in_suffix:
+                continue
+            sidecars = []
+            if output_dir is not None:
+                sidecars = [
+                    (os.path.join(root, other), os.path.join(target_root, other))
+                    for other in sorted(by_stem[stem])
+                    if not other.lower().endswith(IMAGE_EXTENSIONS + (in_suffix, out_suffix.lower()))
+                ]
+            jobs.append(ConversionJob(os.path.join(root, name), os.path.join(target_root, stem + out_suffix), sidecars))
+        if not recursive:
+            break
+    return jobs
+
+
+def _convert(source, target, image_format, save_kwargs, rgb_only):
+    """Worker: decode source and encode it to target atomically. Returns the bytes written."""
+    from PIL import Image
+
+    with Image.open(source) as image:
+        info = {key: image.info[key] for key in ("icc_profile", "exif") if image.info.get(key)}
+        if rgb_only and image.mode not in ("RGB", "L", "CMYK"):
+            # JPEG has no alpha: flatten transparent images onto white rather than failing
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target) or ".", prefix=".convert_", suffix=os.path.splitext(target)[1])
+        os.close(fd)
+        try:
+            # The temporary file keeps the target's extension, so PIL picks the format from it when image_format is None
+            image.save(tmp_path, format=image_format, **info, **save_kwargs)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return os.path.getsize(target)
+
+
+def _copy_sidecar(source, target):
+    """Copy a sidecar file unless the target already has the same size and mtime. Returns True if copied."""
+    try:
+        source_stat, target_stat = os.stat(source), os.stat(target)
+        if (source_stat.st_size, source_stat.st_mtime_ns) == (target_stat.st_size, target_stat.st_mtime_ns):
+            return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target) or ".", prefix=".convert_")
+    os.close(fd)
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+    return True
+
+
+def convert_images(
+    jobs,
+    image_format=None,
+    save_kwargs=None,
+    workers=None,
+    max_in_flight=None,
+    delete_originals=False,
+    rgb_only=False,
+    refresh=False,
+    log=print,
+):
+    """
+    Run ConversionJobs on a process pool. Returns {"converted", "skipped", "failed", "sidecars",
+    "seconds", "images_per_sec"}; images/sec counts converted images only.
+
+    image_format is the PIL format name (None: from the target extension). With delete_originals
+    a source is removed once its target is in place (never when source and target are the same file).
+    An existing target is skipped; with refresh, only when it is at least as new as its source.
+    """
+    save_kwargs = save_kwargs or {}
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    stats = {"converted": 0, "skipped": 0, "failed": 0, "sidecars": 0}
+    start = time.perf_counter()
+
+    def finish(job, delete_source):
+        for sidecar_source, sidecar_target in job.sidecars:
+            try:
+                stats["sidecars"] += _copy_sidecar(sidecar_source, sidecar_target)
+            except OSError as e:
+                log(f"Error copying {sidecar_source}: {e}")
+        if delete_source and os.path.abspath(job.source) != os.path.abspath(job.target):
+            os.remove(job.source)
+
+    todo = []
+    for job in jobs:
+        exists = _is_fresh(job.source, job.target) if refresh else os.path.exists(job.target)
+        if os.path.abspath(job.source) == os.path.abspath(job.target) or exists:
+            log(f"Skipping {job.source} because {job.target} already exists")
+            stats["skipped"] += 1
+            finish(job, delete_source=False)
+        else:
+            todo.append(job)
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            pending = {}
+            queued = iter(todo)
+            while True:
+                # Keep the pool busy without queueing every image up front
+                while len(pending) < max_in_flight:
+                    job = next(queued, None)
+                    if job is None:
+                        break
+                    pending[pool.submit(_convert, job.source, job.target, image_format, save_kwargs, rgb_only)] = job
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = pending.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        log(f"Error processing {job.source}: {e}")
+                        stats["failed"] += 1
+                        continue
+                    stats["converted"] += 1
+                    log(job.target)
+                    finish(job, delete_originals)
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["images_per_sec"] = stats["converted"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    log(
+        f"Converted {stats['converted']} image(s) in {stats['seconds']:.1f}s ({stats['images_per_sec']:.1f} images/sec), "
+        f"skipped {stats['skipped']}, failed {stats['failed']}, copied {stats['sidecars']} sidecar file(s)"
+    )
+    return stats
+
+
+def add_engine_arguments(parser):
+    parser.add_argument("--recursive", action="store_true", help="also convert the images in subfolders")
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="write the converted images (and their caption/sidecar files) here instead of next to the originals")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="convert again the images whose existing target is older than the source, overwriting that target "
+                             "(by default any existing target is skipped)")
+    parser.add_argument("--max_in_flight", type=int, default=None, help="images queued to the workers at once (default: 2 x workers)")
+
@@ -0,0 +1,274 @@
+"""
+Header-only image size probe with a persistent cache, shared by the aspect-ratio tools.
+
+`probe(path)` reads only the first bytes of the file: PNG IHDR, JPEG SOF (and the EXIF orientation
+in APP1), WebP VP8 / VP8L / VP8X, GIF and BMP headers. Other formats fall back to PIL, which also
+only parses the header. No pixel data is decoded.
+
+`ProbeCache` stores (width, height, format, orientation) in a sqlite database keyed by path and
+validated by file size and mtime, so re-sorting a folder only costs one stat per image:
+
+    cache = ProbeCache()                    # ~/.cache/kohya_ss/image_probe.sqlite
+    infos = cache.probe_many(paths)         # {path: ImageInfo or None}
+    ratio = infos[path].aspect_ratio
+
+`width`/`height` are the stored pixel dimensions (what PIL's Image.size reports); `display_size`
+applies the EXIF orientation (what cv2.imread and ImageOps.exif_transpose produce).
+"""
+
+import os
+import sqlite3
+import struct
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get("KOHYA_SS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "kohya_ss")),
+    "image_probe.sqlite",
+)
+HEADER_READ_SIZE = 64 * 1024  # enough for the SOF of JPEGs with ordinary EXIF/ICC segments
+PROBE_WORKERS = 16
+SQL_CHUNK = 500
+
+
+class ImageInfo(namedtuple("ImageInfo", ["width", "height", "format", "orientation"])):
+    __slots__ = ()
+
+    @property
+    def display_size(self):
+        """(width, height) after applying the EXIF orientation (5-8 swap the axes)."""
+        return (self.height, self.width) if self.orientation in (5, 6, 7, 8) else (self.width, self.height)
+
+    @property
+    def aspect_ratio(self):
+        return self.width / self.height
+
+    @property
+    def display_aspect_ratio(self):
+        width, height = self.display_size
+        return width / height
+
+
+def _png(data):
+    if len(data) >= 24 and data[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", data[16:24])
+        return ImageInfo(width, height, "PNG", 1)
+    return None
+
+
+def _gif(data):
+    width, height = struct.unpack("<HH", data[6:10])
+    return ImageInfo(width, height, "GIF", 1)
+
+
+def _bmp(data):
+    header_size = struct.unpack("<I", data[14:18])[0]
+    if header_size == 12:
+        width, height = struct.unpack("<HH", data[18:22])
+    else:
+        width, height = struct.unpack("<ii", data[18:26])
+    return ImageInfo(abs(width), abs(height), "BMP", 1)
+
+
+def _webp(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 " and data[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", data[26:30])
+        return ImageInfo(width & 0x3FFF, height & 0x3FFF, "WEBP", 1)
+    if chunk == b"VP8L" and data[20] == 0x2F:
+        bits = int.from_bytes(data[21:25], "little")
+        return ImageInfo((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, "WEBP", 1)
+    if chunk == b"VP8X":
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return ImageInfo(width, height, "WEBP", 1)
+    return None
+
+
+def _exif_orientation(segment):
+    """Orientation tag (0x0112) of an APP1 Exif segment payload, 1 if absent."""
+    if segment[:6] != b"Exif\x00\x00":
+        return 1
+    tiff = segment[6:]
+    endian = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if endian is None or len(tiff) < 8:
+        return 1
+    ifd_offset = struct.unpack(endian + "I", tiff[4:8])[0]
+    if ifd_offset + 2 > len(tiff):
+        return 1
+    (count,) = struct.unpack(endian + "H", tiff[ifd_offset : ifd_offset + 2])
+    for i in range(count):
+        entry = ifd_offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, _, _ = struct.unpack(endian + "HHI", tiff[entry : entry + 8])
+        if tag == 0x0112:
+            (value,) = struct.unpack(endian + "H", tiff[entry + 8 : entry + 10])
+            return value if 1 <= value <= 8 else 1
+    return 1
+
+
+# Start-of-frame markers carry the size; C4 (DHT), C8 (JPG) and CC (DAC) share the range but do not.
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg(f, data):
+    orientation = 1
+    pos = 2
+    while True:
+        # Large APPn segments (ICC profiles, thumbnails) can push the SOF past the first read
+        while pos + 4 > len(data):
+            more = f.read(HEADER_READ_SIZE)
+            if not more:
+                return None
+            data += more
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # markers without a length
+            pos += 2
+            continue
+        (length,) = struct.unpack(">H", data[pos + 2 : pos + 4])
+        while pos + 2 + length > len(data):
+            more = f.read(max(HEADER_READ_SIZE, pos + 2 + length - len(data)))
+            if not more:
+                return None
+            data += more
+        if marker == 0xE1 and orientation == 1:
+            orientation = _exif_orientation(data[pos + 4 : pos + 2 + length])
+        elif marker in _SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[pos + 5 : pos + 9])
+            return ImageInfo(width, height, "JPEG", orientation)
+        elif marker == 0xDA:  # start of scan without a frame header
+            return None
+        pos += 2 + length
+
+
+def _pil(path):
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(path) as image:
+            orientation = image.getexif().get(0x0112, 1) if hasattr(image, "getexif") else 1
+            return ImageInfo(image.width, image.height, image.format or "", orientation)
+    except Exception:
+        return None
+
+
+def probe(path):
+    """ImageInfo of an image file from its header, or None if it cannot be read."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read(HEADER_READ_SIZE)
+            if data[:8] == b"\x89PNG\r\n\x1a\n":
+                info = _png(data)
+            elif data[:2] == b"\xff\xd8":
+                info = _jpeg(f, data)
+            elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+                info = _webp(data)
+            elif data[:6] in (b"GIF87a", b"GIF89a"):
+                info = _gif(data)
+            elif data[:2] == b"BM":
+                info = _bmp(data)
+            else:
+                info = None
+    except (OSError, struct.error, IndexError):
+        info = None
+    # Unusual layouts (and formats without a parser here) go to PIL's header parser
+    return info if info is not None and info.width > 0 and info.height > 0 else _pil(path)
+
+
+class ProbeCache:
+    """
+    sqlite store of probe results keyed by path and validated by (size, mtime_ns).
+
+    Safe to share between threads; several processes may use the same file (sqlite locking).
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "width INTEGER, height INTEGER, format TEXT, orientation INTEGER)"
+            )
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def probe(self, path):
+        return self.probe_many([path])[path]
+
+    def probe_many(self, paths, workers=PROBE_WORKERS):
+        """{path: ImageInfo or None}. Cached entries are used when size and mtime match; the rest are probed on a thread pool."""
+        paths = list(dict.fromkeys(paths))
+        # abspath() is most of a warm lookup's cost, so absolute paths (the usual case) are used as they are
+        keys = {path: path if os.path.isabs(path) else os.path.abspath(path) for path in paths}
+
+        stats = {}
+        for key in keys.values():
+            try:
+                st = os.stat(key)
+                stats[key] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                pass
+
+        conn = self._connection()
+        cached = {}
+        stat_keys = list(stats)
+        for start in range(0, len(stat_keys), SQL_CHUNK):
+            chunk = stat_keys[start : start + SQL_CHUNK]
+            rows = conn.execute(
+                f"SELECT path, size, mtime_ns, width, height, format, orientation FROM images WHERE path IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for key, size, mtime_ns, width, height, fmt, orientation in rows:
+                if stats[key] == (size, mtime_ns):
+                    cached[key] = ImageInfo(width, height, fmt, orientation)
+
+        missing = [key for key in stat_keys if key not in cached]
+        if missing:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                probed = list(pool.map(probe, missing))
+            rows = [
+                (key, *stats[key], info.width, info.height, info.format, info.orientation)
+                for key, info in zip(missing, probed)
+                if info is not None
+            ]
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            cached.update(zip(missing, probed))
+
+        return {path: cached.get(key) for path, key in keys.items()}
+
+
+def probe_many(paths, cache=None, workers=PROBE_WORKERS):
+    """{path: ImageInfo or None}, through `cache` if given, else probing every file."""
+    if cache is not None:
+        return cache.probe_many(paths, workers)
+    paths = list(dict.fromkeys(paths))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(paths, pool.map(probe, paths)))
+
+
+def add_cache_arguments(parser):
+    parser.add_argument("--probe_cache", type=str, default=DEFAULT_CACHE_PATH, help="sqlite file caching image sizes between runs")
+    parser.add_argument("--no_probe_cache", action="store_true", help="Read every image header instead of using the size cache")
+
+
+def cache_from_args(args):
+    return None if args.no_probe_cache else ProbeCache(args.probe_cache)
@@ -117,13 +117,28 @@ def get_args():
         default=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--delta_cache_dir",
+        help=(
+            "directory of the shared delta cache (see delta_cache.py). Built on first use for this model pair, "
+            "then reused: later runs read the deltas from it and load neither model"
+        ),
+        default=None,
+        type=str,
+    )
     return parser.parse_args()
 
 
 ARGS = get_args()
 
 
-from lycoris.utils import extract_diff
+if ARGS.delta_cache_dir:
+    # The local copy of lycoris.utils reads and fills the shared delta cache
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from delta_cache import DeltaCache
+    from lycoris_utils import delta_cache_covers, extract_diff
+else:
+    from lycoris.utils import extract_diff
 from library.model_util import load_models_from_stable_diffusion_checkpoint
 from library.sdxl_model_util import load_models_from_sdxl_checkpoint
 
@@ -133,12 +148,32 @@ from safetensors.torch import save_file
 
 def main():
     args = ARGS
-    if args.is_sdxl:
-        base = load_models_from_sdxl_checkpoint(None, args.base_model, "cpu")
-        db = load_models_from_sdxl_checkpoint(None, args.db_model, "cpu")
+    cache_kwargs = {}
+    if args.delta_cache_dir:
+        model_kind = "sdxl" if args.is_sdxl else "v2" if args.is_v2 else "v1"
+        cache_kwargs["delta_cache"] = DeltaCache(args.delta_cache_dir, args.base_model, args.db_model, f"locon_{model_kind}")
+
+    if cache_kwargs and delta_cache_covers(cache_kwargs["delta_cache"], args.use_sparse_bias, not args.disable_cp):
+        print(f"Reading the deltas from {cache_kwargs['delta_cache'].data_path}")
+        base_tes = db_tes = base_unet = db_unet = None
     else:
-        base = load_models_from_stable_diffusion_checkpoint(args.is_v2, args.base_model)
-        db = load_models_from_stable_diffusion_checkpoint(args.is_v2, args.db_model)
+        if args.is_sdxl:
+            base = load_models_from_sdxl_checkpoint(None, args.base_model, "cpu")
+            db = load_models_from_sdxl_checkpoint(None, args.db_model, "cpu")
+        else:
+            base = load_models_from_stable_diffusion_checkpoint(args.is_v2, args.base_model)
+            db = load_models_from_stable_diffusion_checkpoint(args.is_v2, args.db_model)
+
+        if args.is_sdxl:
+            db_tes = [db[0], db[1]]
+            db_unet = db[3]
+            base_tes = [base[0], base[1]]
+            base_unet = base[3]
+        else:
+            db_tes = [db[0]]
+            db_unet = db[2]
+            base_tes = [base[0]]
+            base_unet = base[2]
 
     linear_mode_param = {
         "fixed": args.linear_dim,
@@ -155,17 +190,6 @@ def main():
         "full": None,
     }[args.mode]
 
-    if args.is_sdxl:
-        db_tes = [db[0], db[1]]
-        db_unet = db[3]
-        base_tes = [base[0], base[1]]
-        base_unet = base[3]
-    else:
-        db_tes = [db[0]]
-        db_unet = db[2]
-        base_tes = [base[0]]
-        base_unet = base[2]
-
     state_dict = extract_diff(
         base_tes,
         db_tes,
@@ -178,6 +202,7 @@ def main():
         args.use_sparse_bias,
         args.sparsity,
         not args.disable_cp,
+        **cache_kwargs,
     )
 
     if args.safetensors:
@@ -6,10 +6,11 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-import torch.linalg as linalg
 
 from tqdm import tqdm
 
+import svd_backend
+
 
 def make_sparse(t: torch.Tensor, sparsity=0.95):
     abs_t = torch.abs(t)
@@ -25,11 +26,17 @@ def extract_conv(
     mode_param = 0,
     device = 'cpu',
     is_cp = False,
+    svd_method = 'exact',
 ) -> Tuple[nn.Parameter, nn.Parameter]:
     weight = weight.to(device)
     out_ch, in_ch, kernel_size, _ = weight.shape
     
-    U, S, Vh = linalg.svd(weight.reshape(out_ch, -1))
+    # Only 'fixed' knows its rank before seeing the spectrum, so only it can use a truncated SVD.
+    U, S, Vh = svd_backend.svd(
+        weight.reshape(out_ch, -1),
+        max(1, mode_param) if mode=='fixed' else None,
+        svd_method,
+    )
     
     if mode=='fixed':
         lora_rank = mode_param
@@ -69,11 +76,16 @@ def extract_linear(
     mode = 'fixed',
     mode_param = 0,
     device = 'cpu',
+    svd_method = 'exact',
 ) -> Tuple[nn.Parameter, nn.Parameter]:
     weight = weight.to(device)
     out_ch, in_ch = weight.shape
     
-    U, S, Vh = linalg.svd(weight)
+    U, S, Vh = svd_backend.svd(
+        weight,
+        max(1, mode_param) if mode=='fixed' else None,
+        svd_method,
+    )
     
     if mode=='fixed':
         lora_rank = mode_param
@@ -108,17 +120,35 @@ def extract_linear(
     return (extract_weight_A, extract_weight_B, diff), 'low rank'
 
 
+def delta_cache_covers(delta_cache, use_bias = False, small_conv = True):
+    """True if extract_diff can run from delta_cache alone, so neither model has to be loaded."""
+    # Entries written before the allclose flag was recorded are rebuilt
+    return delta_cache is not None and delta_cache.records_allclose and not (use_bias and small_conv)
+
+
 def extract_diff(
-    base_model,
-    db_model,
+    base_tes,
+    db_tes,
+    base_unet,
+    db_unet,
     mode = 'fixed',
     linear_mode_param = 0,
     conv_mode_param = 0,
     extract_device = 'cpu',
     use_bias = False,
     sparsity = 0.98,
-    small_conv = True
+    small_conv = True,
+    delta_cache = None,
+    svd_method = 'exact',
 ):
+    """
+    base_tes/db_tes are lists of text encoders (two for SDXL, named lora_te1/lora_te2).
+
+    delta_cache: optional delta_cache.DeltaCache keyed by lora name. If delta_cache_covers() it,
+    the deltas are read from it and the models are not touched (they may be None); otherwise it is
+    filled while diffing the models. With use_bias and small_conv the models are always diffed,
+    since the sparse bias of 3x3 convs is taken from the fine-tuned weight, which the cache does not hold.
+    """
     UNET_TARGET_REPLACE_MODULE = [
         "Transformer2DModel", 
         "Attention", 
@@ -135,12 +165,75 @@ def extract_diff(
     TEXT_ENCODER_TARGET_REPLACE_MODULE = ["CLIPAttention", "CLIPMLP"]
     LORA_PREFIX_UNET = 'lora_unet'
     LORA_PREFIX_TEXT_ENCODER = 'lora_te'
+
+    def decompose(loras, lora_name, layer, delta, root_weight=None):
+        if layer == 'Linear':
+            weight, decompose_mode = extract_linear(
+                delta,
+                mode,
+                linear_mode_param,
+                device = extract_device,
+                svd_method = svd_method,
+            )
+            if decompose_mode == 'low rank':
+                extract_a, extract_b, diff = weight
+        elif layer == 'Conv2d':
+            is_linear = (delta.shape[2] == 1
+                         and delta.shape[3] == 1)
+            weight, decompose_mode = extract_conv(
+                delta, 
+                mode,
+                linear_mode_param if is_linear else conv_mode_param,
+                device = extract_device,
+                svd_method = svd_method,
+            )
+            if decompose_mode == 'low rank':
+                extract_a, extract_b, diff = weight
+            if small_conv and not is_linear and decompose_mode == 'low rank':
+                dim = extract_a.size(0)
+                (extract_c, extract_a, _), _ = extract_conv(
+                    extract_a.transpose(0, 1), 
+                    'fixed', dim, 
+                    extract_device, True, svd_method
+                )
+                extract_a = extract_a.transpose(0, 1)
+                extract_c = extract_c.transpose(0, 1)
+                loras[f'{lora_name}.lora_mid.weight'] = extract_c.detach().cpu().contiguous().half()
+                if use_bias:
+                    # Residual of the raw fine-tuned weight, only diffed models (never the cache) get here
+                    diff = root_weight - torch.einsum(
+                        'i j k l, j r, p i -> p r k l', 
+                        extract_c, extract_a.flatten(1, -1), extract_b.flatten(1, -1)
+                    ).detach().cpu().contiguous()
+                del extract_c
+        else:
+            return
+        if decompose_mode == 'low rank':
+            loras[f'{lora_name}.lora_down.weight'] = extract_a.detach().cpu().contiguous().half()
+            loras[f'{lora_name}.lora_up.weight'] = extract_b.detach().cpu().contiguous().half()
+            loras[f'{lora_name}.alpha'] = torch.Tensor([extract_a.shape[0]]).half()
+            if use_bias:
+                diff = diff.detach().cpu().reshape(extract_b.size(0), -1)
+                sparse_diff = make_sparse(diff, sparsity).to_sparse().coalesce()
+                
+                indices = sparse_diff.indices().to(torch.int16)
+                values = sparse_diff.values().half()
+                loras[f'{lora_name}.bias_indices'] = indices
+                loras[f'{lora_name}.bias_values'] = values
+                loras[f'{lora_name}.bias_size'] = torch.tensor(diff.shape).to(torch.int16)
+            del extract_a, extract_b, diff
+        elif decompose_mode == 'full':
+            loras[f'{lora_name}.diff'] = weight.detach().cpu().contiguous().half()
+        else:
+            raise NotImplementedError
+
     def make_state_dict(
         prefix, 
         root_module: torch.nn.Module,
         target_module: torch.nn.Module,
         target_replace_modules,
-        target_replace_names = []
+        target_replace_names = [],
+        cache_writer = None,
     ):
         loras = {}
         temp = {}
@@ -156,6 +249,16 @@ def extract_diff(
             elif name in target_replace_names:
                 temp_name[name] = module.weight
         
+        def process(lora_name, layer, root_weight, weights):
+            if layer not in {'Linear', 'Conv2d'}:
+                return
+            identical = torch.allclose(root_weight, weights)
+            if cache_writer is not None:
+                cache_writer.add(lora_name, root_weight - weights, allclose=identical)
+            if identical:
+                return
+            decompose(loras, lora_name, layer, root_weight - weights, root_weight)
+
         for name, module in tqdm(list(target_module.named_modules())):
             if name in temp:
                 weights = temp[name]
@@ -164,147 +267,56 @@ def extract_diff(
                     lora_name = lora_name.replace('.', '_')
                     layer = child_module.__class__.__name__
                     if layer in {'Linear', 'Conv2d'}:
-                        root_weight = child_module.weight
-                        if torch.allclose(root_weight, weights[child_name]):
-                            continue
-                    
-                    if layer == 'Linear':
-                        weight, decompose_mode = extract_linear(
-                            (child_module.weight - weights[child_name]),
-                            mode,
-                            linear_mode_param,
-                            device = extract_device,
-                        )
-                        if decompose_mode == 'low rank':
-                            extract_a, extract_b, diff = weight
-                    elif layer == 'Conv2d':
-                        is_linear = (child_module.weight.shape[2] == 1
-                                     and child_module.weight.shape[3] == 1)
-                        weight, decompose_mode = extract_conv(
-                            (child_module.weight - weights[child_name]), 
-                            mode,
-                            linear_mode_param if is_linear else conv_mode_param,
-                            device = extract_device,
-                        )
-                        if decompose_mode == 'low rank':
-                            extract_a, extract_b, diff = weight
-                        if small_conv and not is_linear and decompose_mode == 'low rank':
-                            dim = extract_a.size(0)
-                            (extract_c, extract_a, _), _ = extract_conv(
-                                extract_a.transpose(0, 1), 
-                                'fixed', dim, 
-                                extract_device, True
-                            )
-                            extract_a = extract_a.transpose(0, 1)
-                            extract_c = extract_c.transpose(0, 1)
-                            loras[f'{lora_name}.lora_mid.weight'] = extract_c.detach().cpu().contiguous().half()
-                            diff = child_module.weight - torch.einsum(
-                                'i j k l, j r, p i -> p r k l', 
-                                extract_c, extract_a.flatten(1, -1), extract_b.flatten(1, -1)
-                            ).detach().cpu().contiguous()
-                            del extract_c
-                    else:
-                        continue
-                    if decompose_mode == 'low rank':
-                        loras[f'{lora_name}.lora_down.weight'] = extract_a.detach().cpu().contiguous().half()
-                        loras[f'{lora_name}.lora_up.weight'] = extract_b.detach().cpu().contiguous().half()
-                        loras[f'{lora_name}.alpha'] = torch.Tensor([extract_a.shape[0]]).half()
-                        if use_bias:
-                            diff = diff.detach().cpu().reshape(extract_b.size(0), -1)
-                            sparse_diff = make_sparse(diff, sparsity).to_sparse().coalesce()
-                            
-                            indices = sparse_diff.indices().to(torch.int16)
-                            values = sparse_diff.values().half()
-                            loras[f'{lora_name}.bias_indices'] = indices
-                            loras[f'{lora_name}.bias_values'] = values
-                            loras[f'{lora_name}.bias_size'] = torch.tensor(diff.shape).to(torch.int16)
-                        del extract_a, extract_b, diff
-                    elif decompose_mode == 'full':
-                        loras[f'{lora_name}.diff'] = weight.detach().cpu().contiguous().half()
-                    else:
-                        raise NotImplementedError
+                        process(lora_name, layer, child_module.weight, weights[child_name])
             elif name in temp_name:
-                weights = temp_name[name]
                 lora_name = prefix + '.' + name
                 lora_name = lora_name.replace('.', '_')
-                layer = module.__class__.__name__
-                
-                if layer in {'Linear', 'Conv2d'}:
-                    root_weight = module.weight
-                    if torch.allclose(root_weight, weights):
-                        continue
-                
-                if layer == 'Linear':
-                    weight, decompose_mode = extract_linear(
-                        (root_weight - weights),
-                        mode,
-                        linear_mode_param,
-                        device = extract_device,
-                    )
-                    if decompose_mode == 'low rank':
-                        extract_a, extract_b, diff = weight
-                elif layer == 'Conv2d':
-                    is_linear = (
-                        root_weight.shape[2] == 1
-                        and root_weight.shape[3] == 1
-                    )
-                    weight, decompose_mode = extract_conv(
-                        (root_weight - weights), 
-                        mode,
-                        linear_mode_param if is_linear else conv_mode_param,
-                        device = extract_device,
-                    )
-                    if decompose_mode == 'low rank':
-                        extract_a, extract_b, diff = weight
-                    if small_conv and not is_linear and decompose_mode == 'low rank':
-                        dim = extract_a.size(0)
-                        (extract_c, extract_a, _), _ = extract_conv(
-                            extract_a.transpose(0, 1), 
-                            'fixed', dim, 
-                            extract_device, True
-                        )
-                        extract_a = extract_a.transpose(0, 1)
-                        extract_c = extract_c.transpose(0, 1)
-                        loras[f'{lora_name}.lora_mid.weight'] = extract_c.detach().cpu().contiguous().half()
-                        diff = root_weight - torch.einsum(
-                            'i j k l, j r, p i -> p r k l', 
-                            extract_c, extract_a.flatten(1, -1), extract_b.flatten(1, -1)
-                        ).detach().cpu().contiguous()
-                        del extract_c
-                else:
-                    continue
-                if decompose_mode == 'low rank':
-                    loras[f'{lora_name}.lora_down.weight'] = extract_a.detach().cpu().contiguous().half()
-                    loras[f'{lora_name}.lora_up.weight'] = extract_b.detach().cpu().contiguous().half()
-                    loras[f'{lora_name}.alpha'] = torch.Tensor([extract_a.shape[0]]).half()
-                    if use_bias:
-                        diff = diff.detach().cpu().reshape(extract_b.size(0), -1)
-                        sparse_diff = make_sparse(diff, sparsity).to_sparse().coalesce()
-                        
-                        indices = sparse_diff.indices().to(torch.int16)
-                        values = sparse_diff.values().half()
-                        loras[f'{lora_name}.bias_indices'] = indices
-                        loras[f'{lora_name}.bias_values'] = values
-                        loras[f'{lora_name}.bias_size'] = torch.tensor(diff.shape).to(torch.int16)
-                    del extract_a, extract_b, diff
-                elif decompose_mode == 'full':
-                    loras[f'{lora_name}.diff'] = weight.detach().cpu().contiguous().half()
-                else:
-                    raise NotImplementedError
+                process(lora_name, module.__class__.__name__, module.weight, temp_name[name])
         return loras
-    
-    text_encoder_loras = make_state_dict(
-        LORA_PREFIX_TEXT_ENCODER, 
-        base_model[0], db_model[0], 
-        TEXT_ENCODER_TARGET_REPLACE_MODULE
-    )
-    
-    unet_loras = make_state_dict(
-        LORA_PREFIX_UNET,
-        base_model[2], db_model[2], 
-        UNET_TARGET_REPLACE_MODULE,
-        UNET_TARGET_REPLACE_NAME
-    )
+
+    def make_state_dict_from_cache(prefix):
+        # Identical layers are skipped with the torch.allclose result recorded when the cache was built
+        # (the prefix also matches the lora_te1/lora_te2 text encoders of SDXL)
+        loras = {}
+        for lora_name in tqdm([k for k in delta_cache.keys() if k.startswith(prefix)]):
+            if delta_cache.allclose(lora_name):
+                continue
+            layer = {2: 'Linear', 4: 'Conv2d'}.get(len(delta_cache.shape(lora_name)))
+            if layer is not None:
+                decompose(loras, lora_name, layer, delta_cache.get(lora_name))
+        return loras
+
+    if delta_cache_covers(delta_cache, use_bias, small_conv):
+        delta_cache.open()
+        text_encoder_loras = make_state_dict_from_cache(LORA_PREFIX_TEXT_ENCODER)
+        unet_loras = make_state_dict_from_cache(LORA_PREFIX_UNET)
+    else:
+        cache_complete = delta_cache is not None and delta_cache.records_allclose
+        cache_writer = delta_cache.writer() if delta_cache is not None and not cache_complete else None
+        try:
+            text_encoder_loras = {}
+            for i, (base_te, db_te) in enumerate(zip(base_tes, db_tes)):
+                prefix = f'{LORA_PREFIX_TEXT_ENCODER}{i + 1}' if len(base_tes) > 1 else LORA_PREFIX_TEXT_ENCODER
+                text_encoder_loras |= make_state_dict(
+                    prefix, 
+                    base_te, db_te, 
+                    TEXT_ENCODER_TARGET_REPLACE_MODULE,
+                    cache_writer = cache_writer,
+                )
+            
+            unet_loras = make_state_dict(
+                LORA_PREFIX_UNET,
+                base_unet, db_unet, 
+                UNET_TARGET_REPLACE_MODULE,
+                UNET_TARGET_REPLACE_NAME,
+                cache_writer = cache_writer,
+            )
+        except BaseException:
+            if cache_writer is not None:
+                cache_writer.abort()
+            raise
+        if cache_writer is not None:
+            cache_writer.close()
     print(len(text_encoder_loras), len(unet_loras))
     return text_encoder_loras|unet_loras
 
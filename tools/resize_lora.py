@@ -7,11 +7,15 @@
 # Thanks to cloneofsimo and kohya
 
 import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
 import torch
-from safetensors.torch import load_file, save_file, safe_open
+from safetensors.torch import load_file, safe_open
 from tqdm import tqdm
 from library import train_util, model_util
 import numpy as np
+import svd_backend
+from safetensors_writer import write_safetensors
 
 MIN_SV = 1e-6
 
@@ -32,15 +36,16 @@ def load_state_dict(file_name, dtype):
 
 
 def save_to_file(file_name, model, state_dict, dtype, metadata):
+  if model_util.is_safetensors(file_name):
+    # Cast while streaming, one tensor at a time.
+    write_safetensors(file_name, model, metadata, dtype)
+    return
+
   if dtype is not None:
     for key in list(state_dict.keys()):
       if type(state_dict[key]) == torch.Tensor:
         state_dict[key] = state_dict[key].to(dtype)
-
-  if model_util.is_safetensors(file_name):
-    save_file(model, file_name, metadata)
-  else:
-    torch.save(model, file_name)
+  torch.save(model, file_name)
 
 
 def index_sv_cumulative(S, target):
@@ -65,11 +70,13 @@ def index_sv_fro(S, target):
 
 
 # Modified from Kohaku-blueleaf's extract/merge functions
-def extract_conv(weight, lora_rank, dynamic_method, dynamic_param, device, scale=1):
+def extract_conv(weight, lora_rank, dynamic_method, dynamic_param, device, scale=1, svd_method="exact"):
     out_size, in_size, kernel_size, _ = weight.size()
-    U, S, Vh = torch.linalg.svd(weight.reshape(out_size, -1).to(device))
+    matrix = weight.reshape(out_size, -1).to(device)
+    # Dynamic methods look at the whole spectrum, so only a fixed rank can use the randomized SVD.
+    U, S, Vh = svd_backend.svd(matrix, None if dynamic_method else lora_rank, svd_method)
     
-    param_dict = rank_resize(S, lora_rank, dynamic_method, dynamic_param, scale)
+    param_dict = rank_resize(S, lora_rank, dynamic_method, dynamic_param, scale, svd_backend.frobenius_norm(matrix))
     lora_rank = param_dict["new_rank"]
 
     U = U[:, :lora_rank]
@@ -83,12 +90,13 @@ def extract_conv(weight, lora_rank, dynamic_method, dynamic_param, device, scale
     return param_dict
 
 
-def extract_linear(weight, lora_rank, dynamic_method, dynamic_param, device, scale=1):
+def extract_linear(weight, lora_rank, dynamic_method, dynamic_param, device, scale=1, svd_method="exact"):
     out_size, in_size = weight.size()
+    matrix = weight.to(device)
     
-    U, S, Vh = torch.linalg.svd(weight.to(device))
+    U, S, Vh = svd_backend.svd(matrix, None if dynamic_method else lora_rank, svd_method)
     
-    param_dict = rank_resize(S, lora_rank, dynamic_method, dynamic_param, scale)
+    param_dict = rank_resize(S, lora_rank, dynamic_method, dynamic_param, scale, svd_backend.frobenius_norm(matrix))
     lora_rank = param_dict["new_rank"]
     
     U = U[:, :lora_rank]
@@ -129,7 +137,9 @@ def merge_linear(lora_down, lora_up, device):
     return weight
   
 
-def rank_resize(S, rank, dynamic_method, dynamic_param, scale=1):
+def rank_resize(S, rank, dynamic_method, dynamic_param, scale=1, fro_norm=None):
+    # S may be only the leading part of the spectrum (randomized SVD); fro_norm is then the exact
+    # Frobenius norm of the full matrix. sum(S) retained is always relative to the S given.
     param_dict = {}
 
     if dynamic_method=="sv_ratio":
@@ -168,7 +178,7 @@ def rank_resize(S, rank, dynamic_method, dynamic_param, scale=1):
     s_rank = torch.sum(torch.abs(S[:new_rank]))
     
     S_squared = S.pow(2)
-    s_fro = torch.sqrt(torch.sum(S_squared))
+    s_fro = torch.sqrt(torch.sum(S_squared)) if fro_norm is None else fro_norm
     s_red_fro = torch.sqrt(torch.sum(S_squared[:new_rank]))
     fro_percent = float(s_red_fro/s_fro)
 
@@ -181,7 +191,41 @@ def rank_resize(S, rank, dynamic_method, dynamic_param, scale=1):
     return param_dict
 
 
-def resize_lora_model(lora_sd, new_rank, save_dtype, device, dynamic_method, dynamic_param, verbose):
+def build_module_index(lora_sd):
+  """module name -> {"down": key, "up": key, "alpha": key or None}, in order of first appearance.
+
+  Keys are grouped by their module prefix, so lora_down/lora_up/alpha do not need to be adjacent.
+  """
+  index = {}
+  for key in lora_sd.keys():
+    module = key.split(".")[0]
+    if 'lora_down' in key:
+      index.setdefault(module, {"down": None, "up": None, "alpha": None})["down"] = key
+    elif 'lora_up' in key:
+      index.setdefault(module, {"down": None, "up": None, "alpha": None})["up"] = key
+    elif key.endswith('alpha'):
+      index.setdefault(module, {"down": None, "up": None, "alpha": None})["alpha"] = key
+  return index
+
+
+def resize_layer(lora_down_weight, lora_up_weight, new_rank, device, dynamic_method, dynamic_param, scale, svd_method):
+  """Merge one down/up pair and re-decompose it. Returns (param_dict, merge seconds, svd seconds)."""
+  start = time.perf_counter()
+  conv2d = (len(lora_down_weight.size()) == 4)
+  if conv2d:
+    full_weight_matrix = merge_conv(lora_down_weight, lora_up_weight, device)
+  else:
+    full_weight_matrix = merge_linear(lora_down_weight, lora_up_weight, device)
+  merged = time.perf_counter()
+
+  if conv2d:
+    param_dict = extract_conv(full_weight_matrix, new_rank, dynamic_method, dynamic_param, device, scale, svd_method)
+  else:
+    param_dict = extract_linear(full_weight_matrix, new_rank, dynamic_method, dynamic_param, device, scale, svd_method)
+  return param_dict, merged - start, time.perf_counter() - merged
+
+
+def resize_lora_model(lora_sd, new_rank, save_dtype, device, dynamic_method, dynamic_param, verbose, svd_method="exact", threads=1):
   network_alpha = None
   network_dim = None
   verbose_str = "\n"
@@ -203,66 +247,65 @@ def resize_lora_model(lora_sd, new_rank, save_dtype, device, dynamic_method, dyn
   if dynamic_method:
     print(f"Dynamically determining new alphas and dims based off {dynamic_method}: {dynamic_param}, max rank is {new_rank}")
 
-  lora_down_weight = None
-  lora_up_weight = None
+  module_index = build_module_index(lora_sd)
+  modules = []
+  for module, keys in module_index.items():
+    if keys["down"] is None or keys["up"] is None:
+      print(f"skipping {module}: missing {'lora_up' if keys['down'] else 'lora_down'} weight, copied as is")
+    else:
+      modules.append(module)
 
   o_lora_sd = lora_sd.copy()
-  block_down_name = None
-  block_up_name = None
-
-  with torch.no_grad():
-    for key, value in tqdm(lora_sd.items()):
-      if 'lora_down' in key:
-        block_down_name = key.split(".")[0]
-        lora_down_weight = value
-      if 'lora_up' in key:
-        block_up_name = key.split(".")[0]
-        lora_up_weight = value
-
-      weights_loaded = (lora_down_weight is not None and lora_up_weight is not None)
-
-      if (block_down_name == block_up_name) and weights_loaded:
-
-        conv2d = (len(lora_down_weight.size()) == 4)
-
-        if conv2d:
-          full_weight_matrix = merge_conv(lora_down_weight, lora_up_weight, device)
-          param_dict = extract_conv(full_weight_matrix, new_rank, dynamic_method, dynamic_param, device, scale)
-        else:
-          full_weight_matrix = merge_linear(lora_down_weight, lora_up_weight, device)
-          param_dict = extract_linear(full_weight_matrix, new_rank, dynamic_method, dynamic_param, device, scale)
-
-        if verbose:
-          max_ratio = param_dict['max_ratio']
-          sum_retained = param_dict['sum_retained']
-          fro_retained = param_dict['fro_retained']
-          if not np.isnan(fro_retained):
-            fro_list.append(float(fro_retained))
-
-          verbose_str+=f"{block_down_name:75} | "
-          verbose_str+=f"sum(S) retained: {sum_retained:.1%}, fro retained: {fro_retained:.1%}, max(S) ratio: {max_ratio:0.1f}"
-
-        if verbose and dynamic_method:
-          verbose_str+=f", dynamic | dim: {param_dict['new_rank']}, alpha: {param_dict['new_alpha']}\n"
-        else:
-          verbose_str+=f"\n"
-
-        new_alpha = param_dict['new_alpha']
-        o_lora_sd[block_down_name + "." + "lora_down.weight"] = param_dict["lora_down"].to(save_dtype).contiguous()
-        o_lora_sd[block_up_name + "." + "lora_up.weight"] = param_dict["lora_up"].to(save_dtype).contiguous()
-        o_lora_sd[block_up_name + "." "alpha"] = torch.tensor(param_dict['new_alpha']).to(save_dtype)
-
-        block_down_name = None
-        block_up_name = None
-        lora_down_weight = None
-        lora_up_weight = None
-        weights_loaded = False
-        del param_dict
+  new_alpha = None
+  layer_times = []
+  start = time.perf_counter()
+
+  # Merge + SVD of different modules are independent and torch releases the GIL inside them, so
+  # threads overlap the heavy parts. Results are consumed in index order, so the output is deterministic.
+  with torch.no_grad(), ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+    futures = [
+      pool.submit(
+        resize_layer, lora_sd[module_index[module]["down"]], lora_sd[module_index[module]["up"]],
+        new_rank, device, dynamic_method, dynamic_param, scale, svd_method,
+      )
+      for module in modules
+    ]
+    for module, future in tqdm(zip(modules, futures), total=len(modules)):
+      param_dict, merge_time, svd_time = future.result()
+      layer_times.append((module, merge_time, svd_time))
+
+      if verbose:
+        max_ratio = param_dict['max_ratio']
+        sum_retained = param_dict['sum_retained']
+        fro_retained = param_dict['fro_retained']
+        if not np.isnan(fro_retained):
+          fro_list.append(float(fro_retained))
+
+        verbose_str+=f"{module:75} | "
+        verbose_str+=f"sum(S) retained: {sum_retained:.1%}, fro retained: {fro_retained:.1%}, max(S) ratio: {max_ratio:0.1f}"
+        verbose_str+=f", merge: {merge_time*1000:.1f} ms, svd: {svd_time*1000:.1f} ms"
+
+      if verbose and dynamic_method:
+        verbose_str+=f", dynamic | dim: {param_dict['new_rank']}, alpha: {param_dict['new_alpha']}\n"
+      else:
+        verbose_str+=f"\n"
+
+      new_alpha = param_dict['new_alpha']
+      o_lora_sd[module_index[module]["down"]] = param_dict["lora_down"].to(save_dtype).contiguous()
+      o_lora_sd[module_index[module]["up"]] = param_dict["lora_up"].to(save_dtype).contiguous()
+      o_lora_sd[module_index[module]["alpha"] or module + ".alpha"] = torch.tensor(param_dict['new_alpha']).to(save_dtype)
+      del param_dict
+  wall_time = time.perf_counter() - start
 
   if verbose:
     print(verbose_str)
 
     print(f"Average Frobenius norm retention: {np.mean(fro_list):.2%} | std: {np.std(fro_list):0.3f}")
+  if layer_times:
+    merge_total = sum(t[1] for t in layer_times)
+    svd_total = sum(t[2] for t in layer_times)
+    slowest = max(layer_times, key=lambda t: t[1] + t[2])
+    print(f"{len(layer_times)} layers in {wall_time:.2f}s with {max(1, threads)} thread(s) | merge: {merge_total:.2f}s, svd: {svd_total:.2f}s (summed over layers) | slowest: {slowest[0]} {slowest[1] + slowest[2]:.2f}s")
   print("resizing complete")
   return o_lora_sd, network_dim, new_alpha
 
@@ -289,8 +332,12 @@ def resize(args):
   print("loading Model...")
   lora_sd, metadata = load_state_dict(args.model, merge_dtype)
 
+  if args.threads > 1 and (args.device is None or args.device == "cpu"):
+    # Split the intra-op threads between the layer threads instead of oversubscribing the cores.
+    torch.set_num_threads(max(1, torch.get_num_threads() // args.threads))
+
   print("Resizing Lora...")
-  state_dict, old_dim, new_alpha = resize_lora_model(lora_sd, args.new_rank, save_dtype, args.device, args.dynamic_method, args.dynamic_param, args.verbose)
+  state_dict, old_dim, new_alpha = resize_lora_model(lora_sd, args.new_rank, save_dtype, args.device, args.dynamic_method, args.dynamic_param, args.verbose, args.svd_method, args.threads)
 
   # update metadata
   if metadata is None:
@@ -333,6 +380,10 @@ if __name__ == '__main__':
                       help="Specify dynamic resizing method, --new_rank is used as a hard limit for max rank")
   parser.add_argument("--dynamic_param", type=float, default=None,
                       help="Specify target for dynamic reduction")
+  parser.add_argument("--svd_method", type=str, default="exact", choices=svd_backend.SVD_METHODS,
+                      help="SVD backend: exact, randomized (falls back to exact when inaccurate) or auto. Only used without --dynamic_method")
+  parser.add_argument("--threads", type=int, default=1,
+                      help="Number of layers merged and decomposed concurrently / 同時に処理するレイヤー数")
                                            
 
   args = parser.parse_args()
@@ -0,0 +1,270 @@
+"""
+Incremental safetensors writers shared by the extraction and resize tools.
+
+  write_safetensors            save a state dict tensor by tensor (dtype cast per tensor, no full copy).
+  SafetensorsStreamWriter      append tensors of unknown count; the header is prepended on close().
+  ResumableSafetensorsWriter   append-only output for long extractions. Tensors go to `<path>.partial`
+                               behind a reserved header region; checkpoint() fsyncs and records the
+                               committed tensors in `<path>.partial.json`, so an interrupted run
+                               reopens the same file and continues instead of rewriting everything.
+
+File layout (https://github.com/huggingface/safetensors): 8-byte little-endian header length, JSON
+header (space padded), then the tensor bytes. The data region must be covered exactly, so keys that
+are written twice leave dead bytes that close() compacts away.
+"""
+
+import json
+import os
+import shutil
+import struct
+from collections import OrderedDict
+
+import torch
+
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+JOURNAL_VERSION = 1
+DEFAULT_HEADER_RESERVE = 1024 * 1024
+DEFAULT_FSYNC_INTERVAL = 256 * 1024 * 1024
+
+_SAFETENSORS_DTYPES = {
+    torch.float64: "F64", torch.float32: "F32", torch.float16: "F16", torch.bfloat16: "BF16",
+    torch.int64: "I64", torch.int32: "I32", torch.int16: "I16", torch.int8: "I8",
+    torch.uint8: "U8", torch.bool: "BOOL",
+}
+_TORCH_DTYPES = {v: k for k, v in _SAFETENSORS_DTYPES.items()}
+
+
+def _tensor_bytes(tensor):
+    tensor = tensor.detach().cpu().contiguous()
+    return tensor.reshape(-1).view(torch.uint8).numpy().tobytes()
+
+
+def _header_bytes(entries, metadata=None, min_size=0):
+    header = dict(entries)
+    if metadata:
+        header["__metadata__"] = {str(k): str(v) for k, v in metadata.items()}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    return header_bytes + b" " * max(0, min_size - len(header_bytes))
+
+
+def write_safetensors(path, state_dict, metadata=None, dtype=None):
+    """save_file() equivalent that computes the header from shapes first and then writes one tensor at a time.
+
+    With dtype, floating-point tensors are cast as they are written, so no cast copy of the whole dict is made.
+    """
+    entries, offset = OrderedDict(), 0
+    for key, tensor in state_dict.items():
+        tensor_dtype = dtype if dtype is not None and tensor.is_floating_point() else tensor.dtype
+        nbytes = tensor.numel() * torch.empty((), dtype=tensor_dtype).element_size()
+        entries[key] = {"dtype": _SAFETENSORS_DTYPES[tensor_dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + nbytes]}
+        offset += nbytes
+    header_bytes = _header_bytes(entries, metadata)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for key, tensor in state_dict.items():
+            f.write(_tensor_bytes(tensor.to(dtype) if dtype is not None and tensor.is_floating_point() else tensor))
+    os.replace(tmp_path, path)
+
+
+class SafetensorsStreamWriter:
+    """Streams tensors into a safetensors file without holding them all in memory.
+
+    Tensor bytes go to a scratch file as they arrive; close() prepends the header and atomically
+    renames the result to `path`. Nothing appears at `path` until close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = OrderedDict()
+        self.offset = 0
+        self.blob_path = path + ".blob.tmp"
+        self.blob = open(self.blob_path, "wb")
+
+    def add(self, key, tensor):
+        data = _tensor_bytes(tensor)
+        self.header[key] = {"dtype": _SAFETENSORS_DTYPES[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [self.offset, self.offset + len(data)]}
+        self.blob.write(data)
+        self.offset += len(data)
+
+    def close(self, metadata=None):
+        self.blob.close()
+        header_bytes = _header_bytes(self.header, metadata)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as out, open(self.blob_path, "rb") as blob:
+            out.write(struct.pack("<Q", len(header_bytes)))
+            out.write(header_bytes)
+            shutil.copyfileobj(blob, out, COPY_CHUNK_SIZE)
+        os.remove(self.blob_path)
+        os.replace(tmp_path, self.path)
+
+    def abort(self):
+        self.blob.close()
+        for path in (self.blob_path, self.path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class ResumableSafetensorsWriter:
+    """Append-only safetensors output that survives interruption.
+
+    Only what was covered by the last checkpoint() is recovered on resume; bytes appended after it are
+    truncated away. While there are no dead bytes and the header fits the reserved region, every
+    checkpoint also rewrites the header in place, so `<path>.partial` is itself a loadable LoRA file.
+    """
+
+    def __init__(self, path, resume=True, header_reserve=DEFAULT_HEADER_RESERVE, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.path = path
+        self.partial_path = path + ".partial"
+        self.journal_path = self.partial_path + ".json"
+        self.fsync_interval = fsync_interval
+        self.entries = OrderedDict()
+        self.metadata = {}
+        self.data_end = 0
+        self.dead_bytes = 0
+        self.unsynced_bytes = 0
+        self.resumed = False
+        journal = self._read_journal() if resume else None
+        if journal is not None:
+            self.header_reserve = journal["header_reserve"]
+            self.entries = OrderedDict((k, v) for k, v in journal["entries"])
+            self.metadata = journal["metadata"]
+            self.data_end = journal["data_end"]
+            self.dead_bytes = journal["dead_bytes"]
+            self.file = open(self.partial_path, "r+b")
+            self.file.truncate(self._data_start + self.data_end)
+            self.resumed = True
+        else:
+            self.header_reserve = header_reserve + (-header_reserve % 8)
+            self.file = open(self.partial_path, "w+b")
+            self.file.write(struct.pack("<Q", self.header_reserve) + _header_bytes({}, min_size=self.header_reserve))
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+        self.file.seek(0, os.SEEK_END)
+
+    @property
+    def _data_start(self):
+        return 8 + self.header_reserve
+
+    def _read_journal(self):
+        if not (os.path.exists(self.partial_path) and os.path.exists(self.journal_path)):
+            return None
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if journal.get("version") != JOURNAL_VERSION or os.path.getsize(self.partial_path) < 8 + journal["header_reserve"] + journal["data_end"]:
+            return None
+        return journal
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def keys(self):
+        return list(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key, tensor):
+        data = _tensor_bytes(tensor)
+        # Bytes first, bookkeeping second: a checkpoint taken in between (e.g. from a signal handler) never
+        # records a tensor whose bytes are not in the file yet.
+        self.file.write(data)
+        if key in self.entries:
+            start, end = self.entries.pop(key)["data_offsets"]
+            self.dead_bytes += end - start
+        self.entries[key] = {"dtype": _SAFETENSORS_DTYPES[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [self.data_end, self.data_end + len(data)]}
+        self.data_end += len(data)
+        self.unsynced_bytes += len(data)
+        if self.fsync_interval and self.unsynced_bytes >= self.fsync_interval:
+            self._sync()
+
+    def get_tensor(self, key):
+        entry = self.entries[key]
+        start, end = entry["data_offsets"]
+        self.file.flush()
+        self.file.seek(self._data_start + start)
+        data = bytearray(self.file.read(end - start))
+        self.file.seek(0, os.SEEK_END)
+        dtype = _TORCH_DTYPES[entry["dtype"]]
+        return (torch.frombuffer(data, dtype=dtype) if data else torch.empty(0, dtype=dtype)).reshape(entry["shape"])
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced_bytes = 0
+
+    def _write_header_in_place(self, metadata):
+        header_bytes = _header_bytes(self.entries, metadata, min_size=self.header_reserve)
+        if self.dead_bytes or len(header_bytes) > self.header_reserve:
+            return False
+        self.file.seek(8)
+        self.file.write(header_bytes)
+        self.file.seek(0, os.SEEK_END)
+        return True
+
+    def checkpoint(self, metadata=None):
+        """Make everything added so far durable and resumable. `metadata` is kept for the final header."""
+        if metadata is not None:
+            self.metadata = {str(k): str(v) for k, v in metadata.items()}
+        self._sync()
+        journal = {
+            "version": JOURNAL_VERSION, "header_reserve": self.header_reserve, "data_end": self.data_end,
+            "dead_bytes": self.dead_bytes, "entries": list(self.entries.items()), "metadata": self.metadata,
+        }
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(journal, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        if self._write_header_in_place(self.metadata):
+            self._sync()
+
+    def close(self, metadata=None):
+        """Finish the file at `path`: the header is written into the reserved region, or the live tensors are
+        copied into a compact file when keys were rewritten or the header outgrew the reservation."""
+        if metadata is not None:
+            self.metadata = {str(k): str(v) for k, v in metadata.items()}
+        if self._write_header_in_place(self.metadata):
+            self.file.truncate(self._data_start + self.data_end)
+            self._sync()
+            self.file.close()
+            os.replace(self.partial_path, self.path)
+        else:
+            self.file.flush()
+            compact_entries, offset = OrderedDict(), 0
+            for key, entry in self.entries.items():
+                start, end = entry["data_offsets"]
+                compact_entries[key] = {**entry, "data_offsets": [offset, offset + end - start]}
+                offset += end - start
+            header_bytes = _header_bytes(compact_entries, self.metadata)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as out:
+                out.write(struct.pack("<Q", len(header_bytes)))
+                out.write(header_bytes)
+                for entry in self.entries.values():
+                    start, end = entry["data_offsets"]
+                    self.file.seek(self._data_start + start)
+                    remaining = end - start
+                    while remaining:
+                        chunk = self.file.read(min(remaining, COPY_CHUNK_SIZE))
+                        out.write(chunk)
+                        remaining -= len(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            self.file.close()
+            os.replace(tmp_path, self.path)
+            os.remove(self.partial_path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def discard(self):
+        self.file.close()
+        for path in (self.partial_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,78 @@
+"""
+Shared SVD backend for the LoRA/LyCORIS extraction and resize tools.
+
+`svd(A, rank, method)` returns (U, S, Vh) of a 2-D matrix:
+
+  exact       torch.linalg.svd(full_matrices=False); every singular triplet.
+  randomized  randomized range finder with oversampling and power (subspace) iterations, as in
+              torch.svd_lowrank / Halko et al. Returns rank + oversample triplets, the leading `rank`
+              checked by an accuracy guard; if the guard fails the exact SVD is used instead.
+  auto        randomized when it saves work (rank + oversample well below min(m, n)), else exact.
+
+Randomized mode only knows the leading part of the spectrum, so callers that pick the rank from the
+whole spectrum (dynamic / threshold / quantile methods) should ask for 'exact'. The Frobenius norm of
+A is always exact (see `frobenius_norm`) for retention statistics.
+"""
+
+import torch
+
+SVD_METHODS = ["exact", "randomized", "auto"]
+DEFAULT_OVERSAMPLE = 8
+DEFAULT_POWER_ITERATIONS = 2
+DEFAULT_TOLERANCE = 0.05
+
+
+def svd(A, rank=None, method="exact", oversample=DEFAULT_OVERSAMPLE, power_iterations=DEFAULT_POWER_ITERATIONS,
+        tolerance=DEFAULT_TOLERANCE, return_info=False):
+    """(U, S, Vh) of 2-D A, computed in float32 on A's device. See the module docstring for `method`.
+
+    With return_info, also returns {'method': 'exact' | 'randomized', 'residual': float | None, 'fallback': bool}.
+    """
+    if method not in SVD_METHODS:
+        raise ValueError(f"Unknown SVD method '{method}', expected one of {SVD_METHODS}")
+    A = A.float()
+    m, n = A.shape
+    sketch_size = None if rank is None else min(rank + oversample, m, n)
+    use_randomized = method != "exact" and rank is not None and sketch_size < min(m, n)
+    if method == "auto":
+        use_randomized = use_randomized and sketch_size * 4 <= min(m, n)
+
+    info = {"method": "exact", "residual": None, "fallback": False}
+    if use_randomized:
+        U, S, Vh = _randomized_svd(A, sketch_size, power_iterations)
+        residual = _relative_residual(A, U[:, :rank], S[:rank], Vh[:rank])
+        info.update(method="randomized", residual=residual)
+        if residual <= tolerance:
+            return (U, S, Vh, info) if return_info else (U, S, Vh)
+        info.update(method="exact", fallback=True)
+    U, S, Vh = torch.linalg.svd(A, full_matrices=False)
+    return (U, S, Vh, info) if return_info else (U, S, Vh)
+
+
+def frobenius_norm(A):
+    return float(torch.linalg.matrix_norm(A.float()))
+
+
+def _randomized_svd(A, sketch_size, power_iterations):
+    m, n = A.shape
+    generator = torch.Generator(device=A.device).manual_seed(0)
+    omega = torch.randn(n, sketch_size, device=A.device, dtype=A.dtype, generator=generator)
+    Q, _ = torch.linalg.qr(A @ omega)
+    for _ in range(power_iterations):
+        # Re-orthonormalize between products so small singular directions are not lost to round-off.
+        Q, _ = torch.linalg.qr(A.mT @ Q)
+        Q, _ = torch.linalg.qr(A @ Q)
+    Ub, S, Vh = torch.linalg.svd(Q.mT @ A, full_matrices=False)
+    return Q @ Ub, S, Vh
+
+
+def _relative_residual(A, U, S, Vh):
+    """||A V - U S||_F / ||S||_F for the leading triplets.
+
+    By construction A^T U = V S holds exactly for the sketch, so this side measures how much of the
+    true leading subspace the range finder missed.
+    """
+    s_norm = float(torch.linalg.vector_norm(S))
+    if s_norm == 0.0:
+        return 0.0
+    return float(torch.linalg.matrix_norm(A @ Vh.mT - U * S)) / s_norm
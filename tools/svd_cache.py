@@ -0,0 +1,138 @@
+"""
+Persistent cache of truncated SVD spectra for LoRA extraction.
+
+For every module of a model pair it keeps the full singular values S and the leading `max_rank`
+columns of U / rows of Vh, keyed by the content hashes of both checkpoints, a namespace and the
+module name. Any later extraction with rank <= max_rank, and any dynamic rank method (they only
+look at S), becomes slicing instead of a fresh decomposition.
+
+  <base hash>_<ft hash>_<namespace>.spectra.safetensors   <name>.U, <name>.S, <name>.Vh
+  <base hash>_<ft hash>_<namespace>.spectra.json          shape and max |delta| of every module, max_rank per spectrum
+"""
+
+import json
+import os
+
+import safetensors
+
+from delta_cache import file_sha256, write_json_atomic
+from safetensors_writer import SafetensorsStreamWriter
+
+SPECTRUM_CACHE_VERSION = 1
+
+
+class SpectrumCache:
+    def __init__(self, cache_dir, base_model_path, ft_model_path, namespace, max_rank):
+        os.makedirs(cache_dir, exist_ok=True)
+        memo_path = os.path.join(cache_dir, "hashes.json")
+        self.base_model_path = base_model_path
+        self.ft_model_path = ft_model_path
+        self.namespace = namespace
+        self.max_rank = max_rank
+        self.base_sha256 = file_sha256(base_model_path, memo_path)
+        self.ft_sha256 = file_sha256(ft_model_path, memo_path)
+        stem = f"{self.base_sha256[:16]}_{self.ft_sha256[:16]}_{namespace}"
+        self.data_path = os.path.join(cache_dir, stem + ".spectra.safetensors")
+        self.index_path = os.path.join(cache_dir, stem + ".spectra.json")
+        self.index = None
+        self._handle = None
+
+    @property
+    def exists(self):
+        if not (os.path.exists(self.data_path) and os.path.exists(self.index_path)):
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("version") == SPECTRUM_CACHE_VERSION
+        except (OSError, ValueError):
+            return False
+
+    def open(self):
+        if self.index is None:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+            self._handle = safetensors.safe_open(self.data_path, framework="pt", device="cpu")
+        return self
+
+    # Same index interface as DeltaCache, so module selection can run on either.
+    def keys(self):
+        return list(self.index["modules"])
+
+    def shape(self, name):
+        return tuple(self.index["modules"][name]["shape"])
+
+    def max_abs(self, name):
+        return self.index["modules"][name]["max_abs"]
+
+    def is_identical(self, name, atol=0.0):
+        return self.max_abs(name) <= atol
+
+    def covers(self, names, rank):
+        """True when every module in `names` has a cached spectrum good for extraction at up to `rank`."""
+        spectra = self.index["spectra"]
+        return all(name in spectra and spectra[name]["max_rank"] >= min(rank, spectra[name]["full_rank"]) for name in names)
+
+    def get(self, name):
+        """(U[:, :max_rank], S, Vh[:max_rank]) for one module."""
+        return (self._handle.get_tensor(f"{name}.U"), self._handle.get_tensor(f"{name}.S"), self._handle.get_tensor(f"{name}.Vh"))
+
+    def writer(self):
+        return SpectrumCacheWriter(self)
+
+
+class SpectrumCacheWriter:
+    """Collects spectra for one run. Spectra already in the cache that this run did not recompute are carried over on close()."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.modules = {}
+        self.spectra = {}
+        self.stream = SafetensorsStreamWriter(cache.data_path)
+
+    def add_module(self, name, shape, max_abs):
+        self.modules[name] = {"shape": list(shape), "max_abs": float(max_abs)}
+
+    def add(self, name, U, S, Vh):
+        rank = min(self.cache.max_rank, S.numel())
+        self.stream.add(f"{name}.U", U[:, :rank].float())
+        self.stream.add(f"{name}.S", S.float())
+        self.stream.add(f"{name}.Vh", Vh[:rank].float())
+        self.spectra[name] = {"max_rank": rank, "full_rank": S.numel()}
+
+    def close(self):
+        try:
+            if self.cache.exists:
+                previous = self.cache.open()
+                for name, info in previous.index["modules"].items():
+                    self.modules.setdefault(name, info)
+                for name, info in previous.index["spectra"].items():
+                    if name not in self.spectra:
+                        for part in ("U", "S", "Vh"):
+                            self.stream.add(f"{name}.{part}", previous._handle.get_tensor(f"{name}.{part}").clone())
+                        self.spectra[name] = info
+            # Unmap the old file before it is replaced: Windows cannot replace a file that is still mapped
+            self.cache.index, self.cache._handle = None, None
+            self.stream.close({"base_sha256": self.cache.base_sha256, "ft_sha256": self.cache.ft_sha256, "namespace": self.cache.namespace})
+        except BaseException:
+            self.stream.abort()
+            raise
+        write_json_atomic(self.cache.index_path, {
+            "version": SPECTRUM_CACHE_VERSION, "namespace": self.cache.namespace,
+            "base": {"path": os.path.abspath(self.cache.base_model_path), "sha256": self.cache.base_sha256},
+            "ft": {"path": os.path.abspath(self.cache.ft_model_path), "sha256": self.cache.ft_sha256},
+            "modules": self.modules, "spectra": self.spectra,
+        })
+        self.cache.index, self.cache._handle = None, None
+
+    def abort(self):
+        self.stream.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False